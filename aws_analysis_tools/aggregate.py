@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+"""
+Counts of instances grouped by fields such as type, zone, state or a tag.
+
+A GroupCounter is a ColumnarWriter whose sink counts rows instead of writing
+them: each batch of dictionary encoded columns is reduced to a count per
+distinct combination of codes, and the batch is dropped. With numpy the codes
+of a batch are combined into one integer per row and counted with
+numpy.bincount(), without a Python loop over the rows; without numpy they
+are counted with a Counter. Either way memory stays bounded by the batch
+size and the number of groups, however many instances are counted.
+"""
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import operator
+from collections import Counter, namedtuple
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.columnar import (
+    ColumnarWriter, ColumnSpec, DEFAULT_BATCH_SIZE, DICT, attribute_getter, tag_getter,
+)
+
+
+# Fields instances can be grouped by, besides "tag:<key>", to InstanceRecord attribute
+GROUP_FIELDS = {
+    'region': 'region',
+    'zone': 'zone',
+    'type': 'instance_type',
+    'instance_type': 'instance_type',
+    'state': 'state',
+    'group': 'group',
+    'root': 'root_device_type',
+    'root_device_type': 'root_device_type',
+}
+
+# Above this many possible combinations of codes, a batch is counted with
+# numpy.unique() instead of a numpy.bincount() array of that size
+_MAX_BINS = 1 << 22
+
+# Combined codes must fit in an int64
+_MAX_COMBINATIONS = 1 << 62
+
+
+class GroupByError(Exception):
+    """
+    A field can't be grouped by.
+    """
+
+
+# VALUES holds the value of each field grouped by, None where it is missing
+Group = namedtuple('Group', ['values', 'count'])
+
+
+def parse_group_keys(value):
+    """
+    Parses a comma separated list of fields to group by.
+    """
+    keys = tuple(key.strip() for key in (value or '').split(',') if key.strip())
+    for key in keys:
+        if key not in GROUP_FIELDS and not (key.startswith('tag:') and len(key) > len('tag:')):
+            raise GroupByError('Cannot group by {0!r}; use tag:<key> or one of {1}'.format(
+                key, ', '.join(sorted(GROUP_FIELDS))))
+    return keys
+
+
+def group_columns(keys):
+    """
+    Returns dictionary encoded ColumnSpecs for the fields KEYS.
+    """
+    return [
+        ColumnSpec(key, DICT, tag_getter(key[len('tag:'):]) if key.startswith('tag:')
+                   else attribute_getter(GROUP_FIELDS[key]))
+        for key in keys
+    ]
+
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def count_codes(codes, sizes, np=None):
+    """
+    Counts the distinct rows of the dictionary encoded columns CODES, arrays of
+    int32 codes whose dictionaries hold SIZES values. Returns a dict of tuple
+    of codes to count.
+    """
+    combinations = 1
+    for size in sizes:
+        combinations *= size + 1
+
+    if np is None or not codes or combinations >= _MAX_COMBINATIONS:
+        return Counter(zip(*codes))
+
+    # Mixed radix: code + 1 (so missing values are 0) is one digit per column
+    combined = np.zeros(len(codes[0]), dtype=np.int64)
+    for values, size in zip(codes, sizes):
+        combined *= size + 1
+        combined += np.frombuffer(values, dtype=np.int32)
+        combined += 1
+
+    if combinations <= _MAX_BINS:
+        counts = np.bincount(combined, minlength=combinations)
+        uniques = np.flatnonzero(counts)
+        counts = counts[uniques]
+    else:
+        uniques, counts = np.unique(combined, return_counts=True)
+
+    digits = []
+    for size in reversed(sizes):
+        uniques, digit = np.divmod(uniques, size + 1)
+        digits.append((digit - 1).tolist())
+    digits.reverse()
+    return dict(zip(zip(*digits), counts.tolist()))
+
+
+def _values_key(group):
+    return tuple('' if value is None else value for value in group.values)
+
+
+_count = operator.attrgetter('count')
+
+
+class _CountSink(object):
+    """
+    ColumnarWriter sink keeping the count of each distinct row.
+    """
+
+    def __init__(self):
+        self.np = _import_numpy()
+        self.counts = Counter()
+        self.dictionaries = None
+
+    def write_batch(self, columns):
+        self.counts.update(count_codes(
+            [column.values for column in columns],
+            [len(column.dictionary) for column in columns],
+            np=self.np,
+        ))
+
+    def close(self, dictionaries):
+        self.dictionaries = dictionaries
+
+    def abort(self):
+        pass
+
+
+class GroupCounter(ColumnarWriter):
+    """
+    Counts the records written to it by the fields KEYS, as parsed by
+    parse_group_keys(). write() may be called from several threads.
+    """
+
+    def __init__(self, keys, batch_size=DEFAULT_BATCH_SIZE):
+        self.keys = keys
+        super(GroupCounter, self).__init__(_CountSink(), group_columns(keys),
+                                           batch_size=batch_size)
+
+    def groups(self):
+        """
+        Closes the counter and returns a Group per distinct combination of
+        values, the most common first.
+        """
+        self.close()
+        if not self.keys:
+            return [Group((), self.rows)] if self.rows else []
+
+        counts = self.sink.counts
+        # Decoded a column at a time; the None appended to each dictionary is
+        # what NULL_CODE (-1) indexes
+        columns = [
+            list(map((self.sink.dictionaries[key] + [None]).__getitem__, codes))
+            for key, codes in zip(self.keys, zip(*counts))
+        ]
+        groups = list(map(Group, zip(*columns), counts.values()))
+        # Ties in the order of their values; sort() is stable, even in reverse
+        groups.sort(key=_values_key)
+        groups.sort(key=_count, reverse=True)
+        return groups
+
+
+def top_groups(groups, top=None):
+    """
+    Returns the first TOP of GROUPS, or all of them without TOP, and the total
+    count of the rest.
+    """
+    if top is None:
+        return groups, 0
+    return groups[:top], sum(g.count for g in groups[top:])
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+"""
+Snapshots of the instances of the fleet, and the changes between a snapshot
+and the fleet as it is now.
+
+A snapshot is a text file, gzipped if its name ends in .gz, with a JSON
+header line and then one line per instance:
+
+    <instance id> TAB <fingerprint> TAB <InstanceRecord.to_row() as JSON>
+
+The fingerprint is a hash of the record's fields, so telling whether an
+instance changed only takes comparing two short strings; the row itself is
+only decoded for the instances that did. iter_changes() is a hash join with the fleet of the
+current run as the build side, which is in memory already, and the snapshot
+as the probe side, read one line at a time, so a diff takes one pass over
+each and little memory besides the current records. record_changes() compares
+two sets of records already in memory, such as two refreshes of --watch.
+"""
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import gzip
+import hashlib
+import io
+import json
+import operator
+import os
+import tempfile
+import time
+from collections import namedtuple
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.records import InstanceRecord
+
+
+# Change types reported by iter_changes()
+ADDED = 'added'
+REMOVED = 'removed'
+CHANGED = 'changed'
+
+_VERSION = 1
+
+# Fields compared between the snapshot and the current fleet, besides tags
+COMPARED_FIELDS = ('instance_type', 'zone', 'groups', 'state', 'ip_address',
+                   'private_ip_address', 'dns_name', 'root_device_type', 'region')
+
+
+class Change(namedtuple('Change', ['change', 'id', 'old', 'new', 'fields'])):
+    """
+    A change to instance ID: OLD is the record in the snapshot and NEW the
+    current one, either of which is None for added and removed instances.
+    FIELDS lists the fields that changed, with tags as "tag:<key>".
+    """
+    __slots__ = ()
+
+    @property
+    def record(self):
+        return self.new if self.new is not None else self.old
+
+
+class SnapshotError(Exception):
+    """
+    A snapshot file can't be read.
+    """
+
+
+# Returns the values of an InstanceRecord, tags included, as a tuple
+_values = operator.attrgetter(*(InstanceRecord.__slots__ + ('_tags',)))
+
+
+def fingerprint(record):
+    """
+    Hash of the fields of an InstanceRecord, used to tell whether an instance
+    changed. The repr() of strings and tuples doesn't change between runs,
+    unlike their hash().
+    """
+    return hashlib.sha1(repr(_values(record)).encode('utf-8')).hexdigest()[:16]
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        # The default level 9 takes several times longer for little gain
+        return io.TextIOWrapper(gzip.open(path, mode + 'b', compresslevel=6), encoding='utf-8')
+    return io.open(path, mode, encoding='utf-8')
+
+
+def write_snapshot(path, records):
+    """
+    Writes RECORDS to a snapshot at PATH. The file is replaced atomically, so
+    a concurrent diff never reads a partially written snapshot.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    suffix = '.gz' if path.endswith('.gz') else ''
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.snapshot-', suffix=suffix)
+    os.close(fd)
+    count = 0
+    try:
+        with _open(tmp_path, 'w') as f:
+            f.write(u'{0}\n'.format(json.dumps({'version': _VERSION, 'created': time.time()})))
+            for record in records:
+                f.write(u'{0}\t{1}\t{2}\n'.format(
+                    record.id, fingerprint(record),
+                    json.dumps(record.to_row(), separators=(',', ':')),
+                ))
+                count += 1
+        os.rename(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+    return count
+
+
+def _read_header(f, path):
+    try:
+        header = json.loads(f.readline())
+    except ValueError:
+        header = None
+    if not isinstance(header, dict) or header.get('version') != _VERSION:
+        raise SnapshotError('{0} is not an instance snapshot'.format(path))
+    return header
+
+
+def iter_snapshot(path):
+    """
+    Yields an (id, fingerprint, encoded row) tuple per instance in the
+    snapshot at PATH, without decoding the rows.
+    """
+    with _open(path, 'r') as f:
+        _read_header(f, path)
+        for line in f:
+            instance_id, print_, row = line.rstrip('\n').split('\t', 2)
+            yield instance_id, print_, row
+
+
+def read_snapshot(path):
+    """
+    Returns the InstanceRecords in the snapshot at PATH.
+    """
+    return [InstanceRecord.from_row(json.loads(row)) for _, _, row in iter_snapshot(path)]
+
+
+def changed_fields(old, new):
+    """
+    Returns the names of the fields that differ between records OLD and NEW.
+    """
+    fields = [field for field in COMPARED_FIELDS if getattr(old, field) != getattr(new, field)]
+    old_tags, new_tags = old.tags, new.tags
+    fields.extend(
+        'tag:{0}'.format(key) for key in sorted(set(old_tags) | set(new_tags))
+        if old_tags.get(key) != new_tags.get(key)
+    )
+    return fields
+
+
+def iter_changes(path, records):
+    """
+    Yields a Change for every instance that was added, removed or changed
+    between the snapshot at PATH and RECORDS, the current fleet. Removed and
+    changed instances are yielded as the snapshot is read, added ones at the
+    end.
+    """
+    current = dict((record.id, record) for record in records)
+
+    for instance_id, print_, row in iter_snapshot(path):
+        record = current.pop(instance_id, None)
+        if record is None:
+            yield Change(REMOVED, instance_id, InstanceRecord.from_row(json.loads(row)), None, ())
+            continue
+
+        if fingerprint(record) != print_:
+            old = InstanceRecord.from_row(json.loads(row))
+            fields = changed_fields(old, record)
+            if fields:
+                yield Change(CHANGED, instance_id, old, record, fields)
+
+    for instance_id, record in current.items():
+        yield Change(ADDED, instance_id, None, record, ())
+
+
+def record_changes(old, new, ids=None):
+    """
+    Returns a Change for every instance that was added, removed or changed
+    between OLD and NEW, dicts of instance id to record, looking at the
+    instances IDS only if given. The changes are in the order of the ids.
+    """
+    if ids is None:
+        ids = set(old) | set(new)
+
+    changes = []
+    for instance_id in sorted(ids):
+        old_record, new_record = old.get(instance_id), new.get(instance_id)
+        if old_record is None and new_record is not None:
+            changes.append(Change(ADDED, instance_id, None, new_record, ()))
+        elif new_record is None and old_record is not None:
+            changes.append(Change(REMOVED, instance_id, old_record, None, ()))
+        elif old_record is not new_record and _values(old_record) != _values(new_record):
+            changes.append(Change(CHANGED, instance_id, old_record, new_record,
+                                  changed_fields(old_record, new_record)))
+    return changes
@@ -17,6 +17,18 @@ from pprint import pformat
 import krux.cli
 import krux_ec2.cli
 from krux_ec2.filter import Filter
+from aws_analysis_tools.inventory import (
+    lookup_instances, configure_inventory, add_inventory_cli_arguments,
+)
+from aws_analysis_tools.pool import pooled_client
+from aws_analysis_tools.records import InstanceRecord, describe_instance_records
+from aws_analysis_tools.regions import (
+    get_region_names, parse_region_names, map_regions, add_region_cli_arguments,
+)
+from aws_analysis_tools.throttle import (
+    throttled_call, get_governor, configure_governor, add_throttle_cli_arguments,
+)
+from aws_analysis_tools.tracing import span, profiled, configure_tracer, add_profile_cli_arguments
 
 NAME = 'convert_ip'
 
@@ -33,6 +45,10 @@ class Application(krux_ec2.cli.Application):
         # Set what AWS arg to filter based on
         self.filter_arg = Application._PRIVATE_IP if self.args.private else Application._IP
 
+        configure_governor(self.args, stats=self.stats, log=self.logger)
+        configure_tracer(self.args, stats=self.stats)
+        configure_inventory(self.args)
+
     def add_cli_arguments(self, parser):
         # Call to the superclass first
         super(Application, self).add_cli_arguments(parser)
@@ -53,16 +69,57 @@ class Application(krux_ec2.cli.Application):
             help="True if the given IP address is private. (default: %(default)s)",
         )
 
+        group.add_argument(
+            "--regions",
+            default=None,
+            help="Comma separated list of regions to search in parallel, or 'all'. "
+            "(default: the region given by --boto-region)",
+        )
+
+        add_region_cli_arguments(group)
+        add_throttle_cli_arguments(group)
+        add_profile_cli_arguments(group)
+        add_inventory_cli_arguments(group)
+
     def find_instances(self, filter_arg, address):
         """
         Searches for AWS instance based on given filter argument and ip address (private or normal).
+        Searches the --boto-region, or all regions given by --regions in parallel, and
+        returns the matches as InstanceRecords. The inventory daemon answers
+        instead of EC2 when it is running.
         """
         f = Filter()
         f.add_filter(
             name=filter_arg,
             value=address
         )
-        return self.ec2.find_instances(f)
+        regions = parse_region_names(self.args.regions) if self.args.regions else \
+            [self.args.boto_region]
+        instances = lookup_instances(f.to_filter(), regions=regions, log=self.logger)
+        if instances is not None:
+            return instances
+
+        if not self.args.regions:
+            return [
+                InstanceRecord.from_boto3(i, region=self.args.boto_region)
+                for i in throttled_call(
+                    self.args.boto_region, 'DescribeInstances', self.ec2.find_instances, f
+                )
+            ]
+
+        region_names = get_region_names(include=parse_region_names(self.args.regions))
+
+        def _find_in_region(region_name):
+            client = pooled_client(self.boto3, 'ec2', region_name)
+            return describe_instance_records(client, region_name, f.to_filter())
+
+        results = map_regions(
+            _find_in_region, region_names,
+            concurrency=self.args.region_concurrency,
+            timeout=self.args.region_timeout,
+            log=self.logger,
+        )
+        return list(results.chain())
 
     def output_info(self, instances, filter_arg, address):
         """
@@ -83,8 +140,12 @@ class Application(krux_ec2.cli.Application):
             self.logger.info('No instance with ' + filter_arg + ': ' + address + ' was found.')
 
     def run(self):
-        instances = self.find_instances(self.filter_arg, self.args.ip_address)
-        self.output_info(instances, self.filter_arg, self.args.ip_address)
+        with profiled(self.args, log=self.logger):
+            with span('fetch'):
+                instances = self.find_instances(self.filter_arg, self.args.ip_address)
+            with span('render'):
+                self.output_info(instances, self.filter_arg, self.args.ip_address)
+        get_governor().log_summary(self.logger)
 
 
 def main():
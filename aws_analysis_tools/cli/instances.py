@@ -8,6 +8,9 @@
 #
 
 from __future__ import absolute_import
+import re
+import sys
+import time
 
 #
 # Third party libraries
@@ -23,6 +26,32 @@ import krux_boto
 import krux.cli
 import krux_ec2.cli
 from krux_ec2.filter import Filter
+from aws_analysis_tools.aggregate import GroupCounter, GroupByError, parse_group_keys, top_groups
+from aws_analysis_tools.columnar import (
+    open_writer, check_export, instance_columns, parse_tag_keys, add_export_cli_arguments,
+    ExportError,
+)
+from aws_analysis_tools.changes import iter_changes, write_snapshot, CHANGED, ADDED, REMOVED
+from aws_analysis_tools.inventory import (
+    lookup_instances, configure_inventory, add_inventory_cli_arguments, inventory_note,
+)
+from aws_analysis_tools.pool import pooled_client
+from aws_analysis_tools.records import (
+    InstanceRecord, describe_instance_records, iter_instance_pages,
+)
+from aws_analysis_tools.regions import (
+    get_region_names, parse_region_names, map_regions, add_region_cli_arguments,
+)
+from aws_analysis_tools.throttle import (
+    throttled_call, get_governor, configure_governor, add_throttle_cli_arguments,
+)
+from aws_analysis_tools.tracing import span, profiled, configure_tracer, add_profile_cli_arguments
+from aws_analysis_tools.watch import (
+    WatchState, ScreenPainter, terminal_height, TRANSITIONAL_STATES, DEFAULT_FULL_EVERY,
+)
+from aws_analysis_tools.where import (
+    parse_where, push_down, compile_predicate, WhereError, And, Call, Comparison, Not,
+)
 
 
 NAME = 'instances'
@@ -39,18 +68,9 @@ class Application(krux_ec2.cli.Application):
         'state': 'instance-state-name'
     }
 
-    # List of all options
+    # List of all options, which are also --where fields
     _OPTS = ['group', 'name', 'type', 'zone', 'state']
 
-    # A dict with key=CLI options and value=instance attribute
-    _INSTANCE_ATTR = {
-        'group': lambda i, attr: next((g.name for g in i.groups if attr in g.name), None),
-        'name': lambda i, attr: i.tags.get('Name'),
-        'type': lambda i, attr: i.instance_type,
-        'zone': lambda i, attr: str(i._placement),
-        'state': lambda i, attr: i.state
-    }
-
     _EC2_FILTER_VALUE_TEMPLATE = '*{value}*'
 
     def __init__(self, name=NAME):
@@ -61,6 +81,48 @@ class Application(krux_ec2.cli.Application):
         # keys instead of attributes
         self.options = vars(self.args)
 
+        configure_governor(self.args, stats=self.stats, log=self.logger)
+        configure_tracer(self.args, stats=self.stats)
+        configure_inventory(self.args)
+
+        if self.args.export:
+            try:
+                check_export(self.args.export)
+            except ExportError as e:
+                self.parser.error(str(e))
+
+        # Fields to count the instances by with --group-by or --count, None to list them
+        self.group_keys = None
+        if self.args.group_by is not None or self.args.count:
+            try:
+                self.group_keys = parse_group_keys(self.args.group_by)
+            except GroupByError as e:
+                self.parser.error(str(e))
+            if self.args.export or self.args.diff or self.args.snapshot:
+                self.parser.error('--group-by and --count cannot be used with --export, --diff '
+                                  'or --snapshot')
+        if self.args.top is not None and not self.group_keys:
+            self.parser.error('--top needs --group-by')
+
+        # The --where expression, parsed once; convert_args() pushes what it
+        # can down to EC2 and leaves the rest in _where_rest
+        self.where = None
+        if self.args.where is not None:
+            try:
+                self.where = parse_where(self.args.where)
+            except WhereError as e:
+                self.parser.error(str(e))
+        self._where_rest = self.where
+        self._predicate = None
+
+        if self.args.watch is not None:
+            if self.args.watch <= 0:
+                self.parser.error('--watch needs a number of seconds greater than 0')
+            if self.args.export or self.args.diff or self.args.snapshot or \
+                    self.group_keys is not None:
+                self.parser.error('--watch cannot be used with --export, --diff, --snapshot, '
+                                  '--group-by or --count')
+
     def add_cli_arguments(self, parser):
         # Call to the superclass first
         super(Application, self).add_cli_arguments(parser)
@@ -74,6 +136,18 @@ class Application(krux_ec2.cli.Application):
             help="suppress table header",
         )
 
+        group.add_argument(
+            "--regions",
+            default=None,
+            help="Comma separated list of regions to query in parallel, or 'all'. "
+            "(default: the region given by --boto-region)",
+        )
+
+        add_region_cli_arguments(group)
+        add_throttle_cli_arguments(group)
+        add_profile_cli_arguments(group)
+        add_inventory_cli_arguments(group)
+
         group.add_argument(
             "-g", "--group",
             action="append",
@@ -151,6 +225,76 @@ class Application(krux_ec2.cli.Application):
             help="Exclude instances with states whose name include these characters",
         )
 
+        group.add_argument(
+            "--snapshot",
+            default=None,
+            metavar="FILE",
+            help="Save the instances found to FILE (gzipped if it ends in .gz), for a later --diff",
+        )
+
+        group.add_argument(
+            "--where",
+            default=None,
+            metavar="EXPR",
+            help="Only include instances matching EXPR, e.g. \"type = m4.* and "
+            "tag:cluster_name in (kafka, zookeeper) and not name ~ '^test'\". "
+            "Compare a field (id, name, type, zone, state, group, region, ip, private_ip, "
+            "dns_name, root or tag:<key>) with =, != (globs allowed), in, not in, "
+            "~ or !~ (regex), and combine with and, or, not and parentheses.",
+        )
+
+        add_export_cli_arguments(group)
+
+        group.add_argument(
+            "--group-by",
+            default=None,
+            metavar="FIELDS",
+            help="Instead of the instances, print how many there are per distinct value of the "
+            "comma separated FIELDS, most common first: region, zone, type, state, group, root "
+            "or tag:<key>, e.g. --group-by type,tag:cluster_name",
+        )
+
+        group.add_argument(
+            "--count",
+            action="store_true",
+            default=False,
+            help="Instead of the instances, print how many there are",
+        )
+
+        group.add_argument(
+            "--top",
+            type=int,
+            default=None,
+            metavar="N",
+            help="With --group-by, only print the N most common groups, and the rest as one",
+        )
+
+        group.add_argument(
+            "--watch",
+            type=float,
+            default=None,
+            metavar="SECONDS",
+            help="Refresh the table every SECONDS, redrawing only the rows that changed, until "
+            "interrupted. When stdout isn't a terminal, print the changes of each refresh.",
+        )
+
+        group.add_argument(
+            "--watch-full",
+            type=int,
+            default=DEFAULT_FULL_EVERY,
+            metavar="N",
+            help="With --watch, fetch all the instances every N refreshes, and in between only "
+            "the ones changing state (default: %(default)s)",
+        )
+
+        group.add_argument(
+            "--diff",
+            default=None,
+            metavar="FILE",
+            help="Instead of the instances, list the ones added, removed or changed since the "
+            "--snapshot FILE was saved. Use the same filters as when it was saved.",
+        )
+
     def convert_args(self):
         """
         Convert options dictionary to use AWS filters as keys instead of CLI options.
@@ -168,52 +312,180 @@ class Application(krux_ec2.cli.Application):
                     value=self._EC2_FILTER_VALUE_TEMPLATE.format(value=opt_value)
                 )
 
+        # Push the --where conditions EC2 can evaluate down to it, except on
+        # filters the options above use, as values of a filter are ORed
+        taken = [f['Name'] for f in include_filter.to_filter()]
+        filters, self._where_rest = push_down(self.where, taken=taken)
+        for name, values in filters:
+            self.logger.debug('Filtering on %s in EC2 for --where', name)
+            for value in values:
+                include_filter.add_filter(name=name, value=value)
+        self._predicate = None
+
         return include_filter
 
+    def find_instances(self, include_filter):
+        """
+        Find instances matching include_filter in every region given by --regions,
+        or in the --boto-region if no regions were given. Returns InstanceRecords.
+        The inventory daemon answers instead of EC2 when it is running.
+        """
+        instances = self.lookup_instances(include_filter)
+        if instances is not None:
+            return instances
+        return self.fetch_instances(include_filter)
+
+    def fetch_instances(self, include_filter):
+        """
+        Like find_instances(), always asking EC2, as --watch does: the inventory
+        daemon only refreshes every few minutes.
+        """
+        if not self.options.get('regions'):
+            region_name = self.options.get('boto_region')
+            return [
+                InstanceRecord.from_boto3(i, region=region_name)
+                for i in throttled_call(
+                    region_name, 'DescribeInstances', self.ec2.find_instances, include_filter,
+                )
+            ]
+
+        region_names = get_region_names(include=parse_region_names(self.options['regions']))
+
+        def _find_in_region(region_name):
+            client = pooled_client(self.boto3, 'ec2', region_name)
+            return describe_instance_records(client, region_name, include_filter.to_filter())
+
+        results = map_regions(
+            _find_in_region, region_names,
+            concurrency=self.options['region_concurrency'],
+            timeout=self.options['region_timeout'],
+            log=self.logger,
+        )
+        for _ in results.failed:
+            self.stats.incr('error.region')
+
+        return list(results.chain())
+
+    def lookup_instances(self, include_filter):
+        """
+        Returns the instances matching include_filter from the inventory daemon,
+        or None if it isn't running or can't answer.
+        """
+        if self.options.get('regions'):
+            regions = parse_region_names(self.options['regions'])
+        else:
+            regions = [self.options.get('boto_region')]
+        return lookup_instances(include_filter.to_filter(), regions=regions, log=self.logger)
+
+    def write_instances(self, writer, include_filter):
+        """
+        Writes the instances matching include_filter and the exclusion options to
+        WRITER, a ColumnarWriter. Each page of results is written as soon as it is
+        fetched, so the instances are never all held at once.
+        """
+        instances = self.lookup_instances(include_filter)
+        if instances is not None:
+            writer.write(self.exclude_instances(instances))
+            return
+
+        if self.options.get('regions'):
+            region_names = get_region_names(include=parse_region_names(self.options['regions']))
+        else:
+            region_names = [self.options.get('boto_region')]
+
+        def _write_region(region_name):
+            client = pooled_client(self.boto3, 'ec2', region_name)
+            for page in iter_instance_pages(client, region_name, include_filter.to_filter()):
+                writer.write(self.exclude_instances(page))
+
+        results = map_regions(
+            _write_region, region_names,
+            concurrency=self.options['region_concurrency'],
+            timeout=self.options['region_timeout'],
+            log=self.logger,
+        )
+        for _ in results.failed:
+            self.stats.incr('error.region')
+
+    def export_instances(self, include_filter):
+        """
+        Writes the instances to the --export file. Returns the number written.
+        """
+        columns = instance_columns(parse_tag_keys(self.args.export_tags))
+        with open_writer(self.args.export, columns) as writer:
+            self.write_instances(writer, include_filter)
+        return writer.rows
+
+    def count_instances(self, include_filter):
+        """
+        Returns the Groups of instances by the --group-by fields, the most common
+        first.
+        """
+        counter = GroupCounter(self.group_keys)
+        self.write_instances(counter, include_filter)
+        return counter.groups()
+
     def filter_args(self, include_filter):
         """
         Use include_filter to filter instances based on inclusion/exclusion options
         """
 
         # Filter/find instances based on inclusion filters
-        instances = self.ec2.find_instances(include_filter)
+        with span('fetch'):
+            instances = self.find_instances(include_filter)
 
-        if self.options.get('no_name', False):
-            self.logger.debug(
-                'Excluding instances from the list of %s instances based on filter (%s)',
-                len(instances), 'no_name'
-            )
-            filtered = []
-            for i in instances:
+        with span('filter'):
+            return self.exclude_instances(instances)
+
+    def get_predicate(self):
+        """
+        Returns the function deciding whether an instance found is kept, which
+        checks the exclusion options and the --where conditions not pushed down
+        to EC2, or None to keep them all. Compiled once.
+        """
+        if self._predicate is None:
+            terms = []
+            if self.options.get('no_name', False):
                 # Include instances which have tags (not terminated) and
                 # which don't have a value for the Name tag
-                if i.tags and not [tag for tag in i.tags
-                                   if tag['Key'] == 'Name' and tag['Value']]:
-                        filtered.append(i)
-            instances = filtered
-
-        # Iterate through found instances and filter based on exclude options
-        for opt in Application._OPTS:
-            opt_name = 'exclude_' + opt
-            opt_values = self.options[opt_name]
-
-            self.logger.debug(
-                'Excluding instances from the list of %s instances based on filter (%s: %s)',
-                len(instances), opt_name, opt_values,
-            )
-            for opt_value in opt_values:
-                # Exclude instances if they have an attribute that is excluded
-                instances = [
-                    i for i in instances
-                    if hasattr(i, opt_value) and (Application._INSTANCE_ATTR[opt](i, opt_value) is None or
-                        opt_value not in Application._INSTANCE_ATTR[opt](i, opt_value))
-                ]
+                terms.append(Call(lambda i: bool(i.tags) and not i.name))
+
+            # Exclude instances if they have an attribute that is excluded
+            for opt in Application._OPTS:
+                for opt_value in self.options['exclude_' + opt]:
+                    terms.append(Not(Comparison(opt, '~', (re.escape(opt_value),))))
+
+            if self._where_rest is not None:
+                terms.append(self._where_rest)
+            if not terms:
+                return None
 
-        return instances
+            self._predicate = compile_predicate(And(tuple(terms)))
+            self.logger.debug('Filtering instances with %s', self._predicate.source)
+
+        return self._predicate
+
+    def exclude_instances(self, instances):
+        """
+        Filter instances based on the exclusion options and --where, in a single
+        pass
+        """
+        predicate = self.get_predicate()
+        if predicate is None:
+            return instances
+        return [i for i in instances if predicate(i)]
 
     def output_table(self, instances):
         """
-        Outputs filtered instances as a table
+        Outputs filtered InstanceRecords as a table
+        """
+        # table.draw() blows up if there is nothing to print
+        if instances or not self.args.no_header:
+            print(self.format_table(instances))
+
+    def format_table(self, instances):
+        """
+        Returns filtered InstanceRecords as a table
         """
         table = Texttable(max_width=0)
 
@@ -239,33 +511,239 @@ class Application(krux_ec2.cli.Application):
             # ])
             volumes = None
 
-            # you can use i.region instead of i._placement, but it pretty
-            # prints to RegionInfo:us-east-1. For now, use the private version
             # XXX EVERY column in this output had better have a non-zero length
             # or texttable blows up with 'width must be greater than 0' error
-            name = [tag['Value'] for tag in i.tags if tag['Key'] == 'Name']
             table.add_row([
                 i.id,
-                name[0] if len(name) else None,
+                i.name,
                 i.instance_type,
-                i.placement['AvailabilityZone'],
-                i.security_groups[0]['GroupName'] if len(
-                    i.security_groups) else None,
+                i.zone,
+                i.group,
                 i.state,
                 i.root_device_type,
                 volumes or '-'
             ])
 
+        return table.draw()
+
+    def output_diff(self, changes):
+        """
+        Outputs the changes since a snapshot as a table, one row per instance,
+        with the fields that changed as "field: old -> new"
+        """
+        table = Texttable(max_width=0)
+
+        table.set_deco(Texttable.HEADER)
+        table.set_cols_dtype(['t', 't', 't', 't', 't', 't', 't'])
+        table.set_cols_align(['l', 'l', 'l', 'l', 'l', 'l', 'l'])
+
+        if not self.args.no_header:
+            # using add_row, so the headers aren't being centered, for easier grepping
+            table.add_row(['# change', 'id', 'Name', 'Type', 'Zone', 'State', 'Changes'])
+
+        count = 0
+        for change in changes:
+            i = change.record
+            fields = None
+            if change.change == CHANGED:
+                fields = ', '.join(
+                    '{0}: {1} -> {2}'.format(
+                        field, self._field_value(change.old, field),
+                        self._field_value(change.new, field),
+                    )
+                    for field in change.fields
+                )
+
+            # XXX EVERY column in this output had better have a non-zero length
+            # or texttable blows up with 'width must be greater than 0' error
+            table.add_row([
+                change.change,
+                i.id,
+                i.name or '-',
+                i.instance_type or '-',
+                i.zone or '-',
+                i.state or '-',
+                fields or '-',
+            ])
+            count += 1
+
         # table.draw() blows up if there is nothing to print
-        if instances or not self.args.no_header:
+        if count or not self.args.no_header:
+            print(table.draw())
+
+    def output_groups(self, groups):
+        """
+        Outputs the number of instances per group as a table, or only the number
+        of instances without --group-by fields
+        """
+        if not self.group_keys:
+            print(sum(g.count for g in groups))
+            return
+
+        groups, other = top_groups(groups, self.args.top)
+
+        table = Texttable(max_width=0)
+
+        table.set_deco(Texttable.HEADER)
+        table.set_cols_dtype(['t'] * (len(self.group_keys) + 1))
+        table.set_cols_align(['r'] + ['l'] * len(self.group_keys))
+
+        if not self.args.no_header:
+            # using add_row, so the headers aren't being centered, for easier grepping
+            table.add_row(['# count'] + list(self.group_keys))
+
+        for g in groups:
+            # XXX EVERY column in this output had better have a non-zero length
+            # or texttable blows up with 'width must be greater than 0' error
+            table.add_row([str(g.count)] + [value or '-' for value in g.values])
+
+        if other:
+            table.add_row([str(other), '(other)'] + ['-'] * (len(self.group_keys) - 1))
+
+        # table.draw() blows up if there is nothing to print
+        if groups or not self.args.no_header:
             print(table.draw())
 
+    @staticmethod
+    def _field_value(instance, field):
+        if field.startswith('tag:'):
+            return instance.tag(field[len('tag:'):], '-')
+        value = getattr(instance, field)
+        if isinstance(value, tuple):
+            value = ','.join(value)
+        return value or '-'
+
+    def show_instances(self, include_filter):
+        """
+        Outputs the instances, or their changes with --diff, and saves them to the
+        --snapshot file
+        """
+        instances = self.filter_args(include_filter)
+        with span('render'):
+            if self.args.diff:
+                self.output_diff(iter_changes(self.args.diff, instances))
+            else:
+                self.output_table(instances)
+        if self.args.snapshot:
+            with span('snapshot'):
+                count = write_snapshot(self.args.snapshot, instances)
+            self.logger.info('Saved %d instances to %s', count, self.args.snapshot)
+
+    @staticmethod
+    def _copy_filter(include_filter):
+        copy = Filter()
+        for entry in include_filter.to_filter():
+            for value in entry['Values']:
+                copy.add_filter(name=entry['Name'], value=value)
+        return copy
+
+    def narrowed_filters(self, include_filter, state):
+        """
+        Returns include_filter narrowed for a refresh of --watch that only
+        fetches the instances changing state: those in a transitional state,
+        and those of STATE that were, and the ids of the latter.
+        """
+        transitional = self._copy_filter(include_filter)
+        for state_name in TRANSITIONAL_STATES:
+            transitional.add_filter(name='instance-state-name', value=state_name)
+        filters = [transitional]
+
+        polled_ids = state.transitional_ids()
+        if polled_ids:
+            by_id = self._copy_filter(include_filter)
+            for instance_id in polled_ids:
+                by_id.add_filter(name='instance-id', value=instance_id)
+            filters.append(by_id)
+
+        return filters, polled_ids
+
+    def watch_instances(self, include_filter):
+        """
+        Outputs the instances every --watch seconds until interrupted, redrawing
+        only the rows that changed on a terminal, or printing the changes
+        otherwise. Every refresh asks EC2, not the inventory daemon
+        """
+        # Refreshes can only be narrowed when the filters leave the state and
+        # id to them, as values of a filter are ORed
+        names = set(f['Name'] for f in include_filter.to_filter())
+        narrow = not names & set(['instance-state-name', 'instance-id'])
+
+        painter = None
+        if sys.stdout.isatty():
+            painter = ScreenPainter(sys.stdout, height=terminal_height())
+
+        state = WatchState()
+        try:
+            while True:
+                started = time.time()
+                full = not narrow or state.needs_full(self.args.watch_full)
+
+                with span('fetch'):
+                    if full:
+                        fetched, polled_ids = self.fetch_instances(include_filter), ()
+                    else:
+                        filters, polled_ids = self.narrowed_filters(include_filter, state)
+                        fetched = [i for f in filters for i in self.fetch_instances(f)]
+                    first = not state.refreshes
+                    changes = state.update(fetched, keep=self.get_predicate(), full=full,
+                                           polled_ids=polled_ids)
+
+                with span('render'):
+                    if painter is not None:
+                        self.paint_instances(painter, state, changes, full)
+                    elif first:
+                        self.output_table(state.sorted_records())
+                    elif changes:
+                        self.output_diff(changes)
+                        sys.stdout.flush()
+
+                time.sleep(max(self.args.watch - (time.time() - started), 0))
+        except KeyboardInterrupt:
+            pass
+
+    def paint_instances(self, painter, state, changes, full):
+        """
+        Redraws the table of --watch with a status line, rewriting only the
+        lines that changed
+        """
+        counts = dict((change, 0) for change in (ADDED, REMOVED, CHANGED))
+        for change in changes:
+            counts[change.change] += 1
+
+        status = '{0}  every {1:g}s  {2} instances  +{3} -{4} ~{5}  ({6} refresh)'.format(
+            time.strftime('%H:%M:%S'), self.args.watch, len(state.records),
+            counts[ADDED], counts[REMOVED], counts[CHANGED], 'full' if full else 'partial',
+        )
+        instances = state.sorted_records()
+        lines = [status, '']
+        if instances or not self.args.no_header:
+            lines.extend(self.format_table(instances).split('\n'))
+        painter.paint(lines)
+
     def run(self):
         self.logger.debug('Parsed arguments: %s', self.args)
 
-        include_filter = self.convert_args()
-        instances = self.filter_args(include_filter)
-        self.output_table(instances)
+        with profiled(self.args, log=self.logger):
+            include_filter = self.convert_args()
+            if self.args.export:
+                with span('export'):
+                    count = self.export_instances(include_filter)
+                self.logger.info('Exported %d instances to %s', count, self.args.export)
+            elif self.args.watch is not None:
+                self.watch_instances(include_filter)
+            elif self.group_keys is not None:
+                with span('fetch'):
+                    groups = self.count_instances(include_filter)
+                with span('render'):
+                    self.output_groups(groups)
+            else:
+                self.show_instances(include_filter)
+        get_governor().log_summary(self.logger)
+
+        # The daemon's data may be minutes old, so say when it answered
+        note = inventory_note()
+        if note is not None:
+            sys.stderr.write('Note: %s\n' % note)
 
 
 def main():
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+"""
+Runs the inventory daemon: keeps the instances and volumes of all regions in
+memory, refreshes them in the background and answers the other CLIs over a
+Unix socket. With --status, prints what a running daemon holds instead.
+"""
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+
+#
+# Third party libraries
+#
+
+from texttable import Texttable
+
+#
+# Internal libraries
+#
+
+import krux.cli
+from aws_analysis_tools.inventory import (
+    Inventory, InventoryServer, InventoryClient, Refresher, get_socket_path,
+    DEFAULT_SOCKET, DEFAULT_REFRESH_INTERVAL, DEFAULT_REFRESH_JITTER, DEFAULT_RETRY_INTERVAL,
+)
+from aws_analysis_tools.regions import (
+    get_region_names, parse_region_names, add_region_cli_arguments,
+)
+from aws_analysis_tools.throttle import configure_governor, add_throttle_cli_arguments
+
+
+NAME = 'ec2-inventory'
+
+
+class Application(krux.cli.Application):
+
+    def __init__(self, name=NAME):
+        # Call to the superclass to bootstrap.
+        super(Application, self).__init__(name=name)
+
+        self.socket_path = self.args.socket or get_socket_path() or DEFAULT_SOCKET
+
+        configure_governor(self.args, stats=self.stats, log=self.logger)
+
+    def add_cli_arguments(self, parser):
+        group = krux.cli.get_group(parser, self.name)
+
+        group.add_argument(
+            '--socket',
+            default=None,
+            help="Unix socket to listen on. (default: the --inventory-socket default of the "
+            "other CLIs)",
+        )
+
+        group.add_argument(
+            '--regions',
+            default=None,
+            help="Comma separated list of EC2 regions to keep. (default: all regions)",
+        )
+
+        group.add_argument(
+            '--refresh-interval',
+            type=float,
+            default=DEFAULT_REFRESH_INTERVAL,
+            help="Seconds between refreshes of a region. (default: %(default)s)",
+        )
+
+        group.add_argument(
+            '--refresh-jitter',
+            type=float,
+            default=DEFAULT_REFRESH_JITTER,
+            help="Each region's interval is randomly lengthened or shortened by up to this "
+            "fraction, to spread the API calls. (default: %(default)s)",
+        )
+
+        group.add_argument(
+            '--retry-interval',
+            type=float,
+            default=DEFAULT_RETRY_INTERVAL,
+            help="Seconds before a region that failed to refresh is tried again. "
+            "(default: %(default)s)",
+        )
+
+        group.add_argument(
+            '--status',
+            action='store_true',
+            default=False,
+            help="Print the age and size of each region held by the running daemon, and exit.",
+        )
+
+        add_region_cli_arguments(group)
+        add_throttle_cli_arguments(group)
+
+    def print_status(self):
+        table = Texttable(max_width=0)
+        table.set_deco(Texttable.HEADER)
+        table.set_cols_dtype(['t', 't', 't', 't', 't'])
+        table.set_cols_align(['l', 'r', 'r', 'r', 'l'])
+        # using add_row, so the headers aren't being centered, for easier grepping
+        table.add_row(['# region', 'Age', 'Instances', 'Volumes', 'Error'])
+
+        client = InventoryClient(self.socket_path)
+        for region, status in client.status().items():
+            table.add_row([
+                region,
+                '-' if status['age'] is None else '{0:.0f}s'.format(status['age']),
+                '-' if status['instances'] is None else str(status['instances']),
+                '-' if status['volumes'] is None else str(status['volumes']),
+                status['error'] or '-',
+            ])
+        client.close()
+        print(table.draw())
+
+    def serve(self):
+        region_names = get_region_names(include=parse_region_names(self.args.regions))
+        inventory = Inventory(region_names)
+
+        refresher = Refresher(
+            inventory,
+            interval=self.args.refresh_interval,
+            jitter=self.args.refresh_jitter,
+            retry_interval=self.args.retry_interval,
+            concurrency=self.args.region_concurrency,
+            timeout=self.args.region_timeout,
+            log=self.logger,
+        )
+        server = InventoryServer(self.socket_path, inventory, log=self.logger)
+
+        self.logger.info('Serving the inventory of %d regions on %s',
+                         len(region_names), self.socket_path)
+        refresher.start()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            refresher.stop()
+            server.server_close()
+
+    def run(self):
+        if self.args.status:
+            self.print_status()
+        else:
+            self.serve()
+
+
+def main():
+    app = Application()
+    with app.context():
+        app.run()
+
+
+if __name__ == '__main__':
+    main()
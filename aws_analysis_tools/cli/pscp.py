@@ -0,0 +1,224 @@
+#!/usr/bin/env kaws-python
+"""Parallel copy of a file to a list of nodes, returned from search-ec2-tags.py
+(must be in your path).
+
+Usage:
+  pscp.py -h | --help
+  pscp.py [--query=ec2_tag | --hosts=<hosts>] [--connect-timeout=<timeout>]
+      [--concurrency=<concurrency>] [--address=<type>] [--relay] [--fanout=<N>]
+      [--attempts=<N>] <file> <destination>
+
+Options:
+  -h --help                    show this help message and exit
+  --query=<query>              the string to pass search-ec2-tags.py, "Name:*" when no hosts are
+                               given otherwise
+  --hosts=<hosts>              comma-sep list of hosts to copy to
+  --connect-timeout=<timeout>  the number of seconds to wait for a connection to be established
+                               [default: 10]
+  --concurrency=<N>            number of copies to run in parallel [default: 10]
+                               (0 means run all at once)
+  --address=<type>             connect to the hosts found by --query by their 'name', or their
+                               'private' or 'public' IP address, which skips the DNS lookups.
+                               Output is still prefixed with the name. [default: name]
+  --relay                      hosts that have the file send it on to the next hosts, over ssh,
+                               instead of all getting it from here. Your ssh agent is forwarded
+                               to every host that relays the file
+  --fanout=<N>                 with --relay, the copies each host, and this one, sends at once
+                               [default: 2]
+  --attempts=<N>               copies to a host before giving up on it [default: 3]
+"""
+
+import os
+import sys
+import time
+from collections import OrderedDict
+
+from colorama import Fore
+from docopt import docopt
+
+from eventlet import greenpool
+from eventlet import queue
+from eventlet.green import subprocess
+
+### The hosts are found as krux-ec2-pssh2 finds them
+from aws_analysis_tools.cli.pssh2 import _query, DEFAULT_QUERY
+from aws_analysis_tools.distribute import (RelayPlan, LOCAL, PRESENT, bash_command, file_sha256,
+                                           parse_probe, probe_command, receive_command,
+                                           relay_command)
+from aws_analysis_tools.ssh import (AddressedSSHHost, format_summary, host_key_alias, host_pairs,
+                                    ADDRESS_TYPES, FAILED, OK)
+
+
+MEGABYTE = 1024.0 * 1024
+
+
+def _positive(args, name, zero=False):
+    """
+    Returns the value of option NAME as an integer greater than 0, or 0 too if ZERO.
+    """
+    try:
+        value = int(args[name])
+    except ValueError:
+        value = -1
+    if value < (0 if zero else 1):
+        print(Fore.RED + '%s must be %s integer' % (
+            name, '0 or a positive' if zero else 'a positive') + Fore.RESET)
+        sys.exit(1)
+    return value
+
+
+def main():
+    args = docopt(__doc__)
+
+    path = args['<file>']
+    dest = args['<destination>']
+    query = args['--query']
+
+    if args['--query'] and args['--hosts']:
+        print(Fore.RED + 'You can use only one of --query and --hosts' + Fore.RESET)
+        sys.exit(1)
+    if not args['--hosts']:
+        query = query or DEFAULT_QUERY
+
+    address = args['--address']
+    if address not in ADDRESS_TYPES:
+        print(Fore.RED + '--address must be one of: %s' % ', '.join(ADDRESS_TYPES) + Fore.RESET)
+        sys.exit(1)
+
+    concurrency = _positive(args, '--concurrency', zero=True)
+    fanout = _positive(args, '--fanout')
+    attempts = _positive(args, '--attempts')
+    connect_timeout = int(args['--connect-timeout'])
+
+    if not os.path.isfile(path):
+        print(Fore.RED + 'Sorry, %s is not a file.' % path + Fore.RESET)
+        sys.exit(1)
+
+    ### hosts holds (label, address) pairs, one per address: instances sharing a Name get labels
+    ### of their own, and the copies are planned and reported by label
+    zones = {}
+    if query:
+        hosts = _query(query, address, zones)
+        if len(hosts) > 0 and hosts[0][0].startswith('Error'):
+            print('%sSorry, search-ec2-tags.py returned an error:\n %s%s' % (
+                Fore.RED, hosts, Fore.RESET))
+            sys.exit(1)
+    else:
+        hosts = list(host_pairs(host.strip() for host in args['--hosts'].split(',')))
+
+    if len(hosts) == 0:
+        print(Fore.RED + 'Sorry, search-ec2-tags.py returned zero results.' + Fore.RESET)
+        sys.exit(1)
+
+    if concurrency == 0:
+        concurrency = len(hosts)
+    addresses = OrderedDict(hosts)
+    ppl = max(len(host) for host, _ in hosts) + 3
+
+    size = os.path.getsize(path)
+    sha256 = file_sha256(path)
+    print('Copying %s (%.1f MB, sha256 %s) to %s on %d hosts' % (
+        path, size / MEGABYTE, sha256, dest, len(hosts)))
+
+    receive = receive_command(dest, size, sha256)
+
+    def ssh_cmd(host, forward_agent=False):
+        cmd = AddressedSSHHost(host, addresses[host], connect_timeout=connect_timeout,
+                               prefix_pad_length=ppl)._get_ssh_cmd()
+        if forward_agent:
+            cmd[-1:-1] = ['-A']
+        return cmd
+
+    def copy(source, target):
+        """
+        Continues the copy of the file to TARGET from SOURCE, or only checks it if TARGET has it.
+        Returns the outcome, the bytes sent, what went wrong and whether SOURCE was involved.
+        """
+        probe = subprocess.Popen(ssh_cmd(target) + [bash_command(probe_command(dest, sha256))],
+                                 stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE)
+        stdout, stderr = probe.communicate()
+        if probe.returncode != 0:
+            return FAILED, 0, stderr.decode('utf-8', 'replace').strip(), False
+        offset = parse_probe(stdout.decode('utf-8', 'replace'))
+        if offset == PRESENT:
+            return OK, 0, None, False
+
+        if source is LOCAL:
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                proc = subprocess.Popen(ssh_cmd(target) + [bash_command(receive)], stdin=f,
+                                        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                _, stderr = proc.communicate()
+        else:
+            ### The source connects to the target with the agent forwarded from here
+            target_ssh = ['-o', 'ConnectTimeout=%d' % connect_timeout, addresses[target]]
+            alias = host_key_alias(target, addresses[target])
+            if alias is not None:
+                target_ssh[-1:-1] = ['-o', 'HostKeyAlias=%s' % alias]
+            proc = subprocess.Popen(
+                ssh_cmd(source, forward_agent=True)
+                + [bash_command(relay_command(dest, offset, target_ssh, receive))],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            _, stderr = proc.communicate()
+        ### How much of the file got there is only known to the next probe
+        if proc.returncode != 0:
+            return FAILED, 0, (stderr.decode('utf-8', 'replace').strip()
+                               or 'exit status %d' % proc.returncode), True
+        return OK, size - offset, None, True
+
+    done = queue.Queue()
+
+    def do_copy(source, target):
+        start = time.time()
+        try:
+            outcome, sent, error, involved = copy(source, target)
+        except (IOError, OSError) as e:
+            outcome, sent, error, involved = FAILED, 0, str(e), True
+        done.put((source, target, outcome, sent, error, involved, time.time() - start))
+
+    plan = RelayPlan(list(addresses), relay=bool(args['--relay']), fanout=fanout,
+                     attempts=attempts, zones=zones)
+    pool = greenpool.GreenPool(concurrency)
+    running = 0
+    sent_here = 0
+    started = time.time()
+    while True:
+        while running < concurrency:
+            transfer = plan.next_transfer()
+            if transfer is None:
+                break
+            pool.spawn_n(do_copy, *transfer)
+            running += 1
+        if running == 0:
+            break
+
+        source, target, outcome, sent, error, involved, seconds = done.get()
+        running -= 1
+        plan.done(source, target, outcome == OK, source_failed=involved)
+        prefix = '[%s]' % target
+        prefix += ' ' * (ppl - len(prefix))
+        origin = 'here' if source is LOCAL else source
+        if source is LOCAL:
+            sent_here += sent
+        if outcome == OK:
+            if sent:
+                print('%s %.1f MB from %s in %.2fs' % (prefix, sent / MEGABYTE, origin, seconds))
+            else:
+                print('%s already has the file' % prefix)
+        else:
+            print('%s%s copy from %s failed%s: %s%s' % (
+                Fore.RED, prefix, origin, '' if target in plan.failed else ', trying again',
+                error, Fore.RESET))
+
+    outcomes = [(host, FAILED if host in plan.failed else OK) for host in addresses]
+    depth = max([plan.depth(host) for host in plan.sources] or [0])
+    print('%d of %d hosts have the file after %.1fs, %.1f MB sent from here, %d hops deep' % (
+        len(plan.sources), len(hosts), time.time() - started, sent_here / MEGABYTE, depth))
+    if plan.failed:
+        print(Fore.RED + '\n'.join(format_summary(outcomes)) + Fore.RESET)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -9,13 +9,19 @@
 #
 # Options:
 #  -h, --help           show this help message and exit
-#  --query=QUERY        the string to pass search-ec2-tags.py
+#  --query=QUERY        the string to pass search-ec2-tags.py, answered from the
+#                       krux-ec2-inventory daemon when it is running
 #  --hosts=HOSTS        comma-sep list of hosts to ssh to
 #  --no-color           disable or enable color
 #  --keep-ssh-warnings  disable the removing of SSH warnings from stderr output
 #  --connect-timeout    ssh ConnectTimeout option
 #  --timeout            amount of time to wait, before killing the ssh
+#  --address            connect by 'name', or 'private' or 'public' IP address
+#  --state              where the state of the run is written
+#  --retry-failed       run again on the hosts of a state file that didn't succeed
+#  --resume             run on the hosts of a state file that weren't done
 
+import os
 import sys
 import time
 import select
@@ -24,6 +30,10 @@ from optparse import OptionParser
 
 ### Nasty hack to get around the fact that search-ec2-tags has dashes in the name
 from aws_analysis_tools.cli.search_ec2_tags import parse_query, search_tags
+from aws_analysis_tools.inventory import inventory_note
+from aws_analysis_tools.run_state import (RunState, StateError, new_state_path, resume_state,
+                                          retry_message)
+from aws_analysis_tools.ssh import ADDRESS_TYPES, FAILED, OK, TIMED_OUT, host_pairs
 
 def hilite(string, options, color='white', bold=False):
     if options.no_color:
@@ -66,17 +76,35 @@ def remove_ssh_warnings(stderr, options):
     return '\n'.join(output)
 
 
-def query(string):
+def query(string, address='name'):
+    """
+    Returns the hosts matching the query as unique (label, address) pairs.
+    Hosts without the address asked for are reached by name.
+    """
     parsed_query, parsed_regions = parse_query(string)
-    response = search_tags(parsed_query, passed_regions=parsed_regions)
-    print("Matched the following hosts: %s" % ', '.join(response))
+    response = list(host_pairs(search_tags(parsed_query, passed_regions=parsed_regions,
+                                           address=None if address == 'name' else address),
+                               address))
+    note = inventory_note()
+    print("Matched the following hosts%s: %s" % ('' if note is None else ' (%s)' % note,
+                                                 ', '.join(label for label, _ in response)))
     return response
 
 
+def record_outcome(state, host, host_address, proc, started):
+    """
+    Records the outcome of HOST, reached at HOST_ADDRESS, whose ssh PROC exited, in STATE.
+    """
+    state.record(host, host_address, OK if proc.returncode == 0 else FAILED,
+                 status=proc.returncode,
+                 seconds=time.time() - started)
+
+
 def main():
     parser = OptionParser(usage=__doc__)
     parser.add_option("--query",
-            help='the string to pass search-ec2-tags.py.',
+            help='the string to pass search-ec2-tags.py, answered from the krux-ec2-inventory '
+                 'daemon when it is running.',
             default=False
     )
     parser.add_option("--host", help='comma-sep list of hosts to ssh to', default=False)
@@ -89,31 +117,90 @@ def main():
     parser.add_option("--keep-ssh-warnings", action="store_true",
                       help="disable the removing of SSH warnings from stderr output",
                       default=False)
+    parser.add_option("--address", choices=ADDRESS_TYPES, default='name',
+                      help="connect to queried hosts by 'name', or by 'private' or 'public' "
+                      "IP address to skip the DNS lookups")
+    parser.add_option("--state", default=None,
+                      help="where the state of the run is written, by default a new file in "
+                      "~/.cache/aws-analysis-tools/pssh-runs")
+    parser.add_option("--retry-failed", metavar="STATE", default=None,
+                      help="run the command again on the hosts of the run whose state file this is "
+                      "that didn't succeed, adding their outcomes to it")
+    parser.add_option("--resume", metavar="STATE", default=None,
+                      help="run the command on the hosts of the run whose state file this is that "
+                      "it didn't get to or see the end of, adding their outcomes to it")
     (options, args) = parser.parse_args()
 
     procs = []
     command = args[0]
 
-    hosts = []
+    # (label, address) pairs, the labels unique even when instances share their Name
+    pairs = []
     if options.query:
-        hosts = query(options.query)
-        if len(hosts) > 0 and hosts[0].startswith("Error"):
-            print(hilite("Sorry, search-ec2-tags.py returned an error:\n %s" % hosts, options, 'red'))
+        pairs = query(options.query, options.address)
+        if len(pairs) > 0 and (pairs[0][0] or '').startswith("Error"):
+            print(hilite("Sorry, search-ec2-tags.py returned an error:\n %s" % pairs, options, 'red'))
             sys.exit(1)
 
     if options.host:
-        hosts = [host.strip() for host in hosts.split(',')]
+        pairs = list(host_pairs(host.strip() for host in options.host.split(',')))
+
+    # The state file has the outcome of each host as soon as it is known, so a run can be retried
+    # or resumed even if it was interrupted
+    previous = options.retry_failed or options.resume
+    if previous:
+        if options.query or options.host or (options.retry_failed and options.resume):
+            print(hilite("You can use only one of --query, --host, --retry-failed and --resume",
+                         options, 'red'))
+            sys.exit(1)
+        try:
+            state, pairs = resume_state(previous, command,
+                                        retry_failed=bool(options.retry_failed))
+        except StateError as e:
+            print(hilite(str(e), options, 'red'))
+            sys.exit(1)
+        if len(pairs) == 0:
+            state.close()
+            print("There are no hosts to run again in %s" % previous)
+            sys.exit(0)
+        print("Running again on: %s" % ', '.join(label for label, _ in pairs))
 
-    if len(hosts) == 0:
+    if len(pairs) == 0:
         print(hilite("Sorry, search-ec2-tags.py returned zero results.", options, 'red'))
         sys.exit(1)
 
-    for host in hosts:
+    if not previous:
+        state = RunState(os.path.expanduser(options.state or new_state_path()))
+        state.start(command, pairs)
+
+    started = time.time()
+
+    hosts = list(pairs)
+    for _, host_address in pairs:
         proc = subprocess.Popen("ssh -oStrictHostKeyChecking=no -oConnectTimeout=%s %s '%s'" %
-                                (options.connect_timeout, host, command), shell=True,
+                                (options.connect_timeout, host_address, command), shell=True,
                                 stderr=subprocess.PIPE, stdout=subprocess.PIPE)
         procs.append(proc)
 
+    try:
+        run(hosts, procs, options, state, started)
+    except KeyboardInterrupt:
+        state.close()
+        print(hilite("\nInterrupted; run the hosts not done with --resume %s" % state.path,
+                     options, 'red'))
+        sys.exit(130)
+    state.close()
+
+    message = retry_message(state)
+    if message:
+        print(hilite(message, options, 'red'))
+
+
+def run(hosts, procs, options, state, started):
+    """
+    Prints the output of the ssh PROCS to HOSTS, (label, address) pairs, as they finish, and
+    records their outcomes in STATE.
+    """
     index = 0
     ticks = 0
     too_long = False
@@ -124,7 +211,7 @@ def main():
         if ticks > 60:
             too_long = True
 
-        host = hosts[index]
+        host, host_address = hosts[index]
         proc = procs[index]
 
         # has it finished? go ahead and print the host and results.
@@ -137,12 +224,13 @@ def main():
             stderr = remove_ssh_warnings(stderr, options)
             if stderr and len(stderr) > 1:
                 print("STDERR: \n%s" % hilite(stderr, options, 'red', False))
+            record_outcome(state, host, host_address, proc, started)
             del procs[index]
             del hosts[index]
 
         elif not too_long and (ticks > 1) and (ticks % 5 == 0):
             # only print "waiting still.." every 5 sec.
-            print("waiting on these hosts, still: %s" % ', '.join(hosts))
+            print("waiting on these hosts, still: %s" % ', '.join(label for label, _ in hosts))
             time.sleep(1)
 
         if too_long:
@@ -189,6 +277,7 @@ def main():
 
             # remove from queue
             if proc.poll() is not None:
+                record_outcome(state, host, host_address, proc, started)
                 del procs[index]
                 del hosts[index]
 
@@ -203,7 +292,10 @@ def main():
 
         if ticks > options.timeout:
             [bad.terminate() for bad in procs]
-            print(hilite("\nSorry, the following hosts took too long, and I gave up: %s\n" % ','.join(hosts), options, 'red'))
+            for host, host_address in hosts:
+                state.record(host, host_address, TIMED_OUT, seconds=time.time() - started)
+            labels = ','.join(label for label, _ in hosts)
+            print(hilite("\nSorry, the following hosts took too long, and I gave up: %s\n" % labels, options, 'red'))
             break
 
 if __name__ == '__main__':
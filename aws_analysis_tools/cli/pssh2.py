@@ -4,13 +4,25 @@
 
 Usage:
   pssh.py -h | --help
-  pssh.py [--query=ec2_tag | --hosts=<hosts>] [--connect-timeout=<timeout>]
-      [--concurrency=<concurrency>] [--force-line-buf] <command>
+  pssh.py [--query=ec2_tag | --hosts=<hosts> | --retry-failed=<state> | --resume=<state>]
+      [--state=<file>] [--connect-timeout=<timeout>]
+      [--concurrency=<concurrency>] [--force-line-buf] [--stream] [--address=<type>]
+      [--timeout=<seconds>] [--deadline=<seconds>] [--order=<order>] [--history=<file>]
+      [--no-history] [--timings] [--timings-output=<file>] [--slowest=<N>]
+      [--flush-interval=<seconds>] <command>
 
 Options:
   -h --help                    show this help message and exit
-  --query=<query>              the string to pass search-ec2-tags.py [default: "Name:*"]
+  --query=<query>              the string to pass search-ec2-tags.py, "Name:*" when no hosts are
+                               given otherwise. The krux-ec2-inventory daemon answers it when
+                               it is running, which the matched hosts are printed with
   --hosts=<hosts>              comma-sep list of hosts to ssh to
+  --retry-failed=<state>       run the command again on the hosts of the run whose state file this
+                               is that didn't succeed, adding their outcomes to it
+  --resume=<state>             run the command on the hosts of the run whose state file this is
+                               that it didn't get to or see the end of, adding their outcomes to it
+  --state=<file>               where the state of the run is written, by default a new file in
+                               ~/.cache/aws-analysis-tools/pssh-runs
   --connect-timeout=<timeout>  the number of seconds to wait for a connection to be established
                                [default: 10]
   --concurrency=<N>            number of ssh commands to run in parallel [default: 10]
@@ -19,10 +31,40 @@ Options:
                                NOTE: This is known to cause issues with some commands, such as
                                 apt-get. If you get hanging output or strange IO errors, don't
                                 use this option for that command.
+  --stream                     Start running the command on the hosts found in each region as
+                               soon as that region has been searched, instead of waiting for all
+                               regions. --concurrency applies to all hosts combined.
+  --address=<type>             connect to the hosts found by --query by their 'name', or their
+                               'private' or 'public' IP address, which skips the DNS lookups.
+                               Output is still prefixed with the name. [default: name]
+  --timeout=<seconds>          stop the command on a host after this many seconds, freeing its
+                               slot for the next host. The command is terminated on the host.
+  --deadline=<seconds>         stop the commands still running this many seconds after the
+                               start, and skip the hosts not started yet. A summary of the
+                               hosts that timed out or were skipped is printed at the end.
+  --order=<order>              the order the hosts are run in: 'slowest' first, by how long they
+                               took in previous runs, which shortens runs with more hosts than the
+                               concurrency; 'zone', slowest first with the hosts running at once
+                               spread over the availability zones; or by 'name'. Doesn't apply
+                               to --stream. [default: slowest]
+  --history=<file>             where how long each host took is kept
+                               [default: ~/.cache/aws-analysis-tools/pssh2-history.json]
+  --no-history                 neither use nor update the history
+  --timings                    time the phases of ssh on each host (dns, connect, auth and
+                               command) and print their percentiles, a histogram and the slowest
+                               hosts at the end
+  --timings-output=<file>      also write the timings of each host to this file, as JSON lines
+  --slowest=<N>                number of the slowest hosts --timings prints [default: 10]
+  --flush-interval=<seconds>   when the output isn't a terminal, the lines of all hosts are written
+                               in chunks, each line at most this long after it came; 0 writes
+                               each line as it comes, as on a terminal [default: 0.1]
 """
 
+import os
 import sys
-import traceback
+import time
+
+import eventlet
 
 from colorama import Fore
 from docopt import docopt
@@ -44,49 +86,180 @@ import eventlet.green.subprocess
 ssh.subprocess = eventlet.green.subprocess
 
 ### Nasty hack to get around the fact that search-ec2-tags has dashes in the name
-from aws_analysis_tools.cli.search_ec2_tags import parse_query, search_tags
+from aws_analysis_tools.cli.search_ec2_tags import parse_query, search_tags, iter_search_tags
+from aws_analysis_tools.inventory import inventory_note
+from aws_analysis_tools.output import CoalescingWriter
+from aws_analysis_tools.ssh import (AddressedSSHHost, Deadline, run_command, format_summary,
+                                    host_pairs, ADDRESS_TYPES, OK, SKIPPED, TIMED_OUT)
+from aws_analysis_tools.run_state import (RunState, StateError, new_state_path, resume_state,
+                                          retry_message)
+from aws_analysis_tools.schedule import HostHistory, order_hosts, ORDERS
+from aws_analysis_tools.ssh_timing import (HostTiming, PhaseTimer, TimedSSHHost, render_timings,
+                                           write_timings)
+
+### How often the region search is polled while ssh commands are running in --stream mode. The
+### search runs in real threads, so polling blocks the green threads for up to this long.
+STREAM_POLL_INTERVAL = 0.01
+STREAM_IDLE_INTERVAL = 0.05
+
+### The hosts run on when none are given
+DEFAULT_QUERY = 'Name:*'
 
 
-def _query(string):
+def _query(string, address='name', zones=None):
+    """
+    Returns the hosts matching the query as unique (label, address) pairs, and puts the zone of
+    each in ZONES, when given, under its label.
+    """
     parsed_query, parsed_regions = parse_query(string)
-    response = search_tags(parsed_query, passed_regions=parsed_regions)
-    print('Matched the following hosts: %s' % ', '.join(response))
+    found = {}
+    response = list(host_pairs(search_tags(
+        parsed_query, passed_regions=parsed_regions,
+        address=None if address == 'name' else address, zones=found,
+    ), address))
+    if zones is not None:
+        zones.update((label, found[host_address]) for label, host_address in response
+                     if host_address in found)
+    note = inventory_note()
+    print('Matched the following hosts%s: %s' % ('' if note is None else ' (%s)' % note,
+                                                 ', '.join(label for label, _ in response)))
     return response
 
 
+def _stream_query(string, address='name'):
+    """
+    Yields the hosts matching the query as each region is searched, once each, as unique
+    (label, address) pairs.
+    """
+    parsed_query, parsed_regions = parse_query(string)
+    return host_pairs(iter_search_tags(
+        parsed_query, passed_regions=parsed_regions, poll_interval=STREAM_POLL_INTERVAL,
+        idle=lambda: eventlet.sleep(STREAM_IDLE_INTERVAL),
+        address=None if address == 'name' else address,
+    ), address)
+
+
+def _seconds(args, name):
+    """
+    Returns the value of option NAME as a number of seconds greater than 0, or None if not given.
+    """
+    value = args[name]
+    if value is None:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        seconds = 0
+    if seconds <= 0:
+        print(Fore.RED + '%s must be a number of seconds greater than 0' % name + Fore.RESET)
+        sys.exit(1)
+    return seconds
+
+
 def main():
     args = docopt(__doc__)
 
     command = args['<command>']
     query = args['--query']
 
-    if args['--hosts'] and query:
-        print(Fore.RED + 'You can use only one of --query and --hosts' + Fore.RESET)
+    given = [option for option in ('--query', '--hosts', '--retry-failed', '--resume')
+             if args[option]]
+    if len(given) > 1:
+        print(Fore.RED + 'You can use only one of --query, --hosts, --retry-failed and --resume'
+              + Fore.RESET)
         sys.exit(1)
+    if not given:
+        query = DEFAULT_QUERY
+
+    address = args['--address']
+    if address not in ADDRESS_TYPES:
+        print(Fore.RED + '--address must be one of: %s' % ', '.join(ADDRESS_TYPES) + Fore.RESET)
+        sys.exit(1)
+
+    order = args['--order']
+    if order not in ORDERS:
+        print(Fore.RED + '--order must be one of: %s' % ', '.join(ORDERS) + Fore.RESET)
+        sys.exit(1)
+
+    timing = bool(args['--timings'] or args['--timings-output'])
+    try:
+        slowest = int(args['--slowest'])
+    except ValueError:
+        slowest = -1
+    if slowest < 0:
+        print(Fore.RED + '--slowest must be 0 or a positive integer' + Fore.RESET)
+        sys.exit(1)
+
+    try:
+        flush_interval = float(args['--flush-interval'])
+    except ValueError:
+        flush_interval = -1
+    if flush_interval < 0:
+        print(Fore.RED + '--flush-interval must be 0 or a number of seconds' + Fore.RESET)
+        sys.exit(1)
+
+    history = None
+    if not args['--no-history']:
+        history = HostHistory(os.path.expanduser(args['--history'])).load()
+
+    ### hosts holds (label, address) pairs. With --stream, it is a generator that yields them while
+    ### the search is still running
+    stream = bool(query and args['--stream'])
 
     hosts = []
-    if query:
-        hosts = _query(query)
-        if len(hosts) > 0 and hosts[0].startswith('Error'):
+    zones = {}
+    if stream:
+        hosts = _stream_query(query, address)
+    elif query:
+        hosts = _query(query, address, zones)
+        if len(hosts) > 0 and hosts[0][0].startswith('Error'):
             print('%sSorry, search-ec2-tags.py returned an error:\n %s%s' % (
                 Fore.RED, hosts, Fore.RESET))
             sys.exit(1)
 
     if args['--hosts']:
-        hosts = [host.strip() for host in args['--hosts'].split(',')]
+        hosts = list(host_pairs(host.strip() for host in args['--hosts'].split(',')))
 
-    if len(hosts) == 0:
+    ### The state file has the outcome of each host as soon as it is known, so a run can be retried
+    ### or resumed even if it was interrupted
+    previous = args['--retry-failed'] or args['--resume']
+    if previous:
+        try:
+            state, hosts = resume_state(previous, command,
+                                        retry_failed=bool(args['--retry-failed']))
+        except StateError as e:
+            print(Fore.RED + str(e) + Fore.RESET)
+            sys.exit(1)
+        if len(hosts) == 0:
+            state.close()
+            print('There are no hosts to run again in %s' % previous)
+            sys.exit(0)
+        print('Running again on: %s' % ', '.join(name for name, _ in hosts))
+    else:
+        state = RunState(os.path.expanduser(args['--state'] or new_state_path()))
+        state.start(command, [] if stream else hosts)
+
+    if not stream and len(hosts) == 0:
         print(Fore.RED + 'Sorry, search-ec2-tags.py returned zero results.' + Fore.RESET)
         sys.exit(1)
 
     concurrency = int(args['--concurrency'])
     if concurrency == 0:
-        concurrency = len(hosts)
+        concurrency = sys.maxsize if stream else len(hosts)
     elif concurrency < 0:
         print(Fore.RED + '--concurrency must be 0 or a positive integer' + Fore.RESET)
         sys.exit(1)
 
-    ppl = max(len(host) for host in hosts) + 3
+    ### The hosts expected to take longest start first, so they don't hold up the end of the run
+    if not stream:
+        estimates = history.estimates(host for host, _ in hosts) if history is not None else {}
+        hosts = order_hosts(hosts, order, estimates, zones, key=lambda pair: pair[0])
+
+    ### Each host gets up to --timeout seconds, and none runs past the --deadline of the whole run
+    deadline = Deadline(_seconds(args, '--timeout'), _seconds(args, '--deadline'))
+
+    ### When streaming, the prefixes are padded to the longest host seen so far
+    ppl = 0 if stream else max(len(host) for host, _ in hosts) + 3
 
     ### This creates a library that automatically makes stdout line-buffered to try to enforece the
     ### commands run to output a line to us as soon as one is ready. Since this library is injected
@@ -100,17 +273,96 @@ def main():
                    ' | gcc -s -include stdio.h -x c - -fPIC -shared -o "$HOME/lib/line-buffer.so";'
                    ' export LD_PRELOAD="$HOME/lib/line-buffer.so"; ' + command)
 
-    def do_ssh(host):
-        try:
-            ssh.SSHHost(host, prefix_pad_length=ppl,
-                        connect_timeout=int(args['--connect-timeout'])).run(command)
-        except ssh.SSHException:
-            traceback.print_exc()
+    ### (host, outcome) pairs, in the order the hosts finished, how long each host took and, with
+    ### timings, how long each took to connect and the HostTiming of each
+    outcomes = []
+    durations = {}
+    connects = {}
+    timings = []
+
+    def do_ssh(host, host_address, ppl):
+        timeout = deadline.remaining()
+        if timeout is not None and timeout <= 0:
+            outcomes.append((host, SKIPPED))
+            state.record(host, host_address, SKIPPED)
+            return
+        options = dict(prefix_pad_length=ppl, connect_timeout=int(args['--connect-timeout']),
+                       output=output)
+        timer = PhaseTimer() if timing else None
+        if timer is None:
+            ssh_host = AddressedSSHHost(host, host_address, **options)
+        else:
+            ssh_host = TimedSSHHost(host, host_address, timer=timer, **options)
+
+        start = time.time()
+        outcome = run_command(ssh_host, command, timeout=timeout, sleep=eventlet.sleep)
+        outcomes.append((host, outcome))
+        state.record(host, host_address, outcome,
+                     status=ssh_host.process and ssh_host.process.returncode,
+                     seconds=time.time() - start)
+        if timer is not None:
+            timer.finish()
+            timings.append(HostTiming(host, outcome, timer.phases()))
+            if timer.connect_time() is not None:
+                connects[host] = timer.connect_time()
+        ### A failure may be a connection that failed, which says nothing of how long the command
+        ### takes; a timeout is a lower bound
+        if outcome in (OK, TIMED_OUT):
+            durations[host] = time.time() - start
 
+    ### The output of all hosts goes through one writer, which writes it in large chunks unless
+    ### stdout is a terminal, and flushes it in a green thread of its own while it is quiet
+    output = CoalescingWriter(sys.stdout, flush_interval=flush_interval)
+    if not output.line_buffered:
+        eventlet.spawn_n(output.run, sleep=eventlet.sleep)
+
+    ### spawn_n() waits for a free slot when the pool is full, so with --stream the search results
+    ### queue up until there's room for them.
     pool = greenpool.GreenPool(concurrency)
-    for host in hosts:
-        pool.spawn_n(do_ssh, host)
-    pool.waitall()
+    started = 0
+    try:
+        for host, host_address in hosts:
+            ppl = max(ppl, len(host) + 3)
+            if stream:
+                state.add_host(host, host_address)
+            pool.spawn_n(do_ssh, host, host_address, ppl)
+            started += 1
+        pool.waitall()
+    except KeyboardInterrupt:
+        output.close()
+        state.close()
+        print(Fore.RED + '\nInterrupted; run the hosts not done with --resume %s' % state.path
+              + Fore.RESET)
+        sys.exit(130)
+    output.close()
+    state.close()
+
+    if started == 0:
+        print(Fore.RED + 'Sorry, search-ec2-tags.py returned zero results.' + Fore.RESET)
+        sys.exit(1)
+
+    if any(outcome != OK for _, outcome in outcomes):
+        print(Fore.RED + '\n'.join(format_summary(outcomes)) + Fore.RESET)
+        message = retry_message(state)
+        if message:
+            print(Fore.RED + message + Fore.RESET)
+
+    if args['--timings'] and timings:
+        sys.stderr.write(render_timings(timings, slowest) + '\n')
+    if args['--timings-output']:
+        try:
+            write_timings(args['--timings-output'], timings)
+        except (IOError, OSError) as e:
+            print(Fore.RED + 'Unable to write the timings to %s: %s' % (args['--timings-output'], e)
+                  + Fore.RESET)
+
+    if history is not None and (durations or connects):
+        history.record_run(durations, connects)
+        try:
+            history.save()
+        except (IOError, OSError) as e:
+            print(Fore.RED + 'Unable to save the host history to %s: %s' % (history.path, e)
+                  + Fore.RESET)
 
 
 if __name__ == '__main__':
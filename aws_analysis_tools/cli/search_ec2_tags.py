@@ -28,10 +28,26 @@ import krux.logging
 ### Third Party Libraries ###
 #############################
 
-import boto.ec2
-import boto.exception
 import json
 
+##########################
+### Internal Libraries ###
+##########################
+
+from aws_analysis_tools.inventory import (
+    configure_inventory, add_inventory_cli_arguments, inventory_note,
+)
+from aws_analysis_tools.regions import (
+    add_region_cli_arguments, DEFAULT_CONCURRENCY, DEFAULT_TIMEOUT, POLL_INTERVAL,
+)
+from aws_analysis_tools.search import (
+    iter_search_instances, search_instances, parse_fields, project, FIELDS,
+)
+from aws_analysis_tools.throttle import (
+    get_governor, configure_governor, add_throttle_cli_arguments,
+)
+from aws_analysis_tools.tracing import span, profiled, configure_tracer, add_profile_cli_arguments
+
 
 def parse_query(query_to_parse):
     """
@@ -54,100 +70,58 @@ def parse_query(query_to_parse):
     return parsed_query, parsed_regions
 
 
-def search_tags(query_terms, passed_regions=None, log=None):
+### Instance attribute holding each kind of address search_tags() can return
+ADDRESS_ATTRIBUTES = {
+    'private': 'private_ip_address',
+    'public': 'ip_address',
+}
+
+
+def search_tags(query_terms, passed_regions=None, log=None,
+                concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT, address=None,
+                zones=None):
     """
     Searches EC2 instances based on parsed search terms returned by parse_query()
     Skips GovCloud and China regions, and can be further filtered by region.
+    Regions are searched in parallel; a region that fails is logged and
+    skipped.
+
+    With ADDRESS ('private' or 'public'), returns (name, IP address) tuples
+    instead of names, so callers can connect without resolving the names.
+    With ZONES, a dict, the availability zone of each instance found is also
+    put in it under the address it is reached at: its name, or its IP address
+    with ADDRESS when it has one.
     """
-    regions    = boto.ec2.regions()
-    filters    = []
-    query      = {}
-    inst_names = []
+    return sorted(iter_search_tags(
+        query_terms, passed_regions=passed_regions, log=log,
+        concurrency=concurrency, timeout=timeout, address=address, zones=zones,
+    ), key=lambda result: (result if address is None else result[0]) or '')
+
 
+def iter_search_tags(query_terms, passed_regions=None, log=None,
+                     concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT,
+                     poll_interval=POLL_INTERVAL, idle=None, address=None, zones=None):
+    """
+    Like search_tags(), but yields the names found in each region as soon as
+    that region has been searched, so callers can start working on them while
+    slower regions are still being searched. IDLE is passed to iter_regions().
+    """
     if log is None:
         log = krux.logging.get_logger(
             'search_tags', level='error'
         )
 
-    ### Set filters
-    if passed_regions is not None and passed_regions:
-        ### lambda:  if we've specified a region, only pick regions that
-        ### match the provided regions
-        if isinstance(passed_regions, list):
-            filters.extend([lambda r: r.name in passed_regions])
-        else:
-            filters.extend([lambda r: r.name in passed_regions.split(',')])
-
-    ### lambdas:  remove govcloud and China to improve search speed since
-    ### we don't have access to them.
-    filters.extend([
-        lambda r: '-gov-' not in r.name,
-        lambda r: not r.name.startswith('cn-')
-    ])
-
-    ### Filter out unneeded regions from our regions list.
-    for some_filter in filters:
-        regions = filter(some_filter, regions)
-
-    ### Populate query dictionary to send to AWS
-    for search_param in query_terms:
-        ### Splits the query at : if it's a tag:value search parameter and adds
-        ### those to the query dictionary (or appends the value to an existing
-        ### tag), otherwise it creates a key of tag-value (if it doesn't already
-        ### exist) with the search term as the value and performs a value only
-        ### search.
-        ###
-        ### Examples:
-        ###     Name:period searches for tag Name and value *period*
-        ###     s_periodic searches for value matching *s_periodic*.
-        ###     Name:period*,Name:webapp* searches for tag Name with values
-        ###         *period* and *webapp* as an OR search.
-
-        ### Check to see if we're searching for an s_class where the split
-        ### would cause a problem
-        if search_param.startswith('s_') and not search_param.startswith('s_classes'):
-            search_term = [search_param]
+    for record in iter_search_instances(
+        query_terms, passed_regions=passed_regions, log=log, concurrency=concurrency,
+        timeout=timeout, poll_interval=poll_interval, idle=idle, fields=('name',),
+    ):
+        host_address = None if address is None else getattr(record, ADDRESS_ATTRIBUTES[address])
+        if zones is not None and (host_address or record.name):
+            zones[host_address or record.name] = record.zone
+        if address is None:
+            yield record.name
         else:
-            search_term = search_param.split(':',1)
-
-        ### If the query contains just a value, like with a query for s_periodic,
-        ### add it to the value search, len(search_term) will be 1 and gets added
-        ### to tag value.  We always search to ensure that the key for the dictionary
-        ### hasn't already been made before adding it, otherwise, we append the
-        ### value to the already existing key.  This goes for a tag:value query
-        ### as well.
-        if len(search_term) == 1:
-            if "tag-value" not in query:
-                query.update({"tag-value": ['*' + search_term[0] + '*']})
-            else:
-                query["tag-value"] = query.get('tag-value') + ['*' + search_term[0] + '*']
-
-        ### But, if the query is in tag:value format (like s_classes:s_periodic),
-        ### len(search_term) will be 2, and if the query was s_classes:s_periodic,
-        ### search_term would be [ 's_classes', 's_periodic' ], so we assign
-        ### search_term[0] to the tag variable, and search_term[1] to the val
-        ### variable.
-        else:
-            tag, val = search_term
-            if 'tag:%s' % tag not in query:
-                query.update({"tag:%s" % tag: ['*' + val + '*']})
-            else:
-                query["tag:%s" % tag] = query.get("tag:%s" % tag) + ['*' + val + '*']
-
-    ### Search each region for matching tags/values and return them as a list.
-    for region in regions:
-        try:
-            ec2 = region.connect()
-
-            for res in ec2.get_all_instances(filters=query):
-                instance = res.instances[0]
-                inst_names.append(instance.tags.get('Name'))
-        except boto.exception.EC2ResponseError as e:
-            log.error('Unable to query region %r due to %r', region, e)
-            continue
-
-
-    return sorted(inst_names)
+            yield (record.name, host_address)
 
 
 class Application(krux.cli.Application):
@@ -159,6 +133,19 @@ class Application(krux.cli.Application):
 
         self.output_format = self.args.output_format
 
+        self.fields = None
+        if self.args.fields:
+            if self.output_format == 'legacy':
+                self.parser.error('--fields needs --output-format json or unix')
+            try:
+                self.fields = parse_fields(self.args.fields)
+            except ValueError as e:
+                self.parser.error(str(e))
+
+        configure_governor(self.args, stats=self.stats, log=self.logger)
+        configure_tracer(self.args, stats=self.stats)
+        configure_inventory(self.args)
+
 
     def add_cli_arguments(self, parser):
         group = krux.cli.get_group(parser, self.name)
@@ -169,6 +156,11 @@ class Application(krux.cli.Application):
             default = False
         )
 
+        add_region_cli_arguments(group)
+        add_throttle_cli_arguments(group)
+        add_profile_cli_arguments(group)
+        add_inventory_cli_arguments(group)
+
         group.add_argument(
             '--output-format', '-f',
             default = 'legacy',
@@ -176,6 +168,14 @@ class Application(krux.cli.Application):
             help    = 'Output format.  Default: %(default)s',
         )
 
+        group.add_argument(
+            '--fields',
+            default = None,
+            help    = "Comma separated instance fields to output instead of names, with json or "
+            "unix output: {0}, or tag:<key> for a tag.  Every instance of every matching "
+            "reservation is included.".format(', '.join(FIELDS)),
+        )
+
         parser.add_argument(
             'query',
             nargs   = "+",
@@ -209,14 +209,21 @@ class Application(krux.cli.Application):
 
     def render_json(self, results):
         """
-        Render the results in JSON format.
+        Render the results in JSON format. With --fields, this is a list of
+        objects with those fields.
         """
         return json.dumps(results)
 
     def render_unix(self, results):
         """
         Render the results in "unix" format, i.e. newline-separated values.
+        With --fields, each line holds the fields separated by tabs.
         """
+        if self.fields:
+            return '\n'.join(
+                '\t'.join('' if value is None else str(value) for value in result.values())
+                for result in results
+            )
         return '\n'.join(results)
 
 
@@ -229,7 +236,28 @@ def main():
     ### proceed normally, otherwise, print a simple usage statement and exit
     ### with status 1.
     parsed_query, regions = parse_query(app.args.query)
-    print(app.render(search_tags(parsed_query, app.args.regions)))
+    with profiled(app.args, log=app.logger):
+        with span('fetch'):
+            if app.fields:
+                results = [
+                    project(record, app.fields) for record in search_instances(
+                        parsed_query, app.args.regions, log=app.logger, fields=app.fields,
+                        concurrency=app.args.region_concurrency, timeout=app.args.region_timeout,
+                    )
+                ]
+            else:
+                results = search_tags(
+                    parsed_query, app.args.regions,
+                    concurrency=app.args.region_concurrency, timeout=app.args.region_timeout,
+                )
+        with span('render'):
+            print(app.render(results))
+    get_governor().log_summary()
+
+    ### The daemon's data may be minutes old, so say when it answered
+    note = inventory_note()
+    if note is not None:
+        sys.stderr.write('Note: %s\n' % note)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,321 @@
+#!/usr/bin/env kaws-python
+
+import re
+import sys
+import json
+import logging
+import threading
+
+from optparse   import OptionParser
+
+from aws_analysis_tools.regions import ( get_region_names, parse_region_names, connect_ec2,
+                                         iter_regions, RegionTimeout, DEFAULT_CONCURRENCY,
+                                         DEFAULT_TIMEOUT )
+from aws_analysis_tools.records import ( iter_snapshot_pages, iter_volume_pages )
+from aws_analysis_tools.throttle import ( get_governor, configure_governor, throttled_call,
+                                          DEFAULT_RATE, DEFAULT_MAX_RETRIES )
+from aws_analysis_tools.tracing  import ( span, profiled, configure_tracer )
+
+### snapshots per DescribeSnapshots call; EC2 returns at most 1000
+SNAPSHOT_PAGE_SIZE = 1000
+
+### volumes per DescribeVolumes call, when listing the volumes that exist
+VOLUME_PAGE_SIZE = 500
+
+### volume ids per DescribeVolumes call checking that volumes are gone; a
+### filter takes at most 200 values
+RECHECK_BATCH_SIZE = 200
+
+### the volume id EC2 gives snapshots that weren't taken of a volume of the
+### account, such as copies and the snapshots of AMIs it registered
+PLACEHOLDER_VOLUME_ID = 'vol-ffffffff'
+
+### seconds per region; hundreds of pages of snapshots take longer than the
+### default meant for a single Describe call
+REGION_TIMEOUT = max( DEFAULT_TIMEOUT, 1800 )
+
+FORMATS = [ 'table', 'jsonl' ]
+
+### the table is printed as the pages come, so its columns have fixed widths;
+### the Name comes last as the only one that can be of any length
+TABLE_ROW    = '%-22s  %-21s  %-14s  %6s  %-24s  %-9s  %-6s  %s'
+TABLE_HEADER = ( '# id', 'Volume', 'Region', 'Size', 'Started', 'Status', 'Orphan', 'Name' )
+
+###################
+### Arg parsing
+###################
+
+parser = OptionParser("usage: %prog [options]" )
+parser.add_option(  "-v", "--verbose",      default=None, action="store_true",
+                    help="enable debug output" )
+parser.add_option(  "-H", "--no-header",    default=None, action="store_true",
+                    help="suppress table header" )
+parser.add_option(  "-f", "--format",       default='table', choices=FORMATS,
+                    help="output format: %s" % ', '.join( FORMATS ) )
+parser.add_option(  "-o", "--orphans",      default=None, action="store_true",
+                    help="only show snapshots of volumes that no longer exist" )
+parser.add_option(  "-r", "--region",       default='all',
+                    help="comma separated ec2 regions to query in parallel, or 'all'" )
+parser.add_option(  "-n", "--name",         default=None,
+                    help="Include snapshots with these names only (regex)" )
+parser.add_option(  "-N", "--exclude-name", default=None,
+                    help="Exclude snapshots with these names (regex)" )
+parser.add_option(  "-d", "--description",  default=None,
+                    help="Include snapshots with these descriptions only (regex)" )
+parser.add_option(  "-D", "--exclude-description", default=None,
+                    help="Exclude snapshots with these descriptions (regex)" )
+parser.add_option(  "-V", "--volume",       default=None,
+                    help="Include snapshots of these volume ids only (regex)" )
+parser.add_option(  "-X", "--exclude-volume", default=None,
+                    help="Exclude snapshots of these volume ids (regex)" )
+parser.add_option(  "--owner",              default='self',
+                    help="account id or alias whose snapshots to list" )
+parser.add_option(  "--region-concurrency", default=DEFAULT_CONCURRENCY, type="int",
+                    help="number of regions to query in parallel" )
+parser.add_option(  "--region-timeout", default=REGION_TIMEOUT, type="float",
+                    help="seconds to wait for a single region before giving up on it" )
+parser.add_option(  "--api-rate", default=DEFAULT_RATE, type="float",
+                    help="initial API calls per second per region, adapts to throttling" )
+parser.add_option(  "--api-max-retries", default=DEFAULT_MAX_RETRIES, type="int",
+                    help="number of times a throttled API call is retried" )
+parser.add_option(  "--profile",        default=False, action="store_true",
+                    help="print the time spent per API call and stage to stderr" )
+parser.add_option(  "--profile-output", default=None,
+                    help="write cProfile stats of the run to this file" )
+
+
+def parse_options( argv=None ):
+    (options, args) = parser.parse_args( argv )
+
+    ###################
+    ### Logging
+    ###################
+
+    if options.verbose: log_level = logging.DEBUG
+    else:               log_level = logging.INFO
+
+    ### stdout is for the snapshots, which may be JSONL
+    logging.basicConfig(stream=sys.stderr, level=log_level)
+
+    configure_governor( options )
+    configure_tracer( options )
+
+    return options
+
+
+###################
+### Regexes
+###################
+
+def build_regexes( options ):
+    regexes = {}
+    for opt in [ 'name', 'exclude_name', 'description', 'exclude_description',
+                 'volume', 'exclude_volume' ]:
+
+        ### we have a regex we should build
+        if options.__dict__.get( opt, None ):
+            regexes[ opt ] = re.compile( options.__dict__.get( opt ), re.IGNORECASE )
+
+    return regexes
+
+
+def filter_snapshots( snapshots, regexes, region=None ):
+    """
+    Returns the SnapshotRecords of SNAPSHOTS matching REGEXES.
+    """
+    rv = []
+
+    with span( 'filter', region=region ):
+        for s in snapshots:
+            wanted_node = True
+
+            for re_name, regex in regexes.items():
+
+                ### What's the value we will be testing against?
+                if re.search( 'name', re_name ):
+                    value = s.name or ''
+                elif re.search( 'description', re_name ):
+                    value = s.description or ''
+                else:
+                    value = s.volume_id or ''
+
+                ### an exclude regex must not match, an include regex must
+                if ( regex.search( value ) is None ) != bool( re.search( 'exclude', re_name ) ):
+                    wanted_node = False
+                    break
+
+            if wanted_node:
+                rv.append( s )
+
+    return rv
+
+
+def get_volume_ids( conn ):
+    """
+    Returns the set of the ids of the volumes that exist in a region, from
+    DescribeVolumes. Only the ids are kept, a page of volumes at a time. This
+    is never taken from the inventory daemon, whose data may be minutes old:
+    snapshots flagged as orphans get deleted.
+    """
+    ids = set()
+    for page in iter_volume_pages( conn, page_size=VOLUME_PAGE_SIZE ):
+        ids.update( v.id for v in page )
+    return ids
+
+
+def is_known_volume( volume_id ):
+    """
+    Returns whether VOLUME_ID is the id of a volume that was in the account,
+    rather than missing or the placeholder of copied and AMI snapshots.
+    """
+    return bool( volume_id ) and volume_id != PLACEHOLDER_VOLUME_ID
+
+
+def recheck_volume_ids( conn, volume_ids ):
+    """
+    Adds to the set VOLUME_IDS the volumes of the snapshots that aren't in it
+    but exist now, such as those created after it was listed. Returns the
+    function to call with each page of snapshots before flagging orphans.
+    """
+    region_name = conn.region.name
+
+    def recheck( snapshots ):
+        missing = sorted( set( s.volume_id for s in snapshots if is_known_volume( s.volume_id )
+                               and s.volume_id not in volume_ids ) )
+        for start in range( 0, len( missing ), RECHECK_BATCH_SIZE ):
+            ### a filter, unlike VolumeId.N, doesn't fail on the ids that are gone
+            batch   = missing[ start:start + RECHECK_BATCH_SIZE ]
+            volumes = throttled_call( region_name, 'DescribeVolumes', conn.get_all_volumes,
+                                      filters={ 'volume-id': batch } )
+            volume_ids.update( v.id for v in volumes )
+
+    return recheck
+
+
+class SnapshotPrinter( object ):
+    """
+    Prints snapshots as they are found, from any number of region threads,
+    and counts them. Nothing more is printed of a region once it is
+    abandoned, nor of any region once the printer is closed.
+    """
+
+    def __init__( self, options, out=None ):
+        self.options  = options
+        self.out      = out or sys.stdout
+        self.count    = 0
+        self.size     = 0
+        self.orphans  = 0
+        self.orphaned_size = 0
+        self.closed   = False
+        self._abandoned = set()
+        self._lock    = threading.Lock()
+
+        if options.format == 'table' and not options.no_header:
+            self.out.write( ( TABLE_ROW % TABLE_HEADER ).rstrip() + '\n' )
+
+    def format( self, snapshot, orphan ):
+        if self.options.format == 'jsonl':
+            record = snapshot.to_dict()
+            ### null when the volume isn't known
+            record[ 'orphan' ] = orphan
+            return json.dumps( record, sort_keys=True )
+
+        flag = '?' if orphan is None else 'yes' if orphan else '-'
+
+        return ( TABLE_ROW % ( snapshot.id, snapshot.volume_id or '-', snapshot.region or '-',
+                               snapshot.size if snapshot.size is not None else '-',
+                               snapshot.start_time or '-', snapshot.status or '-',
+                               flag, snapshot.name or '-' ) ).rstrip()
+
+    def abandon( self, region_name ):
+        with self._lock:
+            self._abandoned.add( region_name )
+
+    def is_abandoned( self, region_name ):
+        return self.closed or region_name in self._abandoned
+
+    def close( self ):
+        with self._lock:
+            self.closed = True
+
+    def write( self, snapshots, volume_ids, region_name=None ):
+        """
+        Prints SNAPSHOTS, a page of REGION_NAME, given the set VOLUME_IDS of
+        the volumes of the region. Snapshots without a known volume are
+        neither orphans nor printed with --orphans.
+        """
+        lines = []
+        count = size = orphans = orphaned_size = 0
+
+        for s in snapshots:
+            orphan = s.volume_id not in volume_ids if is_known_volume( s.volume_id ) else None
+            count += 1
+            size  += s.size or 0
+            if orphan:
+                orphans       += 1
+                orphaned_size += s.size or 0
+            elif self.options.orphans:
+                continue
+            lines.append( self.format( s, orphan ) )
+
+        with self._lock:
+            if self.is_abandoned( region_name ):
+                return
+            if lines:
+                self.out.write( '\n'.join( lines ) + '\n' )
+                self.out.flush()
+            self.count         += count
+            self.size          += size
+            self.orphans       += orphans
+            self.orphaned_size += orphaned_size
+
+
+def list_region_snapshots( region_name, options, regexes, printer ):
+    """
+    Prints the snapshots of a single region matching REGEXES, flagging the ones
+    of volumes that no longer exist, a page at a time. Only the ids of the
+    region's volumes are held, however many snapshots there are. The volumes
+    of the snapshots that look orphaned are looked up again before they are
+    flagged, as volumes may have been created since they were listed.
+    """
+    conn = connect_ec2( region_name )
+
+    with span( 'volumes', region=region_name ):
+        volume_ids = get_volume_ids( conn )
+    recheck = recheck_volume_ids( conn, volume_ids )
+
+    for page in iter_snapshot_pages( conn, owner=options.owner, page_size=SNAPSHOT_PAGE_SIZE ):
+        if printer.is_abandoned( region_name ):
+            return
+        page = filter_snapshots( page, regexes, region_name )
+        with span( 'volumes', region=region_name ):
+            recheck( page )
+        printer.write( page, volume_ids, region_name )
+
+
+def list_snapshots():
+    options = parse_options()
+    regexes = build_regexes( options )
+    printer = SnapshotPrinter( options )
+
+    with profiled( options ):
+        with span( 'fetch' ):
+            region_names = get_region_names( include=parse_region_names( options.region ) )
+            list_region = lambda r: list_region_snapshots( r, options, regexes, printer )
+            for result in iter_regions( list_region, region_names,
+                                        concurrency=options.region_concurrency,
+                                        timeout=options.region_timeout ):
+                if result.error is None:
+                    continue
+                ### the thread of a region that timed out keeps running; what it finds isn't printed
+                if isinstance( result.error, RegionTimeout ):
+                    printer.abandon( result.region )
+                logging.error( 'Unable to query region %s due to %r', result.region, result.error )
+            printer.close()
+
+    logging.info( 'Found %d snapshots of %d GB, %d of them of deleted volumes (%d GB)',
+                  printer.count, printer.size, printer.orphans, printer.orphaned_size )
+    get_governor().log_summary()
+
+if __name__ == '__main__':
+    list_snapshots()
@@ -38,10 +38,12 @@ import subprocess
 import sys
 import time
 
-import boto.ec2
 from docopt import docopt
 from reversefold.util import multiproc
 
+from aws_analysis_tools.regions import connect_ec2
+from aws_analysis_tools.throttle import throttled_call
+
 
 FINISHED_STATUSES = ['bootstrap_complete', 'bootstrap_failed']
 TIMEOUT = 30 * 60  # 30 minutes
@@ -78,8 +80,9 @@ def test_provision(ubuntu_codename):
     if proc.returncode != 0:
         logging.error('Starting instance failed! See above for details')
         sys.exit(1)
-    ec2_conn = boto.ec2.connect_to_region('us-east-1')
-    reservations = ec2_conn.get_all_instances(filters={'tag:Name': hostname})
+    ec2_conn = connect_ec2('us-east-1')
+    reservations = throttled_call('us-east-1', 'DescribeInstances', ec2_conn.get_all_instances,
+                                  filters={'tag:Name': hostname})
     if len(reservations) == 0 or len(reservations[0].instances) == 0:
         logging.error(
             'Something has gone horribly wrong and we can\'t find the instance we just started')
@@ -95,7 +98,7 @@ def test_provision(ubuntu_codename):
         logging.info('Waiting on instance %s, current status: %r',
                      instance.id, instance.tags.get('krux-status'))
         time.sleep(5)
-        instance.update()
+        throttled_call('us-east-1', 'DescribeInstances', instance.update)
     logging.info('Bootstrap finished with status %r', instance.tags.get('krux-status'))
     if instance.tags['krux-status'] == 'bootstrap_failed':
         logging.error('Bootstrap failed, log into %s [%s] to debug, then terminate it.',
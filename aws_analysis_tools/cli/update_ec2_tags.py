@@ -18,6 +18,11 @@ import krux.cli
 import krux_boto
 
 from krux_boto import add_boto_cli_arguments
+from aws_analysis_tools.pool import get_pool
+from aws_analysis_tools.throttle import (
+    throttled_call, configure_governor, add_throttle_cli_arguments, without_sdk_retries,
+)
+from aws_analysis_tools.tracing import profiled, configure_tracer, add_profile_cli_arguments
 
 
 class Application(krux_boto.Application):
@@ -36,12 +41,18 @@ class Application(krux_boto.Application):
         self.kernel_version = self.args.kernel_version
         self.dry_run = self.args.dry_run
 
+        configure_governor(self.args, stats=self.stats, log=self.logger)
+        configure_tracer(self.args, stats=self.stats)
+
     def add_cli_arguments(self, parser):
 
         add_boto_cli_arguments(parser)
 
         group = krux.cli.get_group(parser, self.name)
 
+        add_throttle_cli_arguments(group)
+        add_profile_cli_arguments(group)
+
         group.add_argument(
             '--instance-id',
             help=("The instance id of the instance. Example: 'i-27459bcc' "
@@ -170,12 +181,18 @@ class Application(krux_boto.Application):
 
             else:
                 log.info('Updating instance %s in region %s', instance_id, ec2_region)
-                region_obj = self.boto.ec2.get_region(ec2_region)
-                ec2 = self.boto.connect_ec2(region=region_obj)
+                ec2 = get_pool().get(
+                    'ec2', ec2_region,
+                    lambda: without_sdk_retries(
+                        self.boto.connect_ec2(region=self.boto.ec2.get_region(ec2_region))),
+                    credentials=self.boto,
+                    per_thread=True,
+                )
 
-                # ec2 calls throw exceptions when they fail
+                # ec2 calls throw exceptions when they fail; throttling is
+                # retried with backoff before giving up
                 try:
-                    ec2.create_tags([instance_id], tags_dict)
+                    throttled_call(ec2_region, 'CreateTags', ec2.create_tags, [instance_id], tags_dict)
                     stats.incr('ec2_tag_update')
                     log.info('Update completed successfully')
 
@@ -188,7 +205,7 @@ class Application(krux_boto.Application):
 
 def main():
     app = Application()
-    with app.context():
+    with app.context(), profiled(app.args, log=app.logger):
         app.update_tags()
 
 
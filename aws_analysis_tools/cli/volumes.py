@@ -3,15 +3,31 @@
 import re
 import sys
 import logging
-
-import boto.ec2
+import threading
 
 from texttable  import Texttable
 from pprint     import PrettyPrinter
 from optparse   import OptionParser
 
+from aws_analysis_tools.columnar  import ( open_writer, check_export, volume_columns, parse_tag_keys,
+                                           ExportError, DEFAULT_TAGS )
+from aws_analysis_tools.inventory import ( lookup_instances, lookup_volumes, configure_inventory,
+                                           DEFAULT_MAX_AGE )
+from aws_analysis_tools.regions import ( get_region_names, parse_region_names, connect_ec2,
+                                         iter_regions, map_regions, RegionTimeout,
+                                         DEFAULT_CONCURRENCY, DEFAULT_TIMEOUT )
+from aws_analysis_tools.records import VolumeRecord, iter_volume_pages
+from aws_analysis_tools.throttle import ( throttled_call, get_governor, configure_governor,
+                                          DEFAULT_RATE, DEFAULT_MAX_RETRIES )
+from aws_analysis_tools.tracing  import ( span, profiled, configure_tracer )
+from aws_analysis_tools.waste    import ( WasteReport, StoppedInstances, sorted_totals,
+                                          waste_columns, STOPPED_STATES )
+
 PP = PrettyPrinter( indent=2 )
 
+### volumes per DescribeVolumes call with --waste
+VOLUME_PAGE_SIZE = 500
+
 ###################
 ### Arg parsing
 ###################
@@ -23,8 +39,8 @@ parser.add_option(  "-H", "--no-header",    default=None, action="store_true",
                     help="suppress table header" )
 parser.add_option(  "-i", "--instance-name",default=None, action="store_true",
                     help="Show instance names in attachment info (SLOW!)" )
-parser.add_option(  "-r", "--region",       default='us-east-1',
-                    help="ec2 region to connect to" )
+parser.add_option(  "-r", "--region",       default='all',
+                    help="comma separated ec2 regions to query in parallel, or 'all'" )
 parser.add_option(  "-n", "--name",         default=None,
                     help="Include volumes with these names only (regex)" )
 parser.add_option(  "-N", "--exclude-name", default=None,
@@ -37,97 +53,432 @@ parser.add_option(  "-d", "--device",         default=None,
                     help="Include volumes attached to these devices only (regex)" )
 parser.add_option(  "-D", "--exclude-device", default=None,
                     help="Exclude volumes attached to these devices (regex)" )
+parser.add_option(  "--region-concurrency", default=DEFAULT_CONCURRENCY, type="int",
+                    help="number of regions to query in parallel" )
+parser.add_option(  "--region-timeout", default=DEFAULT_TIMEOUT, type="float",
+                    help="seconds to wait for a single region before giving up on it" )
+parser.add_option(  "--api-rate", default=DEFAULT_RATE, type="float",
+                    help="initial API calls per second per region, adapts to throttling" )
+parser.add_option(  "--api-max-retries", default=DEFAULT_MAX_RETRIES, type="int",
+                    help="number of times a throttled API call is retried" )
+parser.add_option(  "--profile",        default=False, action="store_true",
+                    help="print the time spent per API call and stage to stderr" )
+parser.add_option(  "--profile-output", default=None,
+                    help="write cProfile stats of the run to this file" )
+parser.add_option(  "--export",         default=None,
+                    help="write the volumes to this file in a columnar format, .parquet, .arrow, "
+                         ".arrows or .npz, instead of printing them (needs pyarrow or numpy)" )
+parser.add_option(  "--export-tags",    default=','.join( DEFAULT_TAGS ),
+                    help="comma separated tags to export as tag:<key> columns" )
+parser.add_option(  "--waste",        default=False, action="store_true",
+                    help="instead of the volumes, summarise the unattached ones, the GB by status and "
+                         "Name prefix, and the ones attached to stopped instances; with --export, "
+                         "also write the wasted volumes there" )
+parser.add_option(  "--top",          default=None, type="int",
+                    help="with --waste, only show the N largest rows of each summary" )
+parser.add_option(  "--inventory-socket", default=None,
+                    help="socket of the krux-ec2-inventory daemon to answer from when it is running" )
+parser.add_option(  "--no-inventory",   default=False, action="store_true",
+                    help="always query EC2, even when the inventory daemon is running" )
+parser.add_option(  "--inventory-max-age", default=DEFAULT_MAX_AGE, type="float",
+                    help="query EC2 when the inventory daemon's data is older than this many seconds" )
+
+
+def parse_options( argv=None ):
+    (options, args) = parser.parse_args( argv )
+
+    ###################
+    ### Logging
+    ###################
+
+    if options.verbose: log_level = logging.DEBUG
+    else:               log_level = logging.INFO
+
+    logging.basicConfig(stream=sys.stdout, level=log_level)
+    logging.basicConfig(stream=sys.stderr, level=(logging.ERROR,logging.CRITICAL))
+
+    configure_governor( options )
+    configure_tracer( options )
+    configure_inventory( options )
+
+    if options.export:
+        try:
+            check_export( options.export )
+        except ExportError as e:
+            parser.error( str( e ) )
+
+    if options.top is not None and not options.waste:
+        parser.error( '--top needs --waste' )
+
+    return options
 
 
-(options, args) = parser.parse_args()
-
 ###################
-### Logging
+### Regexes
 ###################
 
-if options.verbose: log_level = logging.DEBUG
-else:               log_level = logging.INFO
+def build_regexes( options ):
+    regexes = {}
+    for opt in [ 'name', 'exclude_name', 'zone', 'exclude_zone',
+                 'device', 'exclude_device' ]:
 
-logging.basicConfig(stream=sys.stdout, level=log_level)
-logging.basicConfig(stream=sys.stderr, level=(logging.ERROR,logging.CRITICAL))
+        ### we have a regex we should build
+        if options.__dict__.get( opt, None ):
+            regexes[ opt ] = re.compile( options.__dict__.get( opt ), re.IGNORECASE )
 
+    #PP.pprint( regexes )
+    return regexes
 
-###################
-### Connection
-###################
 
-conn = boto.ec2.connect_to_region( options.region )
+def get_volumes( conn, regexes ):
+    """
+    Returns the volumes of CONN's region matching REGEXES, as VolumeRecords.
+    """
+    region  = conn.region.name
+    volumes = throttled_call( region, 'DescribeVolumes', conn.get_all_volumes )
 
-###################
-### Regexes
-###################
+    return filter_volumes( ( VolumeRecord.from_boto( vol, region=region ) for vol in volumes ),
+                           regexes, region )
 
-regexes = {}
-for opt in [ 'name', 'exclude_name', 'zone', 'exclude_zone',
-             'device', 'exclude_device' ]:
+def filter_volumes( volumes, regexes, region=None ):
+    """
+    Returns the VolumeRecords of VOLUMES matching REGEXES.
+    """
+    rv      = [];
 
-    ### we have a regex we should build
-    if options.__dict__.get( opt, None ):
-        regexes[ opt ] = re.compile( options.__dict__.get( opt ), re.IGNORECASE )
+    with span( 'filter', region=region ):
+        for v in volumes:
 
-#PP.pprint( regexes )
+            ### we will assume this node is one of the nodes we want
+            ### to operate on, and we will unset this flag if any of
+            ### the criteria fail
+            wanted_node = True
 
-def get_volumes():
-    volumes = conn.get_all_volumes()
-    rv      = [];
+            for re_name, regex in regexes.items():
 
-    for v in volumes:
+                ### What's the value we will be testing against?
+                if re.search( 'name', re_name ):
+                    value = v.name or ''
+                elif re.search( 'zone', re_name ):
+                    value = v.zone
+                elif re.search( 'device', re_name ):
+                    value = v.device or ''
+                else:
+                    logging.error( "Don't know what to do with: %s" % re_name )
+                    continue
 
-        ### we will assume this node is one of the nodes we want
-        ### to operate on, and we will unset this flag if any of
-        ### the criteria fail
-        wanted_node = True
+                #PP.pprint( "name = %s value = %s pattern = %s" % ( re_name, value, regex.pattern ) )
 
-        for re_name, regex in regexes.items():
+                ### Should the regex match or not match?
+                if re.search( 'exclude', re_name ):
+                    rv_value = None
+                else:
+                    rv_value = True
 
-            ### What's the value we will be testing against?
-            if re.search( 'name', re_name ):
-                value = v.tags.get( 'Name', '' )
-            elif re.search( 'zone', re_name ):
-                ### i.region is an object. i._placement is a string.
-                value = v.zone
-            elif re.search( 'device', re_name ):
-                value = v.attach_data.device or ''
-            else:
-                logging.error( "Don't know what to do with: %s" % re_name )
-                continue
+                ### if the match is not what we expect, then clearly we
+                ### don't care about the node
+                result = regex.search( value )
 
-            #PP.pprint( "name = %s value = %s pattern = %s" % ( re_name, value, regex.pattern ) )
+                ### we expected to get no results, excellent
+                if result == None and rv_value == None:
+                    pass
 
-            ### Should the regex match or not match?
-            if re.search( 'exclude', re_name ):
-                rv_value = None
-            else:
-                rv_value = True
+                ### we expected to get some match, excellent
+                elif result is not None and rv_value is not None:
+                    pass
 
-            ### if the match is not what we expect, then clearly we
-            ### don't care about the node
-            result = regex.search( value )
+                ### we don't care about this node
+                else:
+                    wanted_node = False
+                    break
 
-            ### we expected to get no results, excellent
-            if result == None and rv_value == None:
-                pass
+            if wanted_node:
+                rv.append( v )
 
-            ### we expected to get some match, excellent
-            elif result is not None and rv_value is not None:
-                pass
+    return rv
 
-            ### we don't care about this node
-            else:
-                wanted_node = False
-                break
+def get_instance_names( conn, instance_ids ):
+    """
+    Looks up the Name tag of INSTANCE_IDS with a single API call. Instances
+    without a Name are reported by id.
+    """
+    if not instance_ids:
+        return {}
+
+    names = {}
+    for res in throttled_call( conn.region.name, 'DescribeInstances', conn.get_all_instances,
+                               instance_ids=list( instance_ids ) ):
+        for i in res.instances:
+            names[ i.id ] = i.tags.get( 'Name', i.id )
+    return names
+
+
+def get_region_volumes( region_name, options, regexes ):
+    """
+    Returns a list of ( volume, instance name ) tuples for a single region.
+    """
+    conn    = connect_ec2( region_name )
+    volumes = get_volumes( conn, regexes )
+    names   = {}
+
+    if options.instance_name:
+        names = get_instance_names(
+                    conn, set( v.instance_id for v in volumes if v.instance_id ) )
+
+    return [ ( v, names.get( v.instance_id, v.instance_id ) ) for v in volumes ]
+
+
+def get_inventory_volumes( options, regexes ):
+    """
+    Like get_region_volumes(), for all regions at once, from the inventory
+    daemon. Returns None if the daemon isn't running or can't answer.
+    """
+    regions = parse_region_names( options.region )
+    volumes = lookup_volumes( regions=regions )
+    if volumes is None:
+        return None
+
+    volumes = filter_volumes( volumes, regexes )
+    names   = {}
+
+    if options.instance_name:
+        ids       = sorted( set( v.instance_id for v in volumes if v.instance_id ) )
+        instances = lookup_instances( { 'instance-id': ids }, regions=regions ) if ids else []
+        if instances is None:
+            return None
+        names     = dict( ( i.id, i.name or i.id ) for i in instances )
+
+    return [ ( v, names.get( v.instance_id, v.instance_id ) ) for v in volumes ]
+
+
+class RegionWriter( object ):
+    """
+    Writes the records of any number of region threads to WRITER, a
+    ColumnarWriter. Nothing more is written of a region once it is
+    abandoned, nor of any region once WRITER is closed.
+    """
+
+    def __init__( self, writer ):
+        self.writer     = writer
+        self._abandoned = set()
+        self._lock      = threading.Lock()
+
+    def abandon( self, region_name ):
+        with self._lock:
+            self._abandoned.add( region_name )
+
+    def is_abandoned( self, region_name ):
+        return self.writer.closed or region_name in self._abandoned
+
+    def write( self, records, region_name ):
+        with self._lock:
+            if self.is_abandoned( region_name ):
+                return
+            self.writer.write( records )
+
+
+def map_writer_regions( func, options, writer ):
+    """
+    Calls FUNC( region_name, region_writer ) for each region given by the
+    options, as map_regions() does, with a RegionWriter of WRITER, or None
+    without one. Returns the values of the regions that succeeded.
+    """
+    region_names  = get_region_names( include=parse_region_names( options.region ) )
+    region_writer = RegionWriter( writer ) if writer is not None else None
+    values        = []
+
+    for result in iter_regions( lambda r: func( r, region_writer ), region_names,
+                                concurrency=options.region_concurrency,
+                                timeout=options.region_timeout ):
+        if result.error is None:
+            values.append( result.value )
+            continue
+        ### the thread of a region that timed out keeps running; what it finds isn't written
+        if isinstance( result.error, RegionTimeout ) and region_writer is not None:
+            region_writer.abandon( result.region )
+        logging.error( 'Unable to query region %s due to %r', result.region, result.error )
+
+    return values
+
+
+def export_volumes( options ):
+    """
+    Writes the volumes matching the options to the --export file, each region's
+    as soon as they are fetched. Returns the number of volumes written.
+    """
+    regexes = build_regexes( options )
+    columns = volume_columns( parse_tag_keys( options.export_tags ) )
+
+    with open_writer( options.export, columns ) as writer:
+        volumes = lookup_volumes( regions=parse_region_names( options.region ) )
+        if volumes is not None:
+            writer.write( filter_volumes( volumes, regexes ) )
+            return writer.rows
+
+        map_writer_regions( lambda r, w: w.write( get_volumes( connect_ec2( r ), regexes ), r ),
+                            options, writer )
+
+    return writer.rows
+
+
+def get_stopped_instances( conn, instance_ids=None ):
+    """
+    Returns the ids of the stopped instances among INSTANCE_IDS, or of all the
+    stopped instances of CONN's region without INSTANCE_IDS, with a single API
+    call. Unlike a lookup by id, filters don't fail on terminated instances.
+    """
+    filters = { 'instance-state-name': list( STOPPED_STATES ) }
+    if instance_ids is not None:
+        filters[ 'instance-id' ] = list( instance_ids )
+
+    return [ i.id
+             for res in throttled_call( conn.region.name, 'DescribeInstances',
+                                        conn.get_all_instances, filters=filters )
+             for i in res.instances ]
+
+
+def get_region_waste( region_name, regexes, writer=None ):
+    """
+    Returns the WasteReport of the volumes of a single region matching REGEXES,
+    a page of volumes at a time, and writes the wasted ones to WRITER, a
+    RegionWriter.
+    """
+    conn    = connect_ec2( region_name )
+    report  = WasteReport()
+    stopped = StoppedInstances( lambda ids: get_stopped_instances( conn, ids ) )
+
+    for page in iter_volume_pages( conn, page_size=VOLUME_PAGE_SIZE ):
+        if writer is not None and writer.is_abandoned( region_name ):
+            break
+        volumes = filter_volumes( page, regexes, region_name )
+        stopped.update( v.instance_id for v in volumes if v.instance_id )
+        wasted  = report.update( volumes, stopped )
+        if writer is not None and wasted:
+            writer.write( wasted, region_name )
+
+    return report
+
+
+def get_inventory_waste( options, regexes, writer=None ):
+    """
+    Like get_region_waste(), for all regions at once, from the inventory
+    daemon. Returns None if the daemon isn't running or can't answer.
+    """
+    regions = parse_region_names( options.region )
+    volumes = lookup_volumes( regions=regions )
+    if volumes is None:
+        return None
+
+    volumes = filter_volumes( volumes, regexes )
+    ids     = sorted( set( v.instance_id for v in volumes if v.instance_id ) )
+    stopped = []
+    if ids:
+        stopped = lookup_instances( { 'instance-id': ids,
+                                      'instance-state-name': list( STOPPED_STATES ) },
+                                    regions=regions )
+        if stopped is None:
+            return None
+
+    report  = WasteReport()
+    wasted  = report.update( volumes, set( i.id for i in stopped ) )
+    if writer is not None and wasted:
+        writer.write( wasted )
+    return report
+
+
+def get_waste( options, regexes, writer=None ):
+    """
+    Returns the WasteReport of the volumes matching REGEXES in all regions
+    given by the options, from the inventory daemon if it is running.
+    """
+    report = get_inventory_waste( options, regexes, writer )
+    if report is not None:
+        return report
+
+    results = map_writer_regions( lambda r, w: get_region_waste( r, regexes, w ),
+                                  options, writer )
+
+    report = WasteReport()
+    for region_report in results:
+        report.merge( region_report )
+    return report
+
+
+def print_totals( options, header, rows ):
+    """
+    Prints ROWS, lists of values ending with a count and GB, under HEADER.
+    """
+    table = Texttable( max_width=0 )
 
-        if wanted_node:
-            rv.append( v )
+    table.set_deco( Texttable.HEADER )
+    table.set_cols_dtype( [ 't' ] * len( header ) )
+    table.set_cols_align( [ 'l' ] * ( len( header ) - 2 ) + [ 'r', 'r' ] )
+
+    if not options.no_header:
+        ### using add_row, so the headers aren't being centered, for easier grepping
+        table.add_row( header )
+
+    for row in rows:
+        ### XXX EVERY column in this output had better have a non-zero length
+        ### or texttable blows up with 'width must be greater than 0' error
+        table.add_row( [ str( value ) if value else '-' for value in row[ :-2 ] ] +
+                       [ str( row[ -2 ] ), str( row[ -1 ] ) ] )
+
+    ### table.draw() blows up if there is nothing to print
+    if rows or not options.no_header:
+        print(table.draw())
+
+
+def show_waste( options ):
+    regexes = build_regexes( options )
+
+    with span( 'fetch' ):
+        if options.export:
+            columns = waste_columns( parse_tag_keys( options.export_tags ) )
+            with open_writer( options.export, columns ) as writer:
+                report = get_waste( options, regexes, writer )
+            logging.info( 'Exported %d wasted volumes to %s', writer.rows, options.export )
+        else:
+            report = get_waste( options, regexes )
+
+    with span( 'render' ):
+        unattached = report.total_unattached
+        stopped    = report.total_stopped
+        print( '# %d volumes, %d GB: %d GB in %d unattached volumes, %d GB in %d volumes '
+               'attached to %d stopped instances' % (
+                   report.total[ 0 ], report.total[ 1 ],
+                   unattached[ 1 ], unattached[ 0 ],
+                   stopped[ 1 ], stopped[ 0 ], len( report.stopped_instances ) ) )
+        print( '' )
+        print_totals( options, [ '# unattached zone', 'Volumes', 'GB' ],
+                      sorted_totals( report.unattached, options.top ) )
+        print( '' )
+        print_totals( options, [ '# status', 'Name prefix', 'Volumes', 'GB' ],
+                      [ key + ( count, size ) for key, count, size in
+                        sorted_totals( report.by_status_prefix, options.top ) ] )
+        print( '' )
+        print_totals( options, [ '# stopped instance zone', 'Volumes', 'GB' ],
+                      sorted_totals( report.stopped, options.top ) )
 
-    return rv
 
 def list_volumes():
+    options     = parse_options()
+
+    with profiled( options ):
+        if options.export and not options.waste:
+            with span( 'export' ):
+                count = export_volumes( options )
+            logging.info( 'Exported %d volumes to %s', count, options.export )
+        elif options.waste:
+            show_waste( options )
+        else:
+            show_volumes( options )
+
+    get_governor().log_summary()
+
+
+def show_volumes( options ):
+    regexes     = build_regexes( options )
     table       = Texttable( max_width=0 )
 
     table.set_deco( Texttable.HEADER )
@@ -138,22 +489,22 @@ def list_volumes():
         ### using add_row, so the headers aren't being centered, for easier grepping
         table.add_row([ '# id', 'Name', 'Zone', 'Status', 'Size', 'Instance', 'Device' ])
 
-    volumes = get_volumes()
-    for v in volumes:
-        ad = v.attach_data
-
-        if ad.instance_id:
-            if options.instance_name:
-                i       = conn.get_all_instances(
-                            instance_ids=[ ad.instance_id ] )[0].instances[ 0 ]
-                name    = i.tags.get('Name', i.id )
-            else:
-                name    = ad.instance_id
-        else:
-            name    = '-'
-
-        table.add_row( [ v.id, v.tags.get( 'Name', ' ' ), v.zone , v.status,
-                         v.size, name or '-' , ad.device or '-' ] )
+    ### answer from the inventory daemon if it is running, or query all regions
+    ### in parallel; a region that fails is logged and skipped
+    with span( 'fetch' ):
+        volumes = get_inventory_volumes( options, regexes )
+        if volumes is None:
+            region_names = get_region_names( include=parse_region_names( options.region ) )
+            results      = map_regions( lambda r: get_region_volumes( r, options, regexes ),
+                                        region_names,
+                                        concurrency=options.region_concurrency,
+                                        timeout=options.region_timeout )
+            volumes      = list( results.chain() )
+
+    with span( 'render' ):
+        for v, name in volumes:
+            table.add_row( [ v.id, v.name or ' ', v.zone , v.status,
+                             v.size, name or '-' , v.device or '-' ] )
 
         #PP.pprint(  )
 
@@ -174,9 +525,9 @@ def list_volumes():
         #PP.pprint( i.__dict__ )
         """
 
-    ### table.draw() blows up if there is nothing to print
-    if volumes or not options.no_header:
-        print(table.draw())
+        ### table.draw() blows up if there is nothing to print
+        if volumes or not options.no_header:
+            print(table.draw())
 
 if __name__ == '__main__':
     list_volumes()
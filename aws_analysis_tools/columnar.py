@@ -0,0 +1,496 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+"""
+Columnar export of instance and volume records, for offline analysis.
+
+A ColumnarWriter takes records in any number of write() calls, e.g. one per
+page of a Describe call, and turns them into columns. Low-cardinality
+strings (types, zones, states, tag values) are dictionary encoded: each
+distinct value is kept once and the rows hold integer codes. Every
+batch_size rows the columns are handed to a sink and dropped, so an export
+never holds more than a batch of rows besides the dictionaries.
+
+The sinks write Parquet or Arrow IPC files or streams with pyarrow, or NPZ
+with numpy.
+Both are optional dependencies, only imported when a file of their format is
+written.
+"""
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import operator
+import os
+import threading
+import zipfile
+from array import array
+from collections import namedtuple, OrderedDict
+
+
+DEFAULT_BATCH_SIZE = 10000
+
+# File extension to export format
+FORMATS = OrderedDict([
+    ('.parquet', 'parquet'),
+    ('.arrows', 'arrows'),
+    ('.arrow', 'arrow'),
+    ('.npz', 'npz'),
+])
+
+# Column kinds
+DICT = 'dict'      # dictionary encoded string
+STRING = 'string'  # plain string, for unique values such as ids
+INT = 'int'
+
+# Integer code of a missing value in a dictionary encoded column
+NULL_CODE = -1
+
+# Tags exported by default
+DEFAULT_TAGS = ('Name',)
+
+# Tags that identify a single instance or volume, and aren't worth a dictionary
+UNIQUE_TAGS = frozenset(['Name'])
+
+
+class ExportError(Exception):
+    """
+    The export can't be written, e.g. because its format needs a library
+    that isn't installed.
+    """
+
+
+ColumnSpec = namedtuple('ColumnSpec', ['name', 'kind', 'getter'])
+
+# A batch of one column: VALUES are the codes of a dictionary encoded column,
+# whose dictionary is DICTIONARY, or the values themselves otherwise
+Column = namedtuple('Column', ['name', 'kind', 'values', 'dictionary'])
+
+
+def attribute_getter(name):
+    """
+    Returns the getter of a column holding the attribute NAME of each record.
+    """
+    return operator.attrgetter(name)
+
+
+def tag_getter(key):
+    """
+    Returns the getter of a column holding the tag KEY of each record.
+    """
+    return lambda record: record.tag(key)
+
+
+def _tag_columns(tag_keys):
+    return [
+        ColumnSpec('tag:{0}'.format(key), STRING if key in UNIQUE_TAGS else DICT, tag_getter(key))
+        for key in tag_keys
+    ]
+
+
+def instance_columns(tag_keys=DEFAULT_TAGS):
+    """
+    Returns the ColumnSpecs of an instance export with the tags TAG_KEYS.
+    """
+    return [
+        ColumnSpec('id', STRING, attribute_getter('id')),
+        ColumnSpec('region', DICT, attribute_getter('region')),
+        ColumnSpec('zone', DICT, attribute_getter('zone')),
+        ColumnSpec('instance_type', DICT, attribute_getter('instance_type')),
+        ColumnSpec('state', DICT, attribute_getter('state')),
+        ColumnSpec('group', DICT, attribute_getter('group')),
+        ColumnSpec('root_device_type', DICT, attribute_getter('root_device_type')),
+        ColumnSpec('private_ip_address', STRING, attribute_getter('private_ip_address')),
+        ColumnSpec('ip_address', STRING, attribute_getter('ip_address')),
+        ColumnSpec('dns_name', STRING, attribute_getter('dns_name')),
+    ] + _tag_columns(tag_keys)
+
+
+def volume_columns(tag_keys=DEFAULT_TAGS):
+    """
+    Returns the ColumnSpecs of a volume export with the tags TAG_KEYS.
+    """
+    return [
+        ColumnSpec('id', STRING, attribute_getter('id')),
+        ColumnSpec('region', DICT, attribute_getter('region')),
+        ColumnSpec('zone', DICT, attribute_getter('zone')),
+        ColumnSpec('status', DICT, attribute_getter('status')),
+        ColumnSpec('volume_type', DICT, attribute_getter('volume_type')),
+        ColumnSpec('size', INT, attribute_getter('size')),
+        ColumnSpec('instance_id', STRING, attribute_getter('instance_id')),
+        ColumnSpec('device', DICT, attribute_getter('device')),
+    ] + _tag_columns(tag_keys)
+
+
+def parse_tag_keys(value):
+    """
+    Parses a comma separated list of tag keys.
+    """
+    return tuple(key.strip() for key in (value or '').split(',') if key.strip())
+
+
+def get_format(path, format=None):
+    """
+    Returns the export format of PATH, from FORMAT or the file's extension.
+    """
+    if format:
+        if format not in FORMATS.values():
+            raise ExportError('Unknown export format {0!r}; use one of {1}'.format(
+                format, ', '.join(sorted(set(FORMATS.values())))))
+        return format
+    for extension, name in FORMATS.items():
+        if path.endswith(extension):
+            return name
+    raise ExportError('Cannot tell the export format of {0}; name it {1}'.format(
+        path, ', '.join('*' + extension for extension in FORMATS)))
+
+
+def check_export(path, format=None):
+    """
+    Raises ExportError if PATH can't be exported to, because its format is
+    unknown or needs a library that isn't installed.
+    """
+    format = get_format(path, format)
+    if format == 'npz':
+        _import_numpy()
+    else:
+        _import_pyarrow(format)
+
+
+class ColumnarWriter(object):
+    """
+    Encodes records into the COLUMNS, a list of ColumnSpecs, and hands them to
+    SINK every BATCH_SIZE rows. write() may be called from several threads;
+    records written once the writer is closed, by the thread of a region given
+    up on, say, are dropped.
+    """
+
+    def __init__(self, sink, columns, batch_size=DEFAULT_BATCH_SIZE):
+        self.sink = sink
+        self.columns = columns
+        self.batch_size = batch_size
+        self.rows = 0
+        self.closed = False
+        # Value to code, and the values in code order, per dictionary column
+        self._codes = dict((c.name, {None: NULL_CODE}) for c in columns if c.kind == DICT)
+        self._dictionaries = dict((c.name, []) for c in columns if c.kind == DICT)
+        self._buffers = None
+        self._buffered = 0
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._buffers = [array('i') if c.kind == DICT else [] for c in self.columns]
+        self._buffered = 0
+
+    def _encoder(self, name, values):
+        """
+        Adds the VALUES not seen yet to the dictionary of column NAME, and
+        returns a function from value to code.
+        """
+        codes = self._codes[name]
+        dictionary = self._dictionaries[name]
+        # dict.fromkeys() keeps the values in the order first seen, so the codes
+        # don't depend on hash order
+        for value in dict.fromkeys(values):
+            if value not in codes:
+                codes[value] = len(dictionary)
+                dictionary.append(value)
+        return codes.__getitem__
+
+    def write(self, records):
+        """
+        Adds RECORDS, flushing a batch to the sink whenever one is full.
+        """
+        records = list(records)
+        with self._lock:
+            if self.closed:
+                return
+            start = 0
+            while start < len(records):
+                # Encoded a column at a time, which keeps the loops over the rows in C
+                rows = records[start:start + self.batch_size - self._buffered]
+                start += len(rows)
+                for spec, buf in zip(self.columns, self._buffers):
+                    values = list(map(spec.getter, rows))
+                    if spec.kind == DICT:
+                        buf.extend(map(self._encoder(spec.name, values), values))
+                    else:
+                        buf.extend(values)
+                self._buffered += len(rows)
+                self.rows += len(rows)
+                if self._buffered >= self.batch_size:
+                    self._flush()
+
+    def _flush(self):
+        if not self._buffered:
+            return
+        self.sink.write_batch([
+            Column(spec.name, spec.kind, buf, self._dictionaries.get(spec.name))
+            for spec, buf in zip(self.columns, self._buffers)
+        ])
+        self._reset()
+
+    def close(self):
+        """
+        Flushes the last batch and closes the sink.
+        """
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            self._flush()
+            self.sink.close(self._dictionaries)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            with self._lock:
+                self.closed = True
+            self.sink.abort()
+        return False
+
+
+class _FileSink(object):
+    """
+    Writes to a temporary file next to PATH, renamed to PATH when closed, so
+    a failed export doesn't leave a truncated file behind.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = os.path.join(
+            os.path.dirname(os.path.abspath(path)), '.{0}.tmp'.format(os.path.basename(path)))
+
+    def _commit(self):
+        os.rename(self.tmp_path, self.path)
+
+    def abort(self):
+        try:
+            os.unlink(self.tmp_path)
+        except OSError:
+            pass
+
+
+def _import_numpy():
+    try:
+        import numpy
+        import numpy.lib.format
+    except ImportError:
+        raise ExportError('npz export needs numpy; pip install numpy')
+    return numpy
+
+
+def _import_pyarrow(format):
+    try:
+        import pyarrow
+    except ImportError:
+        raise ExportError('{0} export needs pyarrow; pip install pyarrow'.format(format))
+    return pyarrow
+
+
+class ArrowSink(_FileSink):
+    """
+    Writes each batch as a record batch of a Parquet file (one row group per
+    batch), an Arrow IPC stream or an Arrow IPC file, with dictionary encoded
+    columns as Arrow dictionary arrays. An IPC file can't replace the
+    dictionaries, which grow batch by batch, so it is written as a stream
+    first, and copied to the file a batch at a time with the complete
+    dictionaries when closed.
+    """
+
+    def __init__(self, path, columns, format='parquet'):
+        super(ArrowSink, self).__init__(path)
+        self.pa = pa = _import_pyarrow(format)
+        self.format = format
+
+        types = {
+            DICT: pa.dictionary(pa.int32(), pa.string()),
+            STRING: pa.string(),
+            INT: pa.int64(),
+        }
+        self.schema = pa.schema([pa.field(c.name, types[c.kind]) for c in columns])
+
+        if format == 'parquet':
+            import pyarrow.parquet
+            self._writer = pyarrow.parquet.ParquetWriter(self.tmp_path, self.schema)
+        else:
+            self._stream_path = self.tmp_path + '.stream' if format == 'arrow' else self.tmp_path
+            self._sink = pa.OSFile(self._stream_path, 'wb')
+            self._writer = pa.ipc.new_stream(self._sink, self.schema)
+
+    def write_batch(self, columns):
+        pa = self.pa
+        arrays = []
+        for column in columns:
+            if column.kind == DICT:
+                # Codes of missing values become nulls
+                indices = pa.array([None if code == NULL_CODE else code for code in column.values],
+                                   type=pa.int32())
+                arrays.append(pa.DictionaryArray.from_arrays(
+                    indices, pa.array(column.dictionary, type=pa.string())))
+            else:
+                arrays.append(pa.array(column.values, type=self.schema.field(column.name).type))
+        batch = pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+
+        if self.format == 'parquet':
+            self._writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            self._writer.write_batch(batch)
+
+    def _write_file(self, dictionaries):
+        """
+        Copies the stream to the IPC file, with the DICTIONARIES of the whole
+        export, which the codes of every batch index into.
+        """
+        pa = self.pa
+        dictionaries = dict((name, pa.array(values, type=pa.string()))
+                            for name, values in dictionaries.items())
+        with pa.memory_map(self._stream_path) as source, \
+                pa.OSFile(self.tmp_path, 'wb') as sink:
+            writer = pa.ipc.new_file(sink, self.schema)
+            for batch in pa.ipc.open_stream(source):
+                writer.write_batch(pa.RecordBatch.from_arrays([
+                    pa.DictionaryArray.from_arrays(column.indices, dictionaries[name])
+                    if name in dictionaries else column
+                    for name, column in zip(self.schema.names, batch.columns)
+                ], schema=self.schema))
+            writer.close()
+
+    def close(self, dictionaries):
+        self._writer.close()
+        if self.format != 'parquet':
+            self._sink.close()
+        if self.format == 'arrow':
+            try:
+                self._write_file(dictionaries)
+            except Exception:
+                super(ArrowSink, self).abort()
+                raise
+            finally:
+                os.unlink(self._stream_path)
+        self._commit()
+
+    def abort(self):
+        try:
+            self._writer.close()
+            if self.format != 'parquet':
+                self._sink.close()
+        finally:
+            super(ArrowSink, self).abort()
+            if self.format == 'arrow':
+                try:
+                    os.unlink(self._stream_path)
+                except OSError:
+                    pass
+
+
+class NpzSink(_FileSink):
+    """
+    Writes each batch's columns into an NPZ (zip) file as they come, as
+    "<column>.<batch>" arrays, and the dictionaries as "<column>.dictionary"
+    when done. read_npz() puts the chunks back together.
+    """
+
+    def __init__(self, path, columns):
+        super(NpzSink, self).__init__(path)
+        self.np = _import_numpy()
+        self.columns = columns
+        self.batches = 0
+        self._zip = zipfile.ZipFile(self.tmp_path, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+
+    def _write_array(self, name, value):
+        with self._zip.open(name + '.npy', 'w', force_zip64=True) as f:
+            self.np.lib.format.write_array(f, value, allow_pickle=False)
+
+    def write_batch(self, columns):
+        np = self.np
+        for column in columns:
+            if column.kind == DICT:
+                value = np.frombuffer(column.values, dtype=np.int32)
+            elif column.kind == INT:
+                value = np.array([NULL_CODE if v is None else v for v in column.values],
+                                 dtype=np.int64)
+            else:
+                value = np.array(['' if v is None else v for v in column.values], dtype=np.str_)
+            self._write_array('{0}.{1:05d}'.format(column.name, self.batches), value)
+        self.batches += 1
+
+    def close(self, dictionaries):
+        np = self.np
+        for name, dictionary in dictionaries.items():
+            self._write_array('{0}.dictionary'.format(name), np.array(dictionary, dtype=np.str_))
+        self._write_array('__columns__', np.array(
+            ['{0}:{1}'.format(c.name, c.kind) for c in self.columns], dtype=np.str_))
+        self._zip.close()
+        self._commit()
+
+    def abort(self):
+        try:
+            self._zip.close()
+        finally:
+            super(NpzSink, self).abort()
+
+
+def read_npz(path):
+    """
+    Reads an NPZ export into an OrderedDict of column name to numpy array.
+    Dictionary encoded columns are returned as a (codes, dictionary) tuple;
+    codes of missing values are -1.
+    """
+    import numpy
+
+    with numpy.load(path, allow_pickle=False) as data:
+        columns = OrderedDict()
+        for column in data['__columns__']:
+            name, kind = str(column).rsplit(':', 1)
+            chunks = sorted(key for key in data.files
+                            if key.startswith(name + '.') and key[len(name) + 1:].isdigit())
+            values = numpy.concatenate([data[key] for key in chunks]) if chunks else \
+                numpy.array([])
+            if kind == DICT:
+                columns[name] = (values, data[name + '.dictionary'])
+            else:
+                columns[name] = values
+        return columns
+
+
+def open_writer(path, columns, format=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Returns a ColumnarWriter exporting COLUMNS to PATH, in FORMAT or the
+    format of PATH's extension.
+    """
+    format = get_format(path, format)
+    if format == 'npz':
+        sink = NpzSink(path, columns)
+    else:
+        sink = ArrowSink(path, columns, format=format)
+    return ColumnarWriter(sink, columns, batch_size=batch_size)
+
+
+def add_export_cli_arguments(group):
+    """
+    Adds the export options to an argparse GROUP.
+    """
+    group.add_argument(
+        '--export',
+        default=None,
+        metavar='FILE',
+        help="Write the results to FILE in a columnar format, .parquet, .arrow (Arrow IPC "
+        "file), .arrows (Arrow IPC stream) or .npz, instead of printing them. Parquet and Arrow "
+        "need pyarrow, NPZ needs numpy.",
+    )
+
+    group.add_argument(
+        '--export-tags',
+        default=','.join(DEFAULT_TAGS),
+        help="Comma separated tags to export as tag:<key> columns. (default: %(default)s)",
+    )
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+"""
+Copying a file to many hosts, for krux-ec2-pscp.
+
+Copying from the machine running pscp to every host takes as long as its
+uplink needs to send the file that many times. In a relay tree, each host
+that has the file sends it on to other hosts, over ssh from that host with
+the agent forwarded, so the number of hosts having the file doubles (with a
+fanout of 1; more with more) every time a file is sent, and copying to N
+hosts takes about log2(N) times as long as copying to one.
+
+A RelayPlan decides which host gets the file from which next; the caller
+runs the transfers it hands out and tells it how they went. Transfers are
+resumable and checksummed: the file is written to DESTINATION.part, which a
+later transfer to that host continues, and only becomes DESTINATION once its
+SHA-256 is that of the original. A host that already has the file is only
+checked, and sends it on at once.
+"""
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import hashlib
+import posixpath
+
+#
+# Third party libraries
+#
+
+from reversefold.util.ssh import escape_single_quotes
+
+
+# The source of the transfers from the machine running pscp
+LOCAL = None
+
+# Transfers at once from each host having the file, and from LOCAL, in a relay tree
+DEFAULT_FANOUT = 2
+
+# Transfers to a host before giving up on it
+DEFAULT_ATTEMPTS = 3
+
+# Failed transfers from a host before it stops sending the file on
+RELAY_FAILURES = 2
+
+# Exit statuses of the receiving script: the file is short, which a later
+# transfer continues, or wrong, and removed
+SHORT = 75
+CORRUPT = 76
+
+# Printed by the probe of a host that has the file
+PRESENT = 'present'
+
+# Options of the ssh run on a host to relay the file, which can't use the
+# identity or config of the machine running pscp; the forwarded agent
+# authenticates it. As the agent is forwarded, the host keys are checked
+# against the known_hosts of the relaying user, which only takes new hosts on
+# trust.
+_RELAY_SSH_OPTIONS = ['-o', 'BatchMode=yes', '-o', 'StrictHostKeyChecking=accept-new',
+                      '-o', 'LogLevel=ERROR']
+
+_PROBE = (
+    'if [ -f {dest} ] && printf "%s  %s\\n" {sha256} {dest} | sha256sum -c --status; '
+    'then echo ' + PRESENT + '; else {{ wc -c < {part}; }} 2>/dev/null || echo 0; fi'
+)
+
+_RECEIVE = (
+    'mkdir -p {directory} && cat >> {part} || exit {short}; '
+    'size=$(wc -c < {part}); '
+    'if [ "$size" -lt {size} ]; then exit {short}; fi; '
+    'if [ "$size" -eq {size} ] && printf "%s  %s\\n" {sha256} {part} | sha256sum -c --status; '
+    'then mv -f {part} {dest}; else rm -f {part}; exit {corrupt}; fi'
+)
+
+_CHUNK = 1024 * 1024
+
+
+def _quote(value):
+    return "'%s'" % escape_single_quotes(str(value))
+
+
+def file_sha256(path):
+    """
+    Returns the hex SHA-256 of the file at PATH.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def probe_command(dest, sha256):
+    """
+    Returns the command printing PRESENT if DEST has the checksum SHA256, or
+    else the bytes of DEST.part there are to continue from.
+    """
+    return _PROBE.format(dest=_quote(dest), part=_quote(dest + '.part'), sha256=sha256)
+
+
+def parse_probe(output):
+    """
+    Returns the output of probe_command() as PRESENT or the bytes to
+    continue from, 0 when it isn't understood.
+    """
+    output = output.strip()
+    if output == PRESENT:
+        return PRESENT
+    try:
+        return max(int(output), 0)
+    except ValueError:
+        return 0
+
+
+def receive_command(dest, size, sha256):
+    """
+    Returns the command appending its stdin to DEST.part and, once that has
+    SIZE bytes with the checksum SHA256, moving it to DEST. It exits with
+    SHORT if the file isn't complete yet, and CORRUPT after removing it if it
+    is wrong.
+    """
+    return _RECEIVE.format(directory=_quote(posixpath.dirname(dest) or '.'), dest=_quote(dest),
+                           part=_quote(dest + '.part'), size=int(size), sha256=sha256,
+                           short=SHORT, corrupt=CORRUPT)
+
+
+def relay_command(dest, offset, target_ssh, receive):
+    """
+    Returns the command, run on a host having DEST, sending it from byte
+    OFFSET to the RECEIVE command on another host, through TARGET_SSH, the
+    arguments of ssh to that host.
+    """
+    ssh = ' '.join(_quote(arg) for arg in ['ssh'] + _RELAY_SSH_OPTIONS + list(target_ssh))
+    return 'tail -c +{0} {1} | {2} {3}'.format(int(offset) + 1, _quote(dest), ssh,
+                                              _quote(bash_command(receive)))
+
+
+def bash_command(command):
+    """
+    Returns COMMAND as run by bash whatever the login shell, as SSHHost runs
+    commands.
+    """
+    return '/bin/bash -c ' + _quote(command)
+
+
+class RelayPlan(object):
+    """
+    Which host gets the file from which, for HOSTS in the order given.
+
+    Without RELAY, every host gets the file from LOCAL. With it, each host
+    that got the file, and LOCAL, sends it to up to FANOUT hosts at once:
+    hosts before LOCAL, preferably in the same one of ZONES (a dict of zones
+    by host) as the host getting it, then the ones that failed least and are
+    the least busy. A host whose transfers failed ATTEMPTS times is given up
+    on, and one whose transfers to others failed RELAY_FAILURES times stops
+    sending the file on.
+    """
+
+    def __init__(self, hosts, relay=True, fanout=DEFAULT_FANOUT, attempts=DEFAULT_ATTEMPTS,
+                 zones=None):
+        self.pending = list(hosts)
+        self.relay = relay
+        self.fanout = fanout
+        self.attempts = attempts
+        self.zones = zones or {}
+        # The hosts having the file, in the order they got it, and where each got it from
+        self.holders = [LOCAL]
+        self.sources = {}
+        self.failed = []
+        # Transfers running from each holder, failed transfers from and to each host,
+        # and where the last failed transfer to a host came from
+        self._sending = {LOCAL: 0}
+        self._failures = {}
+        self._tries = {}
+        self._last_source = {}
+
+    def _can_send(self, source):
+        if source is LOCAL:
+            return not self.relay or self._sending[LOCAL] < self.fanout
+        return (self.relay and self._sending[source] < self.fanout
+                and self._failures.get(source, 0) < RELAY_FAILURES)
+
+    def next_transfer(self):
+        """
+        Returns the (source, target) of the next transfer to start, or None
+        if no host is waiting for the file or none can send it now.
+        """
+        if not self.pending:
+            return None
+        free = [source for source in self.holders if self._can_send(source)]
+        if not free:
+            return None
+
+        target = self.pending[0]
+        zone = self.zones.get(target)
+
+        def preference(index):
+            source = free[index]
+            return (source is LOCAL,
+                    source is not LOCAL and zone is not None and self.zones.get(source) != zone,
+                    source == self._last_source.get(target, target),
+                    self._failures.get(source, 0),
+                    self._sending[source],
+                    index)
+
+        source = free[min(range(len(free)), key=preference)]
+        self.pending.pop(0)
+        self._sending[source] += 1
+        return source, target
+
+    def done(self, source, target, ok, source_failed=True):
+        """
+        Notes the end of the transfer from SOURCE to TARGET, and whether OK.
+        A transfer that failed before SOURCE was involved, such as when
+        TARGET can't be reached at all, doesn't count against SOURCE_FAILED.
+        """
+        self._sending[source] -= 1
+        if ok:
+            self.holders.append(target)
+            self.sources[target] = source
+            self._sending[target] = 0
+            return
+        self._tries[target] = self._tries.get(target, 0) + 1
+        self._last_source[target] = source
+        if source is not LOCAL and source_failed:
+            self._failures[source] = self._failures.get(source, 0) + 1
+        if self._tries[target] < self.attempts:
+            self.pending.append(target)
+        else:
+            self.failed.append(target)
+
+    def depth(self, host):
+        """
+        Returns the number of transfers the file went through to reach HOST.
+        """
+        depth = 0
+        while host is not LOCAL:
+            host = self.sources[host]
+            depth += 1
+        return depth
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+"""
+Scanner for EC2 instance status checks and scheduled maintenance events.
+
+The scanner queries every region in parallel, remembers what it reported
+last time in a local state file and only reports events that are new or
+have changed since the previous run.
+"""
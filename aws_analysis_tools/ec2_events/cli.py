@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+"""
+Reports EC2 scheduled maintenance events and failed status checks across all
+regions. Only events that are new or changed since the previous run are
+reported, so this is cheap to poll from a dashboard.
+"""
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import json
+import os
+import sys
+
+#
+# Third party libraries
+#
+
+from texttable import Texttable
+
+#
+# Internal libraries
+#
+
+import krux.cli
+from aws_analysis_tools.ec2_events.scanner import scan_region
+from aws_analysis_tools.ec2_events.state import EventState, CLEARED
+from aws_analysis_tools.regions import (
+    get_region_names, parse_region_names, map_regions, add_region_cli_arguments,
+)
+from aws_analysis_tools.throttle import (
+    get_governor, configure_governor, add_throttle_cli_arguments,
+)
+from aws_analysis_tools.tracing import span, profiled, configure_tracer, add_profile_cli_arguments
+
+
+NAME = 'ec2-events'
+
+DEFAULT_STATE_FILE = os.path.join('~', '.krux-ec2-events.json')
+
+
+class Application(krux.cli.Application):
+    SUPPORTED_OUTPUT_FORMATS = ['table', 'jsonl']
+
+    _TABLE_HEADER = ['# change', 'Region', 'Zone', 'Instance', 'Kind', 'Code', 'State',
+                     'Not Before', 'Not After', 'Description']
+
+    def __init__(self, name=NAME):
+        # Call to the superclass to bootstrap.
+        super(Application, self).__init__(name=name)
+
+        self.output_format = self.args.output_format
+
+        configure_governor(self.args, stats=self.stats, log=self.logger)
+        configure_tracer(self.args, stats=self.stats)
+
+    def add_cli_arguments(self, parser):
+        group = krux.cli.get_group(parser, self.name)
+
+        group.add_argument(
+            '--regions',
+            default=None,
+            help="Comma separated list of EC2 regions to scan. (default: all regions)",
+        )
+
+        add_region_cli_arguments(group)
+        add_throttle_cli_arguments(group)
+        add_profile_cli_arguments(group)
+
+        group.add_argument(
+            '--state-file',
+            default=DEFAULT_STATE_FILE,
+            help="File remembering the events reported by the previous run. (default: %(default)s)",
+        )
+
+        group.add_argument(
+            '--all',
+            action='store_true',
+            default=False,
+            help="Report all current events, not only the new or changed ones. The state file "
+            "is still updated.",
+        )
+
+        group.add_argument(
+            '--report-cleared',
+            action='store_true',
+            default=False,
+            help="Also report events that disappeared since the previous run.",
+        )
+
+        group.add_argument(
+            '--output-format', '-f',
+            default='table',
+            choices=self.SUPPORTED_OUTPUT_FORMATS,
+            help='Output format. (default: %(default)s)',
+        )
+
+        group.add_argument(
+            '-H', '--no-header',
+            action='store_true',
+            default=False,
+            help="Suppress table header",
+        )
+
+    def scan(self):
+        """
+        Scans all regions and returns the list of (change, event) tuples to report.
+        """
+        with span('fetch'):
+            region_names = get_region_names(include=parse_region_names(self.args.regions))
+            results = map_regions(
+                scan_region, region_names,
+                concurrency=self.args.region_concurrency,
+                timeout=self.args.region_timeout,
+                log=self.logger,
+            )
+        events = sorted(results.chain(), key=lambda e: e.key)
+
+        for _ in results.failed:
+            self.stats.incr('error.region')
+
+        with span('filter'):
+            state = EventState(os.path.expanduser(self.args.state_file)).load()
+            changes = state.update(events, results.succeeded)
+            state.save()
+
+        if self.args.all:
+            changed = dict((event.key, change) for change, event in changes if change != CLEARED)
+            changes = [(changed.get(e.key, 'current'), e) for e in events] + \
+                [c for c in changes if c[0] == CLEARED]
+
+        if not self.args.report_cleared:
+            changes = [c for c in changes if c[0] != CLEARED]
+
+        return changes
+
+    def render(self, changes):
+        renderer = getattr(self, 'render_{0}'.format(self.output_format))
+        return renderer(changes)
+
+    def render_table(self, changes):
+        """
+        Render the changes as a Texttable, in the style of krux-ec2-instances.
+        """
+        table = Texttable(max_width=0)
+        table.set_deco(Texttable.HEADER)
+        table.set_cols_dtype(['t'] * len(self._TABLE_HEADER))
+        table.set_cols_align(['l'] * len(self._TABLE_HEADER))
+
+        if not self.args.no_header:
+            # using add_row, so the headers aren't being centered, for easier grepping
+            table.add_row(self._TABLE_HEADER)
+
+        for change, event in changes:
+            if change == CLEARED:
+                region, instance_id, kind, code = event.split('/', 3)
+                row = [change, region, None, instance_id, kind, code, None, None, None, None]
+            else:
+                row = [change, event.region, event.zone, event.instance_id, event.kind,
+                       event.code, event.state, event.not_before, event.not_after,
+                       event.description]
+            # XXX EVERY column in this output had better have a non-zero length
+            # or texttable blows up with 'width must be greater than 0' error
+            table.add_row([value or '-' for value in row])
+
+        # table.draw() blows up if there is nothing to print
+        if changes or not self.args.no_header:
+            return table.draw()
+        return ''
+
+    def render_jsonl(self, changes):
+        """
+        Render the changes as one JSON object per line.
+        """
+        lines = []
+        for change, event in changes:
+            if change == CLEARED:
+                record = {'key': event}
+            else:
+                record = event.to_dict()
+                record['key'] = event.key
+            record['change'] = change
+            lines.append(json.dumps(record, sort_keys=True))
+        return '\n'.join(lines)
+
+    def run(self):
+        with profiled(self.args, log=self.logger):
+            changes = self.scan()
+            with span('render'):
+                output = self.render(changes)
+                if output:
+                    sys.stdout.write(output + '\n')
+        get_governor().log_summary(self.logger)
+
+
+def main():
+    app = Application()
+    with app.context():
+        app.run()
+
+
+if __name__ == '__main__':
+    main()
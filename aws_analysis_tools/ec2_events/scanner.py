@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import hashlib
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.regions import connect_ec2
+from aws_analysis_tools.throttle import throttled_call
+
+
+# Kinds of events reported by the scanner
+KIND_EVENT = 'event'
+KIND_STATUS = 'status'
+
+# Status check values that are not worth reporting
+_HEALTHY_STATUSES = frozenset(['ok', 'initializing', 'not-applicable', None])
+
+# Page size for DescribeInstanceStatus
+_PAGE_SIZE = 1000
+
+
+class Event(object):
+    """
+    A single scheduled event or failed status check for one instance.
+    """
+    __slots__ = ('region', 'instance_id', 'zone', 'kind', 'code', 'description',
+                 'not_before', 'not_after', 'state')
+
+    # Fields that are written out, in this order
+    FIELDS = __slots__
+
+    def __init__(self, region, instance_id, zone, kind, code, description=None,
+                 not_before=None, not_after=None, state=None):
+        self.region = region
+        self.instance_id = instance_id
+        self.zone = zone
+        self.kind = kind
+        self.code = code
+        self.description = description
+        self.not_before = not_before
+        self.not_after = not_after
+        self.state = state
+
+    @property
+    def key(self):
+        """
+        Identity of the event; the same key on two runs is the same event.
+        """
+        return '{0}/{1}/{2}/{3}'.format(self.region, self.instance_id, self.kind, self.code)
+
+    def fingerprint(self):
+        """
+        Hash of the mutable fields, used to tell whether a known event changed.
+        """
+        digest = hashlib.sha1()
+        for value in (self.description, self.not_before, self.not_after, self.state):
+            digest.update(u'{0}\0'.format(value).encode('utf-8'))
+        return digest.hexdigest()
+
+    def to_dict(self):
+        return dict((field, getattr(self, field)) for field in self.FIELDS)
+
+    def __repr__(self):
+        return 'Event({0})'.format(self.key)
+
+
+def _events_from_status(region_name, status):
+    """
+    Yields an Event for each scheduled event and each failed status check of a
+    boto InstanceStatus object.
+    """
+    for event in status.events or []:
+        yield Event(
+            region=region_name,
+            instance_id=status.id,
+            zone=status.zone,
+            kind=KIND_EVENT,
+            code=event.code,
+            description=event.description,
+            not_before=event.not_before,
+            not_after=event.not_after,
+            state=status.state_name,
+        )
+
+    for check_name in ('system_status', 'instance_status'):
+        check = getattr(status, check_name, None)
+        if check is None or check.status in _HEALTHY_STATUSES:
+            continue
+        yield Event(
+            region=region_name,
+            instance_id=status.id,
+            zone=status.zone,
+            kind=KIND_STATUS,
+            code=check_name,
+            description=', '.join(
+                '{0}={1}'.format(k, v) for k, v in sorted(check.details.items())
+            ) or None,
+            state=check.status,
+        )
+
+
+def scan_region(region_name):
+    """
+    Returns the list of Events for a single region, following pagination.
+    Instances that aren't running are included, as they can have events too.
+    """
+    ec2 = connect_ec2(region_name)
+    events = []
+    next_token = None
+
+    while True:
+        page = throttled_call(
+            region_name, 'DescribeInstanceStatus', ec2.get_all_instance_status,
+            max_results=_PAGE_SIZE, next_token=next_token, include_all_instances=True,
+        )
+        for status in page:
+            events.extend(_events_from_status(region_name, status))
+
+        next_token = getattr(page, 'next_token', None)
+        if not next_token:
+            break
+
+    return events
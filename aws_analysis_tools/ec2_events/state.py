@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import json
+import os
+import tempfile
+
+
+# Change types reported by EventState.update()
+NEW = 'new'
+CHANGED = 'changed'
+CLEARED = 'cleared'
+
+_VERSION = 1
+
+
+class EventState(object):
+    """
+    Remembers the fingerprint of every event reported by a previous run, so
+    the next run only reports what is new or different.
+
+    The state is a flat JSON object of event key to fingerprint, plus the
+    region each key belongs to so a failed region keeps its entries.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fingerprints = {}
+        self.regions = {}
+
+    def load(self):
+        """
+        Reads the state file. A missing or unreadable file means a fresh state.
+        """
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return self
+
+        if data.get('version') == _VERSION:
+            for key, (region, fingerprint) in data.get('events', {}).items():
+                self.fingerprints[key] = fingerprint
+                self.regions[key] = region
+        return self
+
+    def save(self):
+        """
+        Atomically replaces the state file, so a concurrent reader never sees
+        a partially written file.
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        data = {
+            'version': _VERSION,
+            'events': dict(
+                (key, [self.regions[key], fingerprint])
+                for key, fingerprint in self.fingerprints.items()
+            ),
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.ec2-events-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f, separators=(',', ':'), sort_keys=True)
+            os.rename(tmp_path, self.path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    def update(self, events, scanned_regions):
+        """
+        Records EVENTS as the current state of SCANNED_REGIONS and returns a
+        list of (change, event) tuples for events that are new or changed.
+
+        Known events of a scanned region that are no longer present are
+        forgotten and reported as (CLEARED, key). Regions that were not
+        scanned (e.g. because the query failed) keep their old entries.
+        """
+        scanned_regions = frozenset(scanned_regions)
+        changes = []
+        seen = set()
+
+        for event in events:
+            key = event.key
+            fingerprint = event.fingerprint()
+            seen.add(key)
+
+            previous = self.fingerprints.get(key)
+            if previous is None:
+                changes.append((NEW, event))
+            elif previous != fingerprint:
+                changes.append((CHANGED, event))
+
+            self.fingerprints[key] = fingerprint
+            self.regions[key] = event.region
+
+        for key in [k for k, region in self.regions.items()
+                    if region in scanned_regions and k not in seen]:
+            del self.fingerprints[key]
+            del self.regions[key]
+            changes.append((CLEARED, key))
+
+        return changes
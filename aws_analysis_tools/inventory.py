@@ -0,0 +1,824 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+"""
+Warm, in-memory inventory of the fleet, served over a local Unix socket.
+
+The inventory daemon (krux-ec2-inventory) keeps the instances and volumes of
+every region as compact records and refreshes each region on its own,
+jittered schedule, so the regions don't all hit the API at once. Queries are
+answered from memory over a Unix socket, one JSON object per line in each
+direction:
+
+    {"op": "instances", "filters": {"tag:Name": ["*web*"]}, "regions": null}
+    {"columns": [...], "rows": [[...], ...]}
+
+Filters are EC2 filters with the same wildcard semantics, and rows are the
+records' to_row(), so the client rebuilds the same records it would have
+made from a DescribeInstances response. An
+answer for a region that hasn't been loaded yet, or was last refreshed more
+than max_age seconds ago, is an error.
+
+The CLIs call lookup_instances() and lookup_volumes() first, which return
+None when no daemon is reachable or it can't answer the query; the CLIs then
+query EC2 as before. As the daemon's data may be minutes old, the CLIs say
+when it answered, with inventory_note().
+"""
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import fnmatch
+import json
+import logging
+import os
+import random
+import re
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import socketserver
+except ImportError:  # pragma: no cover
+    import SocketServer as socketserver
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.records import (
+    InstanceRecord, VolumeRecord, iter_boto_instance_pages, iter_volume_pages,
+)
+from aws_analysis_tools.regions import (
+    connect_ec2, iter_regions, DEFAULT_CONCURRENCY, DEFAULT_TIMEOUT,
+)
+
+
+DEFAULT_SOCKET = os.path.join('~', '.cache', 'aws-analysis-tools', 'inventory.sock')
+
+# Overrides DEFAULT_SOCKET; set it to an empty string to never use the daemon
+SOCKET_ENV = 'AWS_ANALYSIS_TOOLS_INVENTORY'
+
+DEFAULT_REFRESH_INTERVAL = 300
+DEFAULT_REFRESH_JITTER = 0.2     # each interval is drawn from +/- this fraction
+DEFAULT_RETRY_INTERVAL = 30      # refresh a failed region again after this long
+# Clients refuse data older than the longest refresh interval, so an answer
+# is at most one refresh behind EC2
+DEFAULT_MAX_AGE = DEFAULT_REFRESH_INTERVAL * (1 + DEFAULT_REFRESH_JITTER)
+
+# Seconds a client waits for the daemon before falling back to EC2
+DEFAULT_CLIENT_TIMEOUT = 5.0
+
+# Number of encoded answers the server keeps until the next refresh
+RESPONSE_CACHE_SIZE = 256
+
+_TAG_FILTER_PREFIX = 'tag:'
+
+
+class InventoryError(Exception):
+    """
+    The inventory can't answer a query, e.g. because of an unknown filter or a
+    region it doesn't hold.
+    """
+
+
+class InventoryUnavailable(Exception):
+    """
+    No inventory daemon answered.
+    """
+
+
+# Filter name to a function returning the candidate values of a record
+INSTANCE_FILTERS = {
+    'instance-id': lambda r: (r.id,),
+    'instance-type': lambda r: (r.instance_type,),
+    'instance-state-name': lambda r: (r.state,),
+    'availability-zone': lambda r: (r.zone,),
+    'private-ip-address': lambda r: (r.private_ip_address,),
+    'ip-address': lambda r: (r.ip_address,),
+    'dns-name': lambda r: (r.dns_name,),
+    'group-name': lambda r: r.groups,
+    'root-device-type': lambda r: (r.root_device_type,),
+    'tag-key': lambda r: r._tags[0::2],
+    'tag-value': lambda r: r._tags[1::2],
+}
+
+VOLUME_FILTERS = {
+    'volume-id': lambda r: (r.id,),
+    'status': lambda r: (r.status,),
+    'availability-zone': lambda r: (r.zone,),
+    'volume-type': lambda r: (r.volume_type,),
+    'attachment.instance-id': lambda r: (r.instance_id,),
+    'attachment.device': lambda r: (r.device,),
+    'tag-key': lambda r: r._tags[0::2],
+    'tag-value': lambda r: r._tags[1::2],
+}
+
+# Filters whose values are indexed when a region is refreshed. Other tag
+# filters are indexed on first use. A query is driven by the first indexed
+# filter, so only the records having one of its values are scanned, and
+# wildcards are only matched against the distinct values.
+INSTANCE_INDEXES = ('instance-id', 'private-ip-address', 'ip-address', 'tag:Name')
+VOLUME_INDEXES = ('volume-id', 'attachment.instance-id')
+
+
+def normalize_filters(filters):
+    """
+    Returns FILTERS, either a dict of name to values or a boto3 list of
+    {'Name': ..., 'Values': [...]}, or a list of (name, values) pairs, as a
+    sorted list of (name, values) tuples.
+    """
+    if not filters:
+        return []
+    if isinstance(filters, dict):
+        items = filters.items()
+    else:
+        items = [(f['Name'], f['Values']) if isinstance(f, dict) else f for f in filters]
+    return sorted(
+        (name, [values] if not isinstance(values, (list, tuple)) else list(values))
+        for name, values in items
+    )
+
+
+def has_wildcard(value):
+    """
+    Returns whether the EC2 filter VALUE has a wildcard, '*' or '?'.
+    """
+    return '*' in value or '?' in value
+
+
+def _substring(pattern):
+    """
+    Returns the literal of a "*literal*" PATTERN, the form search terms take,
+    or None for any other pattern.
+    """
+    literal = pattern[1:-1]
+    if len(pattern) > 2 and pattern[0] == pattern[-1] == '*' and not has_wildcard(literal) \
+            and '\n' not in literal:
+        return literal
+    return None
+
+
+def _find_lines(text, literal):
+    """
+    Returns the lines of TEXT, which starts and ends with a newline, that
+    contain LITERAL.
+    """
+    lines = []
+    start = text.find(literal)
+    while start != -1:
+        end = text.find('\n', start)
+        lines.append(text[text.rfind('\n', 0, start) + 1:end])
+        start = text.find(literal, end)
+    return lines
+
+
+def compile_pattern(patterns):
+    """
+    Returns a regex matching any of the EC2 filter PATTERNS, where '*' and '?'
+    are the only wildcards and matching is case sensitive.
+    """
+    return re.compile('|'.join(
+        '(?:{0})'.format(re.escape(p).replace(r'\*', '.*').replace(r'\?', '.'))
+        for p in patterns
+    ) + r'\Z', re.DOTALL)
+
+
+def get_getter(name, getters):
+    """
+    Returns the function returning the candidate values of filter NAME.
+    Raises InventoryError for unknown filters.
+    """
+    if name.startswith(_TAG_FILTER_PREFIX):
+        key = name[len(_TAG_FILTER_PREFIX):]
+        return lambda r: (r.tag(key),)
+    if name in getters:
+        return getters[name]
+    raise InventoryError('Unsupported filter {0!r}'.format(name))
+
+
+def compile_filters(filters, getters):
+    """
+    Returns a list of (getter, regex) tuples for FILTERS, as returned by
+    normalize_filters().
+    """
+    return [(get_getter(name, getters), compile_pattern(patterns))
+            for name, patterns in filters]
+
+
+def matches(record, compiled):
+    """
+    Returns whether RECORD passes all COMPILED filters.
+    """
+    for getter, regex in compiled:
+        if not any(v is not None and regex.match(v) for v in getter(record)):
+            return False
+    return True
+
+
+class RegionInventory(object):
+    """
+    The records of one region, as of one refresh. Never changed once built;
+    a refresh replaces the whole object.
+    """
+
+    def __init__(self, region, instances, volumes, refreshed_at):
+        self.region = region
+        self.refreshed_at = refreshed_at
+        self.records = {'instances': list(instances), 'volumes': list(volumes)}
+        self._indexes = {}
+        self._texts = {}
+        self._lock = threading.Lock()
+
+    def index(self, kind, name, getter):
+        """
+        Returns a dict of each value of filter NAME to the records of KIND
+        having it, built on first use with GETTER.
+        """
+        key = (kind, name)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is None:
+                index = {}
+                for record in self.records[kind]:
+                    for value in getter(record):
+                        if value is not None:
+                            index.setdefault(value, []).append(record)
+                self._indexes[key] = index
+        return index
+
+    def lookup(self, kind, name, getter, patterns):
+        """
+        Returns the records of KIND with a value of filter NAME matching any of
+        PATTERNS, once each.
+        """
+        index = self.index(kind, name, getter)
+        if not any(has_wildcard(p) for p in patterns):
+            values = patterns
+        elif all(_substring(p) for p in patterns) and self._text(kind, name, index):
+            # str.find() over all the values at once is several times faster
+            # than matching them one by one
+            text = self._text(kind, name, index)
+            values = [line for p in patterns for line in _find_lines(text, _substring(p))]
+        else:
+            regex = compile_pattern(patterns)
+            values = [value for value in index if regex.match(value)]
+
+        if len(values) == 1:
+            return index.get(values[0], [])
+        seen = set()
+        result = []
+        for value in OrderedDict.fromkeys(values):
+            for record in index.get(value, ()):
+                if id(record) not in seen:
+                    seen.add(id(record))
+                    result.append(record)
+        return result
+
+    def _text(self, kind, name, index):
+        """
+        Returns the distinct values of INDEX as newline separated text, or an
+        empty string if a value contains a newline.
+        """
+        key = (kind, name)
+        with self._lock:
+            text = self._texts.get(key)
+            if text is None:
+                if any('\n' in value for value in index):
+                    text = ''
+                else:
+                    text = '\n' + '\n'.join(index) + '\n'
+                self._texts[key] = text
+        return text
+
+
+def fetch_region(region_name):
+    """
+    Fetches all instances and volumes of REGION_NAME, with all their tags, a
+    page at a time.
+    """
+    ec2 = connect_ec2(region_name)
+    instances = [record for page in iter_boto_instance_pages(ec2) for record in page]
+    volumes = [record for page in iter_volume_pages(ec2) for record in page]
+    return instances, volumes
+
+
+class Inventory(object):
+    """
+    The records of REGION_NAMES, refreshed per region by refresh().
+    """
+
+    _KINDS = {
+        'instances': (INSTANCE_FILTERS, INSTANCE_INDEXES),
+        'volumes': (VOLUME_FILTERS, VOLUME_INDEXES),
+    }
+
+    def __init__(self, region_names, fetch=fetch_region, clock=time.time):
+        self.region_names = sorted(set(region_names))
+        self.fetch = fetch
+        self.clock = clock
+        # Bumped by every successful refresh, so answers cached under an older
+        # generation are known to be stale
+        self.generation = 0
+        self.errors = {}
+        self._regions = {}
+        self._lock = threading.Lock()
+
+    def refresh(self, region_name):
+        """
+        Fetches REGION_NAME again and replaces its records. On failure the old
+        records are kept and the error is raised.
+        """
+        try:
+            instances, volumes = self.fetch(region_name)
+        except Exception as e:
+            with self._lock:
+                self.errors[region_name] = e
+            raise
+        self.update(region_name, instances, volumes)
+
+    def update(self, region_name, instances, volumes):
+        """
+        Replaces the records of REGION_NAME.
+        """
+        region = RegionInventory(region_name, instances, volumes, self.clock())
+        # Build the common indexes here rather than on the first query
+        for kind, (getters, indexes) in self._KINDS.items():
+            for name in indexes:
+                index = region.index(kind, name, get_getter(name, getters))
+                if name.startswith(_TAG_FILTER_PREFIX):
+                    region._text(kind, name, index)
+        with self._lock:
+            self._regions[region_name] = region
+            self.errors.pop(region_name, None)
+            self.generation += 1
+
+    def resolve_regions(self, regions, max_age=None):
+        """
+        Returns the RegionInventory of each of REGIONS, names or glob
+        patterns, or of every region if REGIONS is None. Raises InventoryError
+        for a region that isn't held, hasn't been loaded or is older than
+        MAX_AGE seconds.
+        """
+        if regions is None:
+            names = self.region_names
+        else:
+            names = []
+            for pattern in regions:
+                if any(c in pattern for c in '*?['):
+                    names.extend(fnmatch.filter(self.region_names, pattern))
+                elif pattern in self.region_names:
+                    names.append(pattern)
+                else:
+                    raise InventoryError('Region {0} is not in the inventory'.format(pattern))
+            names = sorted(set(names))
+
+        with self._lock:
+            resolved = [self._regions.get(name) for name in names]
+
+        now = self.clock()
+        for name, region in zip(names, resolved):
+            if region is None:
+                raise InventoryError('Region {0} has not been loaded yet'.format(name))
+            if max_age is not None and now - region.refreshed_at > max_age:
+                raise InventoryError('Region {0} was last refreshed {1:.0f}s ago'.format(
+                    name, now - region.refreshed_at))
+        return resolved
+
+    def query(self, kind, filters=None, regions=None, max_age=None):
+        """
+        Returns the records of KIND ('instances' or 'volumes') in REGIONS that
+        match the EC2 FILTERS.
+        """
+        if kind not in self._KINDS:
+            raise InventoryError('Unknown record kind {0!r}'.format(kind))
+        getters, indexes = self._KINDS[kind]
+
+        filters = normalize_filters(filters)
+        # Tag filters are indexed on demand, the others only if listed
+        driver = next(
+            (index for index, (name, _) in enumerate(filters)
+             if name in indexes or name.startswith(_TAG_FILTER_PREFIX) or name == 'tag-value'),
+            None,
+        )
+        compiled = compile_filters(filters, getters)
+        if driver is not None:
+            name, patterns = filters[driver]
+            getter = compiled.pop(driver)[0]
+
+        result = []
+        for region in self.resolve_regions(regions, max_age=max_age):
+            if driver is None:
+                candidates = region.records[kind]
+            else:
+                candidates = region.lookup(kind, name, getter, patterns)
+            if compiled:
+                result.extend(r for r in candidates if matches(r, compiled))
+            else:
+                result.extend(candidates)
+        return result
+
+    def status(self):
+        """
+        Returns a dict of region name to its age, record counts and last error.
+        """
+        now = self.clock()
+        with self._lock:
+            regions = dict(self._regions)
+            errors = dict(self.errors)
+
+        status = OrderedDict()
+        for name in self.region_names:
+            region = regions.get(name)
+            status[name] = {
+                'age': None if region is None else round(now - region.refreshed_at, 3),
+                'instances': None if region is None else len(region.records['instances']),
+                'volumes': None if region is None else len(region.records['volumes']),
+                'error': repr(errors[name]) if name in errors else None,
+            }
+        return status
+
+
+def jittered(interval, jitter):
+    """
+    Returns INTERVAL, randomly stretched or shrunk by up to the JITTER fraction.
+    """
+    return interval * random.uniform(1 - jitter, 1 + jitter)
+
+
+class Refresher(threading.Thread):
+    """
+    Refreshes the regions of an Inventory, each on its own schedule: every
+    INTERVAL seconds, jittered by JITTER, or after RETRY_INTERVAL when its
+    last refresh failed. All regions are loaded when it starts.
+    """
+
+    def __init__(self, inventory, interval=DEFAULT_REFRESH_INTERVAL, jitter=DEFAULT_REFRESH_JITTER,
+                 retry_interval=DEFAULT_RETRY_INTERVAL, concurrency=DEFAULT_CONCURRENCY,
+                 timeout=DEFAULT_TIMEOUT, log=None):
+        super(Refresher, self).__init__(name='inventory-refresher')
+        self.daemon = True
+        self.inventory = inventory
+        self.interval = interval
+        self.jitter = jitter
+        self.retry_interval = retry_interval
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.log = log or logging.getLogger(__name__)
+        self.next_refresh = dict((name, 0) for name in inventory.region_names)
+        self._stop = threading.Event()
+
+    def refresh_due(self):
+        """
+        Refreshes the regions that are due, and schedules their next refresh.
+        Returns the number of seconds until the next region is due.
+        """
+        now = time.time()
+        due = sorted(name for name, when in self.next_refresh.items() if when <= now)
+
+        for result in iter_regions(self.inventory.refresh, due, concurrency=self.concurrency,
+                                   timeout=self.timeout):
+            if result.error is None:
+                self.next_refresh[result.region] = time.time() + jittered(self.interval,
+                                                                          self.jitter)
+            else:
+                self.log.error('Unable to refresh region %s due to %r',
+                               result.region, result.error)
+                self.next_refresh[result.region] = time.time() + jittered(
+                    min(self.retry_interval, self.interval), self.jitter)
+
+        if not self.next_refresh:
+            return self.interval
+        return max(0, min(self.next_refresh.values()) - time.time())
+
+    def run(self):
+        while not self._stop.is_set():
+            self._stop.wait(self.refresh_due())
+
+    def stop(self):
+        self._stop.set()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """
+    Answers requests, one JSON object per line, until the client disconnects.
+    """
+
+    def handle(self):
+        for line in iter(self.rfile.readline, b''):
+            self.wfile.write(self.server.answer(line))
+            self.wfile.flush()
+
+
+class InventoryServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Serves an Inventory on the Unix socket at PATH, readable by the owner only.
+    """
+    daemon_threads = True
+
+    def __init__(self, path, inventory, log=None):
+        self.path = os.path.expanduser(path)
+        self.inventory = inventory
+        self.log = log or logging.getLogger(__name__)
+        self._cache = OrderedDict()
+        self._cache_generation = None
+        self._cache_lock = threading.Lock()
+
+        _remove_stale_socket(self.path)
+        socketserver.UnixStreamServer.__init__(self, self.path, _Handler)
+        os.chmod(self.path, 0o600)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def answer(self, line):
+        """
+        Returns the encoded answer to the request LINE. Answers to queries are
+        cached until the next refresh, as many clients ask the same thing.
+        """
+        try:
+            request = json.loads(line.decode('utf-8'))
+            op = request['op']
+            if op == 'status':
+                response = {'regions': self.inventory.status()}
+            elif op in ('instances', 'volumes'):
+                return self.answer_query(op, request)
+            else:
+                raise InventoryError('Unknown op {0!r}'.format(op))
+        except (InventoryError, ValueError, KeyError, TypeError) as e:
+            response = {'error': str(e)}
+        return _encode(response)
+
+    def answer_query(self, op, request):
+        filters = normalize_filters(request.get('filters'))
+        regions = request.get('regions')
+        # Raises if the regions are missing or too old, even for cached answers
+        self.inventory.resolve_regions(regions, max_age=request.get('max_age'))
+
+        key = json.dumps([op, filters, regions], sort_keys=True)
+        generation = self.inventory.generation
+        with self._cache_lock:
+            if self._cache_generation != generation:
+                self._cache.clear()
+                self._cache_generation = generation
+            cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+
+        cls = InstanceRecord if op == 'instances' else VolumeRecord
+        encoded = _encode({
+            'columns': list(cls.__slots__) + ['tags'],
+            'rows': [r.to_row() for r in self.inventory.query(op, filters, regions)],
+        })
+        with self._cache_lock:
+            if self._cache_generation == generation:
+                self._cache[key] = encoded
+                while len(self._cache) > RESPONSE_CACHE_SIZE:
+                    self._cache.popitem(last=False)
+        return encoded
+
+
+def _encode(response):
+    return json.dumps(response, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+def _remove_stale_socket(path):
+    """
+    Removes the socket at PATH left behind by a daemon that is gone. Raises
+    InventoryError if a daemon is still listening on it.
+    """
+    if not os.path.exists(path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        return
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        os.unlink(path)
+    else:
+        raise InventoryError('An inventory daemon is already listening on {0}'.format(path))
+    finally:
+        sock.close()
+
+
+class InventoryClient(object):
+    """
+    Queries an inventory daemon over the Unix socket at PATH. The connection
+    is opened on first use and kept for later queries.
+    """
+
+    def __init__(self, path, timeout=DEFAULT_CLIENT_TIMEOUT):
+        self.path = os.path.expanduser(path)
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except socket.error:
+            sock.close()
+            raise
+        self._sock = sock
+        self._file = sock.makefile('rwb')
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._sock is not None:
+            try:
+                self._file.close()
+                self._sock.close()
+            except socket.error:
+                pass
+        self._sock = self._file = None
+
+    def request(self, op, **kwargs):
+        """
+        Sends a request and returns the decoded response. Raises
+        InventoryUnavailable if the daemon can't be reached, and InventoryError
+        if it can't answer.
+        """
+        kwargs['op'] = op
+        line = json.dumps(kwargs, separators=(',', ':'), sort_keys=True).encode('utf-8') + b'\n'
+
+        with self._lock:
+            try:
+                if self._sock is None:
+                    self._connect()
+                self._file.write(line)
+                self._file.flush()
+                answer = self._file.readline()
+            except (socket.error, IOError, OSError) as e:
+                self._close()
+                raise InventoryUnavailable('Inventory daemon at {0} unavailable: {1}'.format(
+                    self.path, e))
+            if not answer:
+                self._close()
+                raise InventoryUnavailable('Inventory daemon at {0} hung up'.format(self.path))
+
+        response = json.loads(answer.decode('utf-8'))
+        if 'error' in response:
+            raise InventoryError(response['error'])
+        return response
+
+    def _records(self, cls, op, filters, regions, max_age, tag_keys):
+        response = self.request(op, filters=dict(normalize_filters(filters)), regions=regions,
+                                max_age=max_age)
+        return [cls.from_row(row, tag_keys=tag_keys) for row in response['rows']]
+
+    def instances(self, filters=None, regions=None, max_age=None, tag_keys=None):
+        """
+        Returns the InstanceRecords matching FILTERS in REGIONS (all when
+        None). If TAG_KEYS is given, only those tags are kept.
+        """
+        return self._records(InstanceRecord, 'instances', filters, regions, max_age, tag_keys)
+
+    def volumes(self, filters=None, regions=None, max_age=None, tag_keys=None):
+        """
+        Returns the VolumeRecords matching FILTERS in REGIONS (all when None).
+        """
+        return self._records(VolumeRecord, 'volumes', filters, regions, max_age, tag_keys)
+
+    def status(self):
+        return self.request('status')['regions']
+
+
+# Settings of the client used by lookup_instances() and lookup_volumes()
+_settings = {'path': None, 'enabled': True, 'max_age': DEFAULT_MAX_AGE, 'answered': False}
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_socket_path():
+    """
+    Returns the path of the daemon's socket, or None if the daemon shouldn't
+    be used.
+    """
+    if _settings['path']:
+        return os.path.expanduser(_settings['path'])
+    path = os.environ.get(SOCKET_ENV, DEFAULT_SOCKET)
+    return os.path.expanduser(path) if path else None
+
+
+def get_client():
+    """
+    Returns the shared InventoryClient, or None if the daemon is disabled or
+    its socket doesn't exist.
+    """
+    global _client
+
+    path = get_socket_path() if _settings['enabled'] else None
+    if not path or not os.path.exists(path):
+        return None
+    with _client_lock:
+        if _client is None or _client.path != path:
+            _client = InventoryClient(path)
+        return _client
+
+
+def configure_inventory(args=None):
+    """
+    Applies the options added by add_inventory_cli_arguments().
+    """
+    global _client
+
+    if args is not None:
+        _settings['path'] = getattr(args, 'inventory_socket', None)
+        _settings['enabled'] = not getattr(args, 'no_inventory', False)
+        _settings['max_age'] = getattr(args, 'inventory_max_age', DEFAULT_MAX_AGE)
+    _settings['answered'] = False
+    with _client_lock:
+        _client = None
+
+
+def _lookup(method, filters, regions, tag_keys, log):
+    client = get_client()
+    if client is None:
+        return None
+    try:
+        records = getattr(client, method)(filters=filters, regions=regions,
+                                          max_age=_settings['max_age'], tag_keys=tag_keys)
+        _settings['answered'] = True
+        return records
+    except InventoryUnavailable as e:
+        # Don't wait for a daemon that's gone again during this run
+        (log or logging.getLogger(__name__)).debug('%s, querying EC2', e)
+        _settings['enabled'] = False
+    except InventoryError as e:
+        (log or logging.getLogger(__name__)).debug(
+            'Inventory daemon cannot answer (%s), querying EC2', e)
+    return None
+
+
+def lookup_instances(filters=None, regions=None, tag_keys=None, log=None):
+    """
+    Returns the InstanceRecords matching the EC2 FILTERS in REGIONS (names or
+    patterns, None for all) from the inventory daemon, or None if the daemon
+    isn't running or can't answer.
+    """
+    return _lookup('instances', filters, regions, tag_keys, log)
+
+
+def lookup_volumes(filters=None, regions=None, log=None):
+    """
+    Like lookup_instances(), for VolumeRecords.
+    """
+    return _lookup('volumes', filters, regions, None, log)
+
+
+def inventory_note():
+    """
+    Returns a note saying the inventory daemon answered a lookup of this
+    process, and how old its data may be, or None if none was answered.
+    """
+    if not _settings['answered']:
+        return None
+    return 'answered from the krux-ec2-inventory daemon, data up to {0:.0f}s old'.format(
+        _settings['max_age'])
+
+
+def add_inventory_cli_arguments(group):
+    """
+    Adds the options controlling the use of the inventory daemon to an
+    argparse GROUP.
+    """
+    group.add_argument(
+        '--inventory-socket',
+        default=None,
+        help="Socket of the krux-ec2-inventory daemon to answer from when it is running. "
+        "(default: ${0} or {1})".format(SOCKET_ENV, DEFAULT_SOCKET),
+    )
+
+    group.add_argument(
+        '--no-inventory',
+        action='store_true',
+        default=False,
+        help="Always query EC2, even when the inventory daemon is running.",
+    )
+
+    group.add_argument(
+        '--inventory-max-age',
+        type=float,
+        default=DEFAULT_MAX_AGE,
+        help="Query EC2 instead of the inventory daemon when its data is older than this many "
+        "seconds. A note on stderr says when the daemon answered. (default: %(default)s)",
+    )
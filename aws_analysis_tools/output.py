@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+"""
+The output stage of krux-ec2-pssh2.
+
+SSHHost.puts() writes and flushes stdout for every line of every host, which
+with hundreds of chatty hosts keeps the driving process busy with system
+calls, and a pipe reading the output gets it a few bytes at a time. A
+CoalescingWriter collects the lines of all hosts instead, each already with
+its prefix and newline, and writes them in one chunk when MAX_BUFFER bytes
+are pending or FLUSH_INTERVAL seconds after the first of them, whichever
+comes first. Lines are only ever written whole, so the prefix of a line is
+never separated from it.
+
+On a terminal, lines are written one at a time as before, since there is
+someone watching them.
+"""
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import sys
+import threading
+import time
+
+
+# Seconds a line may wait in the buffer
+FLUSH_INTERVAL = 0.1
+
+# Bytes pending that are written at once
+MAX_BUFFER = 64 * 1024
+
+
+class CoalescingWriter(object):
+    """
+    Writes lines to STREAM in chunks of up to MAX_BUFFER bytes, at most
+    FLUSH_INTERVAL seconds after they were written. With LINE_BUFFERED, by
+    default when STREAM is a terminal, or a FLUSH_INTERVAL of 0, each line is
+    written and flushed as it comes.
+
+    write() only flushes when the buffer is full or overdue, so something
+    must call flush_due() while the lines are quiet, e.g. a green thread
+    running run(), and close() at the end. With run(), no line waits more
+    than 1.25 * FLUSH_INTERVAL.
+    """
+
+    def __init__(self, stream=None, flush_interval=FLUSH_INTERVAL, max_buffer=MAX_BUFFER,
+                 line_buffered=None, clock=time.time):
+        self.stream = sys.stdout if stream is None else stream
+        if line_buffered is None:
+            isatty = getattr(self.stream, 'isatty', None)
+            line_buffered = bool(isatty and isatty())
+        self.line_buffered = line_buffered or not flush_interval
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.clock = clock
+        self.closed = False
+        # The lines pending, their size and when the first of them came
+        self._lines = []
+        self._size = 0
+        self._since = None
+        self._lock = threading.Lock()
+
+    def write(self, line):
+        """
+        Writes LINE, which ends with a newline.
+        """
+        if self.line_buffered:
+            with self._lock:
+                self.stream.write(line)
+                self.stream.flush()
+            return
+
+        with self._lock:
+            if not self._lines:
+                self._since = self.clock()
+            self._lines.append(line)
+            self._size += len(line)
+            if (self._size >= self.max_buffer
+                    or self.clock() - self._since >= self.flush_interval):
+                self._write_pending()
+
+    def flush_due(self):
+        """
+        Writes the lines pending if the first of them has waited
+        FLUSH_INTERVAL seconds.
+        """
+        with self._lock:
+            if self._lines and self.clock() - self._since >= self.flush_interval:
+                self._write_pending()
+
+    def flush(self):
+        """
+        Writes the lines pending.
+        """
+        with self._lock:
+            if self._lines:
+                self._write_pending()
+            else:
+                self.stream.flush()
+
+    def run(self, sleep=time.sleep):
+        """
+        Flushes the lines that are due until closed, checking every quarter
+        of FLUSH_INTERVAL and calling SLEEP in between; green threads pass
+        eventlet.sleep.
+        """
+        while not self.closed:
+            sleep((self.flush_interval or FLUSH_INTERVAL) / 4.0)
+            self.flush_due()
+
+    def close(self):
+        """
+        Writes the lines pending and stops run(). The stream stays open, for
+        what is printed after the hosts' output.
+        """
+        self.closed = True
+        self.flush()
+
+    def _write_pending(self):
+        chunk = ''.join(self._lines)
+        self._lines = []
+        self._size = 0
+        self._since = None
+        self.stream.write(chunk)
+        self.stream.flush()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+"""
+A process-wide pool of AWS connections and clients, shared by all the CLIs.
+
+Creating a connection resolves its credentials through the provider chain,
+which on an instance is a call to the metadata service, and its first
+request pays for a TLS handshake. A pooled connection keeps both: boto keeps
+its HTTP connections alive between requests (dropping the ones idle for a
+minute) and refreshes its credentials itself before they expire. Repeated
+calls to a region then share one connection. boto3 clients can be used from
+several threads at once, so the threads of a fan-out share them too; boto
+connections can't, so each thread gets its own, which it keeps for the
+later calls it makes and which goes away with the thread.
+
+Connections are keyed by (service, region, credentials), where credentials is
+anything hashable identifying them: the keyword arguments the connection was
+made with, or the object the connection was made from, such as the
+krux-boto wrapper of an Application. A connection made per thread is kept
+in the thread's own local data, so repeated fan-outs don't pile up the
+connections of threads long gone.
+"""
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import os
+import threading
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.throttle import sdk_client_config
+
+
+class ClientPool(object):
+    """
+    Connections and clients by key, each made once with the factory given
+    to get(). The pool starts over in a forked process, as HTTP connections
+    can't be shared with the parent.
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pid = os.getpid()
+
+    def __len__(self):
+        return len(self._clients)
+
+    def get(self, service, region_name, factory, credentials=None, per_thread=False):
+        """
+        Returns the connection to SERVICE in REGION_NAME with CREDENTIALS,
+        calling FACTORY() to make it the first time, or the first time in
+        the calling thread if PER_THREAD, as for boto connections. Threads
+        asking for the same connection wait for the one making it; others
+        don't.
+        """
+        if self._pid != os.getpid():
+            self.clear()
+
+        key = (service, region_name, credentials)
+        if per_thread:
+            clients = getattr(self._local, 'clients', None)
+            if clients is None:
+                clients = self._local.clients = {}
+            client = clients.get(key)
+            if client is None:
+                client = clients[key] = factory()
+            return client
+
+        client = self._clients.get(key)
+        if client is not None:
+            return client
+
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = factory()
+                self._clients[key] = client
+        return client
+
+    def clear(self):
+        """
+        Forgets all connections, so the next get() of each makes a new one.
+        """
+        with self._lock:
+            self._clients = {}
+            self._locks = {}
+            self._local = threading.local()
+            self._pid = os.getpid()
+
+
+_pool = ClientPool()
+
+
+def get_pool():
+    """
+    Returns the ClientPool of the process.
+    """
+    return _pool
+
+
+def pooled_client(boto3, service, region_name):
+    """
+    Returns the pooled boto3 client of SERVICE in REGION_NAME made by BOTO3,
+    a boto3 module or the krux-boto wrapper of one. Its calls are meant to go
+    through throttled_call(), which retries them, so the client doesn't.
+    """
+    return _pool.get(service, region_name,
+                     lambda: boto3.client(service, region_name=region_name,
+                                          config=sdk_client_config()),
+                     credentials=boto3)
@@ -0,0 +1,420 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+"""
+Compact records of EC2 instances, volumes and snapshots.
+
+boto and boto3 objects carry every attribute of the API response, plus the
+nested dicts and helper objects around them, while the CLIs only ever look at
+a handful of fields. The records below keep just those fields in __slots__,
+with the low-cardinality strings (types, zones, states, tag keys and values)
+interned so a large fleet shares one copy of each. Responses are projected
+into records as they are iterated, so the full objects of a page can be freed
+before the next page is fetched.
+"""
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import sys
+
+#
+# Third party libraries
+#
+
+from boto.ec2.instance import Reservation
+from boto.ec2.snapshot import Snapshot
+from boto.ec2.volume import Volume
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.throttle import throttled_call
+
+try:
+    _intern = sys.intern
+except AttributeError:  # pragma: no cover
+    _intern = intern  # noqa: F821
+
+
+def intern_str(value):
+    """
+    Interns VALUE if it is a string, so equal values share storage.
+    """
+    if value is None or not isinstance(value, str):
+        return value
+    return _intern(value)
+
+
+def _flatten_tags(pairs):
+    """
+    Returns tags as a flat tuple (key, value, key, value, ...) of interned
+    strings, sorted by key. That is roughly a quarter of the size of a dict.
+    """
+    flat = []
+    for key, value in sorted(pairs):
+        flat.append(intern_str(key))
+        flat.append(intern_str(value))
+    return tuple(flat)
+
+
+class _TaggedRecord(object):
+    __slots__ = ('_tags',)
+
+    @property
+    def tags(self):
+        """
+        The tags as a new dict.
+        """
+        it = iter(self._tags)
+        return dict(zip(it, it))
+
+    def tag(self, key, default=None):
+        """
+        Returns the value of tag KEY without building the tags dict.
+        """
+        tags = self._tags
+        try:
+            index = tags.index(key)
+            # A value can be the same string as the key; keys are at even indexes
+            while index % 2:
+                index = tags.index(key, index + 1)
+        except ValueError:
+            return default
+        return tags[index + 1]
+
+    @property
+    def name(self):
+        return self.tag('Name')
+
+    def to_row(self):
+        """
+        Returns the record as a list of JSON serializable values: its
+        __slots__ in order, then its tags flattened into a list.
+        """
+        row = [getattr(self, column) for column in self.__slots__]
+        row.append(list(self._tags))
+        return row
+
+    @classmethod
+    def from_row(cls, row, tag_keys=None):
+        """
+        Rebuilds a record from a row made by to_row(). If TAG_KEYS is given,
+        only those tags are kept.
+        """
+        it = iter(row[-1])
+        tags = zip(it, it)
+        if tag_keys is not None:
+            tags = [(key, value) for key, value in tags if key in tag_keys]
+        return cls(*row[:-1], tags=tags)
+
+
+class InstanceRecord(_TaggedRecord):
+    """
+    The fields of an EC2 instance the CLIs use. Attribute names follow boto,
+    so most code written against boto instances works unchanged.
+    """
+    __slots__ = ('id', 'region', 'instance_type', 'zone', 'groups', 'state', 'ip_address',
+                 'private_ip_address', 'dns_name', 'root_device_type')
+
+    # Public fields, in display order
+    FIELDS = ('id', 'name', 'instance_type', 'zone', 'group', 'state', 'ip_address',
+              'private_ip_address', 'dns_name', 'root_device_type', 'region')
+
+    def __init__(self, id, region=None, instance_type=None, zone=None, groups=(), state=None,
+                 ip_address=None, private_ip_address=None, dns_name=None, root_device_type=None,
+                 tags=()):
+        self.id = id
+        self.region = intern_str(region)
+        self.instance_type = intern_str(instance_type)
+        self.zone = intern_str(zone)
+        self.groups = tuple(intern_str(g) for g in groups)
+        self.state = intern_str(state)
+        self.ip_address = ip_address
+        self.private_ip_address = private_ip_address
+        self.dns_name = dns_name or None
+        self.root_device_type = intern_str(root_device_type)
+        self._tags = _flatten_tags(tags.items() if isinstance(tags, dict) else tags)
+
+    @classmethod
+    def from_boto(cls, instance, region=None, tag_keys=None):
+        """
+        Projects a boto (2) Instance. If TAG_KEYS is given, only those tags are
+        kept.
+        """
+        tags = instance.tags
+        if tag_keys is not None:
+            tags = dict((key, value) for key, value in tags.items() if key in tag_keys)
+        return cls(
+            id=instance.id,
+            region=region or getattr(getattr(instance, 'region', None), 'name', None),
+            instance_type=instance.instance_type,
+            zone=instance.placement,
+            groups=[g.name for g in instance.groups],
+            state=instance.state,
+            ip_address=instance.ip_address,
+            private_ip_address=instance.private_ip_address,
+            dns_name=instance.dns_name,
+            root_device_type=instance.root_device_type,
+            tags=tags,
+        )
+
+    @classmethod
+    def from_dict(cls, data, region=None):
+        """
+        Projects an instance dict of a boto3 DescribeInstances response.
+        """
+        return cls(
+            id=data['InstanceId'],
+            region=region,
+            instance_type=data.get('InstanceType'),
+            zone=data.get('Placement', {}).get('AvailabilityZone'),
+            groups=[g['GroupName'] for g in data.get('SecurityGroups') or ()],
+            state=data.get('State', {}).get('Name'),
+            ip_address=data.get('PublicIpAddress'),
+            private_ip_address=data.get('PrivateIpAddress'),
+            dns_name=data.get('PublicDnsName'),
+            root_device_type=data.get('RootDeviceType'),
+            tags=[(t['Key'], t['Value']) for t in data.get('Tags') or ()],
+        )
+
+    @classmethod
+    def from_boto3(cls, instance, region=None):
+        """
+        Projects a boto3 ec2.Instance resource.
+        """
+        return cls.from_dict(instance.meta.data or {'InstanceId': instance.id}, region=region)
+
+    @property
+    def group(self):
+        """
+        Name of the first security group, as shown in tables.
+        """
+        return self.groups[0] if self.groups else None
+
+    def to_dict(self):
+        return dict((field, getattr(self, field)) for field in self.FIELDS)
+
+    def __repr__(self):
+        return 'InstanceRecord({0})'.format(self.id)
+
+
+class VolumeRecord(_TaggedRecord):
+    """
+    The fields of an EBS volume the CLIs use.
+    """
+    __slots__ = ('id', 'region', 'zone', 'status', 'size', 'volume_type', 'instance_id',
+                 'device')
+
+    FIELDS = ('id', 'name', 'zone', 'status', 'size', 'volume_type', 'instance_id', 'device',
+              'region')
+
+    def __init__(self, id, region=None, zone=None, status=None, size=None, volume_type=None,
+                 instance_id=None, device=None, tags=()):
+        self.id = id
+        self.region = intern_str(region)
+        self.zone = intern_str(zone)
+        self.status = intern_str(status)
+        self.size = size
+        self.volume_type = intern_str(volume_type)
+        self.instance_id = instance_id
+        self.device = intern_str(device)
+        self._tags = _flatten_tags(tags.items() if isinstance(tags, dict) else tags)
+
+    @classmethod
+    def from_boto(cls, volume, region=None):
+        """
+        Projects a boto (2) Volume.
+        """
+        attach_data = volume.attach_data
+        return cls(
+            id=volume.id,
+            region=region or getattr(getattr(volume, 'region', None), 'name', None),
+            zone=volume.zone,
+            status=volume.status,
+            size=volume.size,
+            volume_type=getattr(volume, 'type', None),
+            instance_id=attach_data.instance_id if attach_data else None,
+            device=attach_data.device if attach_data else None,
+            tags=volume.tags,
+        )
+
+    @classmethod
+    def from_dict(cls, data, region=None):
+        """
+        Projects a volume dict of a boto3 DescribeVolumes response.
+        """
+        attachments = data.get('Attachments') or ()
+        return cls(
+            id=data['VolumeId'],
+            region=region,
+            zone=data.get('AvailabilityZone'),
+            status=data.get('State'),
+            size=data.get('Size'),
+            volume_type=data.get('VolumeType'),
+            instance_id=attachments[0].get('InstanceId') if attachments else None,
+            device=attachments[0].get('Device') if attachments else None,
+            tags=[(t['Key'], t['Value']) for t in data.get('Tags') or ()],
+        )
+
+    def to_dict(self):
+        return dict((field, getattr(self, field)) for field in self.FIELDS)
+
+    def __repr__(self):
+        return 'VolumeRecord({0})'.format(self.id)
+
+
+class SnapshotRecord(_TaggedRecord):
+    """
+    The fields of an EBS snapshot the CLIs use.
+    """
+    __slots__ = ('id', 'region', 'volume_id', 'status', 'size', 'start_time', 'description')
+
+    FIELDS = ('id', 'name', 'volume_id', 'status', 'size', 'start_time', 'description', 'region')
+
+    def __init__(self, id, region=None, volume_id=None, status=None, size=None, start_time=None,
+                 description=None, tags=()):
+        self.id = id
+        self.region = intern_str(region)
+        self.volume_id = volume_id
+        self.status = intern_str(status)
+        self.size = size
+        self.start_time = start_time
+        self.description = description
+        self._tags = _flatten_tags(tags.items() if isinstance(tags, dict) else tags)
+
+    @classmethod
+    def from_boto(cls, snapshot, region=None):
+        """
+        Projects a boto (2) Snapshot.
+        """
+        return cls(
+            id=snapshot.id,
+            region=region or getattr(getattr(snapshot, 'region', None), 'name', None),
+            volume_id=snapshot.volume_id,
+            status=snapshot.status,
+            size=snapshot.volume_size,
+            start_time=snapshot.start_time,
+            description=snapshot.description,
+            tags=snapshot.tags,
+        )
+
+    @classmethod
+    def from_dict(cls, data, region=None):
+        """
+        Projects a snapshot dict of a boto3 DescribeSnapshots response.
+        """
+        start_time = data.get('StartTime')
+        return cls(
+            id=data['SnapshotId'],
+            region=region,
+            volume_id=data.get('VolumeId'),
+            status=data.get('State'),
+            size=data.get('VolumeSize'),
+            start_time=start_time.isoformat() if hasattr(start_time, 'isoformat') else start_time,
+            description=data.get('Description'),
+            tags=[(t['Key'], t['Value']) for t in data.get('Tags') or ()],
+        )
+
+    def to_dict(self):
+        return dict((field, getattr(self, field)) for field in self.FIELDS)
+
+    def __repr__(self):
+        return 'SnapshotRecord({0})'.format(self.id)
+
+
+def iter_instance_records(reservations, region=None):
+    """
+    Projects every instance of boto (2) RESERVATIONS into an InstanceRecord.
+    """
+    for reservation in reservations:
+        for instance in reservation.instances:
+            yield InstanceRecord.from_boto(instance, region=region)
+
+
+def iter_instance_pages(client, region_name, filters=None, page_size=1000):
+    """
+    Pages through DescribeInstances with a boto3 CLIENT and yields the
+    instances of each page as a list of InstanceRecords, before fetching the
+    next page.
+    """
+    kwargs = {'Filters': filters or [], 'MaxResults': page_size}
+
+    while True:
+        page = throttled_call(region_name, 'DescribeInstances', client.describe_instances, **kwargs)
+        yield [
+            InstanceRecord.from_dict(instance, region=region_name)
+            for reservation in page.get('Reservations', ())
+            for instance in reservation.get('Instances', ())
+        ]
+
+        kwargs['NextToken'] = page.get('NextToken')
+        if not kwargs['NextToken']:
+            break
+
+
+def describe_instance_records(client, region_name, filters=None, page_size=1000):
+    """
+    Pages through DescribeInstances with a boto3 CLIENT and returns the
+    instances as InstanceRecords, projecting each page before fetching the
+    next one.
+    """
+    records = []
+    for page in iter_instance_pages(client, region_name, filters, page_size):
+        records.extend(page)
+    return records
+
+
+def _iter_boto_pages(conn, action, params, item_class, page_size):
+    """
+    Pages through ACTION with a boto (2) CONN, which has no paginators, and
+    yields each page as a list of ITEM_CLASS objects.
+    """
+    params = dict(params, MaxResults=page_size)
+
+    while True:
+        page = throttled_call(conn.region.name, action, conn.get_list, action, params,
+                              [('item', item_class)], verb='POST')
+        yield page
+
+        if not getattr(page, 'next_token', None):
+            break
+        params['NextToken'] = page.next_token
+
+
+def iter_boto_instance_pages(conn, page_size=1000):
+    """
+    Pages through DescribeInstances with a boto (2) CONN and yields the
+    instances of each page as a list of InstanceRecords, before fetching the
+    next page.
+    """
+    region = conn.region.name
+    for page in _iter_boto_pages(conn, 'DescribeInstances', {}, Reservation, page_size):
+        yield list(iter_instance_records(page, region=region))
+
+
+def iter_volume_pages(conn, page_size=500):
+    """
+    Pages through DescribeVolumes with a boto (2) CONN and yields the volumes
+    of each page as a list of VolumeRecords, before fetching the next page.
+    """
+    region = conn.region.name
+    for page in _iter_boto_pages(conn, 'DescribeVolumes', {}, Volume, page_size):
+        yield [VolumeRecord.from_boto(volume, region=region) for volume in page]
+
+
+def iter_snapshot_pages(conn, owner='self', page_size=1000):
+    """
+    Pages through DescribeSnapshots of OWNER with a boto (2) CONN and yields
+    the snapshots of each page as a list of SnapshotRecords, before fetching
+    the next page.
+    """
+    region = conn.region.name
+    params = {'Owner.1': owner} if owner else {}
+    for page in _iter_boto_pages(conn, 'DescribeSnapshots', params, Snapshot, page_size):
+        yield [SnapshotRecord.from_boto(snapshot, region=region) for snapshot in page]
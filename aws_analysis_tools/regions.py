@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+"""
+Region discovery and concurrent per-region execution shared by all the CLIs.
+
+The list of regions is fetched once with DescribeRegions and cached on disk,
+so most runs don't need any API call to know where to look. map_regions() and
+iter_regions() then run a callable for every region in a bounded pool of
+threads, with a per-region timeout, and report the regions that failed
+instead of aborting the whole query.
+"""
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import fnmatch
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import namedtuple, OrderedDict
+from itertools import chain
+
+try:
+    import queue
+except ImportError:  # pragma: no cover
+    import Queue as queue
+
+#
+# Third party libraries
+#
+
+import boto.ec2
+import boto.exception
+from boto.ec2.connection import EC2Connection
+from boto.regioninfo import RegionInfo
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.pool import get_pool
+from aws_analysis_tools.throttle import throttled_call, without_sdk_retries
+from aws_analysis_tools.tracing import span
+
+
+# We don't have access to GovCloud and China, so skip them unless asked for
+# explicitly.
+DEFAULT_EXCLUDE = ('*-gov-*', 'cn-*')
+
+# Region used to call DescribeRegions
+BOOTSTRAP_REGION = 'us-east-1'
+
+DEFAULT_CACHE_FILE = os.path.join('~', '.cache', 'aws-analysis-tools', 'regions.json')
+DEFAULT_CACHE_AGE = 24 * 60 * 60  # one day
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_TIMEOUT = 120
+
+# How often iter_regions() checks for timed out regions, in seconds
+POLL_INTERVAL = 0.1
+
+_ENDPOINT_TEMPLATE = 'ec2.{0}.amazonaws.com'
+
+# Region name to endpoint, filled in from the cache or DescribeRegions
+_endpoints = {}
+_endpoints_lock = threading.Lock()
+
+
+class RegionTimeout(Exception):
+    """
+    The callable passed to iter_regions() took longer than the allowed time.
+    """
+
+    def __init__(self, region, timeout):
+        super(RegionTimeout, self).__init__(
+            'Region {0} did not respond within {1} seconds'.format(region, timeout)
+        )
+        self.region = region
+        self.timeout = timeout
+
+
+RegionResult = namedtuple('RegionResult', ['region', 'value', 'error'])
+
+
+class RegionResults(object):
+    """
+    Results of map_regions(): the values of the regions that succeeded, in the
+    order the regions were given, and the errors of the ones that did not.
+    """
+
+    def __init__(self):
+        self.results = OrderedDict()
+        self.errors = OrderedDict()
+
+    @property
+    def failed(self):
+        return list(self.errors.keys())
+
+    @property
+    def succeeded(self):
+        return list(self.results.keys())
+
+    def values(self):
+        """
+        Returns the per-region values as a list, in region order.
+        """
+        return list(self.results.values())
+
+    def chain(self):
+        """
+        Iterates over the items of every per-region value, for callables that
+        return a list per region.
+        """
+        return chain.from_iterable(self.results.values())
+
+
+def parse_region_names(value):
+    """
+    Normalizes a region option into a list of names, or None for "all regions".
+
+    Accepts a comma separated string, a list of such strings (as produced by
+    argparse's nargs) or 'all'.
+    """
+    if not value:
+        return None
+    if not isinstance(value, (list, tuple)):
+        value = [value]
+
+    names = [name.strip() for part in value for name in part.split(',') if name.strip()]
+    if not names or 'all' in names:
+        return None
+    return names
+
+
+def _read_cache(cache_file, max_age):
+    try:
+        if time.time() - os.path.getmtime(cache_file) > max_age:
+            return None
+        with open(cache_file) as f:
+            return json.load(f)['regions']
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+
+
+def _write_cache(cache_file, endpoints):
+    directory = os.path.dirname(cache_file)
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.regions-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'regions': endpoints}, f)
+        os.rename(tmp_path, cache_file)
+    except (IOError, OSError):
+        # The cache is an optimization only
+        logging.getLogger(__name__).debug('Unable to write region cache %s', cache_file)
+
+
+def _describe_regions():
+    """
+    Returns a tuple of (endpoints, from_api), where endpoints is a dict of
+    region name to endpoint for the regions enabled in the account. Falls back
+    to boto's built-in list if DescribeRegions fails.
+    """
+    try:
+        conn = connect_ec2(BOOTSTRAP_REGION)
+        regions = throttled_call(BOOTSTRAP_REGION, 'DescribeRegions', conn.get_all_regions)
+        return dict((r.name, r.endpoint) for r in regions), True
+    except (boto.exception.BotoClientError, boto.exception.BotoServerError, IOError) as e:
+        logging.getLogger(__name__).warning(
+            'Unable to describe regions due to %r, using the built-in list', e
+        )
+        return dict((r.name, r.endpoint) for r in boto.ec2.regions()), False
+
+
+def _load_endpoints(cache_file, max_age, refresh):
+    cache_file = os.path.expanduser(cache_file) if cache_file else None
+    endpoints = None
+
+    if cache_file and not refresh:
+        endpoints = _read_cache(cache_file, max_age)
+
+    if endpoints is None:
+        endpoints, from_api = _describe_regions()
+        if cache_file and from_api:
+            _write_cache(cache_file, endpoints)
+
+    with _endpoints_lock:
+        _endpoints.update(endpoints)
+    return endpoints
+
+
+def get_region_names(include=None, exclude=DEFAULT_EXCLUDE, cache_file=DEFAULT_CACHE_FILE,
+                     max_age=DEFAULT_CACHE_AGE, refresh=False):
+    """
+    Returns the sorted names of the regions to query.
+
+    INCLUDE is a list of region names or glob patterns; None means all known
+    regions. Regions matching a pattern in EXCLUDE are dropped, unless they
+    were named explicitly in INCLUDE. Unknown names in INCLUDE are kept, so a
+    stale cache never hides a region asked for explicitly.
+    """
+    if include is not None and not any(c in p for p in include for c in '*?['):
+        # Nothing to discover
+        return sorted(set(include))
+
+    endpoints = _load_endpoints(cache_file, max_age, refresh)
+
+    if include is None:
+        names = list(endpoints)
+    else:
+        names = []
+        for pattern in include:
+            if not any(c in pattern for c in '*?['):
+                names.append(pattern)
+            else:
+                names.extend(fnmatch.filter(endpoints, pattern))
+
+    explicit = frozenset(include or [])
+    return sorted(set(
+        name for name in names
+        if name in explicit or not any(fnmatch.fnmatch(name, p) for p in exclude or [])
+    ))
+
+
+def get_endpoint(region_name):
+    """
+    Returns the EC2 endpoint of REGION_NAME, as reported by DescribeRegions.
+    """
+    with _endpoints_lock:
+        endpoint = _endpoints.get(region_name)
+    return endpoint or _ENDPOINT_TEMPLATE.format(region_name)
+
+
+def connect_ec2(region_name, **kwargs):
+    """
+    Returns a boto EC2Connection to REGION_NAME. Unlike
+    boto.ec2.connect_to_region(), this also works for regions that are newer
+    than the installed boto. The connection is pooled: callers in the same
+    thread asking for the same region and KWARGS share it, and its HTTP
+    connections and credentials; boto connections aren't thread-safe. Its
+    calls are meant to go through throttled_call(), which retries them, so
+    the connection doesn't.
+    """
+    endpoint = get_endpoint(region_name)
+
+    def _connect():
+        with span('connect', region=region_name):
+            region = RegionInfo(name=region_name, endpoint=endpoint,
+                                connection_cls=EC2Connection)
+            return without_sdk_retries(EC2Connection(region=region, **kwargs))
+
+    return get_pool().get('ec2', region_name, _connect,
+                          credentials=(endpoint,) + tuple(sorted(kwargs.items())),
+                          per_thread=True)
+
+
+def iter_regions(func, region_names, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT,
+                 poll_interval=POLL_INTERVAL, idle=None):
+    """
+    Calls FUNC(region_name) for each of REGION_NAMES in at most CONCURRENCY
+    threads and yields a RegionResult for each region as soon as it finishes.
+
+    A region that raises yields its exception as the error. A region that
+    runs longer than TIMEOUT seconds yields a RegionTimeout and is abandoned;
+    its thread is replaced so the remaining regions still get their share of
+    the pool. IDLE, if given, is called between polls; cooperative schedulers
+    such as eventlet use it to keep other green threads running.
+    """
+    region_names = list(OrderedDict.fromkeys(region_names))
+    todo = queue.Queue()
+    done = queue.Queue()
+    started = {}
+
+    for name in region_names:
+        todo.put(name)
+
+    def worker():
+        while True:
+            try:
+                name = todo.get_nowait()
+            except queue.Empty:
+                return
+            started[name] = time.time()
+            try:
+                with span('region', region=name):
+                    value = func(name)
+                done.put(RegionResult(name, value, None))
+            except Exception as e:
+                done.put(RegionResult(name, None, e))
+
+    def start_worker():
+        thread = threading.Thread(target=worker, name='region-worker')
+        thread.daemon = True
+        thread.start()
+
+    for _ in range(min(max(1, concurrency), len(region_names))):
+        start_worker()
+
+    remaining = set(region_names)
+    try:
+        while remaining:
+            try:
+                result = done.get(timeout=poll_interval)
+            except queue.Empty:
+                pass
+            else:
+                if result.region in remaining:
+                    remaining.discard(result.region)
+                    yield result
+
+            if timeout is not None:
+                now = time.time()
+                for name in sorted(remaining):
+                    if name in started and now - started[name] > timeout:
+                        remaining.discard(name)
+                        if not todo.empty():
+                            start_worker()
+                        yield RegionResult(name, None, RegionTimeout(name, timeout))
+
+            if idle is not None and remaining:
+                idle()
+    finally:
+        # Stop handing out work if the caller stopped listening
+        while not todo.empty():
+            try:
+                todo.get_nowait()
+            except queue.Empty:
+                break
+
+
+def map_regions(func, region_names, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT,
+                log=None):
+    """
+    Calls FUNC(region_name) for each of REGION_NAMES concurrently and returns a
+    RegionResults once all regions finished, failed or timed out. Failures are
+    logged to LOG and don't affect the other regions.
+    """
+    region_names = list(OrderedDict.fromkeys(region_names))
+    if log is None:
+        log = logging.getLogger(__name__)
+
+    collected = {}
+    results = RegionResults()
+    for result in iter_regions(func, region_names, concurrency=concurrency, timeout=timeout):
+        collected[result.region] = result
+        if result.error is not None:
+            log.error('Unable to query region %s due to %r', result.region, result.error)
+
+    for name in region_names:
+        result = collected[name]
+        if result.error is None:
+            results.results[name] = result.value
+        else:
+            results.errors[name] = result.error
+    return results
+
+
+def add_region_cli_arguments(group):
+    """
+    Adds the options controlling the region fan-out to an argparse GROUP.
+    """
+    group.add_argument(
+        '--region-concurrency',
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help="Number of regions to query in parallel. (default: %(default)s)",
+    )
+
+    group.add_argument(
+        '--region-timeout',
+        type=float,
+        default=DEFAULT_TIMEOUT,
+        help="Seconds to wait for a single region before giving up on it. "
+        "(default: %(default)s)",
+    )
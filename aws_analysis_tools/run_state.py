@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+"""
+The state files of the pssh tools, from which a run can be retried or resumed.
+
+A state file is JSON lines. The first line has the command and every host the
+run targets, as (name, address) pairs; then each host that is done adds a
+line with its outcome, exit status and duration, as soon as it is done, so
+the file of a run that was interrupted is as complete as the run got. Runs
+that find their hosts as they go, such as pssh2 --stream, add a line for each
+host as they start it instead.
+
+Hosts are told apart by address, as instances can share their name. Runs of
+--retry-failed or --resume append to the file they read, and the last line
+of a host is its current state, so retrying a run again retries what
+still didn't succeed:
+
+- --resume runs the hosts that have no outcome or were skipped, the ones the
+  run never got to or didn't see the end of
+- --retry-failed also runs the hosts that failed or timed out
+"""
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import json
+import os
+import time
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.ssh import OK, SKIPPED
+
+
+DEFAULT_STATE_DIRECTORY = '~/.cache/aws-analysis-tools/pssh-runs'
+
+# Only the state files of this many runs are kept in DEFAULT_STATE_DIRECTORY
+KEEP_STATE_FILES = 100
+
+_VERSION = 1
+
+_SUFFIX = '.jsonl'
+
+
+class StateError(Exception):
+    """
+    A state file can't be used.
+    """
+
+
+def new_state_path(directory=DEFAULT_STATE_DIRECTORY, now=None):
+    """
+    Returns the path of a new state file in DIRECTORY, after removing all
+    but the newest KEEP_STATE_FILES - 1 there.
+    """
+    directory = os.path.expanduser(directory)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    old = sorted(f for f in os.listdir(directory) if f.endswith(_SUFFIX))
+    for name in old[:max(len(old) - KEEP_STATE_FILES + 1, 0)]:
+        try:
+            os.unlink(os.path.join(directory, name))
+        except OSError:
+            pass
+
+    stamp = time.strftime('%Y%m%dT%H%M%S', time.localtime(now))
+    return os.path.join(directory, '{0}-{1}{2}'.format(stamp, os.getpid(), _SUFFIX))
+
+
+class RunState(object):
+    """
+    The command and hosts of a run, and the outcome of each host done, by
+    address, as (outcome, exit status, seconds) tuples.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.command = None
+        self.hosts = []
+        self.outcomes = {}
+        self._file = None
+
+    def load(self):
+        """
+        Reads the state file. Raises StateError if it can't be read.
+        """
+        try:
+            with open(self.path) as f:
+                lines = f.read().splitlines()
+        except (IOError, OSError) as e:
+            raise StateError('Unable to read the state file {0}: {1}'.format(self.path, e))
+
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, ValueError):
+            raise StateError('{0} is not a state file'.format(self.path))
+        if not isinstance(header, dict) or header.get('version') != _VERSION:
+            raise StateError('{0} is not a state file'.format(self.path))
+
+        self.command = header['command']
+        self.hosts = [tuple(pair) for pair in header['hosts']]
+        # Outcomes written before they had the address are of the host of that name
+        addresses = dict(self.hosts)
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # The last line of an interrupted run may be cut short
+                continue
+            if 'outcome' not in record:
+                self.hosts.append((record['host'], record['address']))
+                addresses.setdefault(record['host'], record['address'])
+                continue
+            address = record.get('address') or addresses.get(record['host'], record['host'])
+            self.outcomes[address] = (record['outcome'], record.get('status'),
+                                      record.get('seconds'))
+        return self
+
+    def check_command(self, command):
+        """
+        Raises StateError unless COMMAND is the command of the state.
+        """
+        if command != self.command:
+            raise StateError('{0} is the state of another command: {1}'.format(
+                self.path, self.command))
+
+    def pending(self, retry_failed=False):
+        """
+        Returns the (name, address) pairs of the hosts to run again: those
+        without an outcome or skipped and, with RETRY_FAILED, all that
+        didn't succeed.
+        """
+        pending = []
+        for pair in self.hosts:
+            outcome = self.outcomes.get(pair[1], (None,))[0]
+            if outcome in (None, SKIPPED) or (retry_failed and outcome != OK):
+                pending.append(pair)
+        return pending
+
+    def start(self, command, hosts):
+        """
+        Starts a new state file for running COMMAND on HOSTS, a list of
+        (name, address) pairs.
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.command = command
+        self.hosts = [tuple(pair) for pair in hosts]
+        self.outcomes = {}
+        self._file = open(self.path, 'w')
+        self._write({'version': _VERSION, 'command': command, 'started': int(time.time()),
+                     'hosts': self.hosts})
+
+    def add_host(self, name, address):
+        """
+        Adds a host to those the run targets.
+        """
+        self.hosts.append((name, address))
+        self._write({'host': name, 'address': address})
+
+    def reopen(self):
+        """
+        Appends the outcomes of the hosts run again to the state file read.
+        """
+        self._file = open(self.path, 'a')
+
+    def record(self, host, address, outcome, status=None, seconds=None):
+        """
+        Records the OUTCOME of HOST, reached at ADDRESS, with the exit status
+        of ssh and how long it took when known.
+        """
+        self.outcomes[address] = (outcome, status, seconds)
+        self._write({'host': host, 'address': address, 'outcome': outcome, 'status': status,
+                     'seconds': None if seconds is None else round(seconds, 3)})
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def failed_count(self):
+        """
+        Returns the number of hosts that didn't succeed.
+        """
+        return len(self.pending(retry_failed=True))
+
+
+def resume_state(path, command, retry_failed=False):
+    """
+    Reads the state file PATH to run COMMAND again on the hosts of the run
+    that are pending, and reopens it to add their outcomes. Returns the
+    RunState and the (name, address) pairs of the hosts. Raises StateError if
+    the file can't be read or is of another command.
+    """
+    state = RunState(path).load()
+    state.check_command(command)
+    hosts = state.pending(retry_failed)
+    state.reopen()
+    return state, hosts
+
+
+def retry_message(state):
+    """
+    Returns how to retry the hosts of STATE that didn't succeed, or None.
+    """
+    count = state.failed_count()
+    if not count:
+        return None
+    return '{0} of {1} hosts didn\'t succeed; run them again with --retry-failed {2}'.format(
+        count, len(state.hosts), state.path)
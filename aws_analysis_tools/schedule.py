@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+"""
+The order krux-ec2-pssh2 runs the command on the hosts in.
+
+With fewer slots (--concurrency) than hosts, a run lasts until its last host
+is done. In name order, a few slow hosts that sort last start when the others
+are nearly done and keep the run going on their own; started first, they run
+alongside the fast ones. HostHistory keeps how long each host took in previous
+runs, and slowest_first() starts the hosts expected to take longest first,
+the longest-processing-time rule, whose runs are at most 4/3 as long as the
+shortest possible one.
+
+Commands differ in how long they take, so the history of a host is how long it
+took relative to the other hosts of the same run, the ratio of its duration to
+the median duration of the run, averaged over runs. Hosts that aren't in the
+history are expected to take as long as the median host.
+"""
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import json
+import os
+import tempfile
+import time
+from collections import OrderedDict
+
+
+# Values of the --order option of krux-ec2-pssh2
+SLOWEST = 'slowest'
+ZONE = 'zone'
+NAME = 'name'
+ORDERS = (SLOWEST, ZONE, NAME)
+
+DEFAULT_HISTORY_FILE = '~/.cache/aws-analysis-tools/pssh2-history.json'
+
+# Weight of the latest run in a host's average
+SMOOTHING = 0.5
+
+# Only the hosts run most recently are kept
+MAX_HOSTS = 20000
+
+_VERSION = 1
+
+
+def _median(values):
+    values = sorted(values)
+    if not values:
+        return None
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def _average(previous, value):
+    if previous is None:
+        return value
+    return SMOOTHING * value + (1 - SMOOTHING) * previous
+
+
+class HostHistory(object):
+    """
+    The relative duration and the connect time of every host run before.
+
+    The history file is a JSON object of host name to an entry with the
+    average relative duration ('relative'), the last duration in seconds
+    ('seconds'), the average seconds to connect when known ('connect'), the
+    number of runs and when the host was last run.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.hosts = {}
+
+    def load(self):
+        """
+        Reads the history file. A missing or unreadable file means no history.
+        """
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return self
+
+        if data.get('version') == _VERSION:
+            self.hosts = dict(
+                (host, entry) for host, entry in data.get('hosts', {}).items()
+                if isinstance(entry, dict)
+            )
+        return self
+
+    def save(self):
+        """
+        Atomically replaces the history file with the MAX_HOSTS hosts run most
+        recently.
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        if len(self.hosts) > MAX_HOSTS:
+            recent = sorted(self.hosts, key=lambda host: self.hosts[host].get('seen', 0))
+            for host in recent[:len(self.hosts) - MAX_HOSTS]:
+                del self.hosts[host]
+
+        data = {'version': _VERSION, 'hosts': self.hosts}
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.pssh2-history-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f, separators=(',', ':'), sort_keys=True)
+            os.rename(tmp_path, self.path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    def record_run(self, durations, connects=None, now=None):
+        """
+        Adds a run, whose hosts took DURATIONS, a dict of host to seconds, and
+        took CONNECTS, a dict of host to seconds, to connect.
+        """
+        now = int(time.time() if now is None else now)
+        median = _median(durations.values())
+        connects = connects or {}
+
+        for host in set(durations).union(connects):
+            entry = self.hosts.setdefault(host, {'runs': 0})
+            entry['runs'] += 1
+            entry['seen'] = now
+            if host in durations:
+                entry['seconds'] = round(durations[host], 3)
+                if median:
+                    entry['relative'] = round(
+                        _average(entry.get('relative'), durations[host] / median), 4)
+            if host in connects:
+                entry['connect'] = round(_average(entry.get('connect'), connects[host]), 4)
+
+    def estimates(self, hosts):
+        """
+        Returns the relative durations of the HOSTS in the history, by host.
+        """
+        estimates = {}
+        for host in hosts:
+            relative = self.hosts.get(host, {}).get('relative')
+            if relative is not None:
+                estimates[host] = relative
+        return estimates
+
+
+def _name(host):
+    return host
+
+
+def slowest_first(hosts, estimates, key=_name):
+    """
+    Returns HOSTS ordered by their ESTIMATES, a dict of relative durations by
+    KEY(host), the longest first. Hosts without an estimate count as the
+    median of the others, and hosts with the same estimate keep their order.
+    """
+    default = _median(estimates.values())
+    if default is None:
+        return list(hosts)
+    return sorted(hosts, key=lambda host: -estimates.get(key(host), default))
+
+
+def spread_zones(hosts, estimates, zones, key=_name):
+    """
+    Returns HOSTS slowest first within each of their ZONES, a dict of
+    availability zone by KEY(host), interleaved in proportion to the number of
+    hosts of each zone, so the hosts running at once are spread over the zones
+    like all the hosts are, until the end of the run. Hosts without a zone are
+    a zone together.
+    """
+    by_zone = OrderedDict()
+    for position, host in enumerate(slowest_first(hosts, estimates, key)):
+        by_zone.setdefault(zones.get(key(host)), []).append((position, host))
+
+    # The Nth of a zone's hosts goes as far into the run as N is into the zone;
+    # ties go the slower host's way
+    placed = []
+    for queue in by_zone.values():
+        for index, (position, host) in enumerate(queue):
+            placed.append(((index + 0.5) / len(queue), position, host))
+    return [host for _, _, host in sorted(placed, key=lambda entry: entry[:2])]
+
+
+def order_hosts(hosts, order, estimates, zones=None, key=_name):
+    """
+    Returns HOSTS in ORDER, one of ORDERS. NAME keeps them as they are.
+    """
+    if order == SLOWEST:
+        return slowest_first(hosts, estimates, key)
+    if order == ZONE:
+        return spread_zones(hosts, estimates, zones or {}, key)
+    return list(hosts)
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+"""
+Searching EC2 instances by tag, across regions.
+
+The search terms are those of krux-search-ec2-tags: "tag:value" matches the
+tag's value, a bare "value" matches any tag's value, and both match
+substrings. Every instance of every matching reservation is returned as an
+InstanceRecord, once, and callers can project the records onto the fields
+they need, including individual tags as "tag:<key>".
+"""
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import logging
+from collections import OrderedDict
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.inventory import lookup_instances
+from aws_analysis_tools.records import InstanceRecord
+from aws_analysis_tools.regions import (
+    get_region_names, parse_region_names, connect_ec2, iter_regions,
+    DEFAULT_CONCURRENCY, DEFAULT_TIMEOUT, POLL_INTERVAL,
+)
+from aws_analysis_tools.throttle import throttled_call
+
+
+# Fields that can be projected, besides "tag:<key>"
+FIELDS = InstanceRecord.FIELDS
+
+TAG_FIELD_PREFIX = 'tag:'
+
+
+def build_filters(query_terms):
+    """
+    Returns the DescribeInstances filters for QUERY_TERMS, as returned by
+    search_ec2_tags.parse_query().
+    """
+    query = {}
+
+    ### Populate query dictionary to send to AWS
+    for search_param in query_terms:
+        ### Splits the query at : if it's a tag:value search parameter and adds
+        ### those to the query dictionary (or appends the value to an existing
+        ### tag), otherwise it creates a key of tag-value (if it doesn't already
+        ### exist) with the search term as the value and performs a value only
+        ### search.
+        ###
+        ### Examples:
+        ###     Name:period searches for tag Name and value *period*
+        ###     s_periodic searches for value matching *s_periodic*.
+        ###     Name:period*,Name:webapp* searches for tag Name with values
+        ###         *period* and *webapp* as an OR search.
+
+        ### Check to see if we're searching for an s_class where the split
+        ### would cause a problem
+        if search_param.startswith('s_') and not search_param.startswith('s_classes'):
+            search_term = [search_param]
+        else:
+            search_term = search_param.split(':',1)
+
+        ### If the query contains just a value, like with a query for s_periodic,
+        ### add it to the value search, len(search_term) will be 1 and gets added
+        ### to tag value.  We always search to ensure that the key for the dictionary
+        ### hasn't already been made before adding it, otherwise, we append the
+        ### value to the already existing key.  This goes for a tag:value query
+        ### as well.
+        if len(search_term) == 1:
+            if "tag-value" not in query:
+                query.update({"tag-value": ['*' + search_term[0] + '*']})
+            else:
+                query["tag-value"] = query.get('tag-value') + ['*' + search_term[0] + '*']
+
+        ### But, if the query is in tag:value format (like s_classes:s_periodic),
+        ### len(search_term) will be 2, and if the query was s_classes:s_periodic,
+        ### search_term would be [ 's_classes', 's_periodic' ], so we assign
+        ### search_term[0] to the tag variable, and search_term[1] to the val
+        ### variable.
+        else:
+            tag, val = search_term
+            if 'tag:%s' % tag not in query:
+                query.update({"tag:%s" % tag: ['*' + val + '*']})
+            else:
+                query["tag:%s" % tag] = query.get("tag:%s" % tag) + ['*' + val + '*']
+
+    return query
+
+
+def parse_fields(value):
+    """
+    Parses a comma separated list of fields, e.g. "id,name,tag:cluster_name",
+    into a tuple. Raises ValueError for unknown fields.
+    """
+    fields = tuple(f.strip() for f in value.split(',') if f.strip())
+    if not fields:
+        raise ValueError('No fields given')
+    for field in fields:
+        if field not in FIELDS and not (field.startswith(TAG_FIELD_PREFIX) and
+                                        len(field) > len(TAG_FIELD_PREFIX)):
+            raise ValueError('Unknown field {0!r}; use one of {1} or tag:<key>'.format(
+                field, ', '.join(FIELDS)))
+    return fields
+
+
+def get_tag_keys(fields):
+    """
+    Returns the tag keys FIELDS need, or None if all tags are needed.
+    """
+    if fields is None:
+        return None
+    keys = set(f[len(TAG_FIELD_PREFIX):] for f in fields if f.startswith(TAG_FIELD_PREFIX))
+    if 'name' in fields:
+        keys.add('Name')
+    return frozenset(keys)
+
+
+def project(record, fields):
+    """
+    Returns the FIELDS of RECORD as an OrderedDict.
+    """
+    return OrderedDict(
+        (field, record.tag(field[len(TAG_FIELD_PREFIX):])
+         if field.startswith(TAG_FIELD_PREFIX) else getattr(record, field))
+        for field in fields
+    )
+
+
+def iter_search_instances(query_terms, passed_regions=None, log=None,
+                          concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT,
+                          poll_interval=POLL_INTERVAL, idle=None, fields=None):
+    """
+    Searches all regions, or those in PASSED_REGIONS, in parallel for
+    instances matching QUERY_TERMS and yields an InstanceRecord for each, as
+    soon as its region has been searched. Each instance is yielded once. If
+    FIELDS is given, the records only keep the tags those fields need.
+
+    A region that fails is logged to LOG and skipped. IDLE is passed to
+    iter_regions(). When the inventory daemon is running and holds the regions,
+    it answers instead, and EC2 isn't queried at all.
+    """
+    if log is None:
+        log = logging.getLogger(__name__)
+
+    query = build_filters(query_terms)
+    tag_keys = get_tag_keys(fields)
+
+    ### Answer from the inventory daemon's memory when it is running
+    records = lookup_instances(query, regions=parse_region_names(passed_regions),
+                               tag_keys=tag_keys, log=log)
+    if records is not None:
+        for record in _unique(records):
+            yield record
+        return
+
+    ### GovCloud and China are skipped by get_region_names() to improve search
+    ### speed since we don't have access to them.
+    region_names = get_region_names(include=parse_region_names(passed_regions))
+
+    def _search_region(region_name):
+        ec2 = connect_ec2(region_name)
+        reservations = throttled_call(
+            region_name, 'DescribeInstances', ec2.get_all_instances, filters=query
+        )
+        return [
+            InstanceRecord.from_boto(instance, region=region_name, tag_keys=tag_keys)
+            for reservation in reservations
+            for instance in reservation.instances
+        ]
+
+    seen = set()
+    for result in iter_regions(
+        _search_region, region_names, concurrency=concurrency, timeout=timeout,
+        poll_interval=poll_interval, idle=idle,
+    ):
+        if result.error is not None:
+            log.error('Unable to query region %s due to %r', result.region, result.error)
+            continue
+        for record in _unique(result.value, seen):
+            yield record
+
+
+def _unique(records, seen=None):
+    """
+    Yields the RECORDS whose ids aren't in SEEN, and adds them to it.
+    """
+    seen = set() if seen is None else seen
+    for record in records:
+        if record.id not in seen:
+            seen.add(record.id)
+            yield record
+
+
+def search_instances(query_terms, passed_regions=None, log=None,
+                     concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT, fields=None):
+    """
+    Like iter_search_instances(), but returns all records sorted by name and id.
+    """
+    return sorted(
+        iter_search_instances(query_terms, passed_regions=passed_regions, log=log,
+                              concurrency=concurrency, timeout=timeout, fields=fields),
+        key=lambda record: (record.name or '', record.id),
+    )
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+"""
+SSH helpers shared by the pssh tools.
+
+run_command() runs a command on a host like SSHHost.run(), or with a
+timeout. Killing ssh doesn't stop a command running without a tty on the
+remote host, so a command run with a timeout is wrapped by watchdog_command():
+it runs in a process group of its own, and a watcher killing that group when
+its stdin, which ssh keeps open, reaches EOF, which happens when the
+connection closes.
+"""
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import time
+import traceback
+
+#
+# Third party libraries
+#
+
+from reversefold.util import multiproc
+from reversefold.util import ssh
+
+
+# Values of the --address option of the pssh tools
+ADDRESS_TYPES = ('name', 'private', 'public')
+
+# Outcomes of running a command on a host
+OK = 'ok'
+FAILED = 'failed'
+TIMED_OUT = 'timed out'
+SKIPPED = 'skipped'
+OUTCOMES = (OK, FAILED, TIMED_OUT, SKIPPED)
+
+# Seconds between asking ssh, or the remote command, to terminate and killing it
+KILL_GRACE = 5
+
+# Seconds between checks of whether ssh exited
+POLL_INTERVAL = 0.05
+
+# Run by bash on the remote host. Its own stderr goes to /dev/null so job
+# control doesn't report on the jobs; the command's goes to fd 3. The
+# command reads an empty pipe, as when SSHHost closes the stdin of ssh.
+_WATCHDOG = (
+    'exec 3>&2 2>/dev/null; set -m; '
+    "/bin/bash -c '{command}' < <(:) 2>&3 & pid=$!; "
+    '( cat; kill -TERM -- -$pid; sleep {grace}; kill -KILL -- -$pid ) >/dev/null & watcher=$!; '
+    'wait $pid; rc=$?; kill -- -$watcher; exit $rc'
+)
+
+
+class AddressedSSHHost(ssh.SSHHost):
+    """
+    An SSHHost that connects to ADDRESS, usually an IP address from the search
+    results, while its output is still prefixed with HOST, the instance's
+    Name. Connecting by address saves a DNS lookup per host and works for
+    hosts whose Name doesn't resolve. The last ssh process started is kept as
+    PROCESS, for its exit status. Lines go to OUTPUT, e.g. a CoalescingWriter
+    shared by all hosts, when given, instead of straight to stdout.
+    """
+
+    def __init__(self, host, address=None, output=None, **kwargs):
+        super(AddressedSSHHost, self).__init__(host, **kwargs)
+        self.address = address or host
+        self.process = None
+        self.output = output
+
+    def puts(self, line=None):
+        if self.output is None:
+            return super(AddressedSSHHost, self).puts(line)
+        if line is None:
+            line = ''
+        elif not isinstance(line, str):
+            line = line.decode('utf-8', 'backslashreplace')
+        if not line.endswith('\n'):
+            line += '\n'
+        self.output.write('%s %s' % (self.full_prefix, line))
+
+    def _start(self, *args, **kwargs):
+        self.process = super(AddressedSSHHost, self)._start(*args, **kwargs)
+        return self.process
+
+    def _get_ssh_cmd(self, force_tty=False):
+        sshcmd = super(AddressedSSHHost, self)._get_ssh_cmd(force_tty)
+        # SSHHost puts the host last
+        sshcmd[-1] = str(self.address)
+        alias = host_key_alias(self.host, self.address)
+        if alias is not None:
+            # Keep known_hosts entries under the Name, as when connecting by name
+            sshcmd[-1:-1] = ['-o', 'HostKeyAlias=%s' % (alias,)]
+        return sshcmd
+
+
+def host_key_alias(label, address):
+    """
+    Returns the name to keep the host key of LABEL, reached at ADDRESS, under
+    in known_hosts, or None to keep it under the address. A host labelled
+    "name (address)" by host_pairs() shares its Name with another instance,
+    whose host key is not its own.
+    """
+    if address == label or label.endswith(' (%s)' % (address,)):
+        return None
+    return label
+
+
+def host_pairs(results, address='name'):
+    """
+    Yields the (label, address) pairs of the hosts to connect to for search
+    RESULTS: names, or with an ADDRESS of 'private' or 'public', (name, IP
+    address) tuples. Each address is yielded once. Hosts without the address
+    asked for are reached by name, and hosts without a name are labelled by
+    address. Instances of an auto scaling group share their Name, so a host
+    named as one before it is labelled "name (address)".
+    """
+    addresses = set()
+    labels = set()
+    for result in results:
+        name, host_address = (result, result) if address == 'name' else result
+        host_address = host_address or name
+        if not host_address or host_address in addresses:
+            continue
+        addresses.add(host_address)
+        label = name or host_address
+        if label in labels:
+            label = '%s (%s)' % (label, host_address)
+        labels.add(label)
+        yield label, host_address
+
+
+def watchdog_command(command, grace=KILL_GRACE):
+    """
+    Returns COMMAND wrapped so that it and its children are terminated, then
+    killed after GRACE seconds, when the standard input of the wrapper closes.
+    COMMAND is run by bash as by SSHHost.run(), with a stdin at EOF.
+    """
+    return _WATCHDOG.format(command=ssh.escape_single_quotes(command), grace=grace)
+
+
+def wait_process(proc, timeout, sleep=time.sleep, poll_interval=POLL_INTERVAL):
+    """
+    Waits up to TIMEOUT seconds for process PROC to exit, calling SLEEP
+    between checks. Returns whether it did.
+    """
+    expires_at = time.time() + timeout
+    while proc.poll() is None:
+        remaining = expires_at - time.time()
+        if remaining <= 0:
+            return False
+        sleep(min(poll_interval, remaining))
+    return True
+
+
+def run_command(host, command, timeout=None, sleep=time.sleep, grace=KILL_GRACE):
+    """
+    Runs COMMAND on SSHHost HOST, printing its output, and returns OK, FAILED
+    or TIMED_OUT. A command still running after TIMEOUT seconds is
+    terminated on the remote host, then killed after GRACE seconds; green
+    threads pass eventlet.sleep as SLEEP.
+    """
+    if timeout is None:
+        try:
+            host.run(command)
+        except ssh.SSHException:
+            traceback.print_exc()
+            return FAILED
+        return OK
+
+    proc, threads, _, _ = host.start(watchdog_command(command, grace), close_stdin=False)
+    outcome = None
+    if not wait_process(proc, timeout, sleep=sleep):
+        outcome = TIMED_OUT
+        # ssh passes the EOF on, for the watchdog to stop the command; ssh is
+        # only stopped itself if it doesn't exit once the command did
+        proc.stdin.close()
+        if not wait_process(proc, grace + 1, sleep=sleep):
+            proc.terminate()
+            if not wait_process(proc, grace, sleep=sleep):
+                proc.kill()
+    # Waits for the output to be printed and closes the pipes
+    multiproc.terminate_subproc(proc, threads)
+
+    if outcome is None:
+        outcome = OK if proc.returncode == 0 else FAILED
+    return outcome
+
+
+class Deadline(object):
+    """
+    The time left to run a command on a host: at most TIMEOUT seconds, and
+    no later than DEADLINE seconds after the Deadline was made. Either can
+    be None for no limit.
+    """
+
+    def __init__(self, timeout=None, deadline=None):
+        self.timeout = timeout
+        self.expires_at = None if deadline is None else time.time() + deadline
+
+    def remaining(self):
+        """
+        Returns the seconds the next command can run for, 0 or less once the
+        deadline passed, or None for no limit.
+        """
+        if self.expires_at is None:
+            return self.timeout
+        left = self.expires_at - time.time()
+        return left if self.timeout is None else min(self.timeout, left)
+
+
+def format_summary(outcomes):
+    """
+    Returns the lines summing up OUTCOMES, a list of (host, outcome) tuples:
+    the count of each outcome, then the hosts of each but OK.
+    """
+    counts = dict((outcome, 0) for outcome in OUTCOMES)
+    for _, outcome in outcomes:
+        counts[outcome] += 1
+
+    lines = ['%d hosts: %s' % (len(outcomes), ', '.join(
+        '%d %s' % (counts[outcome], outcome) for outcome in OUTCOMES))]
+    for outcome in OUTCOMES[1:]:
+        hosts = [host for host, o in outcomes if o == outcome]
+        if hosts:
+            lines.append('%s%s: %s' % (outcome[0].upper(), outcome[1:], ', '.join(hosts)))
+    return lines
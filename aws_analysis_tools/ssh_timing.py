@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+"""
+Where the time of an ssh command goes, for the --timings option of
+krux-ec2-pssh2.
+
+A TimedSSHHost runs ssh at log level DEBUG1, as -v does, and timestamps the
+log lines marking the end of each phase as they come in, instead of printing
+them:
+
+- dns      until "Connecting to", once the host is resolved (this includes
+           starting ssh, a few milliseconds)
+- connect  until "Connection established", the TCP connection
+- auth     until "Authenticated to" ("Authentication succeeded" before
+           OpenSSH 8): the protocol and key exchange and the authentication
+- command  until ssh exits: opening the session and running the command
+
+A phase whose end never came, such as the auth of a host that refused the
+connection, isn't known. Lines of ssh's own log are recognized by how they
+start, so a command printing lines starting like them on stderr would lose
+them.
+"""
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import, division
+import bisect
+import json
+import re
+import time
+from collections import OrderedDict, namedtuple
+
+#
+# Third party libraries
+#
+
+from reversefold.util import multiproc
+from texttable import Texttable
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.ssh import AddressedSSHHost
+from aws_analysis_tools.tracing import _percentile
+
+
+PHASES = ('dns', 'connect', 'auth', 'command', 'total')
+
+PERCENTILES = (0.5, 0.9, 0.99)
+
+# ssh's log level with the lines the phases end on
+LOG_LEVEL = 'DEBUG1'
+
+# Lines of ssh's log, some of which end a phase
+_LOG_LINE_RE = re.compile(
+    r'^(?:debug\d: |Authenticated to |Transferred: sent |Bytes per second: |'
+    r'Warning: Permanently added )'
+)
+_MARKS = (
+    ('resolved', re.compile(r'^debug1: Connecting to ')),
+    ('connected', re.compile(r'^debug1: Connection established')),
+    ('authenticated', re.compile(r'^(?:Authenticated to |debug1: Authentication succeeded)')),
+)
+
+# Prefixes multiproc gives the lines of stderr
+_ERR_PREFIXES = (multiproc.DEFAULT_ERR_PREFIX, multiproc.DEFAULT_ERR_PREFIX_PLAIN)
+
+# Bounds of the histogram buckets double from this many seconds
+HISTOGRAM_START = 0.1
+HISTOGRAM_WIDTH = 40
+
+# The phases of running the command on a host; PHASES is a dict of seconds,
+# None for the phases that aren't known
+HostTiming = namedtuple('HostTiming', ['host', 'outcome', 'phases'])
+
+
+class PhaseTimer(object):
+    """
+    The time each phase of one ssh command ended, from ssh's log lines.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.start = clock()
+        self.end = None
+        self.marks = {}
+
+    def observe(self, line):
+        """
+        Notes the time if LINE, of ssh's stderr, ends a phase. Returns whether
+        it is a line of ssh's own log, which isn't output of the command.
+        """
+        if not _LOG_LINE_RE.match(line):
+            return False
+        for mark, pattern in _MARKS:
+            if mark not in self.marks and pattern.match(line):
+                self.marks[mark] = self.clock()
+        return True
+
+    def finish(self):
+        self.end = self.clock()
+
+    def phases(self):
+        """
+        Returns the seconds of each of PHASES, or None for those not known.
+        """
+        times = [self.start] + [self.marks.get(mark) for mark, _ in _MARKS] + [self.end]
+        phases = OrderedDict()
+        for index, phase in enumerate(PHASES[:-1]):
+            begin, end = times[index], times[index + 1]
+            phases[phase] = None if begin is None or end is None else end - begin
+        phases['total'] = None if self.end is None else self.end - self.start
+        return phases
+
+    def connect_time(self):
+        """
+        Returns the seconds until the host was authenticated, or None.
+        """
+        if 'authenticated' not in self.marks:
+            return None
+        return self.marks['authenticated'] - self.start
+
+
+class TimedSSHHost(AddressedSSHHost):
+    """
+    An AddressedSSHHost running ssh verbosely, whose log lines go to TIMER
+    instead of the output.
+    """
+
+    def __init__(self, host, address=None, timer=None, **kwargs):
+        kwargs.update(quiet=False, ssh_log_level=LOG_LEVEL)
+        super(TimedSSHHost, self).__init__(host, address, **kwargs)
+        self.timer = timer
+
+    def puts(self, line=None):
+        if isinstance(line, str):
+            for prefix in _ERR_PREFIXES:
+                if line.startswith(prefix):
+                    text = line[len(prefix):]
+                    if text.endswith(multiproc.DEFAULT_ERR_POSTFIX):
+                        text = text[:len(text) - len(multiproc.DEFAULT_ERR_POSTFIX)]
+                    if self.timer.observe(text):
+                        return
+                    break
+        super(TimedSSHHost, self).puts(line)
+
+
+def _known(timings, phase):
+    return sorted(t.phases[phase] for t in timings if t.phases.get(phase) is not None)
+
+
+def histogram(values, start=HISTOGRAM_START, width=HISTOGRAM_WIDTH):
+    """
+    Returns the lines of a histogram of VALUES, in seconds, in buckets whose
+    upper bounds double from START.
+    """
+    if not values:
+        return []
+    bounds = [start]
+    while bounds[-1] < max(values):
+        bounds.append(bounds[-1] * 2)
+    counts = [0] * len(bounds)
+    for value in values:
+        counts[bisect.bisect_left(bounds, value)] += 1
+
+    most = max(counts)
+    return [
+        '<= {0:>8.2f}s |{1:<{width}}| {2}'.format(
+            bound, '#' * (int(round(count * width / most)) or (1 if count else 0)), count,
+            width=width)
+        for bound, count in zip(bounds, counts)
+    ]
+
+
+def render_timings(timings, slowest=10):
+    """
+    Returns the report of TIMINGS, a list of HostTimings: the count,
+    PERCENTILES and maximum of each phase, a histogram of the total time, and
+    the SLOWEST hosts.
+    """
+    table = Texttable(max_width=0)
+    table.set_deco(Texttable.HEADER)
+    table.set_cols_dtype(['t', 'i', 'f', 'f', 'f', 'f'])
+    table.set_cols_align(['l', 'r', 'r', 'r', 'r', 'r'])
+    table.set_precision(3)
+    table.header(['phase', 'hosts'] + ['p%d' % round(p * 100) for p in PERCENTILES] + ['max'])
+    for phase in PHASES:
+        ordered = _known(timings, phase)
+        if ordered:
+            table.add_row([phase, len(ordered)] +
+                          [_percentile(ordered, p) for p in PERCENTILES] + [ordered[-1]])
+    lines = [table.draw(), '', 'total seconds per host:']
+    lines.extend(histogram(_known(timings, 'total')))
+
+    hosts = sorted((t for t in timings if t.phases.get('total') is not None),
+                   key=lambda t: -t.phases['total'])[:slowest]
+    if hosts:
+        table = Texttable(max_width=0)
+        table.set_deco(Texttable.HEADER)
+        table.set_cols_dtype(['t', 't'] + ['t'] * len(PHASES))
+        table.set_cols_align(['l', 'l'] + ['r'] * len(PHASES))
+        table.header(['host', 'outcome'] + list(PHASES))
+        for t in hosts:
+            table.add_row([t.host, t.outcome] + [
+                '-' if t.phases.get(phase) is None else '%.3f' % t.phases[phase]
+                for phase in PHASES
+            ])
+        lines.extend(['', 'slowest hosts:', table.draw()])
+    return '\n'.join(lines)
+
+
+def write_timings(path, timings):
+    """
+    Writes TIMINGS to PATH as JSON lines, one object per host with its
+    outcome and the seconds of each phase, null when not known.
+    """
+    with open(path, 'w') as f:
+        for t in timings:
+            record = OrderedDict([('host', t.host), ('outcome', t.outcome)])
+            record.update((phase, None if t.phases.get(phase) is None
+                           else round(t.phases[phase], 4)) for phase in PHASES)
+            f.write(json.dumps(record) + '\n')
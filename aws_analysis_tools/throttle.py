@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+"""
+Client side rate governor for the EC2 API calls made by the CLIs.
+
+Every call goes through RateGovernor.call(), which takes a token from a bucket
+kept per (region, API action) before calling the API. The bucket's rate is
+adjusted AIMD-style: it grows slowly while calls succeed and is halved when
+AWS throttles us. Throttled and transient server errors, and failed
+connections, are retried with exponential backoff and full jitter. The
+connections and clients the governor calls are made without the retries of
+boto and botocore (see without_sdk_retries()), which would otherwise retry
+every attempt again, without slowing the bucket down. Calls, throttles and
+retries are counted per (region, action), and optionally sent to a krux stats
+client, so the concurrency defaults can be tuned from real numbers. Each
+attempt is also traced as an 'api' span, and time spent waiting for a token as
+'api.wait'.
+"""
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import logging
+import random
+import socket
+import threading
+import time
+from collections import defaultdict
+
+try:
+    import http.client as http_client
+except ImportError:  # pragma: no cover
+    import httplib as http_client
+
+#
+# Third party libraries
+#
+
+try:
+    from botocore.config import Config
+    from botocore.exceptions import ConnectionError as BotocoreConnectionError
+except ImportError:  # pragma: no cover
+    Config = BotocoreConnectionError = None
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.tracing import get_tracer
+
+
+# Error codes AWS uses to tell a client to slow down
+THROTTLE_CODES = frozenset([
+    'RequestLimitExceeded',
+    'Throttling',
+    'ThrottlingException',
+    'RequestThrottled',
+    'TooManyRequestsException',
+    'SlowDown',
+])
+
+# Error codes of transient server side failures, worth another try
+TRANSIENT_CODES = frozenset([
+    'InternalError',
+    'InternalFailure',
+    'ServiceUnavailable',
+    'Unavailable',
+])
+
+DEFAULT_RATE = 10.0       # calls per second per region and action
+DEFAULT_BURST = 20
+DEFAULT_MIN_RATE = 0.5
+DEFAULT_MAX_RATE = 50.0
+DEFAULT_INCREASE = 0.2    # added to the rate after every successful call
+DEFAULT_DECREASE = 0.5    # the rate is multiplied by this when throttled
+DEFAULT_MAX_RETRIES = 6
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 20.0
+
+
+def get_error_code(error):
+    """
+    Returns the AWS error code of a boto or botocore exception, or None.
+    """
+    code = getattr(error, 'error_code', None)
+    if code:
+        return code
+
+    response = getattr(error, 'response', None)
+    if isinstance(response, dict):
+        return response.get('Error', {}).get('Code')
+    return None
+
+
+def get_http_status(error):
+    status = getattr(error, 'status', None)
+    if isinstance(status, int):
+        return status
+
+    response = getattr(error, 'response', None)
+    if isinstance(response, dict):
+        return response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+    return None
+
+
+def is_throttle_error(error):
+    return get_error_code(error) in THROTTLE_CODES
+
+
+def is_connection_error(error):
+    if isinstance(error, (socket.error, http_client.HTTPException)):
+        return True
+    return BotocoreConnectionError is not None and isinstance(error, BotocoreConnectionError)
+
+
+def is_retryable_error(error):
+    if is_throttle_error(error) or get_error_code(error) in TRANSIENT_CODES:
+        return True
+    if is_connection_error(error):
+        return True
+    status = get_http_status(error)
+    return status is not None and status >= 500
+
+
+def without_sdk_retries(connection):
+    """
+    Returns the boto (2) CONNECTION, set not to retry failed requests itself,
+    as the governor does.
+    """
+    connection.num_retries = 0
+    return connection
+
+
+def sdk_client_config():
+    """
+    Returns the botocore Config of the boto3 clients the governor calls, which
+    don't retry failed requests themselves.
+    """
+    return Config(retries={'max_attempts': 0})
+
+
+class TokenBucket(object):
+    """
+    Thread safe token bucket whose rate can be changed while in use.
+
+    acquire() reserves a token right away and sleeps outside the lock until
+    the token is due, so waiting callers are served in order.
+    """
+
+    def __init__(self, rate, burst, clock=time.time, sleep=time.sleep):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self._clock = clock
+        self._sleep = sleep
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self):
+        """
+        Takes a token, waiting for it if needed. Returns the time waited.
+        """
+        with self._lock:
+            self._refill(self._clock())
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill(self._clock())
+            self.rate = float(rate)
+
+    def drain(self):
+        """
+        Drops the tokens saved up, so a burst doesn't follow a throttle.
+        """
+        with self._lock:
+            self._refill(self._clock())
+            self.tokens = min(self.tokens, 0.0)
+
+
+class RateGovernor(object):
+    """
+    Rate limits, retries and counts API calls per (region, action).
+    """
+
+    def __init__(
+        self,
+        rate=DEFAULT_RATE,
+        burst=DEFAULT_BURST,
+        min_rate=DEFAULT_MIN_RATE,
+        max_rate=DEFAULT_MAX_RATE,
+        increase=DEFAULT_INCREASE,
+        decrease=DEFAULT_DECREASE,
+        max_retries=DEFAULT_MAX_RETRIES,
+        base_delay=DEFAULT_BASE_DELAY,
+        max_delay=DEFAULT_MAX_DELAY,
+        stats=None,
+        log=None,
+        sleep=time.sleep,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = stats
+        self.log = log or logging.getLogger(__name__)
+        self._sleep = sleep
+
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.counters = defaultdict(lambda: defaultdict(int))
+
+    def bucket(self, region, action):
+        key = (region, action)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, sleep=self._sleep)
+            return bucket
+
+    def _count(self, region, action, counter):
+        with self._lock:
+            self.counters[(region, action)][counter] += 1
+        if self.stats is not None:
+            self.stats.incr('ec2.{0}.{1}'.format(action, counter))
+
+    def backoff(self, attempt):
+        """
+        Returns the delay before retry number ATTEMPT (0 based), using
+        exponential backoff with full jitter.
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def call(self, region, action, func, *args, **kwargs):
+        """
+        Calls FUNC(*ARGS, **KWARGS) as the API ACTION in REGION, within the
+        rate allowed for them. Throttling and transient errors are retried up
+        to max_retries times; any other error, or the last one, is raised.
+        """
+        bucket = self.bucket(region, action)
+        tracer = get_tracer()
+        attempt = 0
+
+        while True:
+            waited = bucket.acquire()
+            if waited:
+                tracer.record('api.wait', waited, region=region, action=action)
+            self._count(region, action, 'calls')
+            try:
+                with tracer.span('api', region=region, action=action):
+                    result = func(*args, **kwargs)
+            except Exception as e:
+                if not is_retryable_error(e):
+                    raise
+
+                if is_throttle_error(e):
+                    self._count(region, action, 'throttles')
+                    bucket.set_rate(max(self.min_rate, bucket.rate * self.decrease))
+                    bucket.drain()
+
+                if attempt >= self.max_retries:
+                    self._count(region, action, 'failures')
+                    raise
+
+                delay = self.backoff(attempt)
+                self._count(region, action, 'retries')
+                self.log.debug(
+                    '%s in %s failed with %s, retrying in %.2fs (attempt %d of %d)',
+                    action, region, get_error_code(e) or get_http_status(e), delay,
+                    attempt + 1, self.max_retries,
+                )
+                self._sleep(delay)
+                attempt += 1
+            else:
+                if bucket.rate < self.max_rate:
+                    bucket.set_rate(min(self.max_rate, bucket.rate + self.increase))
+                return result
+
+    def summary(self):
+        """
+        Returns a list of (region, action, counters, current rate) tuples,
+        sorted by region and action.
+        """
+        with self._lock:
+            rows = [
+                (region, action, dict(counters), self._buckets[(region, action)].rate)
+                for (region, action), counters in self.counters.items()
+            ]
+        return sorted(rows, key=lambda row: row[:2])
+
+    def log_summary(self, log=None, level=logging.DEBUG):
+        log = log or self.log
+        for region, action, counters, rate in self.summary():
+            log.log(
+                level, 'API %s in %s: %d calls, %d throttles, %d retries, rate now %.1f/s',
+                action, region, counters.get('calls', 0), counters.get('throttles', 0),
+                counters.get('retries', 0), rate,
+            )
+
+
+# The governor shared by everything running in this process
+_governor = RateGovernor()
+
+
+def get_governor():
+    """
+    Returns the process wide RateGovernor.
+    """
+    return _governor
+
+
+def configure_governor(args=None, stats=None, log=None):
+    """
+    Applies the options added by add_throttle_cli_arguments() and the
+    application's stats client and logger to the shared governor.
+    """
+    if args is not None:
+        _governor.rate = args.api_rate
+        _governor.burst = max(1, args.api_rate * 2)
+        _governor.max_retries = args.api_max_retries
+    if stats is not None:
+        _governor.stats = stats
+    if log is not None:
+        _governor.log = log
+    return _governor
+
+
+def throttled_call(region, action, func, *args, **kwargs):
+    """
+    Shortcut for get_governor().call(...).
+    """
+    return _governor.call(region, action, func, *args, **kwargs)
+
+
+def add_throttle_cli_arguments(group):
+    """
+    Adds the options controlling the API rate governor to an argparse GROUP.
+    """
+    group.add_argument(
+        '--api-rate',
+        type=float,
+        default=DEFAULT_RATE,
+        help="Initial number of API calls per second per region and action. The rate adapts "
+        "to throttling. (default: %(default)s)",
+    )
+
+    group.add_argument(
+        '--api-max-retries',
+        type=int,
+        default=DEFAULT_MAX_RETRIES,
+        help="Number of times a throttled API call is retried. (default: %(default)s)",
+    )
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+"""
+Timed spans for the API calls and pipeline stages of the CLIs.
+
+Code wraps the work it wants to account for in span(NAME, region, action):
+every EC2 call made through the rate governor is an 'api' span tagged with
+its region and action, each region of a fan-out is a 'region' span, and the
+CLIs add 'fetch', 'filter' and 'render' spans around their stages. Spans are
+only kept while tracing is enabled (by --profile), so they cost next to
+nothing otherwise. The durations are aggregated per (name, region, action)
+and can also be sent to a krux stats client as timings.
+"""
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import cProfile
+import logging
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+#
+# Third party libraries
+#
+
+from texttable import Texttable
+
+
+class _Span(object):
+    """
+    Context manager timing one span for a Tracer.
+    """
+    __slots__ = ('tracer', 'name', 'region', 'action', 'start')
+
+    def __init__(self, tracer, name, region, action):
+        self.tracer = tracer
+        self.name = name
+        self.region = region
+        self.action = action
+        self.start = None
+
+    def __enter__(self):
+        self.start = self.tracer.clock()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.tracer.record(
+            self.name, self.tracer.clock() - self.start, region=self.region, action=self.action,
+            error=exc_type is not None,
+        )
+        return False
+
+
+class _NullSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class Tracer(object):
+    """
+    Collects span durations per (name, region, action).
+    """
+
+    def __init__(self, enabled=False, stats=None, clock=time.time):
+        self.enabled = enabled
+        self.stats = stats
+        self.clock = clock
+        self._durations = defaultdict(list)
+        self._errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def span(self, name, region=None, action=None):
+        """
+        Returns a context manager that times its block as a span.
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, region, action)
+
+    def record(self, name, duration, region=None, action=None, error=False):
+        """
+        Records a span of DURATION seconds that was timed elsewhere.
+        """
+        if not self.enabled:
+            return
+        key = (name, region, action)
+        with self._lock:
+            self._durations[key].append(duration)
+            if error:
+                self._errors[key] += 1
+        if self.stats is not None:
+            # No region in the metric name, to keep the number of metrics down
+            metric = 'trace.{0}'.format(name) if action is None else \
+                'trace.{0}.{1}'.format(name, action)
+            self.stats.timing(metric, int(duration * 1000))
+
+    def reset(self):
+        with self._lock:
+            self._durations.clear()
+            self._errors.clear()
+
+    def summary(self):
+        """
+        Returns a list of (name, region, action, count, errors, total, mean,
+        p95, max) tuples, with the largest total time first.
+        """
+        with self._lock:
+            items = [(key, sorted(durations), self._errors.get(key, 0))
+                     for key, durations in self._durations.items()]
+
+        rows = []
+        for (name, region, action), ordered, errors in items:
+            total = sum(ordered)
+            rows.append((name, region, action, len(ordered), errors, total,
+                         total / len(ordered), _percentile(ordered, 0.95), ordered[-1]))
+        return sorted(rows, key=lambda row: (-row[5], row[:3]))
+
+    def render_summary(self):
+        """
+        Returns the summary as a table, in seconds.
+        """
+        table = Texttable(max_width=0)
+        table.set_deco(Texttable.HEADER)
+        table.set_cols_dtype(['t', 't', 't', 'i', 'i', 'f', 'f', 'f', 'f'])
+        table.set_cols_align(['l', 'l', 'l', 'r', 'r', 'r', 'r', 'r', 'r'])
+        table.set_precision(4)
+        table.header(['span', 'region', 'action', 'count', 'errors', 'total', 'mean', 'p95', 'max'])
+        for row in self.summary():
+            # XXX EVERY column in this output had better have a non-zero length
+            # or texttable blows up with 'width must be greater than 0' error
+            table.add_row([value if value is not None else '-' for value in row])
+        return table.draw()
+
+
+# The tracer shared by everything running in this process
+_tracer = Tracer()
+
+
+def get_tracer():
+    """
+    Returns the process wide Tracer.
+    """
+    return _tracer
+
+
+def span(name, region=None, action=None):
+    """
+    Shortcut for get_tracer().span(...).
+    """
+    return _tracer.span(name, region=region, action=action)
+
+
+def configure_tracer(args=None, stats=None):
+    """
+    Applies the options added by add_profile_cli_arguments() to the shared
+    tracer. Tracing is enabled by --profile, --profile-output or
+    --profile-stats; the latter also sends the spans to STATS.
+    """
+    if args is not None:
+        send_stats = getattr(args, 'profile_stats', False)
+        _tracer.enabled = bool(
+            getattr(args, 'profile', False) or getattr(args, 'profile_output', None) or send_stats
+        )
+        _tracer.stats = stats if send_stats else None
+    return _tracer
+
+
+@contextmanager
+def profiled(args, out=None, log=None):
+    """
+    Runs the block as the 'total' span. Afterwards, prints the span summary to
+    OUT (stderr by default) if --profile was given, and writes the cProfile
+    stats of the block to the --profile-output file, if any.
+    """
+    out = out or sys.stderr
+    path = getattr(args, 'profile_output', None)
+    profiler = cProfile.Profile() if path else None
+
+    if profiler is not None:
+        profiler.enable()
+    try:
+        with _tracer.span('total'):
+            yield _tracer
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(path)
+            (log or logging.getLogger(__name__)).info('Wrote cProfile stats to %s', path)
+        if getattr(args, 'profile', False) and _tracer.summary():
+            out.write(_tracer.render_summary() + '\n')
+
+
+def add_profile_cli_arguments(group):
+    """
+    Adds the options controlling tracing to an argparse GROUP.
+    """
+    group.add_argument(
+        '--profile',
+        action='store_true',
+        default=False,
+        help="Print the time spent per API call and stage to stderr when done.",
+    )
+
+    group.add_argument(
+        '--profile-output',
+        default=None,
+        help="Write cProfile stats of the run to this file, for pstats or snakeviz.",
+    )
+
+    group.add_argument(
+        '--profile-stats',
+        action='store_true',
+        default=False,
+        help="Send the time spent per API call and stage to the stats server.",
+    )
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+"""
+EBS waste analysis: how much provisioned storage is doing no work.
+
+A WasteReport is updated a page of volumes at a time and only keeps totals,
+so a region with any number of volumes is analysed in the memory of a page:
+
+- volumes that aren't attached to anything, by zone
+- provisioned GB by status and Name prefix
+- volumes attached to stopped instances, by zone
+
+Whether an instance is stopped is looked up with StoppedInstances, which asks
+for the instances of a page in batches of ids and remembers the answers, so
+each instance is looked up once however many volumes it has. When there turn
+out to be many, it lists the stopped instances of the region in one go.
+"""
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import operator
+import re
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.columnar import ColumnSpec, DICT, volume_columns, DEFAULT_TAGS
+
+
+# Why a volume is wasted
+UNATTACHED = 'unattached'
+STOPPED_INSTANCE = 'stopped-instance'
+
+# Volume status of a volume not attached to any instance
+AVAILABLE = 'available'
+
+# Instance states whose volumes count as wasted
+STOPPED_STATES = ('stopped', 'stopping')
+
+# Instance ids per DescribeInstances call; EC2 takes up to 200 filter values
+INSTANCE_ID_BATCH_SIZE = 200
+
+# Lookups by id before all stopped instances are listed instead
+MAX_INSTANCE_ID_BATCHES = 5
+
+# Name prefix of volumes without a Name
+NO_NAME = '(none)'
+
+# The prefix of a Name is what comes before its first digit or dot, e.g. the
+# prefix of web001.example.com-data is web
+_PREFIX_RE = re.compile(r'^[^0-9.]*')
+
+
+def name_prefix(name):
+    """
+    Returns the prefix NAME is grouped by.
+    """
+    if not name:
+        return NO_NAME
+    return _PREFIX_RE.match(name).group(0).rstrip('-_') or name
+
+
+class WasteReport(object):
+    """
+    Totals of the volumes added with update(). Each total is a [count, GB]
+    list.
+    """
+
+    def __init__(self):
+        self.total = [0, 0]
+        # Zone to total of the unattached volumes
+        self.unattached = {}
+        # (status, Name prefix) to total
+        self.by_status_prefix = {}
+        # Zone to total of the volumes attached to stopped instances
+        self.stopped = {}
+        # Ids of the stopped instances with volumes
+        self.stopped_instances = set()
+
+    @staticmethod
+    def _add(totals, key, count, size):
+        total = totals.get(key)
+        if total is None:
+            total = totals[key] = [0, 0]
+        total[0] += count
+        total[1] += size
+
+    def update(self, volumes, stopped=()):
+        """
+        Adds VOLUMES, given the container STOPPED of the ids of the stopped
+        instances. Returns a (volume, reason) tuple per wasted volume.
+        """
+        wasted = []
+        for v in volumes:
+            size = v.size or 0
+            self.total[0] += 1
+            self.total[1] += size
+            self._add(self.by_status_prefix, (v.status, name_prefix(v.name)), 1, size)
+
+            if v.status == AVAILABLE:
+                self._add(self.unattached, v.zone, 1, size)
+                wasted.append((v, UNATTACHED))
+            elif v.instance_id and v.instance_id in stopped:
+                self._add(self.stopped, v.zone, 1, size)
+                self.stopped_instances.add(v.instance_id)
+                wasted.append((v, STOPPED_INSTANCE))
+        return wasted
+
+    def merge(self, other):
+        """
+        Adds the totals of WasteReport OTHER, e.g. of another region.
+        """
+        self.total[0] += other.total[0]
+        self.total[1] += other.total[1]
+        for mine, theirs in ((self.unattached, other.unattached),
+                             (self.by_status_prefix, other.by_status_prefix),
+                             (self.stopped, other.stopped)):
+            for key, (count, size) in theirs.items():
+                self._add(mine, key, count, size)
+        self.stopped_instances.update(other.stopped_instances)
+        return self
+
+    @staticmethod
+    def _sum(totals):
+        return [sum(t[0] for t in totals.values()), sum(t[1] for t in totals.values())]
+
+    @property
+    def total_unattached(self):
+        return self._sum(self.unattached)
+
+    @property
+    def total_stopped(self):
+        return self._sum(self.stopped)
+
+
+def sorted_totals(totals, top=None):
+    """
+    Returns the (key, count, GB) tuples of TOTALS, the most GB first, and only
+    the first TOP if given.
+    """
+    rows = sorted(((key, count, size) for key, (count, size) in totals.items()),
+                  key=lambda row: (-row[2], -row[1], row[0]))
+    return rows if top is None else rows[:top]
+
+
+class StoppedInstances(object):
+    """
+    The stopped instances among the ids given to update(). Ids are looked up
+    once, BATCH_SIZE at a time, with LOOKUP(ids), which returns the ids of the
+    stopped ones. After MAX_BATCHES such lookups, LOOKUP(None) lists all the
+    stopped instances of the region at once instead, which takes fewer calls
+    than looking up most of its instances by id.
+    """
+
+    def __init__(self, lookup, batch_size=INSTANCE_ID_BATCH_SIZE,
+                 max_batches=MAX_INSTANCE_ID_BATCHES):
+        self.lookup = lookup
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.lookups = 0
+        self._all = False
+        self._checked = set()
+        self._stopped = set()
+
+    def update(self, instance_ids):
+        if self._all:
+            return
+        ids = sorted(set(instance_ids) - self._checked)
+        for start in range(0, len(ids), self.batch_size):
+            self.lookups += 1
+            if self.lookups > self.max_batches:
+                self._stopped = set(self.lookup(None))
+                self._all = True
+                self._checked = None
+                return
+            batch = ids[start:start + self.batch_size]
+            self._stopped.update(self.lookup(batch))
+            self._checked.update(batch)
+
+    def __contains__(self, instance_id):
+        return instance_id in self._stopped
+
+
+def waste_columns(tag_keys=DEFAULT_TAGS):
+    """
+    Returns the ColumnSpecs of an export of the (volume, reason) tuples
+    returned by WasteReport.update().
+    """
+    volume = operator.itemgetter(0)
+    return [ColumnSpec('waste', DICT, operator.itemgetter(1))] + [
+        ColumnSpec(spec.name, spec.kind, lambda row, getter=spec.getter: getter(volume(row)))
+        for spec in volume_columns(tag_keys)
+    ]
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+"""
+The --watch mode of krux-ec2-instances: the instances are fetched again every
+few seconds and only what changed is redrawn.
+
+Most refreshes don't fetch every instance matching the filters. During a
+deploy, what changes are the instances being launched, stopped or terminated,
+and those are in a transitional state for a while: a refresh between two full
+ones only fetches the instances in TRANSITIONAL_STATES, and the ones that
+were in one of them the last time, to see what they turned into. WatchState
+merges such partial results into the instances it holds and returns the
+Changes, so a refresh costs as many API calls as the filters and the number
+of instances changing state take, however many instances are watched.
+
+ScreenPainter redraws a terminal line by line, and only rewrites the lines
+that differ from what it drew before.
+"""
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.changes import record_changes
+
+
+# States instances pass through on their way to another one
+TRANSITIONAL_STATES = ('pending', 'stopping', 'shutting-down')
+
+# Full refreshes are made every this many refreshes
+DEFAULT_FULL_EVERY = 10
+
+# EC2 takes up to 200 values per filter; more instances changing state than
+# that are fetched with a full refresh
+MAX_POLLED_IDS = 200
+
+# ANSI escape sequences
+_HOME_AND_CLEAR = '\x1b[H\x1b[2J'
+_MOVE = '\x1b[{0};1H'
+_CLEAR_LINE = '\x1b[K'
+_CLEAR_BELOW = '\x1b[J'
+
+
+def _sort_key(record):
+    return (record.name or '', record.id)
+
+
+class WatchState(object):
+    """
+    The instances found by the last refresh, by id.
+    """
+
+    def __init__(self):
+        self.records = {}
+        self.refreshes = 0
+
+    def update(self, fetched, keep=None, full=True, polled_ids=()):
+        """
+        Updates the instances with the records FETCHED, of which only the ones
+        passing the function KEEP, if given, are kept, and returns the Changes.
+
+        With FULL, FETCHED are all the instances matching the filters. Without,
+        they are a part only: those fetched are updated, or removed if they
+        aren't kept anymore, and those of POLLED_IDS that weren't fetched are
+        removed, as they don't match the filters anymore.
+        """
+        old = self.records
+        self.refreshes += 1
+
+        if full:
+            self.records = dict((r.id, r) for r in fetched if keep is None or keep(r))
+            return record_changes(old, self.records)
+
+        new = dict(old)
+        seen = set()
+        for r in fetched:
+            seen.add(r.id)
+            if keep is None or keep(r):
+                new[r.id] = r
+            else:
+                new.pop(r.id, None)
+        for instance_id in polled_ids:
+            if instance_id not in seen:
+                new.pop(instance_id, None)
+
+        self.records = new
+        return record_changes(old, new, ids=seen.union(polled_ids))
+
+    def transitional_ids(self):
+        """
+        Returns the ids of the instances in TRANSITIONAL_STATES, sorted.
+        """
+        return sorted(r.id for r in self.records.values() if r.state in TRANSITIONAL_STATES)
+
+    def sorted_records(self):
+        """
+        Returns the instances by Name and id, so rows stay in place between
+        refreshes.
+        """
+        return sorted(self.records.values(), key=_sort_key)
+
+    def needs_full(self, full_every=DEFAULT_FULL_EVERY):
+        """
+        Returns whether the next refresh must fetch all instances.
+        """
+        return (self.refreshes % max(full_every, 1) == 0 or
+                len(self.transitional_ids()) > MAX_POLLED_IDS)
+
+
+class ScreenPainter(object):
+    """
+    Draws lists of lines on the terminal OUT, at most HEIGHT of them, by
+    rewriting only the lines that changed since the previous paint().
+    """
+
+    def __init__(self, out, height=None):
+        self.out = out
+        self.height = height
+        self.lines = None
+
+    def _fit(self, lines):
+        if self.height is None or len(lines) < self.height:
+            return list(lines)
+        # The last line of the screen is left for the cursor
+        shown = self.height - 2
+        return list(lines[:shown]) + ['... {0} more'.format(len(lines) - shown)]
+
+    def paint(self, lines):
+        """
+        Draws LINES and returns how many were rewritten.
+        """
+        lines = self._fit(lines)
+        parts = []
+        previous = self.lines
+        if previous is None:
+            parts.append(_HOME_AND_CLEAR)
+            previous = []
+
+        rewritten = 0
+        for index, line in enumerate(lines):
+            if index >= len(previous) or previous[index] != line:
+                parts.append(_MOVE.format(index + 1) + line + _CLEAR_LINE)
+                rewritten += 1
+        if len(lines) < len(previous):
+            parts.append(_MOVE.format(len(lines) + 1) + _CLEAR_BELOW)
+        parts.append(_MOVE.format(len(lines) + 1))
+
+        self.out.write(''.join(parts))
+        self.out.flush()
+        self.lines = lines
+        return rewritten
+
+
+def terminal_height(default=None):
+    """
+    Returns the number of lines of the terminal, or DEFAULT if unknown.
+    """
+    try:
+        import shutil
+        return shutil.get_terminal_size((0, 0)).lines or default
+    except AttributeError:
+        # Python 2
+        return default
@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+"""
+The --where expression language of krux-ec2-instances, e.g.
+
+    type = m4.* and zone in (us-east-1a, us-east-1b) and not tag:cluster_name ~ '^kafka'
+
+Comparisons are FIELD OP VALUE, where FIELD is one of FIELDS or tag:<key> and
+OP is one of:
+
+- =, ==, !=   equal, or matching VALUE as a glob if it has a '*' or '?'
+- in, not in  equal to or matching one of a parenthesized list of values
+- ~, !~       VALUE, a Python regex, matches somewhere in the field
+
+They are combined with and, or, not and parentheses. Values are quoted with
+' or " unless they are a single word; matching is case sensitive, like EC2
+filters. A missing field (an instance without the tag, say) matches nothing,
+and an instance is in a group if any of its groups matches.
+
+An expression is parsed once. push_down() hands the comparisons EC2 can
+evaluate itself over to an EC2 filter, so fewer instances are fetched, and
+compile_predicate() turns the rest into the source of a single function,
+which is compiled once and called once per instance.
+"""
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import re
+from collections import namedtuple
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.inventory import compile_pattern, has_wildcard
+
+
+# Fields to (InstanceRecord attribute, EC2 filter or None); "tag:<key>" is a
+# tag, filtered on with the same name
+FIELDS = {
+    'id': ('id', 'instance-id'),
+    'name': ('name', 'tag:Name'),
+    'type': ('instance_type', 'instance-type'),
+    'instance_type': ('instance_type', 'instance-type'),
+    'zone': ('zone', 'availability-zone'),
+    'state': ('state', 'instance-state-name'),
+    'group': ('groups', 'group-name'),
+    'region': ('region', None),
+    'ip': ('ip_address', 'ip-address'),
+    'ip_address': ('ip_address', 'ip-address'),
+    'private_ip': ('private_ip_address', 'private-ip-address'),
+    'private_ip_address': ('private_ip_address', 'private-ip-address'),
+    'dns_name': ('dns_name', 'dns-name'),
+    'root': ('root_device_type', 'root-device-type'),
+    'root_device_type': ('root_device_type', 'root-device-type'),
+}
+
+# Attributes holding several values, any of which may match
+_MULTI_VALUED = frozenset(['groups'])
+
+# EC2 takes up to 200 values per filter
+MAX_FILTER_VALUES = 200
+
+_TAG_PREFIX = 'tag:'
+
+_KEYWORDS = frozenset(['and', 'or', 'not', 'in'])
+
+_TOKEN_RE = re.compile(r"""
+    \s*(?:
+        (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+      | (?P<operator>==|!=|!~|=|~|\(|\)|,)
+      | (?P<word>[^\s'"(),=!~]+)
+    )
+""", re.VERBOSE)
+
+
+class WhereError(Exception):
+    """
+    An expression can't be parsed.
+    """
+
+
+# OP is 'in', matching any of the globs or values VALUES, or '~', matching
+# the regex VALUES[0]
+Comparison = namedtuple('Comparison', ['field', 'op', 'values'])
+And = namedtuple('And', ['terms'])
+Or = namedtuple('Or', ['terms'])
+Not = namedtuple('Not', ['term'])
+# A Python function of an InstanceRecord, for conditions the language has no
+# syntax for
+Call = namedtuple('Call', ['function'])
+
+
+def _tokenize(text):
+    """
+    Returns the (kind, value) tokens of TEXT, ending with an ('end', None) one.
+    """
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = _TOKEN_RE.match(text, position)
+        if match is None:
+            raise WhereError('Unexpected {0!r} at position {1} of --where'.format(
+                text[position:].strip()[:10], position))
+        position = match.end()
+        if match.group('string') is not None:
+            quoted = match.group('string')
+            tokens.append(('value', quoted[1:-1].replace('\\' + quoted[0], quoted[0])))
+        elif match.group('operator') is not None:
+            tokens.append(('operator', match.group('operator')))
+        elif match.group('word').lower() in _KEYWORDS:
+            tokens.append(('keyword', match.group('word').lower()))
+        else:
+            tokens.append(('value', match.group('word')))
+    tokens.append(('end', None))
+    return tokens
+
+
+class _Parser(object):
+    """
+    Recursive descent parser of the grammar
+
+        or_expr    := and_expr ('or' and_expr)*
+        and_expr   := not_expr ('and' not_expr)*
+        not_expr   := 'not' not_expr | '(' or_expr ')' | comparison
+        comparison := field ('=' | '==' | '!=' | '~' | '!~') value
+                    | field ['not'] 'in' '(' value (',' value)* ')'
+    """
+
+    def __init__(self, text):
+        self.tokens = _tokenize(text)
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position]
+
+    def take(self, kind=None, value=None):
+        token = self.tokens[self.position]
+        if (kind is not None and token[0] != kind) or (value is not None and token[1] != value):
+            expected = repr(value) if value is not None else 'a ' + kind
+            found = 'the end' if token[0] == 'end' else repr(token[1])
+            raise WhereError('Expected {0} in --where, found {1}'.format(expected, found))
+        self.position += 1
+        return token[1]
+
+    def parse(self):
+        node = self.or_expr()
+        self.take('end')
+        return node
+
+    def or_expr(self):
+        terms = [self.and_expr()]
+        while self.peek() == ('keyword', 'or'):
+            self.take()
+            terms.append(self.and_expr())
+        return terms[0] if len(terms) == 1 else Or(tuple(terms))
+
+    def and_expr(self):
+        terms = [self.not_expr()]
+        while self.peek() == ('keyword', 'and'):
+            self.take()
+            terms.append(self.not_expr())
+        return terms[0] if len(terms) == 1 else And(tuple(terms))
+
+    def not_expr(self):
+        if self.peek() == ('keyword', 'not'):
+            self.take()
+            return Not(self.not_expr())
+        if self.peek() == ('operator', '('):
+            self.take()
+            node = self.or_expr()
+            self.take('operator', ')')
+            return node
+        return self.comparison()
+
+    def comparison(self):
+        field = self.take('value')
+        if field not in FIELDS and not (field.startswith(_TAG_PREFIX) and
+                                        len(field) > len(_TAG_PREFIX)):
+            raise WhereError('Unknown field {0!r} in --where; use tag:<key> or one of {1}'.format(
+                field, ', '.join(sorted(FIELDS))))
+
+        kind, op = self.peek()
+        if (kind, op) == ('keyword', 'not'):
+            self.take()
+            self.take('keyword', 'in')
+            return Not(Comparison(field, 'in', self.values()))
+        if (kind, op) == ('keyword', 'in'):
+            self.take()
+            return Comparison(field, 'in', self.values())
+        if kind != 'operator' or op not in ('=', '==', '!=', '~', '!~'):
+            self.take('operator', '=')
+        self.take()
+
+        value = self.take('value')
+        if op in ('~', '!~'):
+            try:
+                re.compile(value)
+            except re.error as e:
+                raise WhereError('Invalid regex {0!r} in --where: {1}'.format(value, e))
+            node = Comparison(field, '~', (value,))
+        else:
+            node = Comparison(field, 'in', (value,))
+        return Not(node) if op.startswith('!') else node
+
+    def values(self):
+        self.take('operator', '(')
+        values = [self.take('value')]
+        while self.peek() == ('operator', ','):
+            self.take()
+            values.append(self.take('value'))
+        self.take('operator', ')')
+        return tuple(values)
+
+
+def parse_where(text):
+    """
+    Parses the expression TEXT. Raises WhereError if it isn't valid.
+    """
+    if not text or not text.strip():
+        raise WhereError('--where needs an expression')
+    return _Parser(text).parse()
+
+
+def conjuncts(node):
+    """
+    Returns the terms that must all be true for NODE to be.
+    """
+    if node is None:
+        return []
+    if isinstance(node, And):
+        return [term for t in node.terms for term in conjuncts(t)]
+    return [node]
+
+
+def _filter_name(field):
+    if field.startswith(_TAG_PREFIX):
+        return field
+    return FIELDS[field][1]
+
+
+def push_down(node, taken=()):
+    """
+    Splits NODE into EC2 filters and the rest. Returns a list of (filter name,
+    values) tuples and the node left to evaluate locally, or None.
+
+    Only comparisons every instance must pass can be pushed down, and only
+    when EC2 matches them the same way: globs and values, not regexes, one
+    per filter, as values of the same filter are ORed, and none for the
+    filters in TAKEN, which are already in use.
+    """
+    taken = set(taken)
+    filters = []
+    rest = []
+    for term in conjuncts(node):
+        name = None
+        if isinstance(term, Comparison) and term.op == 'in' and \
+                len(term.values) <= MAX_FILTER_VALUES:
+            name = _filter_name(term.field)
+        if name is None or name in taken:
+            rest.append(term)
+            continue
+        taken.add(name)
+        filters.append((name, list(term.values)))
+
+    if not rest:
+        return filters, None
+    return filters, rest[0] if len(rest) == 1 else And(tuple(rest))
+
+
+def _matches(match, value):
+    return value is not None and match(value) is not None
+
+
+def _matches_any(match, values):
+    return any(match(value) is not None for value in values)
+
+
+class _Compiler(object):
+    """
+    Generates the source of an expression over the InstanceRecord r, with
+    constants in a namespace of their own rather than in the source.
+    """
+
+    def __init__(self):
+        self.namespace = {'_matches': _matches, '_matches_any': _matches_any}
+
+    def constant(self, value):
+        name = '_c{0}'.format(len(self.namespace))
+        self.namespace[name] = value
+        return name
+
+    def source(self, node):
+        if isinstance(node, And):
+            return '({0})'.format(' and '.join(self.source(t) for t in node.terms) or 'True')
+        if isinstance(node, Or):
+            return '({0})'.format(' or '.join(self.source(t) for t in node.terms))
+        if isinstance(node, Not):
+            return '(not {0})'.format(self.source(node.term))
+        if isinstance(node, Call):
+            return '{0}(r)'.format(self.constant(node.function))
+        return self.comparison(node)
+
+    def comparison(self, node):
+        if node.field.startswith(_TAG_PREFIX):
+            attribute = None
+            value = 'r.tag({0})'.format(self.constant(node.field[len(_TAG_PREFIX):]))
+        else:
+            attribute = FIELDS[node.field][0]
+            value = 'r.' + attribute
+        multi = attribute in _MULTI_VALUED
+
+        if node.op == '~':
+            match = re.compile(node.values[0]).search
+        elif any(has_wildcard(v) for v in node.values):
+            match = compile_pattern(node.values).match
+        else:
+            match = None
+
+        if match is not None:
+            return '{0}({1}, {2})'.format('_matches_any' if multi else '_matches',
+                                          self.constant(match), value)
+        if len(node.values) == 1:
+            if multi:
+                return '({0} in {1})'.format(self.constant(node.values[0]), value)
+            return '({0} == {1})'.format(value, self.constant(node.values[0]))
+        values = self.constant(frozenset(node.values))
+        if multi:
+            return '(not {0}.isdisjoint({1}))'.format(values, value)
+        return '({0} in {1})'.format(value, values)
+
+
+def compile_predicate(node):
+    """
+    Returns a function of an InstanceRecord returning whether it matches
+    NODE, or None if NODE is None, as everything matches.
+    """
+    if node is None:
+        return None
+    compiler = _Compiler()
+    source = 'lambda r: ' + compiler.source(node)
+    predicate = eval(compile(source, '<where>', 'eval'), compiler.namespace)
+    predicate.source = source
+    return predicate
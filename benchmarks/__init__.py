@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+"""
+Benchmarks for aws_analysis_tools. Run them as modules from the repository
+root, e.g. ``python -m benchmarks.records_memory``.
+"""
@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+"""
+A small stand-in for the EC2 Query API, serving synthetic fleets.
+
+It understands enough of DescribeRegions, DescribeInstances, DescribeVolumes,
+DescribeSnapshots and CreateTags for the CLIs in this package: filters (with
+* and ? globs), id and owner lists and MaxResults/NextToken pagination. Every response can be delayed
+by a configurable latency, and requests can be throttled, either at random or
+by a per (region, action) rate limit, with the same RequestLimitExceeded error
+EC2 returns.
+
+The region of a request is taken from the SigV4 credential scope (boto3) or
+from the Host header (boto, which talks to it through http_proxy), so one
+server serves every region.
+
+Usage: python -m benchmarks.fake_ec2 [--port N] [--instances N] ...
+"""
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import, print_function
+import argparse
+import fnmatch
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:  # pragma: no cover
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+#
+# Internal libraries
+#
+
+from benchmarks import fleet
+
+
+DEFAULT_REGIONS = ['us-east-1', 'us-west-2', 'eu-west-1', 'ap-southeast-1']
+
+_SCOPE_RE = re.compile(r'Credential=[^/]+/\d+/([a-z0-9-]+)/')
+_HOST_RE = re.compile(r'ec2\.([a-z0-9-]+)\.amazonaws\.com')
+_FILTER_RE = re.compile(r'^Filter\.(\d+)\.(Name|Value\.\d+)$')
+_LIST_RE = re.compile(r'^(InstanceId|VolumeId|SnapshotId|Owner)\.\d+$')
+
+
+def _tag(item, key):
+    for tag in item.get('Tags') or ():
+        if tag['Key'] == key:
+            return tag['Value']
+    return None
+
+
+# Filter name to a function returning the candidate values of an item
+_INSTANCE_FILTERS = {
+    'instance-id': lambda i: [i['InstanceId']],
+    'instance-type': lambda i: [i['InstanceType']],
+    'instance-state-name': lambda i: [i['State']['Name']],
+    'availability-zone': lambda i: [i['Placement']['AvailabilityZone']],
+    'private-ip-address': lambda i: [i['PrivateIpAddress']],
+    'ip-address': lambda i: [i['PublicIpAddress']],
+    'dns-name': lambda i: [i['PublicDnsName']],
+    'group-name': lambda i: [g['GroupName'] for g in i['SecurityGroups']],
+    'tag-key': lambda i: [t['Key'] for t in i['Tags']],
+    'tag-value': lambda i: [t['Value'] for t in i['Tags']],
+}
+
+_VOLUME_FILTERS = {
+    'volume-id': lambda v: [v['VolumeId']],
+    'status': lambda v: [v['State']],
+    'availability-zone': lambda v: [v['AvailabilityZone']],
+    'attachment.instance-id': lambda v: [a['InstanceId'] for a in v['Attachments']],
+    'tag-key': lambda v: [t['Key'] for t in v['Tags']],
+    'tag-value': lambda v: [t['Value'] for t in v['Tags']],
+}
+
+_SNAPSHOT_FILTERS = {
+    'snapshot-id': lambda s: [s['SnapshotId']],
+    'volume-id': lambda s: [s['VolumeId']],
+    'status': lambda s: [s['State']],
+    'owner-id': lambda s: [s['OwnerId']],
+    'tag-key': lambda s: [t['Key'] for t in s['Tags']],
+    'tag-value': lambda s: [t['Value'] for t in s['Tags']],
+}
+
+
+def _matches(item, filters, getters):
+    for name, patterns in filters:
+        if name.startswith('tag:'):
+            values = [_tag(item, name[4:])]
+        elif name in getters:
+            values = getters[name](item)
+        else:
+            # Unknown filters match nothing, like EC2 rejects them
+            return False
+        if not any(v is not None and fnmatch.fnmatchcase(v, p) for v in values for p in patterns):
+            return False
+    return True
+
+
+def _error_xml(code, message):
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?><Response><Errors><Error><Code>{0}</Code>'
+        '<Message>{1}</Message></Error></Errors><RequestID>fake</RequestID></Response>'
+    ).format(code, message).encode('utf-8')
+
+
+class Fleet(object):
+    """
+    The synthetic instances, volumes and snapshots of one region.
+    """
+
+    def __init__(self, region, instance_count, volume_count, snapshot_count=0, seed=0):
+        self.region = region
+        self.instances = fleet.make_instances(instance_count, region=region, seed=seed,
+                                              per_reservation=2)
+        self.volumes = fleet.make_volumes(volume_count, self.instances, region=region, seed=seed)
+        self.snapshots = fleet.make_snapshots(snapshot_count, self.volumes, region=region,
+                                              seed=seed)
+
+
+class FakeEC2(object):
+    """
+    The state and behaviour of the fake endpoint, shared by the request
+    handlers.
+    """
+
+    def __init__(self, fleets, latency=0.0, jitter=0.0, throttle_probability=0.0,
+                 rate_limit=None, max_page_size=1000, seed=0):
+        self.fleets = dict((f.region, f) for f in fleets)
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_probability = throttle_probability
+        self.rate_limit = rate_limit
+        self.max_page_size = max_page_size
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._windows = {}
+        self.counters = defaultdict(int)
+
+    def reset_counters(self):
+        with self._lock:
+            self.counters.clear()
+
+    def _count(self, key):
+        with self._lock:
+            self.counters[key] += 1
+
+    def _throttled(self, region, action):
+        with self._lock:
+            if self.throttle_probability and self._rng.random() < self.throttle_probability:
+                return True
+            if self.rate_limit:
+                # fixed one second windows per (region, action)
+                now = int(time.time())
+                window, count = self._windows.get((region, action), (now, 0))
+                if window != now:
+                    window, count = now, 0
+                self._windows[(region, action)] = (window, count + 1)
+                return count >= self.rate_limit
+        return False
+
+    def handle(self, region, params):
+        """
+        Returns (status, body) for a request with PARAMS in REGION.
+        """
+        action = params.get('Action', '')
+        self._count(('calls', region, action))
+
+        delay = self.latency + (self._rng.uniform(-self.jitter, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+        if self._throttled(region, action):
+            self._count(('throttles', region, action))
+            return 503, _error_xml('RequestLimitExceeded', 'Request limit exceeded.')
+
+        handler = getattr(self, 'action_' + action, None)
+        if handler is None:
+            return 400, _error_xml('InvalidAction', 'The action {0} is not valid'.format(action))
+        if region not in self.fleets and action != 'DescribeRegions':
+            return 401, _error_xml('AuthFailure', 'Region {0} is not enabled'.format(region))
+        return 200, handler(region, params)
+
+    @staticmethod
+    def _filters(params):
+        filters = defaultdict(lambda: [None, []])
+        for key, value in params.items():
+            match = _FILTER_RE.match(key)
+            if match:
+                if match.group(2) == 'Name':
+                    filters[match.group(1)][0] = value
+                else:
+                    filters[match.group(1)][1].append(value)
+        return [tuple(f) for f in filters.values() if f[0]]
+
+    @staticmethod
+    def _list(params, name):
+        return [v for k, v in sorted(params.items()) if _LIST_RE.match(k) and k.startswith(name + '.')]
+
+    def _page(self, items, params):
+        start = int(params.get('NextToken') or 0)
+        size = params.get('MaxResults')
+        if size is None:
+            return items[start:], None
+        size = min(int(size), self.max_page_size)
+        end = start + size
+        return items[start:end], str(end) if end < len(items) else None
+
+    def action_DescribeRegions(self, region, params):
+        items = ''.join(
+            '<item><regionName>{0}</regionName><regionEndpoint>ec2.{0}.amazonaws.com'
+            '</regionEndpoint></item>'.format(name) for name in sorted(self.fleets)
+        )
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?><DescribeRegionsResponse xmlns="{0}">'
+            '<requestId>fake</requestId><regionInfo>{1}</regionInfo></DescribeRegionsResponse>'
+        ).format(fleet.EC2_XMLNS, items).encode('utf-8')
+
+    def action_DescribeInstances(self, region, params):
+        ids = set(self._list(params, 'InstanceId'))
+        filters = self._filters(params)
+        instances = [
+            i for i in self.fleets[region].instances
+            if (not ids or i['InstanceId'] in ids) and _matches(i, filters, _INSTANCE_FILTERS)
+        ]
+        page, next_token = self._page(instances, params)
+        return fleet.describe_instances_xml(page, next_token)
+
+    def action_DescribeVolumes(self, region, params):
+        ids = set(self._list(params, 'VolumeId'))
+        filters = self._filters(params)
+        volumes = [
+            v for v in self.fleets[region].volumes
+            if (not ids or v['VolumeId'] in ids) and _matches(v, filters, _VOLUME_FILTERS)
+        ]
+        page, next_token = self._page(volumes, params)
+        return fleet.describe_volumes_xml(page, next_token)
+
+    def action_DescribeSnapshots(self, region, params):
+        ids = set(self._list(params, 'SnapshotId'))
+        # "self" is the account of the fleet
+        owners = set(fleet.OWNER_ID if o == 'self' else o for o in self._list(params, 'Owner'))
+        filters = self._filters(params)
+        snapshots = [
+            s for s in self.fleets[region].snapshots
+            if (not ids or s['SnapshotId'] in ids) and (not owners or s['OwnerId'] in owners) and
+            _matches(s, filters, _SNAPSHOT_FILTERS)
+        ]
+        page, next_token = self._page(snapshots, params)
+        return fleet.describe_snapshots_xml(page, next_token)
+
+    def action_CreateTags(self, region, params):
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?><CreateTagsResponse xmlns="{0}">'
+            '<requestId>fake</requestId><return>true</return></CreateTagsResponse>'
+        ).format(fleet.EC2_XMLNS).encode('utf-8')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # The headers and the body are written separately; without TCP_NODELAY
+    # a kept alive connection waits for the client's delayed ACK in between
+    disable_nagle_algorithm = True
+
+    def _region(self):
+        match = _SCOPE_RE.search(self.headers.get('Authorization', ''))
+        if match:
+            return match.group(1)
+        match = _HOST_RE.search(self.headers.get('Host', '') or urlparse(self.path).netloc)
+        if match:
+            return match.group(1)
+        return 'us-east-1'
+
+    def _params(self):
+        query = urlparse(self.path).query
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            query += '&' + self.rfile.read(length).decode('utf-8')
+        return dict((k, v[-1]) for k, v in parse_qs(query, keep_blank_values=True).items())
+
+    def _respond(self):
+        status, body = self.server.ec2.handle(self._region(), self._params())
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml;charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _respond
+    do_POST = _respond
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeEC2Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, ec2, host='127.0.0.1', port=0):
+        HTTPServer.__init__(self, (host, port), _Handler)
+        self.ec2 = ec2
+
+    @property
+    def url(self):
+        return 'http://{0}:{1}'.format(*self.server_address[:2])
+
+    def start(self):
+        """
+        Serves in a daemon thread and returns self.
+        """
+        thread = threading.Thread(target=self.serve_forever, name='fake-ec2')
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+def make_server(instances, volumes, regions=DEFAULT_REGIONS, port=0, seed=0, snapshots=0,
+                **kwargs):
+    """
+    Returns a FakeEC2Server with INSTANCES, VOLUMES and SNAPSHOTS spread over
+    REGIONS. Other keyword arguments are passed to FakeEC2.
+    """
+    def _share(count, index):
+        return count // len(regions) + (index < count % len(regions))
+
+    fleets = [
+        Fleet(region, _share(instances, index), _share(volumes, index),
+              _share(snapshots, index), seed=seed)
+        for index, region in enumerate(regions)
+    ]
+    return FakeEC2Server(FakeEC2(fleets, seed=seed, **kwargs), port=port)
+
+
+def add_fake_ec2_arguments(parser):
+    parser.add_argument('--regions', default=','.join(DEFAULT_REGIONS),
+                        help='Comma separated regions to serve (default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds added to every response (default: %(default)s)')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='Random +/- seconds added to the latency (default: %(default)s)')
+    parser.add_argument('--throttle-probability', type=float, default=0.0,
+                        help='Fraction of requests answered with RequestLimitExceeded '
+                        '(default: %(default)s)')
+    parser.add_argument('--rate-limit', type=int, default=None,
+                        help='Requests per second per region and action before throttling')
+
+
+def server_kwargs(args):
+    return {
+        'regions': args.regions.split(','),
+        'latency': args.latency,
+        'jitter': args.jitter,
+        'throttle_probability': args.throttle_probability,
+        'rate_limit': args.rate_limit,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=8773)
+    parser.add_argument('--instances', type=int, default=1000)
+    parser.add_argument('--volumes', type=int, default=1000)
+    parser.add_argument('--snapshots', type=int, default=0)
+    add_fake_ec2_arguments(parser)
+    args = parser.parse_args()
+
+    server = make_server(args.instances, args.volumes, port=args.port, snapshots=args.snapshots,
+                         **server_kwargs(args))
+    print('Serving fake EC2 on {0}'.format(server.url))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
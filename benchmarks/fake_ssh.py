@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+"""
+A fake ssh binary for benchmarking the pssh tools.
+
+install() writes an executable `ssh` into a directory, to be put first on
+PATH, along with one plan file per host. The fake is a POSIX shell script so
+thousands of them can run at once without the memory of as many Python
+interpreters. For its host (the first argument that isn't an option) it
+sleeps for the planned latency, writes the planned number of lines and exits
+with the planned status, or hangs for a long time.
+
+The plans are drawn up front from a seeded generator: latencies follow a
+log-normal distribution around a median, and a fraction of the hosts fail
+(exit 255, like ssh does when it can't connect) or hang.
+"""
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import math
+import os
+import random
+import stat
+
+
+SSH_SCRIPT = r'''#!/bin/sh
+# Fake ssh written by benchmarks.fake_ssh
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -[bcDEeFIiJLlmOopQRSWw]) shift 2 ;;
+        -*) shift ;;
+        *) break ;;
+    esac
+done
+host=$1
+latency=0 lines=1 code=0 hang=0 text=$host
+if [ -r "{plan_dir}/$host" ]; then
+    read latency lines code hang text < "{plan_dir}/$host"
+fi
+sleep "$latency"
+if [ "$hang" != 0 ]; then
+    exec sleep "$hang"
+fi
+if [ "$code" = 255 ]; then
+    echo "ssh: connect to host $host port 22: Connection refused" >&2
+    exit 255
+fi
+if [ "$lines" -gt 0 ]; then
+    yes "$text" | head -n "$lines"
+fi
+exit "$code"
+'''
+
+
+class HostPlan(object):
+    """
+    What the fake ssh does for one host.
+    """
+    __slots__ = ('host', 'latency', 'lines', 'exit_code', 'hang')
+
+    def __init__(self, host, latency=0.0, lines=1, exit_code=0, hang=0):
+        self.host = host
+        self.latency = latency
+        self.lines = lines
+        self.exit_code = exit_code
+        self.hang = hang
+
+
+def make_plans(hosts, latency=0.05, sigma=0.5, lines=10, fail_rate=0.0, hang_rate=0.0,
+               hang_seconds=3600, seed=0):
+    """
+    Returns a HostPlan for each of HOSTS. Latencies are log-normal with a
+    median of LATENCY seconds and a shape of SIGMA; FAIL_RATE and HANG_RATE are
+    the fractions of hosts that fail to connect or never finish.
+    """
+    rng = random.Random(seed)
+    plans = []
+    for host in hosts:
+        draw = rng.random()
+        plans.append(HostPlan(
+            host,
+            latency=latency * math.exp(rng.gauss(0, sigma)) if latency > 0 else 0.0,
+            lines=lines,
+            exit_code=255 if draw < fail_rate else 0,
+            hang=hang_seconds if fail_rate <= draw < fail_rate + hang_rate else 0,
+        ))
+    return plans
+
+
+def install(directory, plans, line_bytes=80):
+    """
+    Writes the fake ssh and the PLANS into DIRECTORY and returns the path of
+    the ssh script. Each output line is LINE_BYTES long, including the newline.
+    """
+    plan_dir = os.path.join(directory, 'plans')
+    if not os.path.isdir(plan_dir):
+        os.makedirs(plan_dir)
+
+    for plan in plans:
+        text = (plan.host + ' ' + 'x' * line_bytes)[:max(line_bytes - 1, 1)]
+        with open(os.path.join(plan_dir, plan.host), 'w') as f:
+            f.write('{0:.3f} {1} {2} {3} {4}\n'.format(
+                plan.latency, plan.lines, plan.exit_code, plan.hang, text))
+
+    path = os.path.join(directory, 'ssh')
+    with open(path, 'w') as f:
+        # plain replace(): the script is full of shell braces
+        f.write(SSH_SCRIPT.replace('{plan_dir}', plan_dir))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return path
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+"""
+Deterministic synthetic EC2 fleets for the benchmarks.
+
+Instances, volumes and snapshots are generated as plain dicts shaped like boto3
+responses, and can be rendered as the EC2 Query API XML that boto parses, so
+the same fleet can feed either library.
+"""
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import random
+import zlib
+from xml.sax.saxutils import escape
+
+
+EC2_XMLNS = 'http://ec2.amazonaws.com/doc/2016-11-15/'
+
+INSTANCE_TYPES = ['c3.large', 'c4.xlarge', 'm4.large', 'm4.2xlarge', 'r4.xlarge', 't2.medium']
+STATES = [('running', 16)] * 18 + [('stopped', 80), ('pending', 0)]
+CLUSTERS = ['apiservices-{0}'.format(c) for c in 'abcd'] + \
+    ['periodic-{0}'.format(c) for c in 'abc'] + ['kafka', 'hadoop-worker', 'webapp']
+ENVIRONMENTS = ['prod', 'prod', 'prod', 'staging', 'dev']
+VOLUME_STATES = ['in-use'] * 8 + ['available', 'available']
+# Fraction of snapshots whose volume was deleted since
+DELETED_VOLUME_SNAPSHOTS = 0.3
+# Account id of the fleet
+OWNER_ID = '123456789012'
+
+
+def _ip(rng, first):
+    return '{0}.{1}.{2}.{3}'.format(first, rng.randint(0, 255), rng.randint(0, 255), rng.randint(1, 254))
+
+
+def make_instances(count, region='us-east-1', seed=0, per_reservation=1):
+    """
+    Returns COUNT instance dicts shaped like the instances of a boto3
+    DescribeInstances response. Consecutive instances are grouped into
+    reservations of PER_RESERVATION; the reservation id is kept under the
+    private '_ReservationId' key.
+    """
+    rng = random.Random('{0}/{1}'.format(region, seed))
+    zones = ['{0}{1}'.format(region, z) for z in 'abcd']
+    instances = []
+
+    for index in range(count):
+        cluster = rng.choice(CLUSTERS)
+        state, code = rng.choice(STATES)
+        private_ip = _ip(rng, 10)
+        public_ip = _ip(rng, 54) if state == 'running' else None
+        instance_id = 'i-{0:017x}'.format(rng.getrandbits(68))
+        name = '{0}-{1:05d}.{2}.krxd.net'.format(cluster, index, region)
+
+        instances.append({
+            '_ReservationId': 'r-{0:017x}'.format(index // per_reservation),
+            'InstanceId': instance_id,
+            'ImageId': 'ami-{0:08x}'.format(rng.getrandbits(32)),
+            'InstanceType': rng.choice(INSTANCE_TYPES),
+            'KeyName': 'ops',
+            'LaunchTime': '2018-0{0}-1{1}T12:00:00.000Z'.format(rng.randint(1, 9), rng.randint(0, 9)),
+            'Placement': {'AvailabilityZone': rng.choice(zones), 'Tenancy': 'default'},
+            'PrivateDnsName': 'ip-{0}.ec2.internal'.format(private_ip.replace('.', '-')),
+            'PrivateIpAddress': private_ip,
+            'PublicDnsName': 'ec2-{0}.compute-1.amazonaws.com'.format(public_ip.replace('.', '-'))
+            if public_ip else '',
+            'PublicIpAddress': public_ip,
+            'State': {'Code': code, 'Name': state},
+            'SubnetId': 'subnet-{0:08x}'.format(rng.getrandbits(32)),
+            'VpcId': 'vpc-0000abcd',
+            'Architecture': 'x86_64',
+            'RootDeviceName': '/dev/sda1',
+            'RootDeviceType': 'ebs',
+            'VirtualizationType': 'hvm',
+            'Hypervisor': 'xen',
+            'Monitoring': {'State': 'disabled'},
+            'SecurityGroups': [{'GroupName': cluster, 'GroupId': 'sg-{0:08x}'.format(zlib.crc32(cluster.encode('utf-8')) & 0xffffffff)}],
+            'BlockDeviceMappings': [{
+                'DeviceName': '/dev/sda1',
+                'Ebs': {
+                    'VolumeId': 'vol-{0:017x}'.format(rng.getrandbits(68)),
+                    'Status': 'attached',
+                    'AttachTime': '2018-01-01T12:00:00.000Z',
+                    'DeleteOnTermination': True,
+                },
+            }],
+            'NetworkInterfaces': [{
+                'NetworkInterfaceId': 'eni-{0:08x}'.format(rng.getrandbits(32)),
+                'PrivateIpAddress': private_ip,
+                'MacAddress': '0e:00:00:00:00:00',
+                'Status': 'in-use',
+                'SourceDestCheck': True,
+            }],
+            'Tags': [
+                {'Key': 'Name', 'Value': name},
+                {'Key': 'cluster_name', 'Value': cluster},
+                {'Key': 'environment', 'Value': rng.choice(ENVIRONMENTS)},
+                {'Key': 's_classes', 'Value': 's_basic,s_{0}'.format(cluster.split('-')[0])},
+                {'Key': 'lts', 'Value': 'trusty'},
+            ],
+        })
+
+    return instances
+
+
+def make_volumes(count, instances=(), region='us-east-1', seed=0):
+    """
+    Returns COUNT volume dicts shaped like the volumes of a boto3
+    DescribeVolumes response. In-use volumes are attached to INSTANCES.
+    """
+    rng = random.Random('volumes/{0}/{1}'.format(region, seed))
+    zones = ['{0}{1}'.format(region, z) for z in 'abcd']
+    instances = list(instances)
+    volumes = []
+
+    for index in range(count):
+        state = rng.choice(VOLUME_STATES) if instances else 'available'
+        attachments = []
+        zone = rng.choice(zones)
+        if state == 'in-use':
+            instance = rng.choice(instances)
+            zone = instance['Placement']['AvailabilityZone']
+            attachments.append({
+                'InstanceId': instance['InstanceId'],
+                'Device': '/dev/xvd{0}'.format('fghijk'[index % 6]),
+                'State': 'attached',
+                'AttachTime': '2018-01-01T12:00:00.000Z',
+                'DeleteOnTermination': False,
+            })
+        cluster = rng.choice(CLUSTERS)
+
+        volumes.append({
+            'VolumeId': 'vol-{0:017x}'.format(rng.getrandbits(68)),
+            'Size': rng.choice([8, 16, 100, 500, 1000]),
+            'AvailabilityZone': zone,
+            'State': state,
+            'VolumeType': rng.choice(['gp2', 'gp2', 'io1', 'st1']),
+            'CreateTime': '2018-01-01T12:00:00.000Z',
+            'Encrypted': False,
+            'Attachments': attachments,
+            'Tags': [
+                {'Key': 'Name', 'Value': '{0}-data-{1:05d}'.format(cluster, index)},
+                {'Key': 'cluster_name', 'Value': cluster},
+            ],
+        })
+
+    return volumes
+
+
+def make_snapshots(count, volumes=(), region='us-east-1', seed=0, owner_id=OWNER_ID):
+    """
+    Returns COUNT snapshot dicts shaped like the snapshots of a boto3
+    DescribeSnapshots response, owned by OWNER_ID. Most are of VOLUMES, the
+    rest of volumes that no longer exist.
+    """
+    rng = random.Random('snapshots/{0}/{1}'.format(region, seed))
+    volumes = list(volumes)
+    snapshots = []
+
+    for index in range(count):
+        if volumes and rng.random() >= DELETED_VOLUME_SNAPSHOTS:
+            volume = rng.choice(volumes)
+            volume_id, size = volume['VolumeId'], volume['Size']
+            name = _tag(volume, 'Name') or volume_id
+        else:
+            volume_id = 'vol-{0:017x}'.format(rng.getrandbits(68))
+            size = rng.choice([8, 16, 100, 500, 1000])
+            name = '{0}-data-deleted'.format(rng.choice(CLUSTERS))
+
+        snapshots.append({
+            'SnapshotId': 'snap-{0:017x}'.format(rng.getrandbits(68)),
+            'VolumeId': volume_id,
+            'VolumeSize': size,
+            'State': 'completed' if index % 50 else 'pending',
+            'Progress': '100%' if index % 50 else '42%',
+            'StartTime': '2018-{0:02d}-{1:02d}T04:00:00.000Z'.format(
+                1 + index % 12, 1 + index % 28),
+            'Description': 'Daily backup of {0}'.format(volume_id),
+            'OwnerId': owner_id,
+            'Encrypted': False,
+            'Tags': [{'Key': 'Name', 'Value': name}],
+        })
+
+    return snapshots
+
+
+def _tag(item, key):
+    for tag in item.get('Tags') or ():
+        if tag['Key'] == key:
+            return tag['Value']
+    return None
+
+
+def _el(name, value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        value = 'true' if value else 'false'
+    return '<{0}>{1}</{0}>'.format(name, escape(str(value)))
+
+
+def _tags_xml(tags):
+    return '<tagSet>{0}</tagSet>'.format(''.join(
+        '<item>{0}{1}</item>'.format(_el('key', t['Key']), _el('value', t['Value'])) for t in tags
+    ))
+
+
+def _instance_xml(i):
+    parts = [
+        _el('instanceId', i['InstanceId']),
+        _el('imageId', i['ImageId']),
+        '<instanceState>{0}{1}</instanceState>'.format(
+            _el('code', i['State']['Code']), _el('name', i['State']['Name'])),
+        _el('privateDnsName', i['PrivateDnsName']),
+        _el('dnsName', i['PublicDnsName']),
+        _el('keyName', i['KeyName']),
+        _el('amiLaunchIndex', 0),
+        _el('instanceType', i['InstanceType']),
+        _el('launchTime', i['LaunchTime']),
+        '<placement>{0}{1}</placement>'.format(
+            _el('availabilityZone', i['Placement']['AvailabilityZone']), _el('tenancy', 'default')),
+        '<monitoring>{0}</monitoring>'.format(_el('state', i['Monitoring']['State'])),
+        _el('subnetId', i['SubnetId']),
+        _el('vpcId', i['VpcId']),
+        _el('privateIpAddress', i['PrivateIpAddress']),
+        _el('ipAddress', i['PublicIpAddress']),
+        '<groupSet>{0}</groupSet>'.format(''.join(
+            '<item>{0}{1}</item>'.format(_el('groupId', g['GroupId']), _el('groupName', g['GroupName']))
+            for g in i['SecurityGroups'])),
+        _el('architecture', i['Architecture']),
+        _el('rootDeviceType', i['RootDeviceType']),
+        _el('rootDeviceName', i['RootDeviceName']),
+        '<blockDeviceMapping>{0}</blockDeviceMapping>'.format(''.join(
+            '<item>{0}<ebs>{1}{2}{3}{4}</ebs></item>'.format(
+                _el('deviceName', b['DeviceName']), _el('volumeId', b['Ebs']['VolumeId']),
+                _el('status', b['Ebs']['Status']), _el('attachTime', b['Ebs']['AttachTime']),
+                _el('deleteOnTermination', b['Ebs']['DeleteOnTermination']))
+            for b in i['BlockDeviceMappings'])),
+        _el('virtualizationType', i['VirtualizationType']),
+        _tags_xml(i['Tags']),
+        _el('hypervisor', i['Hypervisor']),
+        '<networkInterfaceSet>{0}</networkInterfaceSet>'.format(''.join(
+            '<item>{0}{1}{2}{3}{4}</item>'.format(
+                _el('networkInterfaceId', n['NetworkInterfaceId']), _el('status', n['Status']),
+                _el('macAddress', n['MacAddress']), _el('privateIpAddress', n['PrivateIpAddress']),
+                _el('sourceDestCheck', n['SourceDestCheck']))
+            for n in i['NetworkInterfaces'])),
+    ]
+    return '<item>{0}</item>'.format(''.join(parts))
+
+
+def describe_instances_xml(instances, next_token=None):
+    """
+    Renders INSTANCES as a DescribeInstances response body.
+    """
+    reservations = []
+    current = None
+    for instance in instances:
+        if current is None or current[0] != instance['_ReservationId']:
+            current = (instance['_ReservationId'], [])
+            reservations.append(current)
+        current[1].append(instance)
+
+    body = ''.join(
+        '<item>{0}{1}<groupSet/><instancesSet>{2}</instancesSet></item>'.format(
+            _el('reservationId', reservation_id), _el('ownerId', '123456789012'),
+            ''.join(_instance_xml(i) for i in members))
+        for reservation_id, members in reservations
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<DescribeInstancesResponse xmlns="{0}"><requestId>fake</requestId>'
+        '<reservationSet>{1}</reservationSet>{2}</DescribeInstancesResponse>'
+    ).format(EC2_XMLNS, body, _el('nextToken', next_token)).encode('utf-8')
+
+
+def _volume_xml(v):
+    return '<item>{0}</item>'.format(''.join([
+        _el('volumeId', v['VolumeId']),
+        _el('size', v['Size']),
+        _el('snapshotId', ''),
+        _el('availabilityZone', v['AvailabilityZone']),
+        _el('status', v['State']),
+        _el('createTime', v['CreateTime']),
+        '<attachmentSet>{0}</attachmentSet>'.format(''.join(
+            '<item>{0}{1}{2}{3}{4}{5}</item>'.format(
+                _el('volumeId', v['VolumeId']), _el('instanceId', a['InstanceId']),
+                _el('device', a['Device']), _el('status', a['State']),
+                _el('attachTime', a['AttachTime']),
+                _el('deleteOnTermination', a['DeleteOnTermination']))
+            for a in v['Attachments'])),
+        _tags_xml(v['Tags']),
+        _el('volumeType', v['VolumeType']),
+        _el('encrypted', v['Encrypted']),
+    ]))
+
+
+def describe_volumes_xml(volumes, next_token=None):
+    """
+    Renders VOLUMES as a DescribeVolumes response body.
+    """
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<DescribeVolumesResponse xmlns="{0}"><requestId>fake</requestId>'
+        '<volumeSet>{1}</volumeSet>{2}</DescribeVolumesResponse>'
+    ).format(EC2_XMLNS, ''.join(_volume_xml(v) for v in volumes),
+             _el('nextToken', next_token)).encode('utf-8')
+
+
+def _snapshot_xml(s):
+    return '<item>{0}</item>'.format(''.join([
+        _el('snapshotId', s['SnapshotId']),
+        _el('volumeId', s['VolumeId']),
+        _el('status', s['State']),
+        _el('startTime', s['StartTime']),
+        _el('progress', s['Progress']),
+        _el('ownerId', s['OwnerId']),
+        _el('volumeSize', s['VolumeSize']),
+        _el('description', s['Description']),
+        _el('encrypted', s['Encrypted']),
+        _tags_xml(s['Tags']),
+    ]))
+
+
+def describe_snapshots_xml(snapshots, next_token=None):
+    """
+    Renders SNAPSHOTS as a DescribeSnapshots response body.
+    """
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<DescribeSnapshotsResponse xmlns="{0}"><requestId>fake</requestId>'
+        '<snapshotSet>{1}</snapshotSet>{2}</DescribeSnapshotsResponse>'
+    ).format(EC2_XMLNS, ''.join(_snapshot_xml(s) for s in snapshots),
+             _el('nextToken', next_token)).encode('utf-8')
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+"""
+Throughput of the output stage of krux-ec2-pssh2.
+
+Lines of --hosts hosts, interleaved as the hosts would send them, go through
+AddressedSSHHost.puts() into a pipe drained by `cat > /dev/null`, once
+written and flushed one at a time as SSHHost does ('line'), and once through
+a CoalescingWriter ('coalesced'). For each, it records the lines per second,
+the writes to the pipe, and the CPU time of this process per 1,000 lines.
+
+Usage: python -m benchmarks.output_bench [--lines N] [--hosts N ...]
+           [--line-bytes N] [--flush-interval S]
+
+The output stage should sustain 100,000 lines per second.
+"""
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import, division, print_function
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.output import CoalescingWriter
+from aws_analysis_tools.ssh import AddressedSSHHost
+
+
+DEFAULT_HOST_COUNTS = [10, 100, 1000]
+MODES = ('line', 'coalesced')
+
+
+class CountingStream(object):
+    """
+    A text stream counting the writes that reach the file under it.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.writes = 0
+        self.stream = io.TextIOWrapper(io.BufferedWriter(self, buffer_size=io.DEFAULT_BUFFER_SIZE),
+                                       encoding='utf-8')
+
+    # The raw file interface, for the BufferedWriter
+    closed = False
+
+    def writable(self):
+        return True
+
+    def readable(self):
+        return False
+
+    def seekable(self):
+        return False
+
+    def write(self, data):
+        self.writes += 1
+        return os.write(self.raw, data)
+
+    def flush(self):
+        pass
+
+
+def benchmark(mode, count, args):
+    hosts = ['bench-{0:05d}.example.com'.format(index) for index in range(count)]
+    text = 'x' * args.line_bytes
+    sink = subprocess.Popen('cat > /dev/null', shell=True, stdin=subprocess.PIPE)
+    counting = CountingStream(sink.stdin.fileno())
+
+    output = None
+    if mode == 'coalesced':
+        output = CoalescingWriter(counting.stream, flush_interval=args.flush_interval,
+                                  line_buffered=False)
+    ssh_hosts = [AddressedSSHHost(host, output=output, use_color=False,
+                                  prefix_pad_length=len(hosts[-1]) + 3) for host in hosts]
+
+    stdout = sys.stdout
+    sys.stdout = counting.stream
+    started = time.time()
+    cpu = time.process_time()
+    try:
+        for index in range(args.lines):
+            ssh_hosts[index % count].puts('[out] {0}'.format(text))
+        if output is not None:
+            output.close()
+        counting.stream.flush()
+    finally:
+        sys.stdout = stdout
+    seconds = time.time() - started
+    cpu = time.process_time() - cpu
+    sink.stdin.close()
+    sink.wait()
+
+    result = {
+        'benchmark': 'output',
+        'mode': mode,
+        'hosts': count,
+        'lines': args.lines,
+        'line_bytes': args.line_bytes,
+        'flush_interval': args.flush_interval,
+        'seconds': round(seconds, 3),
+        'lines_per_second': int(args.lines / seconds),
+        'writes': counting.writes,
+        'cpu_ms_per_1000_lines': round(cpu * 1000 * 1000 / args.lines, 3),
+    }
+    print(json.dumps(result, sort_keys=True))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lines', type=int, default=500000,
+                        help='Lines written per run (default: %(default)s)')
+    parser.add_argument('--hosts', type=int, action='append', default=[],
+                        help='Number of hosts; can be repeated. (default: {0})'.format(
+                            ', '.join(str(c) for c in DEFAULT_HOST_COUNTS)))
+    parser.add_argument('--line-bytes', type=int, default=80,
+                        help='Bytes of output per line (default: %(default)s)')
+    parser.add_argument('--flush-interval', type=float, default=0.1,
+                        help='pssh2 --flush-interval (default: %(default)s)')
+    parser.add_argument('--mode', action='append', default=[], choices=MODES,
+                        help='Output stage; can be repeated. (default: all)')
+    args = parser.parse_args()
+
+    for count in args.hosts or DEFAULT_HOST_COUNTS:
+        for mode in args.mode or MODES:
+            benchmark(mode, count, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+"""
+Simulated time krux-ec2-pscp takes to copy a file to many hosts, from here
+only and in a relay tree.
+
+Every host, like the machine running pscp, sends at --bandwidth MB/s, shared
+evenly by the copies it sends at once: --concurrency copies from here
+without --relay, --fanout from each host having the file with it. A copy
+takes as long as its share of its source's bandwidth needs to send the
+file. The copies are handed out by the RelayPlan pscp uses, and each starts
+as soon as the plan has one to start, as pssh2's pool runs them.
+
+Usage: python -m benchmarks.pscp_sim [--hosts N ...] [--size MB]
+           [--bandwidth MB/S] [--concurrency C] [--fanout F]
+
+Prints one JSON object per (hosts, mode), with the time to copy the file to
+all hosts, its ratio to the time of one copy at full bandwidth, how deep the
+tree got, and the MB sent from here.
+"""
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import, division, print_function
+import argparse
+import heapq
+import json
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.distribute import RelayPlan, LOCAL
+
+
+DEFAULT_HOST_COUNTS = [10, 100, 1000, 5000]
+MODES = ('direct', 'relay')
+
+
+def simulate(plan, seconds_per_copy, concurrency):
+    """
+    Returns the time the copies of PLAN take, each SECONDS_PER_COPY, with at
+    most CONCURRENCY at once.
+    """
+    now = 0.0
+    started = 0
+    running = []
+    while True:
+        while len(running) < concurrency:
+            transfer = plan.next_transfer()
+            if transfer is None:
+                break
+            # copies ending at the same time end in the order they started
+            heapq.heappush(running, (now + seconds_per_copy, started, transfer))
+            started += 1
+        if not running:
+            return now
+        now, _, (source, target) = heapq.heappop(running)
+        plan.done(source, target, True)
+
+
+def benchmark(count, mode, args):
+    hosts = ['bench-{0:05d}.example.com'.format(index) for index in range(count)]
+    relay = mode == 'relay'
+    plan = RelayPlan(hosts, relay=relay, fanout=args.fanout)
+    concurrency = min(args.concurrency or count, count)
+    sends = args.fanout if relay else concurrency
+    single = args.size / args.bandwidth
+    makespan = simulate(plan, single * sends, concurrency)
+
+    result = {
+        'benchmark': 'pscp',
+        'hosts': count,
+        'mode': mode,
+        'size_mb': args.size,
+        'bandwidth_mb_per_second': args.bandwidth,
+        'concurrency': args.concurrency,
+        'fanout': args.fanout if relay else None,
+        'seconds': round(makespan, 1),
+        'copies_of_one': round(makespan / single, 1),
+        'depth': max(plan.depth(host) for host in hosts),
+        'mb_sent_from_here': sum(args.size for host in hosts if plan.sources[host] is LOCAL),
+    }
+    print(json.dumps(result, sort_keys=True))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--hosts', type=int, action='append', default=[],
+                        help='Number of hosts; can be repeated. (default: {0})'.format(
+                            ', '.join(str(c) for c in DEFAULT_HOST_COUNTS)))
+    parser.add_argument('--size', type=float, default=500,
+                        help='MB of the file (default: %(default)s)')
+    parser.add_argument('--bandwidth', type=float, default=100,
+                        help='MB/s each host sends at (default: %(default)s)')
+    parser.add_argument('--concurrency', type=int, default=50,
+                        help='pscp --concurrency, 0 for all hosts at once (default: %(default)s)')
+    parser.add_argument('--fanout', type=int, default=2,
+                        help='pscp --fanout (default: %(default)s)')
+    args = parser.parse_args()
+
+    for count in args.hosts or DEFAULT_HOST_COUNTS:
+        for mode in MODES:
+            benchmark(count, mode, args)
+
+
+if __name__ == '__main__':
+    main()
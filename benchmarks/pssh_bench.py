@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+"""
+Scale benchmark of krux-ec2-pssh and krux-ec2-pssh2 against a fake ssh.
+
+Both tools run with an explicit host list and benchmarks.fake_ssh first on
+PATH, for each host count. For every run it records the time to the first
+line of output, the makespan, and the peak RSS, peak open file descriptors and
+CPU time of the driving process alone (sampled from /proc, so Linux only),
+plus the CPU time of everything it ran.
+
+Usage: python -m benchmarks.pssh_bench [--hosts N ...] [--tool NAME ...]
+           [--latency S] [--fail-rate F] [--hang-rate F] [--output FILE]
+
+Runs that don't finish within --run-timeout are killed and reported as such;
+with --hang-rate > 0 that is expected of tools that have no timeout.
+"""
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import, print_function
+import argparse
+import json
+import os
+import platform
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+#
+# Internal libraries
+#
+
+from benchmarks import fake_ssh
+
+
+DEFAULT_HOST_COUNTS = [10, 100, 1000, 5000]
+SAMPLE_INTERVAL = 0.02
+
+
+def tool_commands(hosts, args, directory):
+    """
+    Returns the (name, argv) of every benchmarked tool. Their state files and
+    the host history of pssh2 are kept in DIRECTORY.
+    """
+    python = sys.executable
+    host_list = ','.join(hosts)
+    pssh2_limits = ['--order', args.order,
+                    '--history', os.path.join(directory, 'pssh2-history.json'),
+                    '--state', os.path.join(directory, 'pssh2-state.jsonl'),
+                    '--flush-interval', str(args.flush_interval)]
+    if args.timeout is not None:
+        pssh2_limits += ['--timeout', str(args.timeout)]
+    if args.deadline is not None:
+        pssh2_limits += ['--deadline', str(args.deadline)]
+    return [
+        ('krux-ec2-pssh', [python, '-m', 'aws_analysis_tools.cli.pssh', '--no-color',
+                           '--host', host_list,
+                           '--state', os.path.join(directory, 'pssh-state.jsonl'), args.command]),
+        ('krux-ec2-pssh2', [python, '-m', 'aws_analysis_tools.cli.pssh2',
+                            '--concurrency', str(args.concurrency), '--hosts', host_list]
+         + pssh2_limits + [args.command]),
+    ]
+
+
+class ProcSampler(threading.Thread):
+    """
+    Samples the peak RSS, open file descriptors and CPU time of one process
+    from /proc until it exits.
+    """
+
+    def __init__(self, pid, interval=SAMPLE_INTERVAL):
+        super(ProcSampler, self).__init__(name='sampler-{0}'.format(pid))
+        self.daemon = True
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss_kb = None
+        self.peak_fds = None
+        self.cpu_seconds = None
+        self.done = threading.Event()
+        self._ticks = float(os.sysconf('SC_CLK_TCK')) if hasattr(os, 'sysconf') else 100.0
+
+    def sample(self):
+        base = '/proc/{0}'.format(self.pid)
+        with open(base + '/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    self.peak_rss_kb = max(self.peak_rss_kb or 0, int(line.split()[1]))
+        self.peak_fds = max(self.peak_fds or 0, len(os.listdir(base + '/fd')))
+        with open(base + '/stat') as f:
+            # utime and stime of the process itself, after the parenthesised name
+            fields = f.read().rsplit(')', 1)[1].split()
+        self.cpu_seconds = (int(fields[11]) + int(fields[12])) / self._ticks
+
+    def run(self):
+        while not self.done.is_set():
+            try:
+                self.sample()
+            except (IOError, OSError, IndexError, ValueError):
+                # gone, or a zombie without a status
+                break
+            self.done.wait(self.interval)
+
+
+def run_tool(argv, env, timeout):
+    """
+    Runs ARGV and returns a dict of its measurements.
+    """
+    start = time.time()
+    proc = subprocess.Popen(argv, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            preexec_fn=os.setsid)
+    sampler = ProcSampler(proc.pid)
+    sampler.start()
+
+    first_output = []
+    counts = {'stdout': 0, 'stderr': 0}
+    errors = []
+
+    def _read(name, stream):
+        for line in iter(stream.readline, b''):
+            if name == 'stdout' and not first_output:
+                first_output.append(time.time() - start)
+            counts[name] += 1
+            if name == 'stderr':
+                errors.append(line)
+                del errors[:-20]
+
+    readers = [
+        threading.Thread(target=_read, args=('stdout', proc.stdout)),
+        threading.Thread(target=_read, args=('stderr', proc.stderr)),
+    ]
+    for reader in readers:
+        reader.daemon = True
+        reader.start()
+
+    timed_out = False
+    deadline = start + timeout
+    while True:
+        pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+        if pid:
+            break
+        if time.time() > deadline:
+            timed_out = True
+            os.killpg(proc.pid, signal.SIGKILL)
+            pid, status, rusage = os.wait4(proc.pid, 0)
+            break
+        time.sleep(SAMPLE_INTERVAL)
+    makespan = time.time() - start
+    proc.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+
+    sampler.done.set()
+    sampler.join()
+    try:
+        # the ssh children of a finished run are gone already; this is for hung ones
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        pass
+    for reader in readers:
+        reader.join(5)
+
+    return {
+        'exit_status': proc.returncode,
+        'timed_out': timed_out,
+        'first_output_seconds': round(first_output[0], 3) if first_output else None,
+        'makespan_seconds': round(makespan, 3),
+        'peak_rss_kb': sampler.peak_rss_kb,
+        'peak_fds': sampler.peak_fds,
+        'driver_cpu_seconds': sampler.cpu_seconds,
+        # rusage of the reaped child covers its reaped children too
+        'total_cpu_seconds': round(rusage.ru_utime + rusage.ru_stime, 3),
+        'stdout_lines': counts['stdout'],
+        'stderr_lines': counts['stderr'],
+        'stderr_tail': [e.decode('utf-8', 'replace').rstrip() for e in errors[-3:]],
+    }
+
+
+def benchmark(count, tools, args):
+    hosts = ['bench-{0:05d}.example.com'.format(index) for index in range(count)]
+    plans = fake_ssh.make_plans(
+        hosts, latency=args.latency, sigma=args.sigma, lines=args.lines,
+        fail_rate=args.fail_rate, hang_rate=args.hang_rate, seed=args.seed,
+    )
+    directory = tempfile.mkdtemp(prefix='pssh-bench-')
+    results = []
+    try:
+        fake_ssh.install(directory, plans, line_bytes=args.line_bytes)
+        env = dict(os.environ)
+        env['PATH'] = directory + os.pathsep + env.get('PATH', '')
+        env['PYTHONPATH'] = os.pathsep.join(
+            [os.getcwd()] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else [])
+        )
+
+        for name, argv in tool_commands(hosts, args, directory):
+            if tools and name not in tools:
+                continue
+            if name == 'krux-ec2-pssh2':
+                # Earlier runs fill the history the order is based on
+                for _ in range(args.warmup):
+                    run_tool(argv, env, args.run_timeout)
+
+            result = {
+                'benchmark': 'pssh',
+                'tool': name,
+                'hosts': count,
+                'concurrency': args.concurrency if name == 'krux-ec2-pssh2' else count,
+                'latency': args.latency,
+                'sigma': args.sigma,
+                'lines': args.lines,
+                'line_bytes': args.line_bytes,
+                'fail_rate': args.fail_rate,
+                'hang_rate': args.hang_rate,
+            }
+            if name == 'krux-ec2-pssh2':
+                result.update(timeout=args.timeout, deadline=args.deadline, order=args.order,
+                              warmup=args.warmup)
+            result.update(run_tool(argv, env, args.run_timeout))
+            results.append(result)
+            print(json.dumps(result, sort_keys=True))
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--hosts', type=int, action='append', default=[],
+                        help='Number of hosts; can be repeated. (default: {0})'.format(
+                            ', '.join(str(c) for c in DEFAULT_HOST_COUNTS)))
+    parser.add_argument('--tool', action='append', default=[],
+                        help='Only benchmark this tool; can be repeated')
+    parser.add_argument('--command', default='uptime', help='Command to run (default: %(default)s)')
+    parser.add_argument('--concurrency', type=int, default=10,
+                        help='pssh2 --concurrency (default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='Median seconds before a host responds (default: %(default)s)')
+    parser.add_argument('--sigma', type=float, default=0.5,
+                        help='Shape of the log-normal latency distribution (default: %(default)s)')
+    parser.add_argument('--lines', type=int, default=10,
+                        help='Lines of output per host (default: %(default)s)')
+    parser.add_argument('--line-bytes', type=int, default=80,
+                        help='Bytes per line of output (default: %(default)s)')
+    parser.add_argument('--fail-rate', type=float, default=0.0,
+                        help='Fraction of hosts that fail to connect (default: %(default)s)')
+    parser.add_argument('--hang-rate', type=float, default=0.0,
+                        help='Fraction of hosts that never finish (default: %(default)s)')
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='pssh2 --timeout, seconds per host (default: none)')
+    parser.add_argument('--deadline', type=float, default=None,
+                        help='pssh2 --deadline, seconds for all hosts (default: none)')
+    parser.add_argument('--order', default='slowest',
+                        help='pssh2 --order (default: %(default)s)')
+    parser.add_argument('--flush-interval', type=float, default=0.1,
+                        help='pssh2 --flush-interval (default: %(default)s)')
+    parser.add_argument('--warmup', type=int, default=0,
+                        help='pssh2 runs before the measured one, to fill its host history '
+                             '(default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--run-timeout', type=float, default=600,
+                        help='Seconds before a run is killed (default: %(default)s)')
+    parser.add_argument('--output', default=None,
+                        help='Write all results to this JSON file')
+    args = parser.parse_args()
+
+    results = []
+    for count in args.hosts or DEFAULT_HOST_COUNTS:
+        results.extend(benchmark(count, args.tool, args))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'timestamp': int(time.time()),
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
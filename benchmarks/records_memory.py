@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+"""
+Measures the memory kept per instance by boto objects, boto3 response dicts
+and InstanceRecords, for a synthetic fleet.
+
+Usage: python -m benchmarks.records_memory [--count N] [--count N ...]
+
+Prints one JSON object per (count, source) pair.
+"""
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import, print_function
+import argparse
+import copy
+import gc
+import json
+import tracemalloc
+import xml.sax
+
+#
+# Third party libraries
+#
+
+import boto.handler
+from boto.ec2.instance import Reservation
+from boto.resultset import ResultSet
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.records import InstanceRecord
+from benchmarks.fleet import make_instances, describe_instances_xml
+
+
+def _parse_boto(body):
+    reservations = ResultSet([('item', Reservation)])
+    xml.sax.parseString(body, boto.handler.XmlHandler(reservations, None))
+    return reservations
+
+
+def _measure(build):
+    """
+    Returns (result, bytes retained by result) for BUILD().
+    """
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    return result, tracemalloc.get_traced_memory()[0] - before
+
+
+def run(count):
+    instances = make_instances(count, per_reservation=4)
+    body = describe_instances_xml(instances)
+    results = []
+
+    def boto_objects():
+        return _parse_boto(body)
+
+    def boto_records():
+        reservations = _parse_boto(body)
+        return [InstanceRecord.from_boto(i, region='us-east-1')
+                for r in reservations for i in r.instances]
+
+    def boto3_dicts():
+        return copy.deepcopy(instances)
+
+    def boto3_records():
+        return [InstanceRecord.from_dict(i, region='us-east-1') for i in instances]
+
+    for source, build in [('boto', boto_objects), ('boto+records', boto_records),
+                          ('boto3', boto3_dicts), ('boto3+records', boto3_records)]:
+        result, retained = _measure(build)
+        del result
+        results.append({
+            'benchmark': 'records_memory',
+            'source': source,
+            'count': count,
+            'bytes_total': retained,
+            'bytes_per_instance': round(float(retained) / count, 1),
+        })
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--count', type=int, action='append', default=[],
+                        help='Number of instances (default: 1000 and 10000)')
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    for count in args.count or [1000, 10000]:
+        for result in run(count):
+            print(json.dumps(result, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
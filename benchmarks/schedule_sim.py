@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+"""
+Simulated makespan of krux-ec2-pssh2 runs in name, slowest-first and zone
+order.
+
+Each host's duration is drawn as by benchmarks.fake_ssh, and varies from run
+to run by a log-normal factor (--noise). A first run in name order fills a
+HostHistory, and the following --runs runs are simulated in each order, with
+the history updated after each as pssh2 does. A run is simulated as pssh2's
+pool runs it: each host starts on the first slot to free up.
+
+Usage: python -m benchmarks.schedule_sim [--hosts N ...] [--concurrency C ...]
+           [--sigma S] [--noise S] [--zones Z]
+
+Prints one JSON object per (hosts, concurrency, order), with the mean
+makespan, its ratio to the lower bound max(longest host, total / slots), and
+the most hosts run at once in one zone.
+"""
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import, division, print_function
+import argparse
+import heapq
+import json
+import math
+import random
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.schedule import HostHistory, order_hosts, ORDERS
+from benchmarks import fake_ssh
+
+
+DEFAULT_HOST_COUNTS = [100, 1000, 5000]
+DEFAULT_CONCURRENCIES = [10, 50]
+
+
+def simulate(order, durations, concurrency, zones):
+    """
+    Returns the makespan of running the hosts in ORDER with DURATIONS, a dict
+    of seconds by host, on CONCURRENCY slots, and the most hosts run at once
+    in one of their ZONES.
+    """
+    slots = [0.0] * min(concurrency, len(order))
+    events = []
+    for host in order:
+        start = heapq.heappop(slots)
+        finish = start + durations[host]
+        heapq.heappush(slots, finish)
+        events.append((start, 1, zones[host]))
+        events.append((finish, -1, zones[host]))
+
+    running = {}
+    peak = 0
+    # ends sort before starts at the same time
+    for _, change, zone in sorted(events):
+        running[zone] = running.get(zone, 0) + change
+        peak = max(peak, running[zone])
+    return max(slots), peak
+
+
+def benchmark(count, concurrency, args):
+    hosts = ['bench-{0:05d}.example.com'.format(index) for index in range(count)]
+    plans = fake_ssh.make_plans(hosts, latency=args.latency, sigma=args.sigma, seed=args.seed)
+    base = dict((plan.host, plan.latency) for plan in plans)
+    rng = random.Random(args.seed + 1)
+    zones = dict((host, 'zone-{0}'.format(rng.randrange(args.zones))) for host in hosts)
+
+    def draw():
+        return dict((host, seconds * math.exp(rng.gauss(0, args.noise)))
+                    for host, seconds in base.items())
+
+    first = draw()
+    results = []
+    for order in ORDERS:
+        # never saved
+        history = HostHistory(None)
+        history.record_run(first)
+        makespans = []
+        ratios = []
+        peaks = []
+        for _ in range(args.runs):
+            durations = draw()
+            ordered = order_hosts(hosts, order, history.estimates(hosts), zones)
+            makespan, peak = simulate(ordered, durations, concurrency, zones)
+            bound = max(max(durations.values()), sum(durations.values()) / concurrency)
+            makespans.append(makespan)
+            ratios.append(makespan / bound)
+            peaks.append(peak)
+            history.record_run(durations)
+
+        result = {
+            'benchmark': 'schedule',
+            'hosts': count,
+            'concurrency': concurrency,
+            'order': order,
+            'latency': args.latency,
+            'sigma': args.sigma,
+            'noise': args.noise,
+            'zones': args.zones,
+            'runs': args.runs,
+            'makespan_seconds': round(sum(makespans) / len(makespans), 3),
+            'makespan_over_bound': round(sum(ratios) / len(ratios), 3),
+            'peak_hosts_per_zone': max(peaks),
+        }
+        results.append(result)
+        print(json.dumps(result, sort_keys=True))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--hosts', type=int, action='append', default=[],
+                        help='Number of hosts; can be repeated. (default: {0})'.format(
+                            ', '.join(str(c) for c in DEFAULT_HOST_COUNTS)))
+    parser.add_argument('--concurrency', type=int, action='append', default=[],
+                        help='pssh2 --concurrency; can be repeated. (default: {0})'.format(
+                            ', '.join(str(c) for c in DEFAULT_CONCURRENCIES)))
+    parser.add_argument('--latency', type=float, default=1.0,
+                        help='Median seconds a host takes (default: %(default)s)')
+    parser.add_argument('--sigma', type=float, default=1.0,
+                        help='Shape of the log-normal duration distribution (default: %(default)s)')
+    parser.add_argument('--noise', type=float, default=0.2,
+                        help='Shape of the log-normal variation of a host between runs '
+                             '(default: %(default)s)')
+    parser.add_argument('--zones', type=int, default=3,
+                        help='Number of availability zones (default: %(default)s)')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='Runs simulated per order (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for count in args.hosts or DEFAULT_HOST_COUNTS:
+        for concurrency in args.concurrency or DEFAULT_CONCURRENCIES:
+            benchmark(count, concurrency, args)
+
+
+if __name__ == '__main__':
+    main()
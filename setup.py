@@ -36,17 +36,25 @@ setup(
     packages         = find_packages(),
     # dependencies are named in requirements.pip
     install_requires = REQUIREMENTS,
+    # --export needs pyarrow for Parquet and Arrow files, numpy for NPZ
+    extras_require   = {
+        'parquet': ['pyarrow'],
+        'npz':     ['numpy'],
+    },
     entry_points     = {
         'console_scripts': [
             'krux-search-ec2-tags    = aws_analysis_tools.cli.search_ec2_tags:main',
             'krux-update-ec2-tags    = aws_analysis_tools.cli.update_ec2_tags:main',
             'krux-ec2-volumes        = aws_analysis_tools.cli.volumes:list_volumes',
+            'krux-ec2-snapshots      = aws_analysis_tools.cli.snapshots:list_snapshots',
             'krux-ec2-instances      = aws_analysis_tools.cli.instances:main',
             'krux-ec2-pssh           = aws_analysis_tools.cli.pssh:main',
             'krux-ec2-pssh2          = aws_analysis_tools.cli.pssh2:main',
+            'krux-ec2-pscp           = aws_analysis_tools.cli.pscp:main',
             'krux-ec2-events         = aws_analysis_tools.ec2_events.cli:main',
             'krux-ec2-test-provision = aws_analysis_tools.cli.test_provision:main',
             'krux-ec2-ip             = aws_analysis_tools.cli.convert_ip:main',
+            'krux-ec2-inventory      = aws_analysis_tools.cli.inventory:main',
         ],
     },
 )
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import unittest
+from array import array
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.aggregate import (
+    GroupCounter, GroupByError, Group, count_codes, parse_group_keys, top_groups,
+)
+from aws_analysis_tools.records import InstanceRecord
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def _instances():
+    return [
+        InstanceRecord('i-{0}'.format(index), region='us-east-1',
+                       instance_type=('m4.large', 'c4.xlarge', 't2.micro')[index % 3],
+                       state='running', tags={'cluster_name': 'kafka'} if index % 2 else {})
+        for index in range(11)
+    ]
+
+
+class GroupCounterTest(unittest.TestCase):
+
+    def test_groups(self):
+        """
+        Instances are counted per distinct combination of the fields, across
+        batches, the most common first and ties in the order of their values
+        """
+        counter = GroupCounter(parse_group_keys('type,tag:cluster_name'), batch_size=4)
+        counter.write(_instances()[:5])
+        counter.write(_instances()[5:])
+
+        self.assertEqual([
+            Group(('c4.xlarge', None), 2),
+            Group(('c4.xlarge', 'kafka'), 2),
+            Group(('m4.large', None), 2),
+            Group(('m4.large', 'kafka'), 2),
+            Group(('t2.micro', None), 2),
+            Group(('t2.micro', 'kafka'), 1),
+        ], counter.groups())
+
+        counter = GroupCounter(parse_group_keys('state'))
+        counter.write(_instances())
+        self.assertEqual([Group(('running',), 11)], counter.groups())
+
+    def test_count(self):
+        """
+        Without fields, all instances are one group
+        """
+        counter = GroupCounter(())
+        counter.write(_instances())
+
+        self.assertEqual([Group((), 11)], counter.groups())
+        self.assertEqual([], GroupCounter(()).groups())
+
+    @unittest.skipUnless(numpy, 'needs numpy')
+    def test_count_codes(self):
+        """
+        Counting with numpy gives the same counts as without
+        """
+        codes = [array('i', [0, 1, 0, -1, 2, 0]), array('i', [3, -1, 3, 0, 1, 3])]
+
+        self.assertEqual({(0, 3): 3, (1, -1): 1, (-1, 0): 1, (2, 1): 1},
+                         count_codes(codes, [3, 4]))
+        self.assertEqual(count_codes(codes, [3, 4]), count_codes(codes, [3, 4], np=numpy))
+
+    def test_parse_group_keys(self):
+        """
+        Only known fields and tags can be grouped by
+        """
+        self.assertEqual(('type', 'tag:cluster_name'), parse_group_keys(' type, tag:cluster_name'))
+        self.assertEqual((), parse_group_keys(None))
+        with self.assertRaises(GroupByError):
+            parse_group_keys('type,vpc')
+        with self.assertRaises(GroupByError):
+            parse_group_keys('tag:')
+
+    def test_top_groups(self):
+        """
+        The groups after the top ones are counted together
+        """
+        groups = [Group(('a',), 5), Group(('b',), 3), Group(('c',), 1)]
+
+        self.assertEqual(([Group(('a',), 5)], 4), top_groups(groups, 1))
+        self.assertEqual((groups, 0), top_groups(groups))
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.changes import (
+    iter_changes, read_snapshot, record_changes, write_snapshot, SnapshotError, ADDED, REMOVED,
+    CHANGED,
+)
+from aws_analysis_tools.records import InstanceRecord
+
+
+def _instance(instance_id, state='running', instance_type='m4.large', **tags):
+    tags.setdefault('Name', 'web-{0}'.format(instance_id))
+    return InstanceRecord(instance_id, region='us-east-1', instance_type=instance_type,
+                          zone='us-east-1a', groups=['webapp'], state=state,
+                          private_ip_address='10.0.0.1', tags=tags)
+
+
+class ChangesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        """
+        Snapshots, gzipped or not, hold the records as they were
+        """
+        records = [_instance('i-1'), _instance('i-2', cluster_name='webapp')]
+
+        for name in ('instances.snapshot', 'instances.snapshot.gz'):
+            path = os.path.join(self.directory, name)
+            self.assertEqual(2, write_snapshot(path, records))
+            self.assertEqual([r.to_dict() for r in records],
+                             [r.to_dict() for r in read_snapshot(path)])
+            self.assertEqual(records[1].tags, read_snapshot(path)[1].tags)
+
+    def test_changes(self):
+        """
+        Added, removed and changed instances are reported, with the fields
+        that changed
+        """
+        path = os.path.join(self.directory, 'instances.snapshot')
+        write_snapshot(path, [
+            _instance('i-1'), _instance('i-2'), _instance('i-3', environment='prod'),
+        ])
+
+        changes = list(iter_changes(path, [
+            _instance('i-1'),
+            _instance('i-3', state='stopped', instance_type='c4.large', environment='staging'),
+            _instance('i-4'),
+        ]))
+
+        self.assertEqual([(REMOVED, 'i-2'), (CHANGED, 'i-3'), (ADDED, 'i-4')],
+                         [(c.change, c.id) for c in changes])
+        self.assertEqual(['instance_type', 'state', 'tag:environment'], changes[1].fields)
+        self.assertEqual('running', changes[1].old.state)
+        self.assertEqual('web-i-2', changes[0].record.name)
+
+    def test_not_a_snapshot(self):
+        """
+        Files that aren't snapshots are refused
+        """
+        path = os.path.join(self.directory, 'instances.txt')
+        with open(path, 'w') as f:
+            f.write('# id  Name\n')
+
+        with self.assertRaises(SnapshotError):
+            list(iter_changes(path, []))
+
+    def test_record_changes(self):
+        """
+        Records in memory are compared the same way, only for the ids given
+        """
+        old = dict((i.id, i) for i in [_instance('i-1'), _instance('i-2'), _instance('i-3')])
+        new = dict((i.id, i) for i in [_instance('i-1'), _instance('i-3', state='stopping'),
+                                       _instance('i-4')])
+
+        self.assertEqual([(REMOVED, 'i-2', []), (CHANGED, 'i-3', ['state']), (ADDED, 'i-4', [])],
+                         [(c.change, c.id, list(c.fields)) for c in record_changes(old, new)])
+        self.assertEqual(['i-3'], [c.id for c in record_changes(old, new, ids=['i-1', 'i-3'])])
@@ -125,6 +125,7 @@ class ConvertIPtest(unittest.TestCase):
 
         self.assertIn('ip_address', self.app.args)
         self.assertIn('private', self.app.args)
+        self.assertIn('regions', self.app.args)
 
     @patch('aws_analysis_tools.cli.convert_ip.Application.find_instances')
     @patch('aws_analysis_tools.cli.convert_ip.Application.output_info')
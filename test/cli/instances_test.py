@@ -44,6 +44,41 @@ class InstancesTest(unittest.TestCase):
         self.assertIn('exclude_zone', app.args)
         self.assertIn('state', app.args)
         self.assertIn('exclude_state', app.args)
+        self.assertIn('regions', app.args)
+        self.assertIn('region_concurrency', app.args)
+        self.assertIn('region_timeout', app.args)
+        self.assertIn('profile', app.args)
+        self.assertIn('snapshot', app.args)
+        self.assertIn('diff', app.args)
+        self.assertIn('export', app.args)
+        self.assertIn('group_by', app.args)
+        self.assertIn('count', app.args)
+        self.assertIn('top', app.args)
+        self.assertIn('where', app.args)
+        self.assertIn('watch', app.args)
+        self.assertIn('watch_full', app.args)
+
+    def test_watch_asks_ec2(self):
+        """
+        --watch fetches the instances from EC2, never from the inventory daemon
+        """
+        app = Application()
+        app.args.watch = 5
+        app.args.watch_full = 10
+        include_filter = MagicMock()
+        include_filter.to_filter.return_value = []
+
+        with patch.object(app, 'lookup_instances') as lookup, \
+                patch.object(app, 'fetch_instances', return_value=[]) as fetch, \
+                patch.object(app, 'get_predicate', return_value=None), \
+                patch.object(app, 'output_table'), \
+                patch.object(sys.stdout, 'isatty', return_value=False), \
+                patch('aws_analysis_tools.cli.instances.time.sleep',
+                      side_effect=KeyboardInterrupt):
+            app.watch_instances(include_filter)
+
+        fetch.assert_called_once_with(include_filter)
+        self.assertFalse(lookup.called)
 
     def test_main(self):
         """
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import json
+import unittest
+from optparse import Values
+
+#
+# Third party libraries
+#
+
+from mock import MagicMock
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.cli.snapshots import (SnapshotPrinter, build_regexes, filter_snapshots,
+                                              recheck_volume_ids)
+from aws_analysis_tools.records import SnapshotRecord
+
+
+def _snapshots():
+    return [
+        SnapshotRecord('snap-1', region='us-east-1', volume_id='vol-1', size=100,
+                       description='Daily backup', tags={'Name': 'web001-data'}),
+        SnapshotRecord('snap-2', region='us-east-1', volume_id='vol-2', size=8,
+                       description='Created by CreateImage', tags={'Name': 'kafka001-data'}),
+        SnapshotRecord('snap-3', region='us-east-1', volume_id='vol-ffffffff', size=30,
+                       description='Copied for snap-1'),
+        SnapshotRecord('snap-4', region='us-east-1', volume_id=None, size=1),
+    ]
+
+
+class SnapshotsTest(unittest.TestCase):
+
+    def test_filter_snapshots(self):
+        """
+        Snapshots are included and excluded by regexes like volumes
+        """
+        options = Values({'name': 'data', 'exclude_description': 'createimage'})
+
+        self.assertEqual(['snap-1'], [
+            s.id for s in filter_snapshots(_snapshots(), build_regexes(options))])
+
+    def test_orphans(self):
+        """
+        Snapshots of volumes that no longer exist are flagged, and only they
+        are printed with --orphans; snapshots without a known volume aren't
+        """
+        out = MagicMock()
+        printer = SnapshotPrinter(Values({'format': 'jsonl', 'orphans': True}), out=out)
+
+        printer.write(_snapshots(), {'vol-1'})
+
+        lines = ''.join(c[0][0] for c in out.write.call_args_list).splitlines()
+        self.assertEqual([('snap-2', True)], [
+            (r['id'], r['orphan']) for r in map(json.loads, lines)])
+        self.assertEqual((4, 139, 1, 8), (printer.count, printer.size, printer.orphans,
+                                          printer.orphaned_size))
+
+    def test_unknown_volume(self):
+        """
+        Snapshots of copies and AMIs have no volume to be orphaned by
+        """
+        out = MagicMock()
+        printer = SnapshotPrinter(Values({'format': 'jsonl', 'orphans': False}), out=out)
+
+        printer.write(_snapshots(), {'vol-1'})
+
+        lines = ''.join(c[0][0] for c in out.write.call_args_list).splitlines()
+        self.assertEqual([False, True, None, None], [json.loads(l)['orphan'] for l in lines])
+
+    def test_recheck(self):
+        """
+        The volumes of snapshots that look orphaned are looked up again, only for known ids
+        """
+        conn = MagicMock()
+        conn.region.name = 'us-east-1'
+        conn.get_all_volumes.return_value = [MagicMock(id='vol-2')]
+        volume_ids = {'vol-1'}
+
+        recheck_volume_ids(conn, volume_ids)(_snapshots())
+
+        conn.get_all_volumes.assert_called_once_with(filters={'volume-id': ['vol-2']})
+        self.assertEqual({'vol-1', 'vol-2'}, volume_ids)
+
+    def test_abandoned(self):
+        """
+        Nothing is printed of a region once it is abandoned, or after the totals
+        """
+        out = MagicMock()
+        printer = SnapshotPrinter(Values({'format': 'jsonl', 'orphans': False}), out=out)
+
+        printer.abandon('us-east-1')
+        printer.write(_snapshots(), {'vol-1'}, 'us-east-1')
+        printer.write(_snapshots(), {'vol-1'}, 'us-west-2')
+        printer.close()
+        printer.write(_snapshots(), {'vol-1'}, 'us-west-2')
+
+        self.assertEqual(1, out.write.call_count)
+        self.assertEqual(4, printer.count)
+        self.assertTrue(printer.is_abandoned('us-west-2'))
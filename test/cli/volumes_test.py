@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import unittest
+
+#
+# Third party libraries
+#
+
+from mock import MagicMock
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.cli.volumes import RegionWriter
+from aws_analysis_tools.columnar import ColumnarWriter, volume_columns
+from aws_analysis_tools.records import VolumeRecord
+
+
+def _volumes(region):
+    return [VolumeRecord('vol-1', region=region, size=100),
+            VolumeRecord('vol-2', region=region, size=8)]
+
+
+class RegionWriterTest(unittest.TestCase):
+
+    def test_abandoned(self):
+        """
+        Nothing is written of a region once it is abandoned, or after the export is closed
+        """
+        writer = ColumnarWriter(MagicMock(), volume_columns(()))
+        region_writer = RegionWriter(writer)
+
+        region_writer.abandon('us-east-1')
+        region_writer.write(_volumes('us-east-1'), 'us-east-1')
+        region_writer.write(_volumes('us-west-2'), 'us-west-2')
+        writer.close()
+        region_writer.write(_volumes('us-west-2'), 'us-west-2')
+
+        self.assertEqual(2, writer.rows)
+        self.assertTrue(region_writer.is_abandoned('us-west-2'))
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.columnar import (
+    ColumnarWriter, ExportError, open_writer, read_npz, get_format, instance_columns,
+    volume_columns, NULL_CODE,
+)
+from aws_analysis_tools.records import InstanceRecord, VolumeRecord
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+def _instances(count):
+    return [
+        InstanceRecord('i-{0}'.format(index), region='us-east-1', instance_type='m4.large',
+                       zone='us-east-1' + 'ab'[index % 2], state='running',
+                       tags={'Name': 'web{0:03d}'.format(index), 'cluster_name': 'webapp'}
+                       if index % 3 else {})
+        for index in range(count)
+    ]
+
+
+class _ListSink(object):
+
+    def __init__(self):
+        self.batches = []
+        self.dictionaries = None
+
+    def write_batch(self, columns):
+        self.batches.append(dict(
+            (c.name, (list(c.values), list(c.dictionary or ()))) for c in columns))
+
+    def close(self, dictionaries):
+        self.dictionaries = dictionaries
+
+    def abort(self):
+        pass
+
+
+class ColumnarWriterTest(unittest.TestCase):
+
+    def test_batches(self):
+        """
+        Records are handed to the sink in batches, with low-cardinality strings
+        as codes into a dictionary shared by all batches
+        """
+        sink = _ListSink()
+        with ColumnarWriter(sink, instance_columns(('Name', 'cluster_name')), batch_size=4) as w:
+            w.write(_instances(3))
+            w.write(_instances(7)[3:])
+
+        self.assertEqual(7, w.rows)
+        self.assertEqual([4, 3], [len(b['id'][0]) for b in sink.batches])
+        self.assertEqual(([0, 1, 0], ['us-east-1a', 'us-east-1b']), sink.batches[1]['zone'])
+        self.assertEqual([0, 0, NULL_CODE], sink.batches[1]['tag:cluster_name'][0])
+        self.assertEqual(['web004', 'web005', None], sink.batches[1]['tag:Name'][0])
+        self.assertEqual(['webapp'], sink.dictionaries['tag:cluster_name'])
+
+    def test_write_after_close(self):
+        """
+        Records written once the writer is closed are dropped
+        """
+        sink = _ListSink()
+        with ColumnarWriter(sink, instance_columns(()), batch_size=4) as w:
+            w.write(_instances(2))
+        w.write(_instances(3))
+        w.close()
+
+        self.assertEqual(2, w.rows)
+        self.assertEqual([2], [len(b['id'][0]) for b in sink.batches])
+
+    def test_get_format(self):
+        """
+        The format comes from the file name unless given
+        """
+        self.assertEqual('parquet', get_format('fleet.parquet'))
+        self.assertEqual('arrow', get_format('fleet.arrow'))
+        self.assertEqual('arrows', get_format('fleet.arrows'))
+        self.assertEqual('npz', get_format('fleet.out', 'npz'))
+        with self.assertRaises(ExportError):
+            get_format('fleet.csv')
+
+
+class ExportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    @unittest.skipUnless(numpy, 'needs numpy')
+    def test_npz(self):
+        """
+        An NPZ export reads back as whole columns
+        """
+        path = os.path.join(self.directory, 'volumes.npz')
+        with open_writer(path, volume_columns(), batch_size=2) as writer:
+            writer.write([
+                VolumeRecord('vol-{0}'.format(index), zone='us-east-1a', status='available',
+                             size=index * 100) for index in range(5)
+            ])
+
+        columns = read_npz(path)
+
+        self.assertEqual(['vol-0', 'vol-4'], [columns['id'][0], columns['id'][-1]])
+        self.assertEqual([0, 100, 200, 300, 400], list(columns['size']))
+        codes, dictionary = columns['status']
+        self.assertEqual(['available'] * 5, list(dictionary[codes]))
+
+    @unittest.skipUnless(pyarrow, 'needs pyarrow')
+    def test_parquet(self):
+        """
+        A Parquet export has dictionary encoded columns, with nulls for missing
+        values, and no temporary file is left behind
+        """
+        path = os.path.join(self.directory, 'instances.parquet')
+        with open_writer(path, instance_columns(('Name', 'cluster_name')), batch_size=4) as writer:
+            writer.write(_instances(10))
+
+        table = pyarrow.parquet.read_table(path)
+
+        self.assertEqual(10, table.num_rows)
+        self.assertEqual([None, 'webapp', 'webapp'], table.column('tag:cluster_name').to_pylist()[:3])
+        self.assertEqual(pyarrow.string(), table.schema.field('zone').type.value_type)
+        self.assertEqual(['instances.parquet'], os.listdir(self.directory))
+
+    @unittest.skipUnless(pyarrow, 'needs pyarrow')
+    def test_arrow(self):
+        """
+        .arrow is an Arrow IPC file and .arrows an Arrow IPC stream, both with the dictionaries
+        growing batch by batch
+        """
+        for name, open_reader in [('instances.arrow', pyarrow.ipc.open_file),
+                                  ('instances.arrows', pyarrow.ipc.open_stream)]:
+            path = os.path.join(self.directory, name)
+            with open_writer(path, instance_columns(('Name', 'cluster_name')),
+                             batch_size=1) as writer:
+                writer.write(_instances(10))
+
+            with pyarrow.OSFile(path) as f:
+                table = open_reader(f).read_all()
+
+            self.assertEqual(10, table.num_rows)
+            self.assertEqual([instance.id for instance in _instances(10)],
+                             table.column('id').to_pylist())
+            self.assertEqual([None, 'webapp', 'webapp'],
+                             table.column('tag:cluster_name').to_pylist()[:3])
+        self.assertEqual(['instances.arrow', 'instances.arrows'],
+                         sorted(os.listdir(self.directory)))
+
+    def test_failed_export(self):
+        """
+        A failed export leaves no file behind
+        """
+        path = os.path.join(self.directory, 'instances.parquet')
+        sink = _ListSink()
+        sink.abort = lambda: setattr(sink, 'aborted', True)
+
+        with self.assertRaises(ValueError):
+            with ColumnarWriter(sink, instance_columns()):
+                raise ValueError('region failed')
+
+        self.assertTrue(sink.aborted)
+        self.assertFalse(os.path.exists(path))
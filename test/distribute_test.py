@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.distribute import (
+    RelayPlan, LOCAL, PRESENT, SHORT, CORRUPT, file_sha256, parse_probe, probe_command,
+    receive_command, relay_command,
+)
+
+HOSTS = ['web-%d' % index for index in range(1, 8)]
+
+
+def _rounds(plan):
+    """
+    Runs PLAN with every transfer taking as long, and returns the number of rounds.
+    """
+    rounds = 0
+    while plan.pending:
+        transfers = []
+        transfer = plan.next_transfer()
+        while transfer is not None:
+            transfers.append(transfer)
+            transfer = plan.next_transfer()
+        for source, target in transfers:
+            plan.done(source, target, True)
+        rounds += 1
+    return rounds
+
+
+class RelayPlanTest(unittest.TestCase):
+
+    def test_relay_tree(self):
+        """
+        Every host having the file sends it on, so the hosts having it double each round
+        """
+        plan = RelayPlan(HOSTS, fanout=1)
+
+        self.assertEqual(3, _rounds(plan))
+        self.assertEqual(set(HOSTS), set(plan.sources))
+        self.assertEqual(3, max(plan.depth(host) for host in HOSTS))
+        self.assertEqual(3, sum(1 for host in HOSTS if plan.sources[host] is LOCAL))
+
+    def test_direct(self):
+        """
+        Without relaying, every host gets the file from here, all at once
+        """
+        plan = RelayPlan(HOSTS, relay=False)
+
+        self.assertEqual(1, _rounds(plan))
+        self.assertEqual([LOCAL] * len(HOSTS), [plan.sources[host] for host in HOSTS])
+
+    def test_failures(self):
+        """
+        A failed transfer is retried from another host until the attempts run out, and a host
+        whose transfers to others fail stops sending the file on
+        """
+        plan = RelayPlan(HOSTS[:4], fanout=2, attempts=2)
+        plan.done(*plan.next_transfer(), ok=True)
+        plan.done(*plan.next_transfer(), ok=True)
+
+        self.assertEqual(('web-1', 'web-3'), plan.next_transfer())
+        plan.done('web-1', 'web-3', False)
+        self.assertEqual(('web-2', 'web-4'), plan.next_transfer())
+        plan.done('web-2', 'web-4', False, source_failed=False)
+        self.assertEqual(('web-2', 'web-3'), plan.next_transfer())
+        plan.done('web-2', 'web-3', False)
+        self.assertEqual(['web-3'], plan.failed)
+
+        self.assertEqual(('web-1', 'web-4'), plan.next_transfer())
+        plan.done('web-1', 'web-4', False)
+        self.assertEqual(['web-3', 'web-4'], plan.failed)
+        self.assertIsNone(plan.next_transfer())
+
+        # web-1 failed twice as a source
+        plan = RelayPlan(['web-2', 'web-3', 'web-4'], fanout=2)
+        plan.holders.append('web-1')
+        plan._sending['web-1'] = 0
+        plan._failures['web-1'] = 2
+        self.assertEqual(LOCAL, plan.next_transfer()[0])
+
+    def test_zones(self):
+        """
+        Hosts get the file from a host in their zone when one is free
+        """
+        zones = {'web-1': 'a', 'web-2': 'b', 'web-3': 'b', 'web-4': 'a'}
+        plan = RelayPlan(['web-1', 'web-2', 'web-3', 'web-4'], fanout=1, zones=zones)
+        plan.done(*plan.next_transfer(), ok=True)
+        plan.done(*plan.next_transfer(), ok=True)
+
+        self.assertEqual([('web-2', 'web-3'), ('web-1', 'web-4')],
+                         [plan.next_transfer(), plan.next_transfer()])
+
+
+class TransferCommandTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data = os.urandom(100000)
+        self.sha256 = hashlib.sha256(self.data).hexdigest()
+        self.dest = os.path.join(self.tmp_dir, "it's", 'artifact.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _bash(self, command, stdin=b''):
+        proc = subprocess.Popen(['/bin/bash', '-c', command], stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, _ = proc.communicate(stdin)
+        return proc.returncode, stdout.decode('utf-8')
+
+    def test_resume(self):
+        """
+        A copy cut short is continued from where it stopped, and the file is there once complete
+        """
+        receive = receive_command(self.dest, len(self.data), self.sha256)
+        probe = probe_command(self.dest, self.sha256)
+
+        self.assertEqual(0, parse_probe(self._bash(probe)[1]))
+        self.assertEqual((SHORT, ''), self._bash(receive, self.data[:30000]))
+        offset = parse_probe(self._bash(probe)[1])
+        self.assertEqual(30000, offset)
+
+        self.assertEqual((0, ''), self._bash(receive, self.data[offset:]))
+        self.assertEqual(PRESENT, parse_probe(self._bash(probe)[1]))
+        self.assertEqual(self.sha256, file_sha256(self.dest))
+        self.assertFalse(os.path.exists(self.dest + '.part'))
+
+    def test_corrupt(self):
+        """
+        A copy with the wrong checksum is removed, so the next one starts over
+        """
+        receive = receive_command(self.dest, len(self.data), self.sha256)
+
+        self.assertEqual(CORRUPT, self._bash(receive, os.urandom(len(self.data)))[0])
+        self.assertFalse(os.path.exists(self.dest))
+        self.assertEqual(0, parse_probe(self._bash(probe_command(self.dest, self.sha256))[1]))
+
+    def test_relay_command(self):
+        """
+        A relay sends the file from the offset to the receiving command on the next host
+        """
+        command = relay_command("/opt/it's", 1000, ['10.0.0.6'], 'cat > /tmp/x')
+
+        self.assertTrue(command.startswith("tail -c +1001 '/opt/it'\"'\"'s' | 'ssh' "))
+        self.assertIn("'10.0.0.6' ", command)
+        self.assertIn('/bin/bash -c', command)
+        self.assertIn("'StrictHostKeyChecking=accept-new'", command)
+        self.assertNotIn('UserKnownHostsFile', command)
+        self.assertEqual(0, parse_probe('garbage'))
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.ec2_events.scanner import Event, KIND_EVENT
+from aws_analysis_tools.ec2_events.state import EventState, NEW, CHANGED, CLEARED
+
+
+class EventStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'state.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _event(self, region='us-east-1', instance_id='i-1', not_before='2018-01-01'):
+        return Event(region, instance_id, region + 'a', KIND_EVENT, 'system-reboot',
+                     description='reboot', not_before=not_before)
+
+    def _rerun(self, events, regions):
+        state = EventState(self.path).load()
+        changes = state.update(events, regions)
+        state.save()
+        return changes
+
+    def test_first_run_reports_everything(self):
+        """
+        Every event is new on the first run
+        """
+        event = self._event()
+        self.assertEqual([(NEW, event)], self._rerun([event], ['us-east-1']))
+
+    def test_unchanged_events_are_not_reported(self):
+        """
+        Events already in the state file are not reported again
+        """
+        self._rerun([self._event()], ['us-east-1'])
+
+        self.assertEqual([], self._rerun([self._event()], ['us-east-1']))
+
+    def test_changed_event(self):
+        """
+        An event whose schedule moved is reported as changed
+        """
+        self._rerun([self._event()], ['us-east-1'])
+        moved = self._event(not_before='2018-02-01')
+
+        self.assertEqual([(CHANGED, moved)], self._rerun([moved], ['us-east-1']))
+
+    def test_cleared_event(self):
+        """
+        Events that disappear from a scanned region are cleared
+        """
+        event = self._event()
+        self._rerun([event], ['us-east-1'])
+
+        self.assertEqual([(CLEARED, event.key)], self._rerun([], ['us-east-1']))
+        self.assertEqual({}, EventState(self.path).load().fingerprints)
+
+    def test_failed_region_keeps_state(self):
+        """
+        Events of a region that was not scanned are kept as they are
+        """
+        event = self._event(region='eu-west-1')
+        self._rerun([event], ['eu-west-1'])
+
+        self.assertEqual([], self._rerun([], ['us-east-1']))
+        self.assertIn(event.key, EventState(self.path).load().fingerprints)
+
+    def test_corrupt_state_file(self):
+        """
+        An unreadable state file is treated as empty
+        """
+        with open(self.path, 'w') as f:
+            f.write('{not json')
+
+        self.assertEqual({}, EventState(self.path).load().fingerprints)
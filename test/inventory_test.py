@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+#
+# Third party libraries
+#
+
+from mock import MagicMock, patch
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools import inventory
+from aws_analysis_tools.inventory import (
+    Inventory, InventoryServer, InventoryClient, InventoryError, Refresher,
+    lookup_instances, configure_inventory, inventory_note,
+)
+from aws_analysis_tools.records import InstanceRecord, VolumeRecord
+
+
+def _instances(region):
+    return [
+        InstanceRecord('i-1', region=region, instance_type='m4.large', zone=region + 'a',
+                       groups=['webapp'], state='running', private_ip_address='10.0.0.1',
+                       tags={'Name': 'web001.example.com', 'cluster_name': 'webapp'}),
+        InstanceRecord('i-2', region=region, instance_type='c4.xlarge', zone=region + 'b',
+                       groups=['kafka'], state='stopped', private_ip_address='10.0.0.2',
+                       tags={'Name': 'kafka001.example.com', 'cluster_name': 'kafka'}),
+    ]
+
+
+def _inventory(clock=None):
+    inv = Inventory(['us-east-1', 'us-west-2'], clock=clock or (lambda: 1000.0))
+    for region in inv.region_names:
+        inv.update(region, _instances(region), [
+            VolumeRecord('vol-1', region=region, zone=region + 'a', status='in-use', size=100,
+                         instance_id='i-1', tags={'Name': 'web001-data'}),
+        ])
+    return inv
+
+
+class InventoryTest(unittest.TestCase):
+
+    def test_query_filters(self):
+        """
+        EC2 filters and their wildcards select records as EC2 would
+        """
+        inv = _inventory()
+
+        self.assertEqual(['i-1', 'i-1'], [
+            r.id for r in inv.query('instances', {'tag:Name': ['*web*', '*db*']})])
+        self.assertEqual(['i-2'], [r.id for r in inv.query(
+            'instances', {'tag-value': ['*kafka*'], 'instance-state-name': ['stopped']},
+            regions=['us-west-2'])])
+        self.assertEqual(['us-east-1'], [r.region for r in inv.query(
+            'instances', [{'Name': 'private-ip-address', 'Values': ['10.0.0.1']}],
+            regions=['us-east-*'])])
+        self.assertEqual([], inv.query('instances', {'tag:Name': ['WEB*']}))
+        self.assertEqual(['vol-1'], [r.id for r in inv.query(
+            'volumes', {'attachment.instance-id': ['i-1']}, regions=['us-east-1'])])
+
+        with self.assertRaises(InventoryError):
+            inv.query('instances', {'vpc-id': ['vpc-1']})
+
+    def test_regions_must_be_loaded_and_fresh(self):
+        """
+        Regions that are unknown, not loaded yet or too old can't be answered
+        """
+        now = [1000.0]
+        inv = _inventory(clock=lambda: now[0])
+        now[0] = 1100.0
+
+        self.assertEqual(4, len(inv.query('instances', max_age=200)))
+        with self.assertRaises(InventoryError):
+            inv.query('instances', max_age=50)
+        with self.assertRaises(InventoryError):
+            inv.query('instances', regions=['eu-west-1'])
+        with self.assertRaises(InventoryError):
+            Inventory(['us-east-1']).query('instances')
+
+    def test_refresher(self):
+        """
+        All regions are loaded at first, then each is due again after its
+        jittered interval; a failed region keeps its records and is retried
+        sooner
+        """
+        fetch = MagicMock(side_effect=lambda region: (_instances(region), []))
+        inv = Inventory(['us-east-1', 'us-west-2'], fetch=fetch)
+        refresher = Refresher(inv, interval=100, jitter=0.1, retry_interval=10, log=MagicMock())
+
+        wait = refresher.refresh_due()
+
+        self.assertEqual(2, fetch.call_count)
+        self.assertTrue(90 <= wait <= 110)
+        self.assertEqual(2, len(inv.query('instances', regions=['us-west-2'])))
+
+        fetch.side_effect = IOError('unreachable')
+        refresher.next_refresh['us-west-2'] = 0
+        wait = refresher.refresh_due()
+
+        self.assertTrue(wait <= 11)
+        self.assertEqual(2, len(inv.query('instances', regions=['us-west-2'])))
+        self.assertIn('unreachable', inv.status()['us-west-2']['error'])
+
+
+class InventoryServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'inventory.sock')
+        self.inventory = _inventory()
+        self.server = InventoryServer(self.path, self.inventory)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        configure_inventory(MagicMock(inventory_socket=None, no_inventory=False,
+                                      inventory_max_age=inventory.DEFAULT_MAX_AGE))
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        """
+        Records come back from the daemon as they were, with the tags asked for
+        """
+        client = InventoryClient(self.path)
+
+        records = client.instances({'tag:Name': ['*web*']}, regions=['us-east-1'],
+                                   tag_keys={'Name'})
+        # Answered from the cache the second time
+        self.assertEqual(records[0].to_dict(), client.instances(
+            {'tag:Name': ['*web*']}, regions=['us-east-1'], tag_keys={'Name'})[0].to_dict())
+
+        self.assertEqual(1, len(records))
+        self.assertEqual(_instances('us-east-1')[0].to_dict(), records[0].to_dict())
+        self.assertEqual({'Name': 'web001.example.com'}, records[0].tags)
+        self.assertEqual(100, client.volumes(regions=['us-west-2'])[0].size)
+        self.assertEqual(2, client.status()['us-east-1']['instances'])
+        client.close()
+
+    def test_lookup_falls_back(self):
+        """
+        lookup_instances() answers from the daemon, which inventory_note() then
+        says, and returns None when the daemon can't answer or isn't running
+        """
+        configure_inventory(MagicMock(inventory_socket=self.path, no_inventory=False,
+                                      inventory_max_age=60))
+
+        self.assertIsNone(lookup_instances({'vpc-id': ['vpc-1']}))
+        self.assertIsNone(inventory_note())
+        self.assertEqual(['i-2'], [r.id for r in lookup_instances(
+            {'tag:cluster_name': ['*kafka*']}, regions=['us-east-1'])])
+        self.assertIn('up to 60s old', inventory_note())
+
+        with patch.dict(os.environ, {inventory.SOCKET_ENV: ''}):
+            configure_inventory(MagicMock(inventory_socket=None, no_inventory=False,
+                                          inventory_max_age=60))
+            self.assertIsNone(lookup_instances())
+
+    def test_stale_socket(self):
+        """
+        A second daemon refuses a socket in use, but replaces one left behind
+        """
+        with self.assertRaises(InventoryError):
+            InventoryServer(self.path, self.inventory)
+
+        path = os.path.join(self.directory, 'stale.sock')
+        InventoryServer(path, self.inventory).socket.close()
+        server = InventoryServer(path, self.inventory)
+        server.server_close()
+        self.assertFalse(os.path.exists(path))
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import unittest
+
+#
+# Third party libraries
+#
+
+from mock import MagicMock
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.output import CoalescingWriter
+from aws_analysis_tools.ssh import AddressedSSHHost
+
+
+class _Clock(object):
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class _Stream(object):
+    """
+    Keeps each write apart.
+    """
+
+    def __init__(self, isatty=False):
+        self.writes = []
+        self._isatty = isatty
+
+    def write(self, data):
+        self.writes.append(data)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return self._isatty
+
+
+class CoalescingWriterTest(unittest.TestCase):
+
+    def test_coalesces(self):
+        """
+        Lines are written together once the buffer is full or the first of them is due
+        """
+        clock = _Clock()
+        stream = _Stream()
+        writer = CoalescingWriter(stream, flush_interval=1, max_buffer=30, clock=clock)
+
+        writer.write('[web-1] one\n')
+        writer.write('[web-2] two\n')
+        self.assertEqual([], stream.writes)
+        writer.write('[web-1] three\n')
+        self.assertEqual(['[web-1] one\n[web-2] two\n[web-1] three\n'], stream.writes)
+
+        writer.write('[web-2] four\n')
+        clock.now += 0.5
+        writer.flush_due()
+        self.assertEqual(1, len(stream.writes))
+        clock.now += 0.5
+        writer.flush_due()
+        self.assertEqual('[web-2] four\n', stream.writes[-1])
+
+        writer.write('[web-1] five\n')
+        writer.close()
+        self.assertEqual('[web-1] five\n', stream.writes[-1])
+        self.assertTrue(writer.closed)
+
+    def test_terminal(self):
+        """
+        On a terminal, or without a flush interval, each line is written as it comes
+        """
+        stream = _Stream(isatty=True)
+        writer = CoalescingWriter(stream)
+        writer.write('[web-1] one\n')
+        writer.write('[web-1] two\n')
+        self.assertTrue(writer.line_buffered)
+        self.assertEqual(['[web-1] one\n', '[web-1] two\n'], stream.writes)
+
+        self.assertTrue(CoalescingWriter(_Stream(), flush_interval=0).line_buffered)
+        self.assertFalse(CoalescingWriter(_Stream()).line_buffered)
+
+    def test_run(self):
+        """
+        run() flushes the lines that are due until the writer is closed
+        """
+        clock = _Clock()
+        stream = _Stream()
+        writer = CoalescingWriter(stream, flush_interval=1, clock=clock)
+        writer.write('[web-1] one\n')
+
+        def sleep(seconds):
+            clock.now += seconds
+            if clock.now >= 101:
+                writer.closed = True
+
+        writer.run(sleep=sleep)
+        self.assertEqual(['[web-1] one\n'], stream.writes)
+
+    def test_host_output(self):
+        """
+        Hosts given an output write each line to it whole, with its prefix and a newline
+        """
+        output = MagicMock()
+        host = AddressedSSHHost('web-1', '10.0.0.5', output=output, use_color=False)
+        host.puts('[out] up 3 days')
+        host.puts(b'[err] disk full\n')
+
+        self.assertEqual([host.full_prefix + ' [out] up 3 days\n',
+                          host.full_prefix + ' [err] disk full\n'],
+                         [call[0][0] for call in output.write.call_args_list])
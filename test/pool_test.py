@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import gc
+import threading
+import time
+import unittest
+import weakref
+
+#
+# Third party libraries
+#
+
+from mock import MagicMock, patch
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.pool import ClientPool, pooled_client, get_pool
+from aws_analysis_tools.regions import connect_ec2
+
+
+class ClientPoolTest(unittest.TestCase):
+
+    def test_get(self):
+        """
+        A connection is made once per service, region and credentials
+        """
+        pool = ClientPool()
+        factory = MagicMock(side_effect=lambda: object())
+
+        first = pool.get('ec2', 'us-east-1', factory)
+
+        self.assertIs(first, pool.get('ec2', 'us-east-1', factory))
+        self.assertIsNot(first, pool.get('ec2', 'us-west-2', factory))
+        self.assertIsNot(first, pool.get('ec2', 'us-east-1', factory, credentials='other'))
+        self.assertEqual(3, factory.call_count)
+
+    def test_concurrent(self):
+        """
+        Threads asking for the same connection at once share the one made
+        """
+        pool = ClientPool()
+        made = []
+
+        def factory():
+            time.sleep(0.05)
+            made.append(object())
+            return made[-1]
+
+        clients = []
+        threads = [threading.Thread(target=lambda: clients.append(pool.get('ec2', 'r', factory)))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(1, len(made))
+        self.assertEqual([made[0]] * 8, clients)
+
+    def test_per_thread(self):
+        """
+        A connection made per thread isn't shared with the other threads
+        """
+        pool = ClientPool()
+        mine = pool.get('ec2', 'r', object, per_thread=True)
+        theirs = []
+        thread = threading.Thread(
+            target=lambda: theirs.append(pool.get('ec2', 'r', object, per_thread=True)))
+        thread.start()
+        thread.join()
+
+        self.assertIs(mine, pool.get('ec2', 'r', object, per_thread=True))
+        self.assertIsNot(mine, theirs[0])
+
+    def test_per_thread_fan_outs(self):
+        """
+        The connections of a fan-out's threads go away with the threads
+        """
+        class Connection(object):
+            pass
+
+        pool = ClientPool()
+        made = []
+
+        def connect():
+            made.append(weakref.ref(pool.get('ec2', 'r', Connection, per_thread=True)))
+
+        for _ in range(3):
+            threads = [threading.Thread(target=connect) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        gc.collect()
+
+        self.assertEqual(12, len(made))
+        self.assertEqual([None] * 12, [ref() for ref in made])
+        self.assertEqual(0, len(pool))
+
+    def test_fork(self):
+        """
+        A forked process makes its own connections
+        """
+        pool = ClientPool()
+        first = pool.get('ec2', 'us-east-1', object)
+        pool._pid = -1
+
+        self.assertIsNot(first, pool.get('ec2', 'us-east-1', object))
+        self.assertEqual(1, len(pool))
+
+    def test_pooled_client(self):
+        """
+        boto3 clients are pooled by the object making them, and don't retry
+        """
+        boto3 = MagicMock()
+        config = object()
+
+        with patch('aws_analysis_tools.pool.sdk_client_config', return_value=config):
+            client = pooled_client(boto3, 'ec2', 'eu-west-1')
+
+        self.assertIs(client, pooled_client(boto3, 'ec2', 'eu-west-1'))
+        boto3.client.assert_called_once_with('ec2', region_name='eu-west-1', config=config)
+
+    def test_connect_ec2(self):
+        """
+        connect_ec2() returns the same connection for the same region and
+        credentials in the same thread
+        """
+        self.addCleanup(get_pool().clear)
+        kwargs = {'aws_access_key_id': 'AKID', 'aws_secret_access_key': 'secret'}
+        conn = connect_ec2('us-east-1', **kwargs)
+
+        self.assertIs(conn, connect_ec2('us-east-1', **kwargs))
+        self.assertIsNot(conn, connect_ec2('us-east-1', aws_access_key_id='AKID2',
+                                           aws_secret_access_key='secret'))
+        self.assertEqual('us-east-1', conn.region.name)
+        self.assertEqual(0, conn.num_retries)
+
+        other = []
+        thread = threading.Thread(target=lambda: other.append(connect_ec2('us-east-1', **kwargs)))
+        thread.start()
+        thread.join()
+        self.assertIsNot(conn, other[0])
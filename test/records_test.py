@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import json
+import unittest
+
+#
+# Third party libraries
+#
+
+from mock import MagicMock
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.records import (
+    InstanceRecord, VolumeRecord, SnapshotRecord, describe_instance_records, iter_snapshot_pages,
+    iter_boto_instance_pages,
+)
+
+
+class InstanceRecordTest(unittest.TestCase):
+
+    INSTANCE = {
+        'InstanceId': 'i-1',
+        'InstanceType': 'c4.xlarge',
+        'Placement': {'AvailabilityZone': 'us-east-1a'},
+        'SecurityGroups': [{'GroupName': 'webapp'}, {'GroupName': 'ops'}],
+        'State': {'Code': 16, 'Name': 'running'},
+        'PrivateIpAddress': '10.0.0.1',
+        'PublicIpAddress': '54.0.0.1',
+        'PublicDnsName': 'ec2-54-0-0-1.compute-1.amazonaws.com',
+        'RootDeviceType': 'ebs',
+        'Tags': [{'Key': 'Name', 'Value': 'web001'}, {'Key': 'environment', 'Value': 'prod'}],
+    }
+
+    def test_from_dict(self):
+        """
+        A boto3 instance dict is projected into a record
+        """
+        record = InstanceRecord.from_dict(self.INSTANCE, region='us-east-1')
+
+        self.assertEqual('i-1', record.id)
+        self.assertEqual('web001', record.name)
+        self.assertEqual('c4.xlarge', record.instance_type)
+        self.assertEqual('us-east-1a', record.zone)
+        self.assertEqual('webapp', record.group)
+        self.assertEqual(('webapp', 'ops'), record.groups)
+        self.assertEqual('running', record.state)
+        self.assertEqual('54.0.0.1', record.ip_address)
+        self.assertEqual('10.0.0.1', record.private_ip_address)
+        self.assertEqual({'Name': 'web001', 'environment': 'prod'}, record.tags)
+        self.assertEqual('prod', record.tag('environment'))
+        self.assertIsNone(record.tag('missing'))
+        # A tag value that is also a key isn't mistaken for the key
+        record = InstanceRecord('i-2', tags={'cluster': 'role', 'role': 'kafka'})
+        self.assertEqual('kafka', record.tag('role'))
+
+    def test_from_boto(self):
+        """
+        A boto instance is projected into a record
+        """
+        group = MagicMock()
+        group.name = 'webapp'
+        instance = MagicMock(
+            id='i-1', instance_type='m4.large', placement='us-west-2b', groups=[group],
+            state='stopped', ip_address=None, private_ip_address='10.0.0.2', dns_name='',
+            root_device_type='ebs', tags={'Name': 'db001'},
+        )
+
+        record = InstanceRecord.from_boto(instance, region='us-west-2')
+
+        self.assertEqual('db001', record.name)
+        self.assertEqual('us-west-2b', record.zone)
+        self.assertEqual('webapp', record.group)
+        self.assertEqual('us-west-2', record.region)
+        self.assertIsNone(record.dns_name)
+
+    def test_no_dict(self):
+        """
+        Records don't carry a per-instance __dict__
+        """
+        record = InstanceRecord.from_dict(self.INSTANCE)
+
+        self.assertFalse(hasattr(record, '__dict__'))
+        with self.assertRaises(AttributeError):
+            record.something_else = 1
+
+    def test_rows(self):
+        """
+        A record survives a round trip through JSON as a row
+        """
+        record = InstanceRecord.from_dict(self.INSTANCE, region='us-east-1')
+
+        row = json.loads(json.dumps(record.to_row()))
+
+        self.assertEqual(record.to_dict(), InstanceRecord.from_row(row).to_dict())
+        self.assertEqual(record.tags, InstanceRecord.from_row(row).tags)
+        self.assertEqual({'Name': 'web001'}, InstanceRecord.from_row(row, tag_keys={'Name'}).tags)
+
+    def test_describe_instance_records(self):
+        """
+        All pages of DescribeInstances are followed and every instance of a
+        reservation is kept
+        """
+        client = MagicMock()
+        client.describe_instances.side_effect = [
+            {'Reservations': [{'Instances': [self.INSTANCE, dict(self.INSTANCE, InstanceId='i-2')]}],
+             'NextToken': 'token'},
+            {'Reservations': [{'Instances': [dict(self.INSTANCE, InstanceId='i-3')]}]},
+        ]
+
+        records = describe_instance_records(client, 'us-east-1', [{'Name': 'x', 'Values': ['y']}])
+
+        self.assertEqual(['i-1', 'i-2', 'i-3'], [r.id for r in records])
+        self.assertEqual('token', client.describe_instances.call_args_list[1][1]['NextToken'])
+
+
+class VolumeRecordTest(unittest.TestCase):
+
+    def test_from_dict(self):
+        """
+        A boto3 volume dict is projected into a record
+        """
+        record = VolumeRecord.from_dict({
+            'VolumeId': 'vol-1',
+            'AvailabilityZone': 'us-east-1a',
+            'State': 'in-use',
+            'Size': 100,
+            'VolumeType': 'gp2',
+            'Attachments': [{'InstanceId': 'i-1', 'Device': '/dev/xvdf'}],
+            'Tags': [{'Key': 'Name', 'Value': 'data'}],
+        })
+
+        self.assertEqual('data', record.name)
+        self.assertEqual('i-1', record.instance_id)
+        self.assertEqual('/dev/xvdf', record.device)
+        self.assertEqual(100, record.size)
+
+
+class SnapshotRecordTest(unittest.TestCase):
+
+    def test_from_dict(self):
+        """
+        A boto3 snapshot dict is projected into a record
+        """
+        record = SnapshotRecord.from_dict({
+            'SnapshotId': 'snap-1',
+            'VolumeId': 'vol-1',
+            'State': 'completed',
+            'VolumeSize': 100,
+            'Description': 'Daily backup',
+            'Tags': [{'Key': 'Name', 'Value': 'web001-data'}],
+        }, region='us-east-1')
+
+        self.assertEqual('web001-data', record.name)
+        self.assertEqual('vol-1', record.volume_id)
+        self.assertEqual(100, record.size)
+        self.assertEqual('us-east-1', record.to_dict()['region'])
+
+    def test_iter_boto_instance_pages(self):
+        """
+        Pages of instances are fetched one at a time with boto, following the next token
+        """
+        reservation = MagicMock()
+        reservation.instances = [MagicMock(id='i-1', tags={}), MagicMock(id='i-2', tags={})]
+        first, last = MagicMock(), MagicMock(next_token=None)
+        first.__iter__.return_value = [reservation]
+        first.next_token = 'token'
+        last.__iter__.return_value = []
+        conn = MagicMock()
+        conn.region.name = 'us-east-1'
+        conn.get_list.side_effect = [first, last]
+
+        pages = list(iter_boto_instance_pages(conn, page_size=5))
+
+        self.assertEqual([['i-1', 'i-2'], []], [[r.id for r in page] for page in pages])
+        self.assertEqual('DescribeInstances', conn.get_list.call_args[0][0])
+        self.assertEqual({'MaxResults': 5, 'NextToken': 'token'}, conn.get_list.call_args[0][1])
+
+    def test_iter_snapshot_pages(self):
+        """
+        Pages of the snapshots of the owner are fetched one at a time with boto,
+        following the next token
+        """
+        snapshot = MagicMock(id='snap-1', volume_id='vol-1', status='completed', volume_size=8,
+                             start_time='2018-01-01T04:00:00.000Z', description='', tags={})
+        first, last = MagicMock(), MagicMock(next_token=None)
+        first.__iter__.return_value = [snapshot, snapshot]
+        first.next_token = 'token'
+        last.__iter__.return_value = [snapshot]
+        conn = MagicMock()
+        conn.region.name = 'us-east-1'
+        conn.get_list.side_effect = [first, last]
+
+        pages = iter_snapshot_pages(conn, page_size=2)
+
+        self.assertEqual(2, len(next(pages)))
+        self.assertEqual(1, conn.get_list.call_count)
+        self.assertEqual(['us-east-1'], [s.region for s in next(pages)])
+        self.assertEqual({'Owner.1': 'self', 'MaxResults': 2, 'NextToken': 'token'},
+                         conn.get_list.call_args[0][1])
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+#
+# Third party libraries
+#
+
+from mock import patch
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools import regions
+
+
+class RegionNamesTest(unittest.TestCase):
+
+    ENDPOINTS = {
+        'us-east-1': 'ec2.us-east-1.amazonaws.com',
+        'us-west-2': 'ec2.us-west-2.amazonaws.com',
+        'us-gov-west-1': 'ec2.us-gov-west-1.amazonaws.com',
+        'cn-north-1': 'ec2.cn-north-1.amazonaws.com.cn',
+    }
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.tmp_dir, 'regions.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_parse_region_names(self):
+        """
+        Region options are normalized to a list of names, or None for all regions
+        """
+        self.assertIsNone(regions.parse_region_names(None))
+        self.assertIsNone(regions.parse_region_names(False))
+        self.assertIsNone(regions.parse_region_names('all'))
+        self.assertEqual(['us-east-1', 'us-west-2'], regions.parse_region_names('us-east-1, us-west-2'))
+        self.assertEqual(['us-east-1', 'us-west-2'], regions.parse_region_names(['us-east-1,us-west-2']))
+
+    @patch('aws_analysis_tools.regions._describe_regions')
+    def test_default_excludes(self, mock_describe):
+        """
+        GovCloud and China are excluded unless named explicitly
+        """
+        mock_describe.return_value = (self.ENDPOINTS, True)
+
+        self.assertEqual(
+            ['us-east-1', 'us-west-2'],
+            regions.get_region_names(cache_file=self.cache_file),
+        )
+        self.assertEqual(
+            ['us-gov-west-1'],
+            regions.get_region_names(include=['us-gov-west-1'], cache_file=self.cache_file),
+        )
+        self.assertEqual(
+            ['us-east-1', 'us-west-2'],
+            regions.get_region_names(include=['us-*'], cache_file=self.cache_file),
+        )
+
+    @patch('aws_analysis_tools.regions._describe_regions')
+    def test_cache(self, mock_describe):
+        """
+        The region list is only described once and then read from the cache file
+        """
+        mock_describe.return_value = (self.ENDPOINTS, True)
+
+        regions.get_region_names(cache_file=self.cache_file)
+        regions.get_region_names(cache_file=self.cache_file)
+
+        self.assertEqual(1, mock_describe.call_count)
+        with open(self.cache_file) as f:
+            self.assertEqual(self.ENDPOINTS, json.load(f)['regions'])
+
+    @patch('aws_analysis_tools.regions._describe_regions')
+    def test_fallback_is_not_cached(self, mock_describe):
+        """
+        The built-in region list is not written to the cache
+        """
+        mock_describe.return_value = (self.ENDPOINTS, False)
+
+        regions.get_region_names(cache_file=self.cache_file)
+
+        self.assertFalse(os.path.exists(self.cache_file))
+
+
+class MapRegionsTest(unittest.TestCase):
+
+    def test_results_in_region_order(self):
+        """
+        Values are returned in the order the regions were given
+        """
+        results = regions.map_regions(lambda r: [r.upper()], ['b', 'a', 'c'], concurrency=3)
+
+        self.assertEqual(['b', 'a', 'c'], results.succeeded)
+        self.assertEqual(['B', 'A', 'C'], list(results.chain()))
+        self.assertEqual([], results.failed)
+
+    def test_partial_failure(self):
+        """
+        A failing region is reported without affecting the others
+        """
+        error = ValueError('boom')
+
+        def func(region):
+            if region == 'bad':
+                raise error
+            return region
+
+        results = regions.map_regions(func, ['good', 'bad'])
+
+        self.assertEqual(['good'], results.values())
+        self.assertEqual({'bad': error}, dict(results.errors))
+
+    def test_timeout(self):
+        """
+        A region that takes too long is abandoned and the others still run
+        """
+        hang = threading.Event()
+
+        def func(region):
+            if region == 'slow':
+                hang.wait(5)
+            return region
+
+        try:
+            results = regions.map_regions(func, ['slow', 'fast'], concurrency=1, timeout=0.2)
+        finally:
+            hang.set()
+
+        self.assertEqual(['fast'], results.values())
+        self.assertIsInstance(results.errors['slow'], regions.RegionTimeout)
+
+    def test_concurrency_is_bounded(self):
+        """
+        No more than CONCURRENCY regions run at the same time
+        """
+        lock = threading.Lock()
+        running = [0]
+        peak = [0]
+
+        def func(region):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            threading.Event().wait(0.02)
+            with lock:
+                running[0] -= 1
+
+        regions.map_regions(func, [str(i) for i in range(10)], concurrency=3)
+
+        self.assertLessEqual(peak[0], 3)
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools import run_state
+from aws_analysis_tools.run_state import (RunState, StateError, new_state_path, resume_state,
+                                          retry_message)
+from aws_analysis_tools.ssh import OK, FAILED, TIMED_OUT, SKIPPED
+
+HOSTS = [('web-1', '10.0.0.1'), ('web-2', '10.0.0.2'), ('web-3', '10.0.0.3'),
+         ('web-4', '10.0.0.4'), ('web-5', '10.0.0.5')]
+
+
+class RunStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'runs', 'run.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _run(self):
+        state = RunState(self.path)
+        state.start('uptime', HOSTS)
+        state.record('web-1', '10.0.0.1', OK, status=0, seconds=1.23456)
+        state.record('web-2', '10.0.0.2', FAILED, status=255, seconds=0.5)
+        state.record('web-3', '10.0.0.3', TIMED_OUT, status=143, seconds=30)
+        state.record('web-4', '10.0.0.4', SKIPPED)
+        state.close()
+
+    def test_pending(self):
+        """
+        Resuming runs the hosts skipped or not done, retrying also those that failed or timed out
+        """
+        self._run()
+        state = RunState(self.path).load()
+
+        self.assertEqual('uptime', state.command)
+        self.assertEqual(HOSTS, state.hosts)
+        self.assertEqual((OK, 0, 1.235), state.outcomes['10.0.0.1'])
+        self.assertEqual(['web-4', 'web-5'], [name for name, _ in state.pending()])
+        self.assertEqual(HOSTS[1:], state.pending(retry_failed=True))
+
+    def test_interrupted(self):
+        """
+        The last line of a run killed while writing it is ignored
+        """
+        self._run()
+        with open(self.path, 'a') as f:
+            f.write('{"host":"web-5","outc')
+
+        pending = RunState(self.path).load().pending()
+        self.assertEqual(['web-4', 'web-5'], [name for name, _ in pending])
+
+    def test_resume_state(self):
+        """
+        A retry checks the command, appends to the state file, and the latest outcome of a host
+        counts
+        """
+        self._run()
+        with self.assertRaises(StateError):
+            resume_state(self.path, 'reboot')
+
+        state, hosts = resume_state(self.path, 'uptime', retry_failed=True)
+        self.assertEqual(HOSTS[1:], hosts)
+        for name, address in hosts[:-1]:
+            state.record(name, address, OK, status=0, seconds=1)
+        state.close()
+        self.assertIn('1 of 5 hosts', retry_message(state))
+
+        state, hosts = resume_state(self.path, 'uptime', retry_failed=True)
+        self.assertEqual([HOSTS[-1]], hosts)
+        state.record('web-5', '10.0.0.5', OK)
+        state.close()
+        self.assertIsNone(retry_message(RunState(self.path).load()))
+
+    def test_streamed_hosts(self):
+        """
+        Hosts added as they are found are part of the run
+        """
+        state = RunState(self.path)
+        state.start('uptime', [])
+        state.add_host('web-1', '10.0.0.1')
+        state.add_host('web-2', '10.0.0.2')
+        state.record('web-1', '10.0.0.1', OK, status=0, seconds=1)
+        state.close()
+
+        self.assertEqual([('web-2', '10.0.0.2')], RunState(self.path).load().pending())
+
+    def test_shared_names(self):
+        """
+        Hosts sharing a name each have their own outcome, and outcomes written without the
+        address are of the host of that name
+        """
+        hosts = [('web', '10.0.0.1'), ('web (10.0.0.2)', '10.0.0.2'), ('db', '10.0.0.3')]
+        state = RunState(self.path)
+        state.start('uptime', hosts)
+        state.record('web (10.0.0.2)', '10.0.0.2', FAILED, status=255)
+        state.record('web', '10.0.0.1', OK, status=0)
+        state.close()
+        with open(self.path, 'a') as f:
+            f.write('{"host":"db","outcome":"ok"}\n')
+
+        state = RunState(self.path).load()
+        self.assertEqual([('web (10.0.0.2)', '10.0.0.2')], state.pending(retry_failed=True))
+
+    def test_not_a_state(self):
+        """
+        Missing files and other files are errors
+        """
+        with self.assertRaises(StateError):
+            RunState(self.path).load()
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as f:
+            f.write('{"hosts": []}\n')
+        with self.assertRaises(StateError):
+            RunState(self.path).load()
+
+    def test_new_state_path(self):
+        """
+        New state files are named by time, and only the newest are kept
+        """
+        directory = os.path.join(self.tmp_dir, 'runs')
+        os.makedirs(directory)
+        for index in range(run_state.KEEP_STATE_FILES + 5):
+            open(os.path.join(directory, '2018%04d.jsonl' % index), 'w').close()
+
+        path = new_state_path(directory, now=400 * 86400)
+
+        self.assertEqual(directory, os.path.dirname(path))
+        self.assertTrue(os.path.basename(path).startswith('1971'))
+        names = sorted(os.listdir(directory))
+        self.assertEqual(run_state.KEEP_STATE_FILES - 1, len(names))
+        self.assertEqual('2018%04d.jsonl' % 6, names[0])
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.schedule import HostHistory, order_hosts, slowest_first, spread_zones, \
+    NAME, SLOWEST, ZONE
+
+
+class HostHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'cache', 'history.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_record_run(self):
+        """
+        Durations are kept relative to the median of their run, so runs of slow and fast commands
+        average out
+        """
+        history = HostHistory(self.path)
+        history.record_run({'a': 1.0, 'b': 2.0, 'c': 4.0}, connects={'a': 0.5, 'd': 0.1}, now=10)
+        history.record_run({'a': 10.0, 'b': 20.0, 'c': 80.0}, now=20)
+
+        self.assertEqual({'a': 0.5, 'b': 1.0, 'c': 3.0}, history.estimates(['a', 'b', 'c', 'd']))
+        self.assertEqual({'runs': 2, 'seen': 20, 'seconds': 80.0, 'relative': 3.0},
+                         history.hosts['c'])
+        self.assertEqual({'runs': 1, 'seen': 10, 'connect': 0.1}, history.hosts['d'])
+        self.assertEqual(0.5, history.hosts['a']['connect'])
+
+    def test_load_save(self):
+        """
+        The history survives a save and load, and a missing or corrupt file is no history
+        """
+        self.assertEqual({}, HostHistory(self.path).load().hosts)
+
+        history = HostHistory(self.path)
+        history.record_run({'a': 1.0, 'b': 3.0})
+        history.save()
+        self.assertEqual(history.hosts, HostHistory(self.path).load().hosts)
+        self.assertEqual([], [f for f in os.listdir(os.path.dirname(self.path))
+                              if f.startswith('.')])
+
+        with open(self.path, 'w') as f:
+            f.write('{"hosts": ')
+        self.assertEqual({}, HostHistory(self.path).load().hosts)
+
+
+class OrderTest(unittest.TestCase):
+
+    def test_slowest_first(self):
+        """
+        Hosts are run slowest first, hosts without history as the median one, and ties keep their
+        order
+        """
+        hosts = ['a', 'b', 'c', 'd', 'e']
+        estimates = {'b': 0.5, 'd': 3.0, 'e': 1.0}
+        self.assertEqual(['d', 'a', 'c', 'e', 'b'], slowest_first(hosts, estimates))
+        self.assertEqual(hosts, slowest_first(hosts, {}))
+
+    def test_spread_zones(self):
+        """
+        Zones are interleaved in proportion to their hosts, which are run slowest first
+        """
+        hosts = [('a1', 'x'), ('a2', 'x'), ('a3', 'x'), ('b1', 'x'), ('c1', 'x')]
+        zones = {'a1': 'us-east-1a', 'a2': 'us-east-1a', 'a3': 'us-east-1a', 'b1': 'us-east-1b'}
+        estimates = {'a1': 1.0, 'a2': 2.0, 'a3': 0.5, 'b1': 3.0, 'c1': 1.0}
+
+        ordered = spread_zones(hosts, estimates, zones, key=lambda pair: pair[0])
+        self.assertEqual(['a2', 'b1', 'a1', 'c1', 'a3'], [name for name, _ in ordered])
+
+    def test_order_hosts(self):
+        """
+        The name order leaves the hosts as they are
+        """
+        hosts = ['a', 'b', 'c']
+        estimates = {'a': 1.0, 'c': 2.0}
+        self.assertEqual(hosts, order_hosts(hosts, NAME, estimates))
+        self.assertEqual(['c', 'b', 'a'], order_hosts(hosts, SLOWEST, estimates))
+        self.assertEqual(['c', 'b', 'a'], order_hosts(hosts, ZONE, estimates))
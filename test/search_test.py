@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import unittest
+
+#
+# Third party libraries
+#
+
+from mock import MagicMock, patch
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.records import InstanceRecord
+from aws_analysis_tools.search import (
+    build_filters, parse_fields, project, iter_search_instances, search_instances,
+)
+
+
+def _instance(instance_id, name, ip='10.0.0.1'):
+    return MagicMock(
+        id=instance_id, instance_type='m4.large', placement='us-east-1a', groups=[],
+        state='running', ip_address=None, private_ip_address=ip, dns_name='',
+        root_device_type='ebs', tags={'Name': name, 'cluster_name': 'webapp', 'lts': 'trusty'},
+    )
+
+
+class SearchTest(unittest.TestCase):
+
+    def test_build_filters(self):
+        """
+        Terms become tag and tag-value filters, values of the same tag are ORed
+        """
+        self.assertEqual(
+            {'tag:Name': ['*web*', '*db*'], 'tag-value': ['*s_periodic*']},
+            build_filters(['Name:web', 's_periodic', 'Name:db']),
+        )
+
+    def test_parse_fields(self):
+        """
+        Fields are validated, and tags are asked for as tag:<key>
+        """
+        self.assertEqual(('id', 'name', 'tag:lts'), parse_fields('id, name,tag:lts'))
+        with self.assertRaises(ValueError):
+            parse_fields('id,colour')
+        with self.assertRaises(ValueError):
+            parse_fields('tag:')
+
+    def test_project(self):
+        """
+        Records are projected onto fields in the order given
+        """
+        record = InstanceRecord.from_boto(_instance('i-1', 'web001'), region='us-east-1')
+
+        self.assertEqual(
+            [('name', 'web001'), ('private_ip_address', '10.0.0.1'), ('tag:lts', 'trusty'),
+             ('tag:missing', None)],
+            list(project(record, ('name', 'private_ip_address', 'tag:lts', 'tag:missing')).items()),
+        )
+
+    @patch('aws_analysis_tools.search.get_region_names', return_value=['us-east-1', 'us-west-2'])
+    @patch('aws_analysis_tools.search.connect_ec2')
+    def test_iter_search_instances(self, connect_ec2, get_region_names):
+        """
+        Every instance of every reservation is returned once, with only the
+        tags the fields need
+        """
+        reservations = {
+            'us-east-1': [
+                MagicMock(instances=[_instance('i-1', 'web001'), _instance('i-2', 'web002')]),
+                MagicMock(instances=[_instance('i-1', 'web001')]),
+            ],
+            'us-west-2': [MagicMock(instances=[_instance('i-3', 'web003')])],
+        }
+        connections = dict(
+            (region, MagicMock(get_all_instances=MagicMock(return_value=value)))
+            for region, value in reservations.items()
+        )
+        connect_ec2.side_effect = connections.get
+
+        records = search_instances(['Name:web'], fields=('id', 'tag:cluster_name'))
+
+        self.assertEqual(['i-1', 'i-2', 'i-3'], [r.id for r in records])
+        self.assertEqual({'cluster_name': 'webapp'}, records[0].tags)
+        connections['us-west-2'].get_all_instances.assert_called_once_with(
+            filters={'tag:Name': ['*web*']})
+
+    @patch('aws_analysis_tools.search.get_region_names', return_value=['us-east-1', 'us-west-2'])
+    @patch('aws_analysis_tools.search.connect_ec2')
+    def test_failed_region(self, connect_ec2, get_region_names):
+        """
+        A region that fails is logged and skipped
+        """
+        def _connect(region):
+            if region == 'us-west-2':
+                raise IOError('unreachable')
+            return MagicMock(get_all_instances=MagicMock(
+                return_value=[MagicMock(instances=[_instance('i-1', 'web001')])]))
+        connect_ec2.side_effect = _connect
+        log = MagicMock()
+
+        records = list(iter_search_instances(['web'], log=log))
+
+        self.assertEqual(['i-1'], [r.id for r in records])
+        self.assertEqual('us-west-2', log.error.call_args[0][1])
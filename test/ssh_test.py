@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import subprocess
+import time
+import unittest
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.ssh import (
+    AddressedSSHHost, Deadline, format_summary, host_pairs, run_command, watchdog_command,
+    OK, FAILED, TIMED_OUT, SKIPPED,
+)
+
+
+class _LocalHost(object):
+    """
+    Runs commands with a local bash instead of over ssh, as sshd would.
+    """
+
+    def start(self, command, close_stdin=True):
+        proc = subprocess.Popen(['/bin/bash', '-c', command], stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if close_stdin:
+            proc.stdin.close()
+        return proc, [], [], []
+
+
+class AddressedSSHHostTest(unittest.TestCase):
+
+    def test_connects_to_address(self):
+        """
+        ssh connects to the address while the prefix shows the name
+        """
+        host = AddressedSSHHost('web-1.example.com', '10.0.0.5', use_color=False)
+        cmd = host._get_ssh_cmd()
+
+        self.assertEqual('10.0.0.5', cmd[-1])
+        self.assertIn('HostKeyAlias=web-1.example.com', cmd)
+        self.assertIn('[web-1.example.com]', host.full_prefix)
+        self.assertNotIn('10.0.0.5', host.full_prefix)
+
+    def test_defaults_to_name(self):
+        """
+        Without an address, ssh connects to the name as SSHHost does
+        """
+        cmd = AddressedSSHHost('web-1.example.com', use_color=False)._get_ssh_cmd()
+
+        self.assertEqual('web-1.example.com', cmd[-1])
+        self.assertNotIn('HostKeyAlias=web-1.example.com', cmd)
+
+    def test_shared_name(self):
+        """
+        A host sharing its Name with another keeps its host key under its address
+        """
+        cmd = AddressedSSHHost('web (10.0.0.6)', '10.0.0.6', use_color=False)._get_ssh_cmd()
+
+        self.assertEqual('10.0.0.6', cmd[-1])
+        self.assertFalse([arg for arg in cmd if arg.startswith('HostKeyAlias')])
+
+
+class HostPairsTest(unittest.TestCase):
+
+    def test_by_name(self):
+        """
+        Hosts reached by name are run once per name
+        """
+        self.assertEqual([('web-1', 'web-1'), ('web-2', 'web-2')],
+                         list(host_pairs(['web-1', 'web-2', 'web-1', None])))
+
+    def test_by_address(self):
+        """
+        Instances sharing a Name are each reached at their address, under labels of their own
+        """
+        results = [('web', '10.0.0.1'), ('web', '10.0.0.2'), ('web', '10.0.0.1'),
+                   (None, '10.0.0.3'), ('db', None), (None, None)]
+
+        self.assertEqual([('web', '10.0.0.1'), ('web (10.0.0.2)', '10.0.0.2'),
+                          ('10.0.0.3', '10.0.0.3'), ('db', 'db')],
+                         list(host_pairs(results, 'private')))
+
+
+class RunCommandTest(unittest.TestCase):
+
+    def test_exit_status(self):
+        """
+        A command finishing in time is OK or FAILED by its exit status
+        """
+        self.assertEqual(OK, run_command(_LocalHost(), 'true', timeout=5))
+        self.assertEqual(FAILED, run_command(_LocalHost(), 'exit 3', timeout=5))
+
+    def test_timeout(self):
+        """
+        A command running past its timeout is terminated with its children
+        """
+        started = time.time()
+
+        outcome = run_command(_LocalHost(), 'sleep 30 & sleep 30', timeout=0.2, grace=1)
+
+        self.assertEqual(TIMED_OUT, outcome)
+        self.assertLess(time.time() - started, 2)
+
+    def _watchdog(self, command):
+        proc = subprocess.Popen(['/bin/bash', '-c', watchdog_command(command)],
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        # ssh keeps the stdin of the wrapper open until the connection closes
+        proc.stdin.write(b'ignored')
+        proc.stdin.flush()
+        proc.wait()
+        proc.stdin.close()
+        return proc.returncode, proc.stdout.read(), proc.stderr.read()
+
+    def test_watchdog(self):
+        """
+        The wrapped command keeps its exit status and stderr, and reads an
+        empty pipe
+        """
+        self.assertEqual((4, b'pipe\n', b'err\n'),
+                         self._watchdog('cat; [ -p /dev/stdin ] && echo pipe; echo err >&2; exit 4'))
+
+    def test_watchdog_quoting(self):
+        """
+        The wrapped command is run whole, whatever its quotes, comments and parentheses
+        """
+        self.assertEqual((0, b"it's )\n", b''), self._watchdog("echo \"it's )\" # comment"))
+        self.assertEqual((0, b'doc\n', b''), self._watchdog('cat <<EOF\ndoc\nEOF'))
+
+
+class DeadlineTest(unittest.TestCase):
+
+    def test_remaining(self):
+        """
+        A host gets the timeout, or what's left before the deadline if less
+        """
+        self.assertIsNone(Deadline().remaining())
+        self.assertEqual(5, Deadline(timeout=5).remaining())
+        self.assertLess(Deadline(timeout=5, deadline=1).remaining(), 1.01)
+        self.assertLessEqual(Deadline(timeout=5, deadline=0).remaining(), 0)
+
+    def test_summary(self):
+        """
+        The summary counts each outcome and lists the hosts that weren't OK
+        """
+        self.assertEqual([
+            '4 hosts: 1 ok, 0 failed, 2 timed out, 1 skipped',
+            'Timed out: web-2, web-3',
+            'Skipped: web-4',
+        ], format_summary([('web-1', OK), ('web-2', TIMED_OUT), ('web-3', TIMED_OUT),
+                           ('web-4', SKIPPED)]))
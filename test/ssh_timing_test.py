@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+#
+# Third party libraries
+#
+
+from mock import patch
+from reversefold.util import multiproc
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.ssh_timing import (
+    HostTiming, PhaseTimer, TimedSSHHost, histogram, render_timings, write_timings, PHASES,
+)
+
+
+class _Clock(object):
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def _timing(host, total, outcome='ok'):
+    phases = dict((phase, None) for phase in PHASES)
+    phases.update(dns=0.01, total=total)
+    return HostTiming(host, outcome, phases)
+
+
+class PhaseTimerTest(unittest.TestCase):
+
+    def test_phases(self):
+        """
+        Each phase ends on its log line, and phases whose end never came aren't known
+        """
+        clock = _Clock()
+        timer = PhaseTimer(clock=clock)
+        for seconds, line in [(0.5, 'debug1: Reading configuration data /etc/ssh/ssh_config'),
+                              (0.5, 'debug1: Connecting to web-1 [10.0.0.5] port 22.'),
+                              (1.0, 'debug1: Connection established.'),
+                              (2.0, 'Authenticated to web-1 ([10.0.0.5]:22) using "publickey".')]:
+            clock.now += seconds
+            self.assertTrue(timer.observe(line))
+        self.assertFalse(timer.observe('Authentication failed on the app server'))
+        clock.now += 4.0
+        timer.finish()
+
+        self.assertEqual([('dns', 1.0), ('connect', 1.0), ('auth', 2.0), ('command', 4.0),
+                          ('total', 8.0)], list(timer.phases().items()))
+        self.assertEqual(4.0, timer.connect_time())
+
+        refused = PhaseTimer(clock=clock)
+        refused.observe('debug1: Connecting to web-2 [10.0.0.6] port 22.')
+        refused.finish()
+        self.assertEqual((None, None, None), (refused.phases()['connect'],
+                                              refused.phases()['command'],
+                                              refused.connect_time()))
+
+    def test_host_hides_log(self):
+        """
+        ssh's log lines go to the timer while the command's output is printed
+        """
+        clock = _Clock()
+        timer = PhaseTimer(clock=clock)
+        host = TimedSSHHost('web-1', '10.0.0.5', timer=timer, use_color=False)
+        self.assertIn('LogLevel=DEBUG1', host._get_ssh_cmd())
+        self.assertNotIn('-q', host._get_ssh_cmd())
+
+        with patch('sys.stdout') as stdout:
+            host.puts(multiproc.DEFAULT_ERR_PREFIX_PLAIN + 'debug1: Connection established.')
+            host.puts(multiproc.DEFAULT_ERR_PREFIX + 'debug1: Exit status 0' +
+                      multiproc.DEFAULT_ERR_POSTFIX)
+            host.puts(multiproc.DEFAULT_ERR_PREFIX_PLAIN + 'disk full')
+            host.puts(multiproc.DEFAULT_OUT_PREFIX_PLAIN + 'debug1: printed by the command')
+
+        written = ''.join(call[0][0] for call in stdout.write.call_args_list)
+        self.assertEqual(['connected'], list(timer.marks))
+        self.assertNotIn('Connection established', written)
+        self.assertNotIn('Exit status', written)
+        self.assertIn('disk full', written)
+        self.assertIn('printed by the command', written)
+
+
+class ReportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_histogram(self):
+        """
+        Buckets double until the largest value, and every non-empty one shows
+        """
+        lines = histogram([0.05, 0.3, 0.3, 0.35, 1.5] + [0.02] * 100, start=0.1, width=10)
+
+        self.assertEqual(5, len(lines))
+        self.assertTrue(lines[0].startswith('<=     0.10s |##########| 101'))
+        self.assertTrue(lines[2].endswith('|#         | 3'))
+        self.assertTrue(lines[3].endswith('|          | 0'))
+        self.assertTrue(lines[4].startswith('<=     1.60s |#'))
+        self.assertEqual([], histogram([]))
+
+    def test_render_and_write(self):
+        """
+        The report has the percentiles of each phase and the slowest hosts; the JSON lines have
+        every phase of every host
+        """
+        timings = [_timing('web-%d' % i, total=i / 10.0) for i in range(1, 21)]
+        timings.append(HostTiming('down', 'failed', dict((phase, None) for phase in PHASES)))
+
+        report = render_timings(timings, slowest=2)
+        self.assertIn('p50', report)
+        self.assertIn('p99', report)
+        slowest = report.split('slowest hosts:')[1]
+        self.assertIn('web-20', slowest)
+        self.assertIn('web-19', slowest)
+        self.assertNotIn('web-18', slowest)
+
+        path = os.path.join(self.tmp_dir, 'timings.jsonl')
+        write_timings(path, timings)
+        with open(path) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(21, len(records))
+        self.assertEqual({'host': 'down', 'outcome': 'failed', 'dns': None, 'connect': None,
+                          'auth': None, 'command': None, 'total': None}, records[-1])
+        self.assertEqual(0.1, records[0]['total'])
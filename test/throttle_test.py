@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import socket
+import unittest
+
+#
+# Third party libraries
+#
+
+from boto.exception import EC2ResponseError
+from mock import MagicMock
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.throttle import (
+    RateGovernor, TokenBucket, is_throttle_error, is_retryable_error,
+)
+
+
+def _ec2_error(code, status=400):
+    error = EC2ResponseError(status, 'reason')
+    error.error_code = code
+    return error
+
+
+class _ClientError(Exception):
+    """
+    Looks like a botocore ClientError
+    """
+
+    def __init__(self, code, status):
+        super(_ClientError, self).__init__(code)
+        self.response = {'Error': {'Code': code}, 'ResponseMetadata': {'HTTPStatusCode': status}}
+
+
+class ErrorClassificationTest(unittest.TestCase):
+
+    def test_boto_errors(self):
+        """
+        boto throttling errors are recognized by their error code
+        """
+        self.assertTrue(is_throttle_error(_ec2_error('RequestLimitExceeded', 503)))
+        self.assertFalse(is_throttle_error(_ec2_error('InvalidInstanceID.NotFound')))
+        self.assertFalse(is_retryable_error(_ec2_error('InvalidInstanceID.NotFound')))
+
+    def test_botocore_errors(self):
+        """
+        botocore throttling and server errors are recognized from the response
+        """
+        self.assertTrue(is_throttle_error(_ClientError('Throttling', 400)))
+        self.assertTrue(is_retryable_error(_ClientError('Whatever', 500)))
+        self.assertFalse(is_retryable_error(_ClientError('UnauthorizedOperation', 403)))
+
+    def test_connection_errors(self):
+        """
+        Failed connections are retried, as the SDKs don't retry them for us
+        """
+        self.assertTrue(is_retryable_error(socket.timeout('timed out')))
+        self.assertTrue(is_retryable_error(socket.error(104, 'Connection reset by peer')))
+        self.assertFalse(is_retryable_error(ValueError('bad')))
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_burst_then_wait(self):
+        """
+        The burst is served right away, the next token has to wait
+        """
+        now = [0.0]
+        sleep = MagicMock()
+        bucket = TokenBucket(rate=2, burst=2, clock=lambda: now[0], sleep=sleep)
+
+        self.assertEqual(0, bucket.acquire())
+        self.assertEqual(0, bucket.acquire())
+        self.assertAlmostEqual(0.5, bucket.acquire())
+        sleep.assert_called_once_with(0.5)
+
+
+class RateGovernorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sleep = MagicMock()
+        self.governor = RateGovernor(rate=10, burst=100, max_retries=3, sleep=self.sleep)
+
+    def test_success(self):
+        """
+        Successful calls return the result and slowly raise the rate
+        """
+        func = MagicMock(return_value='result')
+
+        self.assertEqual('result', self.governor.call('us-east-1', 'DescribeInstances', func, 1, a=2))
+
+        func.assert_called_once_with(1, a=2)
+        self.assertGreater(self.governor.bucket('us-east-1', 'DescribeInstances').rate, 10)
+
+    def test_throttle_is_retried(self):
+        """
+        A throttled call is retried after a backoff and the rate is decreased
+        """
+        func = MagicMock(side_effect=[_ec2_error('RequestLimitExceeded', 503), 'result'])
+
+        self.assertEqual('result', self.governor.call('us-east-1', 'DescribeInstances', func))
+
+        self.assertEqual(2, func.call_count)
+        counters = self.governor.counters[('us-east-1', 'DescribeInstances')]
+        self.assertEqual(1, counters['throttles'])
+        self.assertEqual(1, counters['retries'])
+        self.assertLess(self.governor.bucket('us-east-1', 'DescribeInstances').rate, 10)
+
+    def test_gives_up_after_max_retries(self):
+        """
+        The last throttling error is raised once the retries are exhausted
+        """
+        error = _ec2_error('RequestLimitExceeded', 503)
+        func = MagicMock(side_effect=error)
+
+        with self.assertRaises(EC2ResponseError):
+            self.governor.call('us-east-1', 'DescribeVolumes', func)
+
+        self.assertEqual(4, func.call_count)
+        counters = self.governor.counters[('us-east-1', 'DescribeVolumes')]
+        self.assertEqual(3, counters['retries'])
+        self.assertEqual(1, counters['failures'])
+
+    def test_other_errors_are_raised(self):
+        """
+        Errors that are not worth retrying are raised right away
+        """
+        func = MagicMock(side_effect=_ec2_error('InvalidInstanceID.NotFound'))
+
+        with self.assertRaises(EC2ResponseError):
+            self.governor.call('us-east-1', 'CreateTags', func)
+
+        self.assertEqual(1, func.call_count)
+
+    def test_stats(self):
+        """
+        Counters are sent to the stats client
+        """
+        stats = MagicMock()
+        self.governor.stats = stats
+        func = MagicMock(side_effect=[_ec2_error('Throttling', 400), None])
+
+        self.governor.call('us-east-1', 'DescribeInstances', func)
+
+        stats.incr.assert_any_call('ec2.DescribeInstances.throttles')
+        stats.incr.assert_any_call('ec2.DescribeInstances.retries')
+
+    def test_backoff_is_bounded(self):
+        """
+        Backoff delays are jittered within the exponential bound
+        """
+        for attempt in range(10):
+            delay = self.governor.backoff(attempt)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(self.governor.max_delay, self.governor.base_delay * 2 ** attempt))
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+from argparse import Namespace
+
+#
+# Third party libraries
+#
+
+from mock import MagicMock, patch
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.throttle import RateGovernor
+from aws_analysis_tools.tracing import Tracer, configure_tracer, profiled, get_tracer
+
+
+class TracerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = [100.0]
+        self.tracer = Tracer(enabled=True, clock=lambda: self.now[0])
+
+    def _span(self, duration, **kwargs):
+        with self.tracer.span('api', **kwargs):
+            self.now[0] += duration
+
+    def test_disabled(self):
+        """
+        A disabled tracer keeps nothing
+        """
+        self.tracer.enabled = False
+        self._span(1.0, region='us-east-1', action='DescribeInstances')
+
+        self.assertEqual([], self.tracer.summary())
+
+    def test_summary(self):
+        """
+        Spans are aggregated per name, region and action, largest total first
+        """
+        self._span(1.0, region='us-east-1', action='DescribeInstances')
+        self._span(3.0, region='us-east-1', action='DescribeInstances')
+        self._span(2.5, region='us-west-2', action='DescribeInstances')
+
+        self.assertEqual(
+            [('api', 'us-east-1', 'DescribeInstances', 2, 0, 4.0, 2.0, 3.0, 3.0),
+             ('api', 'us-west-2', 'DescribeInstances', 1, 0, 2.5, 2.5, 2.5, 2.5)],
+            self.tracer.summary(),
+        )
+        self.assertIn('us-west-2', self.tracer.render_summary())
+
+    def test_errors(self):
+        """
+        A span that raises is counted as an error and the exception propagates
+        """
+        with self.assertRaises(ValueError):
+            with self.tracer.span('fetch'):
+                raise ValueError()
+
+        self.assertEqual(1, self.tracer.summary()[0][4])
+
+    def test_stats(self):
+        """
+        Spans are sent to the stats client as timings, without the region
+        """
+        self.tracer.stats = MagicMock()
+        self._span(0.25, region='us-east-1', action='DescribeVolumes')
+
+        self.tracer.stats.timing.assert_called_once_with('trace.api.DescribeVolumes', 250)
+
+    def test_governor(self):
+        """
+        Calls through the rate governor are traced as api spans
+        """
+        with patch('aws_analysis_tools.throttle.get_tracer', return_value=self.tracer):
+            RateGovernor().call('us-east-1', 'DescribeRegions', lambda: None)
+
+        self.assertEqual(('api', 'us-east-1', 'DescribeRegions'), self.tracer.summary()[0][:3])
+
+
+class ProfiledTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        get_tracer().reset()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+        configure_tracer(Namespace())
+        get_tracer().reset()
+
+    def test_configure(self):
+        """
+        Tracing is only enabled by the profile options
+        """
+        configure_tracer(Namespace(profile=False, profile_output=None, profile_stats=False))
+        self.assertFalse(get_tracer().enabled)
+
+        configure_tracer(Namespace(profile=True, profile_output=None, profile_stats=False))
+        self.assertTrue(get_tracer().enabled)
+
+    def test_profiled(self):
+        """
+        --profile prints the summary and --profile-output writes cProfile stats
+        """
+        path = os.path.join(self.tmp, 'run.prof')
+        args = Namespace(profile=True, profile_output=path, profile_stats=False)
+        out = MagicMock()
+        configure_tracer(args)
+
+        with profiled(args, out=out):
+            pass
+
+        self.assertTrue(os.path.getsize(path) > 0)
+        self.assertIn('total', out.write.call_args[0][0])
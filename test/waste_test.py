@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import unittest
+
+#
+# Third party libraries
+#
+
+from mock import MagicMock
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.columnar import ColumnarWriter
+from aws_analysis_tools.records import VolumeRecord
+from aws_analysis_tools.waste import (
+    WasteReport, StoppedInstances, name_prefix, sorted_totals, waste_columns,
+    UNATTACHED, STOPPED_INSTANCE,
+)
+
+
+def _volumes(region='us-east-1'):
+    return [
+        VolumeRecord('vol-1', region=region, zone=region + 'a', status='available', size=100,
+                     tags={'Name': 'web001-data'}),
+        VolumeRecord('vol-2', region=region, zone=region + 'a', status='in-use', size=50,
+                     instance_id='i-1', tags={'Name': 'web002-data'}),
+        VolumeRecord('vol-3', region=region, zone=region + 'b', status='in-use', size=20,
+                     instance_id='i-2', tags={'Name': 'kafka-broker-3'}),
+        VolumeRecord('vol-4', region=region, zone=region + 'b', status='available', size=None),
+    ]
+
+
+class WasteReportTest(unittest.TestCase):
+
+    def test_update(self):
+        """
+        Unattached volumes and volumes of stopped instances are counted as
+        wasted, and all volumes by status and Name prefix
+        """
+        report = WasteReport()
+
+        wasted = report.update(_volumes(), stopped={'i-2'})
+
+        self.assertEqual([('vol-1', UNATTACHED), ('vol-3', STOPPED_INSTANCE),
+                          ('vol-4', UNATTACHED)], [(v.id, reason) for v, reason in wasted])
+        self.assertEqual([4, 170], report.total)
+        self.assertEqual([('us-east-1a', 1, 100), ('us-east-1b', 1, 0)],
+                         sorted_totals(report.unattached))
+        self.assertEqual([(('in-use', 'web'), 1, 50), (('in-use', 'kafka-broker'), 1, 20)],
+                         sorted_totals(report.by_status_prefix)[1:3])
+        self.assertEqual([1, 20], report.total_stopped)
+
+        other = WasteReport()
+        other.update(_volumes('us-west-2'), stopped=set())
+        report.merge(WasteReport()).merge(other)
+        self.assertEqual([8, 340], report.total)
+        self.assertEqual([4, 200], report.total_unattached)
+        self.assertEqual([1, 20], report.total_stopped)
+        self.assertEqual({'i-2'}, report.stopped_instances)
+
+    def test_name_prefix(self):
+        """
+        Volumes are grouped by what their Name starts with
+        """
+        self.assertEqual('web', name_prefix('web001.example.com-data'))
+        self.assertEqual('periodic-c-data', name_prefix('periodic-c-data-00000'))
+        self.assertEqual('10.0.0.1', name_prefix('10.0.0.1'))
+        self.assertEqual('(none)', name_prefix(None))
+
+    def test_export(self):
+        """
+        Wasted volumes are exported with the reason they are wasted
+        """
+        sink = MagicMock()
+        with ColumnarWriter(sink, waste_columns()) as writer:
+            writer.write(WasteReport().update(_volumes(), stopped={'i-2'}))
+
+        columns = dict((c.name, c) for c in sink.write_batch.call_args[0][0])
+        self.assertEqual([0, 1, 0], list(columns['waste'].values))
+        self.assertEqual([UNATTACHED, STOPPED_INSTANCE], columns['waste'].dictionary)
+        self.assertEqual(['vol-1', 'vol-3', 'vol-4'], columns['id'].values)
+
+
+class StoppedInstancesTest(unittest.TestCase):
+
+    def test_batches(self):
+        """
+        Instances are looked up in batches and only once, until there are so
+        many that listing all the stopped ones is cheaper
+        """
+        lookup = MagicMock(side_effect=lambda ids: ['i-3'] if ids is None else
+                           [i for i in ids if i in ('i-1', 'i-3')])
+        stopped = StoppedInstances(lookup, batch_size=2, max_batches=2)
+
+        stopped.update(['i-1', 'i-2', 'i-1'])
+        stopped.update(['i-2', 'i-1'])
+
+        self.assertEqual(1, lookup.call_count)
+        self.assertIn('i-1', stopped)
+        self.assertNotIn('i-2', stopped)
+
+        stopped.update(['i-3', 'i-4', 'i-5', 'i-6'])
+
+        self.assertEqual([(['i-1', 'i-2'],), (['i-3', 'i-4'],), (None,)],
+                         [c[0] for c in lookup.call_args_list])
+        self.assertIn('i-3', stopped)
+        stopped.update(['i-7'])
+        self.assertEqual(3, lookup.call_count)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import unittest
+
+#
+# Third party libraries
+#
+
+from mock import MagicMock
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.changes import ADDED, REMOVED, CHANGED
+from aws_analysis_tools.records import InstanceRecord
+from aws_analysis_tools.watch import WatchState, ScreenPainter, MAX_POLLED_IDS
+
+
+def _instance(instance_id, state='running', name=None):
+    return InstanceRecord(instance_id, region='us-east-1', instance_type='m4.large',
+                          zone='us-east-1a', state=state,
+                          tags={'Name': name or 'web-{0}'.format(instance_id)})
+
+
+def _changes(changes):
+    return [(c.change, c.id) for c in changes]
+
+
+class WatchStateTest(unittest.TestCase):
+
+    def test_full(self):
+        """
+        A full refresh replaces the instances, without the ones not kept
+        """
+        state = WatchState()
+        state.update([_instance('i-1'), _instance('i-2')])
+
+        changes = state.update([_instance('i-2', state='stopping'), _instance('i-3'),
+                                _instance('i-4', name='test-1')],
+                               keep=lambda i: not i.name.startswith('test'))
+
+        self.assertEqual([(REMOVED, 'i-1'), (CHANGED, 'i-2'), (ADDED, 'i-3')], _changes(changes))
+        self.assertEqual(['i-2'], state.transitional_ids())
+
+    def test_partial(self):
+        """
+        A partial refresh only changes the instances fetched or polled; polled
+        ones not fetched and fetched ones not kept anymore are removed
+        """
+        state = WatchState()
+        state.update([_instance('i-1'), _instance('i-2', state='stopping'),
+                      _instance('i-3', state='pending'), _instance('i-4')])
+
+        changes = state.update([_instance('i-2', state='stopped'), _instance('i-4', 'stopping'),
+                                _instance('i-5', state='pending')],
+                               keep=lambda i: i.state != 'stopped', full=False,
+                               polled_ids=['i-2', 'i-3'])
+
+        self.assertEqual([(REMOVED, 'i-2'), (REMOVED, 'i-3'), (CHANGED, 'i-4'), (ADDED, 'i-5')],
+                         _changes(changes))
+        self.assertEqual(['i-1', 'i-4', 'i-5'], [i.id for i in state.sorted_records()])
+
+    def test_needs_full(self):
+        """
+        Every Nth refresh is full, and so is one with too many instances to poll
+        """
+        state = WatchState()
+        self.assertTrue(state.needs_full(3))
+
+        state.update([_instance('i-1')])
+        self.assertFalse(state.needs_full(3))
+        state.update([], full=False)
+        state.update([], full=False)
+        self.assertTrue(state.needs_full(3))
+
+        state.update([_instance('i-{0}'.format(n), state='pending')
+                      for n in range(MAX_POLLED_IDS + 1)])
+        self.assertTrue(state.needs_full(3))
+
+
+class ScreenPainterTest(unittest.TestCase):
+
+    def test_paint(self):
+        """
+        Only the lines that changed are rewritten, and lines left over are
+        cleared
+        """
+        out = MagicMock()
+        painter = ScreenPainter(out)
+
+        self.assertEqual(3, painter.paint(['a', 'b', 'c']))
+        self.assertEqual(1, painter.paint(['a', 'B']))
+
+        written = out.write.call_args[0][0]
+        self.assertEqual('\x1b[2;1HB\x1b[K\x1b[3;1H\x1b[J\x1b[3;1H', written)
+
+    def test_height(self):
+        """
+        Lines beyond the height of the terminal are summed up
+        """
+        painter = ScreenPainter(MagicMock(), height=4)
+        painter.paint([str(n) for n in range(10)])
+
+        self.assertEqual(['0', '1', '... 8 more'], painter.lines)
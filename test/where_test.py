@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+# © 2018 Salesforce.com, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import unittest
+
+#
+# Internal libraries
+#
+
+from aws_analysis_tools.records import InstanceRecord
+from aws_analysis_tools.where import (
+    WhereError, And, Comparison, Not, Or, compile_predicate, parse_where, push_down,
+)
+
+
+def _instances():
+    return [
+        InstanceRecord('i-1', region='us-east-1', instance_type='m4.large', zone='us-east-1a',
+                       state='running', groups=['web', 'ssh'],
+                       tags={'Name': 'web001', 'cluster_name': 'web'}),
+        InstanceRecord('i-2', region='us-east-1', instance_type='m4.xlarge', zone='us-east-1b',
+                       state='stopped', groups=['kafka'],
+                       tags={'Name': 'kafka001', 'cluster_name': 'kafka'}),
+        InstanceRecord('i-3', region='us-east-1', instance_type='c4.large', zone='us-east-1a',
+                       state='running', groups=['kafka'], tags={'Name': 'test-kafka001'}),
+        InstanceRecord('i-4', region='us-east-1', instance_type='c4.large', zone='us-east-1b',
+                       state='running'),
+    ]
+
+
+def _select(text):
+    predicate = compile_predicate(parse_where(text))
+    return [i.id for i in _instances() if predicate(i)]
+
+
+class ParseWhereTest(unittest.TestCase):
+
+    def test_parse(self):
+        """
+        and binds tighter than or, and the negated operators parse to not
+        """
+        self.assertEqual(
+            Or((
+                Comparison('type', 'in', ('m4.*',)),
+                And((
+                    Not(Comparison('tag:cluster_name', 'in', ('kafka', 'zk'))),
+                    Not(Comparison('name', '~', ('^test',))),
+                )),
+            )),
+            parse_where("type = m4.* or tag:cluster_name not in (kafka, 'zk') and name !~ '^test'"),
+        )
+
+    def test_errors(self):
+        """
+        Unknown fields, bad regexes and incomplete expressions are errors
+        """
+        for text in ('size = 1', "name ~ '('", 'name =', '(name = a', 'name = a b', ''):
+            with self.assertRaises(WhereError):
+                parse_where(text)
+
+
+class CompilePredicateTest(unittest.TestCase):
+
+    def test_select(self):
+        """
+        Values, globs, lists, regexes, groups and tags select the same instances
+        as they would in Python
+        """
+        self.assertEqual(['i-1', 'i-2'], _select('type = m4.*'))
+        self.assertEqual(['i-1', 'i-3'], _select('zone == us-east-1a and state = running'))
+        self.assertEqual(['i-2', 'i-3'], _select('group = kafka'))
+        self.assertEqual(['i-1', 'i-2', 'i-3'], _select('group in (k*, web)'))
+        self.assertEqual(['i-3', 'i-4'], _select('tag:cluster_name not in (web, kafka)'))
+        self.assertEqual(['i-1', 'i-2', 'i-4'], _select("not name ~ '^test'"))
+        self.assertEqual(['i-2', 'i-4'], _select('(type = c4.* and name != *) or state = stopped'))
+
+    def test_missing(self):
+        """
+        A missing field matches no value, glob or regex
+        """
+        self.assertEqual(['i-1', 'i-2', 'i-3'], _select('name = *'))
+        self.assertEqual(['i-1', 'i-2', 'i-3'], _select("name ~ ''"))
+
+
+class PushDownTest(unittest.TestCase):
+
+    def test_push_down(self):
+        """
+        Value and glob conjuncts on EC2 filters are pushed down, once per
+        filter; regexes, fields EC2 can't filter on and the other terms of an
+        or stay
+        """
+        where = parse_where(
+            "type = m4.* and (zone = us-east-1a or state = stopped) and name ~ '^web' and "
+            "region = us-east-1 and tag:cluster_name in (web, kafka) and type != m4.xlarge and "
+            "state = running and group = web"
+        )
+
+        filters, rest = push_down(where, taken=['group-name'])
+
+        self.assertEqual([
+            ('instance-type', ['m4.*']),
+            ('tag:cluster_name', ['web', 'kafka']),
+            ('instance-state-name', ['running']),
+        ], filters)
+        self.assertEqual(['i-1'], [i.id for i in _instances() if compile_predicate(rest)(i)])
+
+    def test_nothing_left(self):
+        """
+        Nothing is left to check once everything is pushed down
+        """
+        self.assertEqual(([('instance-id', ['i-1', 'i-2'])], None),
+                         push_down(parse_where('id in (i-1, i-2)')))
+        self.assertIsNone(compile_predicate(None))